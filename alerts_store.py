@@ -0,0 +1,317 @@
+import argparse
+import csv
+import os
+import sqlite3
+import sys
+import time
+
+usage_msg = """
+keep the checker's alerts csvs in one local sqlite database, one row per
+(subroutine, addr, alert reason) instead of one per (tid, operand), so alerts
+can be counted and compared without re-parsing the csvs.
+
+  python3 alerts_store.py ingest BUILD_DIR/checker.alerts.csv [more csvs...]
+  python3 alerts_store.py query BUILD_DIR/checker.alerts.csv [--function SHA512_Transform] [--opcode ADD64mr] [--reason comp-simp]
+  python3 alerts_store.py count BUILD_DIR/checker.alerts.csv --by opcode [--reason comp-simp]
+  python3 alerts_store.py diff BUILD_DIR/checker.alerts.csv [BUILD_DIR/checker.alerts.csv.verification.csv]
+  python3 alerts_store.py csvs
+
+csvs are (re-)ingested on use when they changed since they were last
+ingested. diff with one csv compares it to its cio double check csv,
+<csv>.verification.csv.
+
+diff matches alerts on (subroutine, opcode, reason) and the alert's
+position among the csv's alerted instructions of that opcode in the
+subroutine, in address order. neither addrs nor offsets in the subroutine
+survive the mitigation, which moves functions and inserts instructions,
+but it doesn't reorder the instructions it keeps. the csv only has the
+alerted instructions though, so when the mitigation fixes an alert, the
+later alerts of the same opcode in that subroutine move up a position:
+the number of alerts a diff reports gone or new is right, which ones can
+be off within a subroutine and opcode.
+"""
+
+DEFAULT_DB = 'alerts.sqlite3'
+
+# cio writes the double check alerts to this next to checker.alerts.csv
+VERIFICATION_SUFFIX = '.verification.csv'
+
+SILENT_STORES = 'silent-stores'
+COMP_SIMP = 'comp-simp'
+
+COUNT_BY_COLUMNS = {'function': 'subroutine', 'opcode': 'mir_opcode', 'reason': 'reason'}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS csvs (
+    csv_id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    num_rows INTEGER NOT NULL,
+    ingested_at TEXT NOT NULL
+);
+
+-- one row per (subroutine, addr, reason) of a csv. the csv rows of a key
+-- differ in tid and in which operand is problematic
+CREATE TABLE IF NOT EXISTS alerts (
+    csv_id INTEGER NOT NULL REFERENCES csvs (csv_id) ON DELETE CASCADE,
+    subroutine TEXT NOT NULL,
+    addr INTEGER NOT NULL,
+    reason TEXT NOT NULL,
+    mir_opcode TEXT NOT NULL,
+    -- position of addr among the alerted addrs of mir_opcode in the subroutine
+    opcode_idx INTEGER NOT NULL,
+    rpo_idx INTEGER,
+    description TEXT,
+    num_rows INTEGER NOT NULL,
+    num_tids INTEGER NOT NULL,
+    -- bit n set if operand n was problematic in any of the rows
+    operands_mask INTEGER NOT NULL,
+    is_live INTEGER NOT NULL,
+    live_flags TEXT,
+    PRIMARY KEY (csv_id, subroutine, addr, reason)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS alerts_by_opcode ON alerts (csv_id, mir_opcode, reason);
+CREATE INDEX IF NOT EXISTS alerts_by_reason ON alerts (csv_id, reason);
+CREATE INDEX IF NOT EXISTS alerts_by_opcode_idx ON alerts (csv_id, subroutine, mir_opcode, opcode_idx, reason);
+"""
+
+
+def connect(db_path=DEFAULT_DB):
+    db = sqlite3.connect(db_path)
+    db.row_factory = sqlite3.Row
+    db.execute('PRAGMA foreign_keys = ON')
+    columns = [row['name'] for row in db.execute('PRAGMA table_info(alerts)')]
+    if columns and 'opcode_idx' not in columns:
+        # a database from before opcode positions, the csvs are ingested again on use
+        db.executescript('DROP TABLE alerts; DROP TABLE csvs;')
+    db.executescript(SCHEMA)
+    return db
+
+
+def parse_addr(addr):
+    ''' addrs are hex, e.g. 0x68C1E '''
+    return int(addr, 16)
+
+
+def format_addr(addr):
+    return f'0x{addr:X}'
+
+
+def as_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def dedup_rows(rows):
+    '''
+    Collapse the rows of an alerts csv into dict of
+    (subroutine, addr, reason) -> alerts table columns.
+    '''
+    alerts = dict()
+    tids = dict()
+    for row in rows:
+        key = (row['subroutine_name'], parse_addr(row['addr']), row['alert_reason'])
+        alert = alerts.get(key)
+        if alert is None:
+            alert = alerts[key] = {
+                'mir_opcode': row['mir_opcode'],
+                'rpo_idx': as_int(row['rpo_idx']),
+                'description': row['description'],
+                'num_rows': 0,
+                'operands_mask': 0,
+                'is_live': False,
+                'live_flags': set(),
+            }
+            tids[key] = set()
+        alert['num_rows'] += 1
+        tids[key].add(row['tid'])
+        operand = as_int(row['problematic_operands'])
+        if operand is not None:
+            alert['operands_mask'] |= 1 << operand
+        alert['is_live'] = alert['is_live'] or row['is_live'] == 'true'
+        alert['live_flags'].update(flag for flag in row['live_flags'].split() if flag)
+
+    opcode_addrs = dict()
+    for (subroutine, addr, _), alert in alerts.items():
+        opcode_addrs.setdefault((subroutine, alert['mir_opcode']), set()).add(addr)
+    opcode_idxs = {(subroutine, addr): idx for (subroutine, _), addrs in opcode_addrs.items()
+                   for idx, addr in enumerate(sorted(addrs))}
+
+    for key, alert in alerts.items():
+        alert['opcode_idx'] = opcode_idxs[key[:2]]
+        alert['num_tids'] = len(tids[key])
+        alert['live_flags'] = ' '.join(sorted(alert['live_flags']))
+    return alerts
+
+
+def ingest(db, alerts_csv, force=False):
+    '''
+    Load an alerts csv into the database, unless it's unchanged since it was
+    last ingested. Returns its csv_id.
+    '''
+    path = os.path.realpath(alerts_csv)
+    stat = os.stat(path)
+    row = db.execute('SELECT csv_id, size, mtime_ns FROM csvs WHERE path = ?', (path,)).fetchone()
+    if not force and row is not None and (row['size'], row['mtime_ns']) == (stat.st_size, stat.st_mtime_ns):
+        return row['csv_id']
+
+    with open(path, newline='') as csv_file:
+        rows = list(csv.DictReader(csv_file))
+    alerts = dedup_rows(rows)
+
+    with db:
+        db.execute('DELETE FROM csvs WHERE path = ?', (path,))
+        new_id = db.execute(
+            'INSERT INTO csvs (path, size, mtime_ns, num_rows, ingested_at) VALUES (?, ?, ?, ?, ?)',
+            (path, stat.st_size, stat.st_mtime_ns, len(rows), time.strftime('%Y-%m-%d %H:%M:%S'))
+        ).lastrowid
+        db.executemany(
+            'INSERT INTO alerts VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            [(new_id, subroutine, addr, reason, alert['mir_opcode'], alert['opcode_idx'], alert['rpo_idx'],
+              alert['description'],
+              alert['num_rows'], alert['num_tids'], alert['operands_mask'], int(alert['is_live']),
+              alert['live_flags'])
+             for (subroutine, addr, reason), alert in alerts.items()])
+
+    print(f"Ingested {len(rows)} rows of {alerts_csv} as {len(alerts)} alerts", file=sys.stderr)
+    return new_id
+
+
+def filter_clause(function=None, opcode=None, reason=None, prefix=''):
+    ''' Get the (sql, params) to AND onto a WHERE clause on the alerts table. '''
+    sql = ''
+    params = []
+    for column, value in (('subroutine', function), ('mir_opcode', opcode), ('reason', reason)):
+        if value is not None:
+            sql += f' AND {prefix}{column} = ?'
+            params.append(value)
+    return sql, params
+
+
+def query(db, csv_id, function=None, opcode=None, reason=None):
+    ''' Get the alerts of a csv, optionally only one function's, opcode's or reason's. '''
+    sql, params = filter_clause(function, opcode, reason)
+    return db.execute(f'SELECT * FROM alerts WHERE csv_id = ?{sql} ORDER BY subroutine, addr, reason',
+                      [csv_id] + params).fetchall()
+
+
+def count(db, csv_id, by, function=None, opcode=None, reason=None):
+    ''' Get (function, opcode or reason, alerts, csv rows) of a csv, most alerts first. '''
+    column = COUNT_BY_COLUMNS[by]
+    sql, params = filter_clause(function, opcode, reason)
+    return db.execute(f'SELECT {column}, COUNT(*), SUM(num_rows) FROM alerts WHERE csv_id = ?{sql} '
+                      f'GROUP BY {column} ORDER BY COUNT(*) DESC, {column}',
+                      [csv_id] + params).fetchall()
+
+
+# the same alert in two csvs, see usage_msg
+SAME_ALERT_SQL = ('b.subroutine = a.subroutine AND b.mir_opcode = a.mir_opcode AND b.reason = a.reason AND '
+                  'b.opcode_idx = a.opcode_idx')
+
+
+def diff(db, before_id, after_id, function=None, opcode=None, reason=None):
+    '''
+    Join the alerts of two csvs on (subroutine, opcode, position, reason).
+    Returns (alerts only in before, alerts only in after, number in both).
+    '''
+    sql, params = filter_clause(function, opcode, reason, prefix='a.')
+
+    def only_in(this_id, other_id):
+        return db.execute(
+            f'SELECT a.* FROM alerts a WHERE a.csv_id = ?{sql} AND NOT EXISTS '
+            f'(SELECT 1 FROM alerts b WHERE b.csv_id = ? AND {SAME_ALERT_SQL}) '
+            'ORDER BY a.subroutine, a.addr, a.reason',
+            [this_id] + params + [other_id]).fetchall()
+
+    in_both = db.execute(
+        f'SELECT COUNT(*) FROM alerts a WHERE a.csv_id = ?{sql} AND EXISTS '
+        f'(SELECT 1 FROM alerts b WHERE b.csv_id = ? AND {SAME_ALERT_SQL})',
+        [before_id] + params + [after_id]).fetchone()[0]
+    return only_in(before_id, after_id), only_in(after_id, before_id), in_both
+
+
+def format_alert(alert):
+    operands = ','.join(str(bit) for bit in range(alert['operands_mask'].bit_length())
+                        if alert['operands_mask'] >> bit & 1)
+    return (f"{alert['subroutine']}\t{format_addr(alert['addr'])}\t{alert['reason']}\t"
+            f"{alert['mir_opcode']}#{alert['opcode_idx']}\t"
+            f"rows: {alert['num_rows']}\ttids: {alert['num_tids']}\toperands: {operands or '-'}\t"
+            f"live: {alert['live_flags'] or ('yes' if alert['is_live'] else 'no')}")
+
+
+def main():
+    parser = argparse.ArgumentParser(usage=usage_msg)
+    parser.add_argument('--db', default=DEFAULT_DB, help=f'alerts database. Defaults to `{DEFAULT_DB}`')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    filter_args = argparse.ArgumentParser(add_help=False)
+    filter_args.add_argument('--function', help='subroutine name, e.g. SHA512_Transform')
+    filter_args.add_argument('--opcode', help='MIR opcode, e.g. ADD64mr')
+    filter_args.add_argument('--reason', choices=[SILENT_STORES, COMP_SIMP])
+
+    ingest_parser = subparsers.add_parser('ingest', help='load alerts csvs into the database')
+    ingest_parser.add_argument('alerts_csvs', nargs='+')
+    ingest_parser.add_argument('--force', action='store_true', help='re-ingest unchanged csvs too')
+
+    query_parser = subparsers.add_parser('query', parents=[filter_args], help='list the alerts of a csv')
+    query_parser.add_argument('alerts_csv')
+
+    count_parser = subparsers.add_parser('count', parents=[filter_args], help='count the alerts of a csv')
+    count_parser.add_argument('alerts_csv')
+    count_parser.add_argument('--by', choices=COUNT_BY_COLUMNS.keys(), default='function')
+
+    diff_parser = subparsers.add_parser('diff', parents=[filter_args],
+                                        help='compare the alerts of two csvs')
+    diff_parser.add_argument('before_csv')
+    diff_parser.add_argument('after_csv', nargs='?',
+                             help=f'Defaults to before_csv + `{VERIFICATION_SUFFIX}`')
+
+    subparsers.add_parser('csvs', help='list ingested csvs')
+
+    args = parser.parse_args()
+    db = connect(args.db)
+
+    if args.command == 'ingest':
+        for alerts_csv in args.alerts_csvs:
+            ingest(db, alerts_csv, args.force)
+        return
+
+    if args.command == 'csvs':
+        for row in db.execute('SELECT c.path, c.num_rows, c.ingested_at, COUNT(a.addr) FROM csvs c '
+                              'LEFT JOIN alerts a ON a.csv_id = c.csv_id GROUP BY c.csv_id ORDER BY c.path'):
+            print(f'{row[0]}\t{row[1]} rows\t{row[3]} alerts\tingested {row[2]}')
+        return
+
+    filters = dict(function=args.function, opcode=args.opcode, reason=args.reason)
+
+    if args.command == 'query':
+        for alert in query(db, ingest(db, args.alerts_csv), **filters):
+            print(format_alert(alert))
+        return
+
+    if args.command == 'count':
+        print(f'{args.by}\talerts\trows')
+        for key, num_alerts, num_rows in count(db, ingest(db, args.alerts_csv), args.by, **filters):
+            print(f'{key}\t{num_alerts}\t{num_rows}')
+        return
+
+    after_csv = args.after_csv or args.before_csv + VERIFICATION_SUFFIX
+    if not os.path.exists(after_csv):
+        print(f"Couldn't find {after_csv} to compare {args.before_csv} to")
+        sys.exit(1)
+    only_before, only_after, in_both = diff(db, ingest(db, args.before_csv), ingest(db, after_csv), **filters)
+    for alert in only_before:
+        print(f'- {format_alert(alert)}')
+    for alert in only_after:
+        print(f'+ {format_alert(alert)}')
+    print(f'{len(only_before)} alerts only in {args.before_csv}, {len(only_after)} only in {after_csv}, '
+          f'{in_both} in both')
+    # like diff(1), nonzero when they differ
+    sys.exit(1 if only_before or only_after else 0)
+
+
+if __name__ == "__main__":
+    main()
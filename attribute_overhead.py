@@ -0,0 +1,235 @@
+import argparse
+import csv
+import functools
+import os
+import sys
+
+import process_eval_data as ped
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'implementation-testing'))
+import mir_opcode
+
+usage_msg = """
+predict the comp simp overhead of each libsodium fn from its dynamic hit counts
+(./eval.sh -d) and the per-opcode transform costs measured by
+./eval_cycle_counts.sh, broken down by the same opcode categories as the
+cs_mul64, cs_lea, cs_vector, cs_other_64 and cs_other ablations.
+
+  python3 attribute_overhead.py EVAL_DIR [--overhead-csv transform-cycle-counts-overhead.csv]
+                                         [--avg-cycles-csv transform-cycle-counts-avg.csv]
+
+predicted extra cycles per iteration = sum over opcodes of
+    (dynamic hits per iteration) * (transformed - original cycles of the opcode)
+and the predicted overhead adds those to the register reservation only (rr)
+run, since that is what the cs ablations build on. where an ablation was run,
+its measured overhead is reported next to the prediction.
+"""
+
+# ablation dir for each category of comp simp transforms, see CS_ABLATIONS in eval.sh
+CATEGORIES = ['cs_mul64', 'cs_lea', 'cs_vector', 'cs_other_64', 'cs_other']
+ALL_CATEGORIES = 'cs'
+
+# transform cost csvs prefix each opcode with its mitigation, see get_opcode_name
+# in implementation-testing/get_cycle_count_data.py
+CS_OPCODE_PREFIX = 'cs-'
+
+
+@functools.lru_cache(maxsize=None)
+def opcode_category(opcode):
+    ''' Get the cs ablation whose transforms cover a MIR opcode, see MirOpcode.category. '''
+    return mir_opcode.MirOpcode(opcode).category()
+
+
+def load_transform_costs(overhead_filepath, avg_cycles_filepath, default_orig_cycles):
+    '''
+    Get the extra cycles each comp simp transform costs per execution, by MIR
+    opcode. Uses the measured original and transformed averages where
+    available, otherwise (geomean overhead - 1) * `default_orig_cycles`.
+    '''
+    costs = dict()
+    if overhead_filepath is not None and os.path.exists(overhead_filepath):
+        with open(overhead_filepath) as file:
+            for opcode, geomean_overhead in csv.reader(file):
+                if opcode.startswith(CS_OPCODE_PREFIX):
+                    costs[opcode[len(CS_OPCODE_PREFIX):]] = (float(geomean_overhead) - 1) * default_orig_cycles
+
+    if avg_cycles_filepath is not None and os.path.exists(avg_cycles_filepath):
+        with open(avg_cycles_filepath) as file:
+            for opcode, orig_avg, _, transformed_avg, _ in csv.reader(file):
+                if opcode.startswith(CS_OPCODE_PREFIX):
+                    costs[opcode[len(CS_OPCODE_PREFIX):]] = float(transformed_avg) - float(orig_avg)
+
+    return costs
+
+
+def hits_per_iteration(fn_data):
+    '''
+    Get the dynamic hit counts of one benchmark per benchmark iteration. The hit
+    counters run for the whole driver, so this divides by the benchmark and
+    warmup iterations in the cycle counts title.
+    '''
+    match = ped.TITLE_RE.search(fn_data[ped.TITLE])
+    num_runs = int(match.group('iterations')) + int(match.group('warmup')) if match else 1
+    return dict({
+        opcode: int(hits) / num_runs for opcode, hits in fn_data[ped.DYN_HITS].items()
+    })
+
+
+def attribute(data, lib, fn, costs):
+    '''
+    Predict the extra cycles per iteration of each category for one fn.
+    Returns (dict of category -> predicted extra cycles,
+             dict of category -> list of (opcode, extra cycles) sorted by cost,
+             list of opcodes with hits but no measured cost)
+    or None if there are no dynamic hit counts for it.
+    '''
+    # the full cs ablation counts every category's hits, a category's own
+    # ablation only counts its own
+    sources = [abl for abl in CATEGORIES + [ALL_CATEGORIES]
+               if fn in data[lib].get(abl, dict()) and data[lib][abl][fn][ped.DYN_HITS] is not None]
+    if not sources:
+        return None
+
+    all_hits = hits_per_iteration(data[lib][sources[-1]][fn])
+    predicted = dict({category: 0.0 for category in CATEGORIES})
+    by_opcode = dict({category: [] for category in CATEGORIES})
+    unmodeled = []
+    for category in CATEGORIES:
+        hits = hits_per_iteration(data[lib][category][fn]) if category in sources else all_hits
+        for opcode, opcode_hits in hits.items():
+            if opcode_category(opcode) != category or opcode_hits == 0:
+                continue
+            if opcode not in costs:
+                unmodeled.append(opcode)
+                continue
+            extra = opcode_hits * costs[opcode]
+            predicted[category] += extra
+            by_opcode[category].append((opcode, extra))
+        by_opcode[category].sort(key=lambda opcode_extra: -opcode_extra[1])
+
+    return predicted, by_opcode, sorted(set(unmodeled))
+
+
+def gen_attribution_rows(data, baseline_dir, rr_dir, costs):
+    ''' Get one row per (fn, category) of predicted and, where run, measured overheads. '''
+    rows = []
+    for lib in data.keys():
+        for fn in ped.CRYPTO_FNS[lib]:
+            if fn not in data[lib][baseline_dir]:
+                continue
+            attribution = attribute(data, lib, fn, costs)
+            if attribution is None:
+                print(f"No dynamic hit counts for {lib} {fn}, rerun ./eval.sh with -d. Skipping")
+                continue
+            predicted, by_opcode, unmodeled = attribution
+            if unmodeled:
+                print(f"warning: no transform cost for {lib} {fn} opcodes {', '.join(unmodeled)}")
+
+            baseline_mean = data[lib][baseline_dir][fn][ped.MEAN]
+            # the cs builds also reserve registers, predict on top of that
+            if fn in data[lib].get(rr_dir, dict()):
+                reference_mean = data[lib][rr_dir][fn][ped.MEAN]
+            else:
+                reference_mean = baseline_mean
+
+            for category in CATEGORIES + [ALL_CATEGORIES]:
+                if category == ALL_CATEGORIES:
+                    extra = sum(predicted.values())
+                    top = sorted([opcode_extra for opcodes in by_opcode.values() for opcode_extra in opcodes],
+                                 key=lambda opcode_extra: -opcode_extra[1])
+                else:
+                    extra = predicted[category]
+                    top = by_opcode[category]
+
+                measured = None
+                if fn in data[lib].get(category, dict()):
+                    measured = data[lib][category][fn][ped.MEAN] / baseline_mean
+
+                rows.append(dict({
+                    'lib': lib,
+                    'fn': fn,
+                    'category': category,
+                    'baseline_cycles': baseline_mean,
+                    'predicted_extra_cycles': extra,
+                    'predicted_overhead': (reference_mean + extra) / baseline_mean,
+                    'measured_overhead': measured,
+                    'top_opcodes': top,
+                }))
+    return rows
+
+
+def rank_opcodes(rows):
+    '''
+    Rank opcodes by their predicted share of each fn's baseline cycles, summed
+    over fns: the transforms worth optimising first.
+    '''
+    shares = dict()
+    for row in rows:
+        if row['category'] != ALL_CATEGORIES:
+            continue
+        for opcode, extra in row['top_opcodes']:
+            shares[opcode] = shares.get(opcode, 0.0) + extra / row['baseline_cycles']
+    return sorted(shares.items(), key=lambda opcode_share: -opcode_share[1])
+
+
+def gen_report_string(rows, ranking, top):
+    lines = [f"{'fn':<26} {'category':<12} {'extra cyc/iter':>14} {'predicted':>9} {'measured':>9}  top opcodes"]
+    for row in rows:
+        measured = '-' if row['measured_overhead'] is None else f"{row['measured_overhead']:.3f}"
+        top_opcodes = ', '.join(f'{opcode} ({extra:.0f})' for opcode, extra in row['top_opcodes'][:top])
+        lines.append(f"{row['fn']:<26} {row['category']:<12} {row['predicted_extra_cycles']:>14.1f} "
+                     f"{row['predicted_overhead']:>9.3f} {measured:>9}  {top_opcodes}")
+
+    lines.append('')
+    lines.append('transforms to optimise first (summed predicted overhead share over fns):')
+    for opcode, share in ranking[:top]:
+        lines.append(f'\t{opcode:<16} {opcode_category(opcode):<12} {share:+.3f}')
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(usage=usage_msg)
+    parser.add_argument('eval_dir', help='directory containing the raw eval data, recorded with -d')
+    parser.add_argument('--baseline-dir', default='baseline',
+        help='subdirectory of eval_dir containing baseline data. Defaults to `baseline`')
+    parser.add_argument('--rr-dir', default='rr',
+        help='subdirectory of eval_dir containing register reservation only data. Defaults to `rr`')
+    parser.add_argument('--overhead-csv', default='transform-cycle-counts-overhead.csv',
+        help='per-opcode geomean overheads from ./eval_cycle_counts.sh')
+    parser.add_argument('--avg-cycles-csv', default='transform-cycle-counts-avg.csv',
+        help='per-opcode average original and transformed cycles from ./eval_cycle_counts.sh')
+    parser.add_argument('--default-orig-cycles', type=float, default=1.0,
+        help='cycles assumed for an original opcode that only has a geomean overhead. Defaults to 1')
+    parser.add_argument('--top', type=int, default=5, help='number of top opcodes to list. Defaults to 5')
+    parser.add_argument('-o', '--out', help='also write the rows to this csv')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+        help='number of worker processes for loading data. Defaults to the number of cores')
+
+    args = parser.parse_args()
+
+    costs = load_transform_costs(args.overhead_csv, args.avg_cycles_csv, args.default_orig_cycles)
+    if not costs:
+        print(f"Couldn't find transform costs in {args.overhead_csv} or {args.avg_cycles_csv}, "
+              "run ./eval_cycle_counts.sh first")
+        sys.exit(1)
+
+    ablations = [abl for abl in [args.rr_dir, ALL_CATEGORIES] + CATEGORIES
+                 if os.path.isdir(os.path.join(args.eval_dir, abl))]
+    data = ped.get_data(args.eval_dir, args.baseline_dir, ablations, jobs=args.jobs)
+
+    rows = gen_attribution_rows(data, args.baseline_dir, args.rr_dir, costs)
+    print(gen_report_string(rows, rank_opcodes(rows), args.top))
+
+    if args.out:
+        with open(args.out, 'w') as file:
+            writer = csv.writer(file)
+            writer.writerow(['lib', 'fn', 'category', 'predicted_extra_cycles',
+                             'predicted_overhead', 'measured_overhead'])
+            for row in rows:
+                writer.writerow([row['lib'], row['fn'], row['category'], row['predicted_extra_cycles'],
+                                 row['predicted_overhead'], row['measured_overhead']])
+        print(f'Saved attribution to {args.out}')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,432 @@
+import argparse
+import csv
+import datetime
+import json
+import os
+import re
+import sys
+from collections import Counter, defaultdict
+
+import cio_resource_monitor
+
+usage_msg = """
+rank the subroutines and instructions the checker spent its time on, to
+find the config entries to exclude, split or give other timeouts.
+
+  python3 checker_hotspots.py BUILD_DIR [--double-check] [--sort check|symex|alerts] [--top 20]
+      [--symex-csv PATH] [--symex-columns sub=subroutine_name,addr=addr,time=time_ms,count=count]
+      [--symex-time-unit 0.001] [--sub-start-re RE] [--timestamp-re RE]
+
+joins per subroutine, and per instruction (subroutine, addr):
+  - symex time and counts from the symex profiling csv cio has bap write
+    into the build dir
+  - checking time, log lines, timeouts and errors of the section of
+    bap.log each subroutine's analysis writes, and the cs/ss stats blocks
+  - alerts from checker.alerts.csv, by alert reason
+and shows each one's share of the CHECKING step (DOUBLECHECKING with
+--double-check): the step's cpu seconds from cio-resources.json when cio
+ran with --monitor-resources, else its wall seconds from
+cio-run-times.csv times the number of bap processes (--bap-shards).
+
+the symex profiling csv has a header row, and --symex-columns says which
+of its columns is the subroutine, the instruction address, the time (in
+--symex-time-unit seconds) and the count. the subroutine and time columns
+have to be in the header, this exits with an error otherwise; without an
+addr column every row is a subroutine total, and so is a row with an
+empty addr. without a count column every row counts once.
+
+a bap.log section starts at a line matching --sub-start-re and ends at
+the next one, at a cs/ss stats block, or at a shard's part of a sharded
+log. sections are timed when log lines start with a timestamp matching
+--timestamp-re; the time outside any section (lifting the binary, mostly)
+is reported too. this exits with an error when there is no bap.log, or
+no line of it matches --sub-start-re, rather than rank without it.
+ranking by checking time (the default --sort) also needs timestamps.
+
+the default columns and patterns are cio's expectation of what the
+checker (the checker submodule) writes; if it writes something else,
+pass its columns and the line it logs when it starts on a subroutine.
+"""
+
+DEFAULT_SYMEX_CSV = 'symex-profiling-data.csv'
+DEFAULT_TOP = 20
+
+# role -> column of the symex profiling csv, named like checker.alerts.csv's
+DEFAULT_SYMEX_COLUMNS = {'sub': 'subroutine_name', 'addr': 'addr', 'time': 'time_ms', 'count': 'count'}
+SYMEX_ROLES = tuple(DEFAULT_SYMEX_COLUMNS)
+REQUIRED_SYMEX_ROLES = ('sub', 'time')
+DEFAULT_SYMEX_TIME_UNIT = 1e-3
+
+DEFAULT_SUB_START_RE = r'\bchecking sub(?:routine)?:? (?P<sub>[A-Za-z_.$][\w.$@]*)'
+# [2023-04-19 07:27:12.123] or 07:27:12 at the start of a line
+DEFAULT_TIMESTAMP_RE = (r'^\[?(?:(?P<date>\d{4}-\d\d-\d\d)[ T])?'
+                        r'(?P<hours>\d\d):(?P<minutes>\d\d):(?P<seconds>\d\d(?:\.\d+)?)\]?')
+STATS_START_RE = re.compile(r'^\s*(?P<kind>cs|ss) stats:')
+# like ./get_bap_numbers.sh
+STATS_LINES = 9
+STATS_LINE_RE = re.compile(r'^\s*(?P<key>[^:=]+?)\s*[:=]\s*(?P<value>\S.*?)\s*$')
+SHARD_HEADER_RE = re.compile(r'^==> shard-\d+')
+TIMEOUT_RE = re.compile(r'(?i)time[ds]?[ -]?out')
+ERROR_RE = re.compile(r'(?i)\b(?:error|exception|fatal)\b')
+
+
+def parse_addr(addr):
+    ''' Get an address as an int whatever way it's written, or as is if it isn't one. '''
+    addr = addr.strip()
+    try:
+        if addr.lower().startswith('0x'):
+            return int(addr, 16)
+        if re.fullmatch(r'[0-9a-fA-F]+', addr) and re.search(r'[a-fA-F]', addr):
+            return int(addr, 16)
+        return int(addr)
+    except ValueError:
+        return addr
+
+
+def fmt_addr(addr):
+    return hex(addr) if isinstance(addr, int) else addr
+
+
+def addr_order(addr):
+    ''' sorts addresses numerically, ones that aren't numbers after them '''
+    return (0, addr, '') if isinstance(addr, int) else (1, 0, addr)
+
+
+def parse_symex_columns(spec):
+    ''' Get role -> column of a --symex-columns role=column,... over the defaults. '''
+    columns = dict(DEFAULT_SYMEX_COLUMNS)
+    for part in spec.split(',') if spec else []:
+        role, sep, column = part.partition('=')
+        if not sep or role not in SYMEX_ROLES:
+            raise ValueError(f'--symex-columns takes role=column pairs of the roles {", ".join(SYMEX_ROLES)}, '
+                             f'not {part!r}')
+        columns[role] = column
+    return columns
+
+
+def to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def read_symex_csv(path, columns, time_unit):
+    '''
+    Get sub -> {'secs', 'count'} and (sub, addr) -> {'secs', 'count'} of a
+    symex profiling csv, and the role -> column of the columns it has.
+    '''
+    with open(path, newline='') as f:
+        reader = csv.DictReader(f)
+        header = reader.fieldnames or []
+        missing = [f'{role}={columns[role]}' for role in REQUIRED_SYMEX_ROLES if columns[role] not in header]
+        if missing:
+            raise ValueError(f"{path} has no {' or '.join(missing)} column, its header is {','.join(header)}. "
+                             f"see --symex-columns")
+        roles = {role: column for role, column in columns.items() if column in header}
+
+        sub_totals = defaultdict(lambda: {'secs': 0.0, 'count': 0})
+        insn_sums = defaultdict(lambda: {'secs': 0.0, 'count': 0})
+        insns = defaultdict(lambda: {'secs': 0.0, 'count': 0})
+        for row in reader:
+            sub = (row.get(roles['sub']) or '').strip()
+            if not sub:
+                continue
+            secs = (to_float(row.get(roles['time'])) or 0.0) * time_unit
+            count = to_float(row.get(roles['count'])) if 'count' in roles else None
+            count = int(count) if count is not None else 1
+
+            addr = (row.get(roles['addr']) or '').strip() if 'addr' in roles else ''
+            if addr:
+                for counts in (insns[(sub, parse_addr(addr))], insn_sums[sub]):
+                    counts['secs'] += secs
+                    counts['count'] += count
+            else:
+                sub_totals[sub]['secs'] += secs
+                sub_totals[sub]['count'] += count
+
+    # a subroutine's own total row, if it has one, already covers its instructions
+    subs = {sub: dict(counts) for sub, counts in insn_sums.items()}
+    subs.update({sub: dict(counts) for sub, counts in sub_totals.items()})
+    return subs, {key: dict(counts) for key, counts in insns.items()}, roles
+
+
+def parse_timestamp(match, last):
+    ''' Get seconds of a timestamp match, past last if the clock went round midnight without a date. '''
+    secs = int(match.group('hours')) * 3600 + int(match.group('minutes')) * 60 + float(match.group('seconds'))
+    date = match.groupdict().get('date')
+    if date:
+        secs += datetime.date.fromisoformat(date).toordinal() * 86400
+    elif last is not None:
+        while secs < last:
+            secs += 86400
+    return secs
+
+
+def parse_bap_log(path, sub_start_re, timestamp_re):
+    '''
+    Get sub -> {'secs', 'lines', 'timeouts', 'errors', 'sections'} of the
+    sections of bap.log, the cs/ss stats blocks, and the secs of the log
+    outside any section (None if it has no timestamps).
+    '''
+    subs = defaultdict(lambda: {'secs': 0.0, 'lines': 0, 'timeouts': 0, 'errors': 0, 'sections': 0})
+    stats = defaultdict(dict)
+    outside = {'secs': 0.0, 'timed': False}
+    current = None
+    section_start = None
+    last_ts = None
+    # end of the previous section, or start of the log or a shard's part
+    outside_start = None
+    stats_kind = None
+    stats_left = 0
+
+    def close(at):
+        nonlocal current, section_start, outside_start
+        if current is not None and section_start is not None and at is not None:
+            subs[current]['secs'] += at - section_start
+        elif current is None and outside_start is not None and at is not None:
+            outside['secs'] += at - outside_start
+            outside['timed'] = True
+        current = None
+        section_start = None
+        outside_start = at
+
+    with open(path, errors='replace') as f:
+        for line in f:
+            line = line.rstrip('\n')
+            if SHARD_HEADER_RE.match(line):
+                # another bap process, its clock starts over
+                close(last_ts)
+                last_ts = None
+                outside_start = None
+                continue
+
+            ts_match = timestamp_re.match(line)
+            if ts_match is not None:
+                last_ts = parse_timestamp(ts_match, last_ts)
+                if current is None and outside_start is None:
+                    outside_start = last_ts
+                elif current is not None and section_start is None:
+                    section_start = last_ts
+
+            body = line[ts_match.end():] if ts_match else line
+            if stats_left:
+                stats_left -= 1
+                stats_line = STATS_LINE_RE.match(body)
+                if stats_line is not None:
+                    stats[stats_kind][stats_line.group('key')] = stats_line.group('value')
+                    continue
+                stats_left = 0
+            stats_match = STATS_START_RE.match(body)
+            if stats_match is not None:
+                # the stats are of the whole run, not of the last subroutine
+                close(last_ts)
+                stats_kind = stats_match.group('kind')
+                stats_left = STATS_LINES
+                continue
+
+            start = sub_start_re.search(line)
+            if start is not None:
+                close(last_ts)
+                current = start.group('sub')
+                section_start = last_ts
+                subs[current]['sections'] += 1
+            if current is not None:
+                subs[current]['lines'] += 1
+                if TIMEOUT_RE.search(line):
+                    subs[current]['timeouts'] += 1
+                if ERROR_RE.search(line):
+                    subs[current]['errors'] += 1
+    close(last_ts)
+    return ({sub: dict(counts) for sub, counts in subs.items()}, dict(stats),
+            outside['secs'] if outside['timed'] else None)
+
+
+def read_alerts(path):
+    ''' Get sub -> reason counter, and (sub, addr) -> {'opcode', 'reasons'} of an alerts csv. '''
+    subs = defaultdict(Counter)
+    insns = dict()
+    with open(path, newline='') as f:
+        for row in csv.DictReader(f):
+            sub = row['subroutine_name']
+            reason = row.get('alert_reason') or '?'
+            subs[sub][reason] += 1
+            key = (sub, parse_addr(row['addr']))
+            insn = insns.setdefault(key, {'opcode': row.get('mir_opcode', ''), 'reasons': Counter()})
+            insn['reasons'][reason] += 1
+    return dict(subs), insns
+
+
+def step_total(build_dir, step):
+    '''
+    Get the seconds the checker processes of a step took, and what they're
+    based on, or (None, why not).
+    '''
+    num_procs = 1
+    shard_plan = os.path.join(build_dir, 'bap-shards', 'shards.json')
+    if os.path.exists(shard_plan):
+        with open(shard_plan) as f:
+            num_procs = len(json.load(f)['shards'])
+
+    if os.path.exists(os.path.join(build_dir, cio_resource_monitor.SUMMARY_FILENAME)):
+        _, stages = cio_resource_monitor.read_summary(build_dir)
+        if step in stages:
+            cpu = stages[step]['cpu_user_sec'] + stages[step]['cpu_sys_sec']
+            return cpu, f'{step} used {cpu:.1f} cpu secs, see {cio_resource_monitor.SUMMARY_FILENAME}'
+
+    run_times = os.path.join(build_dir, 'cio-run-times.csv')
+    if os.path.exists(run_times):
+        with open(run_times, newline='') as f:
+            for row in csv.DictReader(f):
+                if row['step'] == step:
+                    wall = int(row['stop_sec']) - int(row['start_sec'])
+                    return wall * num_procs, (f'{step} took {wall}s x {num_procs} bap processes, '
+                                              f'see cio-run-times.csv')
+    return None, f'no {step} step in cio-run-times.csv'
+
+
+def share(secs, total):
+    if secs is None or not total:
+        return '-'
+    return f'{secs / total:.1%}'
+
+
+def secs_cell(secs):
+    return f'{secs:.1f}' if secs is not None else '-'
+
+
+def reasons_cell(reasons):
+    return ' '.join(f'{reason}:{count}' for reason, count in reasons.most_common())
+
+
+def report(subs, insns, stats, outside_secs, total, total_basis, sort, top):
+    print(total_basis)
+    for kind in sorted(stats):
+        print(f'{kind} stats: ' + ', '.join(f'{key}={value}' for key, value in stats[kind].items()))
+    if outside_secs is not None:
+        print(f'bap.log outside any subroutine (lifting, mostly): {outside_secs:.1f}s {share(outside_secs, total)}')
+    print()
+
+    sort_keys = {'check': lambda item: (item[1]['check_secs'] or 0, item[1]['symex_secs'] or 0),
+                 'symex': lambda item: (item[1]['symex_secs'] or 0, item[1]['check_secs'] or 0),
+                 'alerts': lambda item: (sum(item[1]['reasons'].values()), item[1]['symex_secs'] or 0)}
+    # most expensive first, ties by name
+    ranked = sorted(subs.items(), key=lambda item: (tuple(-cost for cost in sort_keys[sort](item)), item[0]))[:top]
+    print(f"{'subroutine':<40} {'check s':>9} {'share':>7} {'symex s':>9} {'share':>7} {'symex n':>8} "
+          f"{'alerts':>7} {'log lines':>9} {'timeouts':>8}  reasons")
+    for sub, info in ranked:
+        print(f"{sub:<40} {secs_cell(info['check_secs']):>9} {share(info['check_secs'], total):>7} "
+              f"{secs_cell(info['symex_secs']):>9} {share(info['symex_secs'], total):>7} "
+              f"{info['symex_count'] if info['symex_count'] is not None else '-':>8} "
+              f"{sum(info['reasons'].values()):>7} {info['lines']:>9} {info['timeouts']:>8}  "
+              f"{reasons_cell(info['reasons'])}")
+
+    if not insns:
+        return
+    print()
+    insn_keys = {'check': lambda item: (item[1]['symex_secs'] or 0, sum(item[1]['reasons'].values())),
+                 'symex': lambda item: (item[1]['symex_secs'] or 0, sum(item[1]['reasons'].values())),
+                 'alerts': lambda item: (sum(item[1]['reasons'].values()), item[1]['symex_secs'] or 0)}
+    # most expensive first, ties by subroutine and ascending address
+    ranked = sorted(insns.items(), key=lambda item: (tuple(-cost for cost in insn_keys[sort](item)),
+                                                     item[0][0], addr_order(item[0][1])))[:top]
+    print(f"{'subroutine':<40} {'addr':>10} {'opcode':<16} {'symex s':>9} {'share':>7} {'symex n':>8} "
+          f"{'alerts':>7}  reasons")
+    for (sub, addr), info in ranked:
+        print(f"{sub:<40} {fmt_addr(addr):>10} {info['opcode']:<16} {secs_cell(info['symex_secs']):>9} "
+              f"{share(info['symex_secs'], total):>7} "
+              f"{info['symex_count'] if info['symex_count'] is not None else '-':>8} "
+              f"{sum(info['reasons'].values()):>7}  {reasons_cell(info['reasons'])}")
+
+
+def join(symex_subs, symex_insns, log_subs, alert_subs, alert_insns):
+    ''' Get sub -> everything known of it, and (sub, addr) -> everything known of it. '''
+    subs = dict()
+    for sub in set(symex_subs) | set(log_subs) | set(alert_subs):
+        symex = symex_subs.get(sub)
+        log = log_subs.get(sub, {'secs': None, 'lines': 0, 'timeouts': 0})
+        subs[sub] = {'check_secs': log['secs'] if log['secs'] else None,
+                     'symex_secs': symex['secs'] if symex else None,
+                     'symex_count': symex['count'] if symex else None,
+                     'lines': log['lines'], 'timeouts': log['timeouts'],
+                     'reasons': alert_subs.get(sub, Counter())}
+    insns = dict()
+    for key in set(symex_insns) | set(alert_insns):
+        symex = symex_insns.get(key)
+        alerts = alert_insns.get(key, {'opcode': '', 'reasons': Counter()})
+        insns[key] = {'symex_secs': symex['secs'] if symex else None,
+                      'symex_count': symex['count'] if symex else None,
+                      'opcode': alerts['opcode'], 'reasons': alerts['reasons']}
+    return subs, insns
+
+
+def main():
+    argparser = argparse.ArgumentParser(usage=usage_msg)
+    argparser.add_argument('build_dir')
+    argparser.add_argument('--double-check', action='store_true',
+                           help='the double check of the mitigated binary instead of the check')
+    argparser.add_argument('--symex-csv', help='symex profiling csv, by default the one in the build dir')
+    argparser.add_argument('--symex-columns',
+                           help='role=column pairs of the symex csv\'s columns, of the roles sub, addr, time '
+                                'and count. defaults to ' +
+                                ','.join(f'{role}={column}' for role, column in DEFAULT_SYMEX_COLUMNS.items()))
+    argparser.add_argument('--symex-time-unit', type=float, default=DEFAULT_SYMEX_TIME_UNIT,
+                           help='seconds per unit of the symex time column')
+    argparser.add_argument('--sub-start-re', default=DEFAULT_SUB_START_RE,
+                           help='a bap.log line starting a subroutine\'s section, with a (?P<sub>...) group')
+    argparser.add_argument('--timestamp-re', default=DEFAULT_TIMESTAMP_RE,
+                           help='a bap.log line timestamp with hours, minutes, seconds and optionally date groups')
+    argparser.add_argument('--sort', choices=['check', 'symex', 'alerts'], default='check',
+                           help='rank by checking time from bap.log, symex time or alerts')
+    argparser.add_argument('--top', type=int, default=DEFAULT_TOP)
+    args = argparser.parse_args()
+
+    # cio names the double check's files after the check's
+    step = 'DOUBLECHECKING' if args.double_check else 'CHECKING'
+    symex_csv = args.symex_csv or os.path.join(args.build_dir, DEFAULT_SYMEX_CSV)
+    bap_log = os.path.join(args.build_dir, 'bap.log')
+    alerts_csv = os.path.join(args.build_dir, 'checker.alerts.csv')
+    if args.double_check:
+        symex_csv = args.symex_csv or f'{symex_csv}.verification.csv'
+        bap_log = f'{bap_log}.verification.log'
+        alerts_csv = f'{alerts_csv}.verification.csv'
+
+    symex_subs, symex_insns = dict(), dict()
+    if os.path.exists(symex_csv):
+        try:
+            symex_subs, symex_insns, roles = read_symex_csv(symex_csv, parse_symex_columns(args.symex_columns),
+                                                            args.symex_time_unit)
+        except ValueError as err:
+            print(f'error: {err}')
+            sys.exit(1)
+        print(f'{symex_csv}: ' + ', '.join(f'{role}={column}' for role, column in roles.items()))
+    else:
+        print(f"warning: no symex profiling csv {symex_csv}, cio only writes it into the build dir since "
+              f"this script was added, pass --symex-csv for older runs")
+
+    if not os.path.exists(bap_log):
+        print(f'error: no bap.log {bap_log}, the checking times and stats come from it. is {args.build_dir} '
+              f'a cio build dir{" that double checked" if args.double_check else ""}?')
+        sys.exit(1)
+    log_subs, stats, outside_secs = parse_bap_log(bap_log, re.compile(args.sub_start_re),
+                                                  re.compile(args.timestamp_re))
+    if not log_subs:
+        print(f'error: no line of {bap_log} matches --sub-start-re {args.sub_start_re!r}, pass the '
+              f'pattern of the line the checker logs when it starts checking a subroutine')
+        sys.exit(1)
+
+    alert_subs, alert_insns = dict(), dict()
+    if os.path.exists(alerts_csv):
+        alert_subs, alert_insns = read_alerts(alerts_csv)
+
+    total, total_basis = step_total(args.build_dir, step)
+    subs, insns = join(symex_subs, symex_insns, log_subs, alert_subs, alert_insns)
+    if args.sort == 'check' and all(info['check_secs'] is None for info in subs.values()):
+        print(f'error: no checking times in {bap_log}, its lines have no timestamps matching --timestamp-re. '
+              f'pass --timestamp-re, or --sort symex or --sort alerts')
+        sys.exit(1)
+    report(subs, insns, stats, outside_secs, total, total_basis, args.sort, args.top)
+
+
+if __name__ == "__main__":
+    main()
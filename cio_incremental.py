@@ -0,0 +1,566 @@
+import argparse
+import bisect
+import csv
+import hashlib
+import json
+import os
+import re
+import shutil
+import sqlite3
+import subprocess
+import sys
+import time
+
+usage_msg = """
+check only what changed since earlier cio runs. with --incremental, cio
+runs this around the checking and double checking steps:
+
+  python3 cio_incremental.py plan BIG_OBJ CONFIG_FILE --plan-dir BUILD_DIR/incremental [--store cio-incremental.sqlite3]
+      [--checker-flags="CHECKER FLAGS"] [--checker-plugin PLUGIN ...]
+      [--mitigation-flags="MITIGATION CFLAGS" --mitigation-compiler CC]
+  (bap on BUILD_DIR/incremental/dirty.config, if it isn't empty)
+  python3 cio_incremental.py merge --plan-dir BUILD_DIR/incremental -o BUILD_DIR/checker.alerts.csv [--store ...]
+  (mitigation, then the double check on BUILD_DIR/incremental/dirty.config
+   with the taint cache of the check above, if it isn't empty)
+  python3 cio_incremental.py merge --plan-dir BUILD_DIR/incremental --verification-binary BIG_OBJ.verification.o
+      -o BUILD_DIR/checker.alerts.csv.verification.csv [--store ...]
+
+  python3 cio_incremental.py status [--store ...]
+
+`plan` fingerprints every function of BIG_OBJ from its disassembly, with
+addresses replaced by symbol+offset so a function that only moved keeps
+its fingerprint, and combines the fingerprints over the call graph. each
+entry of the checker config (function,secret arg index) is fingerprinted
+by the fingerprints of the functions it reaches, its secret args, the
+checker flags and the hash of the checker plugin, so changing either of
+the latter checks every entry again. entries whose fingerprint has no
+stored alerts go into dirty.config for bap to check.
+
+the double check reads the taint cache of the check, which only covers
+the entries that were checked, so it checks dirty.config too. with
+--mitigation-flags (the mitigation cflags, without the alerts csv path
+that changes with the build dir) an entry also gets a verification
+fingerprint of its fingerprint, the mitigation flags and the compiler.
+entries without stored double check alerts for it are dirty as well, so
+changing only the mitigation checks every entry again, and the double
+check's alerts get stored and merged like the check's, with
+--verification-binary for the functions' addresses in the mitigated
+binary.
+
+`merge` stores the alerts of that bap run under the dirty entries that
+reach each alert's function, and writes them together with the stored
+alerts of the clean entries, rebased to their functions' new addresses,
+as one alerts csv.
+
+the call graph is direct calls and tail calls, plus an edge from every
+indirect call to every function whose address is taken. an alert in a
+function no entry reaches can't be attributed, so that run's dirty
+entries aren't stored and the next run checks them again. an alert of a
+function reached from several entries is kept while any of them is clean,
+so merged alerts can only be a superset of a full run's, never miss one.
+"""
+
+DEFAULT_STORE = 'cio-incremental.sqlite3'
+
+OBJDUMP_FLAGS = ['-d', '-w', '--no-show-raw-insn', '-M', 'suffix']
+
+PLAN_FILENAME = 'plan.json'
+DIRTY_CONFIG_FILENAME = 'dirty.config'
+NEW_ALERTS_FILENAME = 'checker.alerts.csv'
+NEW_VERIFICATION_ALERTS_FILENAME = 'checker.alerts.csv.verification.csv'
+
+# 000000000000fd00 <fe25519_invert>:
+FUNCTION_HEADER_RE = re.compile(r'^(?P<addr>[0-9a-f]+) <(?P<name>[^>]+)>:$')
+#     fd04:	push   %r15
+INSN_RE = re.compile(r'^\s*(?P<addr>[0-9a-f]+):\s*(?P<insn>.*)$')
+# a target objdump symbolized, e.g. `10020 <fe25519_invert+0x320>`
+SYMBOLIZED_RE = re.compile(r'\b(?P<addr>[0-9a-f]+) <(?P<sym>[^>+]+)(?P<off>\+0x[0-9a-f]+)?>')
+RIP_DISPLACEMENT_RE = re.compile(r'-?0x[0-9a-f]+\(%rip\)')
+DIRECT_CALL_RE = re.compile(r'^(call|jmp)[a-z]*\s+<(?P<sym>[^>+]+)(\+0x0)?>$')
+INDIRECT_CALL_RE = re.compile(r'^(call|jmp)[a-z]*\s+\*')
+# 0000000000099840 R_X86_64_RELATIVE  *ABS*+0x000000000000cb50
+RELATIVE_RELOC_RE = re.compile(r'R_X86_64_RELATIVE\s+\*ABS\*\+0x(?P<addr>[0-9a-f]+)')
+# bap names functions without a symbol after their address
+BAP_SUB_RE = re.compile(r'^sub_(?P<addr>[0-9a-f]+)$')
+
+SKIPPED_SECTIONS = ('.plt', '.plt.got', '.plt.sec', '.init', '.fini')
+
+ALERTS_CSV_COLUMNS = ['subroutine_name', 'mir_opcode', 'addr', 'rpo_idx', 'tid', 'problematic_operands',
+                      'left_operand', 'right_operand', 'live_flags', 'is_live', 'alert_reason',
+                      'description', 'flags_live_in']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    fingerprint TEXT PRIMARY KEY,
+    entry TEXT NOT NULL,
+    checked_at TEXT NOT NULL
+);
+
+-- alerts as csv rows with addr made relative to their function
+CREATE TABLE IF NOT EXISTS entry_alerts (
+    fingerprint TEXT NOT NULL REFERENCES entries (fingerprint) ON DELETE CASCADE,
+    function TEXT NOT NULL,
+    offset INTEGER NOT NULL,
+    row TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entry_alerts_by_fingerprint ON entry_alerts (fingerprint);
+"""
+
+
+def connect(store_path=DEFAULT_STORE):
+    db = sqlite3.connect(store_path)
+    db.execute('PRAGMA foreign_keys = ON')
+    db.executescript(SCHEMA)
+    return db
+
+
+def sha256(*parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode())
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def checker_key(flags, plugins):
+    ''' Identify how bap checks: the effective checker flags and the contents of the checker plugin files. '''
+    return sha256(*flags, '', *[file_sha256(plugin) for plugin in plugins])
+
+
+def mitigation_key(flags, compiler):
+    ''' Identify how cio mitigates: the mitigation cflags and the contents of the compiler. '''
+    return sha256(*flags, '', file_sha256(shutil.which(compiler) or compiler))
+
+
+def parse_objdump(dump):
+    '''
+    Get dict of function -> (start addr, [(addr, insn)]) of the functions
+    in objdump -d output, skipping the plt and init/fini stubs.
+    '''
+    functions = dict()
+    insns = None
+    section = None
+    for line in dump.splitlines():
+        if line.startswith('Disassembly of section '):
+            section = line[len('Disassembly of section '):].rstrip(':')
+            insns = None
+            continue
+        header = FUNCTION_HEADER_RE.match(line)
+        if header is not None:
+            insns = None
+            if section not in SKIPPED_SECTIONS:
+                insns = []
+                functions[header.group('name')] = (int(header.group('addr'), 16), insns)
+            continue
+        insn = INSN_RE.match(line)
+        if insn is not None and insns is not None and insn.group('insn') != '(bad)':
+            insns.append((int(insn.group('addr'), 16), insn.group('insn')))
+    return functions
+
+
+def function_ranges(functions):
+    ''' Get sorted ([start], [(start, end, name)]) of the functions, each ending where the next starts. '''
+    starts = sorted((start, name) for name, (start, insns) in functions.items() if insns)
+    ranges = []
+    for idx, (start, name) in enumerate(starts):
+        end = starts[idx + 1][0] if idx + 1 < len(starts) else functions[name][1][-1][0] + 1
+        ranges.append((start, end, name))
+    return [start for start, _, _ in ranges], ranges
+
+
+def containing_function(ranges, addr):
+    ''' Get the name of the function containing addr, or None. '''
+    range_starts, ranges = ranges
+    idx = bisect.bisect_right(range_starts, addr) - 1
+    if idx < 0:
+        return None
+    start, end, name = ranges[idx]
+    return name if start <= addr < end else None
+
+
+def normalize_insn(insn, functions, ranges):
+    '''
+    Get an instruction with every address in it replaced by what it points
+    at: <function+offset> for code, <symbol> for data, so it is the same
+    wherever the linker put it and the things it refers to.
+    '''
+    # keep only the target of a `# 99fe0 <sym>` comment, it's what a rip
+    # relative operand points at
+    code, _, comment = insn.partition('#')
+    target = SYMBOLIZED_RE.search(comment)
+    insn = code + (f' {target.group(0)}' if target is not None else '')
+
+    def symbolize(match):
+        addr = int(match.group('addr'), 16)
+        function = containing_function(ranges, addr)
+        if function is not None:
+            return f'<{function}+{addr - functions[function][0]:#x}>'
+        return f"<{match.group('sym')}>"
+
+    insn = SYMBOLIZED_RE.sub(symbolize, insn)
+    insn = RIP_DISPLACEMENT_RE.sub('(%rip)', insn)
+    return ' '.join(insn.split())
+
+
+def callee_name(sym, functions):
+    ''' e.g. crypto_foo@plt -> crypto_foo, if it's defined here '''
+    sym = sym.split('@')[0]
+    return sym if sym in functions else None
+
+
+def analyze(binary, objdump='objdump'):
+    '''
+    Get dict of function -> {'start', 'size', 'body', 'callees'} for every
+    function in binary, where size is its number of instructions and body
+    is the hash of its normalized instructions.
+    '''
+    dump = subprocess.run([objdump, str(binary)] + OBJDUMP_FLAGS, check=True, text=True,
+                          stdout=subprocess.PIPE).stdout
+    functions = parse_objdump(dump)
+    ranges = function_ranges(functions)
+
+    analysis = dict()
+    address_taken = set()
+    indirect_callers = set()
+    for name, (start, insns) in functions.items():
+        normalized = [normalize_insn(insn, functions, ranges) for _, insn in insns]
+        callees = set()
+        for insn in normalized:
+            call = DIRECT_CALL_RE.match(insn)
+            if call is not None:
+                callee = callee_name(call.group('sym'), functions)
+                if callee is not None and callee != name:
+                    callees.add(callee)
+                continue
+            if INDIRECT_CALL_RE.match(insn):
+                indirect_callers.add(name)
+                continue
+            # a function referenced other than by a call may be called through a pointer
+            for sym in re.findall(r'<([^>+]+)\+0x0>', insn):
+                if callee_name(sym, functions) is not None:
+                    address_taken.add(callee_name(sym, functions))
+        analysis[name] = {'start': start, 'size': len(insns), 'body': sha256(*normalized), 'callees': callees}
+
+    # function pointers in data of a shared object
+    relocs = subprocess.run([objdump, '-R', str(binary)], text=True,
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout
+    for match in RELATIVE_RELOC_RE.finditer(relocs):
+        function = containing_function(ranges, int(match.group('addr'), 16))
+        if function is not None and analysis[function]['start'] == int(match.group('addr'), 16):
+            address_taken.add(function)
+
+    for name in indirect_callers:
+        analysis[name]['callees'] |= address_taken - {name}
+    return analysis
+
+
+def strongly_connected_components(graph):
+    '''
+    Get the sccs of graph (node -> successors) in reverse topological order,
+    callees before callers. iterative tarjan, the call graph is too deep to
+    recurse over.
+    '''
+    index = dict()
+    lowlink = dict()
+    on_stack = set()
+    stack = []
+    sccs = []
+    counter = 0
+    for root in graph:
+        if root in index:
+            continue
+        work = [(root, iter(sorted(graph[root])))]
+        index[root] = lowlink[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack.add(root)
+        while work:
+            node, successors = work[-1]
+            advanced = False
+            for succ in successors:
+                if succ not in index:
+                    index[succ] = lowlink[succ] = counter
+                    counter += 1
+                    stack.append(succ)
+                    on_stack.add(succ)
+                    work.append((succ, iter(sorted(graph[succ]))))
+                    advanced = True
+                    break
+                if succ in on_stack:
+                    lowlink[node] = min(lowlink[node], index[succ])
+            if advanced:
+                continue
+            work.pop()
+            if work:
+                lowlink[work[-1][0]] = min(lowlink[work[-1][0]], lowlink[node])
+            if lowlink[node] == index[node]:
+                scc = []
+                while True:
+                    member = stack.pop()
+                    on_stack.discard(member)
+                    scc.append(member)
+                    if member == node:
+                        break
+                sccs.append(sorted(scc))
+    return sccs
+
+
+def deep_fingerprints(analysis):
+    '''
+    Get function -> hash of its body and its callees' deep fingerprints, so
+    it changes when anything the function can reach changes.
+    '''
+    graph = {name: info['callees'] for name, info in analysis.items()}
+    deep = dict()
+    for scc in strongly_connected_components(graph):
+        members = set(scc)
+        callee_fingerprints = sorted(set(deep[callee] for name in scc for callee in graph[name]
+                                         if callee not in members))
+        fingerprint = sha256(*[f'{name}:{analysis[name]["body"]}' for name in scc], *callee_fingerprints)
+        for name in scc:
+            deep[name] = fingerprint
+    return deep
+
+
+def reachable(analysis, entry):
+    seen = {entry}
+    todo = [entry]
+    while todo:
+        for callee in analysis[todo.pop()]['callees']:
+            if callee not in seen:
+                seen.add(callee)
+                todo.append(callee)
+    return seen
+
+
+def read_config(config_file):
+    ''' Get entry -> sorted secret arg indexes, and the config lines of each entry. '''
+    secrets = dict()
+    lines = dict()
+    with open(config_file) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            entry, _, arg = line.partition(',')
+            secrets.setdefault(entry, []).append(arg)
+            lines.setdefault(entry, []).append(line)
+    return {entry: sorted(args) for entry, args in secrets.items()}, lines
+
+
+def plan(db, binary, config_file, plan_dir, checker='', mitigation=None):
+    '''
+    Write the plan of an incremental check into plan_dir: the dirty entries'
+    config lines for bap and what merge needs. Returns the dirty entries.
+    checker is the checker_key of the bap run, it's part of every entry's
+    fingerprint. mitigation is the mitigation_key if the run double checks.
+    '''
+    analysis = analyze(binary)
+    deep = deep_fingerprints(analysis)
+    secrets, config_lines = read_config(config_file)
+
+    entries = dict()
+    missing = []
+    for entry, args in secrets.items():
+        if entry not in analysis:
+            # nothing to check, it isn't in this build
+            missing.append(entry)
+            continue
+        entries[entry] = {'fingerprint': sha256(deep[entry], checker, *args),
+                          'reaches': sorted(reachable(analysis, entry))}
+        if mitigation is not None:
+            entries[entry]['verification_fingerprint'] = sha256(entries[entry]['fingerprint'], mitigation)
+    if missing:
+        print(f"{len(missing)} config entries aren't functions of {binary}: {' '.join(missing)}", file=sys.stderr)
+
+    stored = set(row[0] for row in db.execute('SELECT fingerprint FROM entries'))
+    dirty = sorted(entry for entry, info in entries.items()
+                   if info['fingerprint'] not in stored
+                   or info.get('verification_fingerprint', info['fingerprint']) not in stored)
+
+    os.makedirs(plan_dir, exist_ok=True)
+    with open(os.path.join(plan_dir, DIRTY_CONFIG_FILENAME), 'w') as f:
+        for entry in dirty:
+            f.writelines(line + '\n' for line in config_lines[entry])
+    with open(os.path.join(plan_dir, PLAN_FILENAME), 'w') as f:
+        json.dump({'binary': os.path.realpath(binary),
+                   'starts': {name: info['start'] for name, info in analysis.items()},
+                   'entries': entries,
+                   'dirty': dirty}, f)
+
+    print(f"{len(dirty)} of {len(entries)} config entries changed since they were last checked", file=sys.stderr)
+    return dirty
+
+
+def rebase(row, function, offset, starts):
+    ''' Get a stored alert row with its addr (and bap sub_ name) moved to where function is now. '''
+    row = dict(row)
+    old_addr = int(row['addr'], 16)
+    new_addr = starts[function] + offset
+    row['addr'] = f'0x{new_addr:X}'
+    sub = BAP_SUB_RE.match(row['subroutine_name'])
+    if sub is not None:
+        row['subroutine_name'] = f"sub_{int(sub.group('addr'), 16) - old_addr + new_addr:x}"
+    return row
+
+
+def function_starts(binary, objdump='objdump'):
+    ''' Get function -> start addr of the functions of binary. '''
+    dump = subprocess.run([objdump, str(binary)] + OBJDUMP_FLAGS, check=True, text=True,
+                          stdout=subprocess.PIPE).stdout
+    return {name: start for name, (start, _) in parse_objdump(dump).items()}
+
+
+def merge(db, plan_dir, output_csv, new_alerts_csv=None, verification_binary=None):
+    '''
+    Store the new alerts of the dirty entries and write them with the stored
+    alerts of the clean entries to output_csv. Returns the number of rows.
+    With verification_binary, the mitigated binary, the alerts are the
+    double check's, stored under the entries' verification fingerprints.
+    '''
+    with open(os.path.join(plan_dir, PLAN_FILENAME)) as f:
+        saved_plan = json.load(f)
+    entries = saved_plan['entries']
+    dirty = saved_plan['dirty']
+    if verification_binary is None:
+        starts = saved_plan['starts']
+        key = 'fingerprint'
+        new_alerts_filename = NEW_ALERTS_FILENAME
+    else:
+        if any('verification_fingerprint' not in info for info in entries.values()):
+            raise ValueError(f'{plan_dir} was planned without the mitigation flags, '
+                             f"so it can't merge double check alerts")
+        starts = function_starts(verification_binary)
+        key = 'verification_fingerprint'
+        new_alerts_filename = NEW_VERIFICATION_ALERTS_FILENAME
+    ranges = sorted((start, name) for name, start in starts.items())
+    range_starts = [start for start, _ in ranges]
+
+    fieldnames = ALERTS_CSV_COLUMNS
+    new_rows = []
+    if dirty:
+        new_alerts_csv = new_alerts_csv or os.path.join(plan_dir, new_alerts_filename)
+        with open(new_alerts_csv, newline='') as f:
+            reader = csv.DictReader(f)
+            fieldnames = reader.fieldnames
+            new_rows = list(reader)
+
+    # which function each new alert is in, and which dirty entries reach it
+    reached_by = dict()
+    for entry in dirty:
+        for function in entries[entry]['reaches']:
+            reached_by.setdefault(function, []).append(entry)
+
+    attributed = []
+    unattributed = 0
+    for row in new_rows:
+        addr = int(row['addr'], 16)
+        idx = bisect.bisect_right(range_starts, addr) - 1
+        function = ranges[idx][1] if idx >= 0 else None
+        if function is None or function not in reached_by:
+            unattributed += 1
+            continue
+        attributed.append((function, addr - starts[function], row))
+
+    if unattributed:
+        print(f"warning: {unattributed} new alerts aren't in a function the dirty entries reach, "
+              "not storing them so the next run checks them again", file=sys.stderr)
+    elif dirty:
+        checked_at = time.strftime('%Y-%m-%d %H:%M:%S')
+        with db:
+            for entry in dirty:
+                fingerprint = entries[entry][key]
+                db.execute('DELETE FROM entries WHERE fingerprint = ?', (fingerprint,))
+                db.execute('INSERT INTO entries VALUES (?, ?, ?)', (fingerprint, entry, checked_at))
+            db.executemany('INSERT INTO entry_alerts VALUES (?, ?, ?, ?)',
+                           [(entries[entry][key], function, offset, json.dumps(row))
+                            for function, offset, row in attributed
+                            for entry in reached_by[function]])
+
+    rows = list(new_rows)
+    clean = [entries[entry][key] for entry in entries if entry not in dirty]
+    for fingerprint in clean:
+        for function, offset, row in db.execute(
+                'SELECT function, offset, row FROM entry_alerts WHERE fingerprint = ?', (fingerprint,)):
+            if function in starts:
+                rows.append(rebase(json.loads(row), function, offset, starts))
+
+    # an alert reached from several entries is stored under each of them
+    unique_rows = list(dict.fromkeys(tuple(row.items()) for row in rows))
+    with open(output_csv, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames, quoting=csv.QUOTE_ALL)
+        # unquoted header, quoted rows, like bap writes them
+        f.write(','.join(fieldnames) + '\n')
+        writer.writerows(dict(row) for row in unique_rows)
+
+    checking = 'checking' if verification_binary is None else 'double checking'
+    print(f"{len(new_rows)} alerts from {checking} {len(dirty)} entries, {len(rows) - len(new_rows)} "
+          f"from the store of {len(clean)} unchanged entries, {len(unique_rows)} after dedup", file=sys.stderr)
+    return len(unique_rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(usage=usage_msg)
+    parser.add_argument('--store', default=DEFAULT_STORE, help=f'alerts store. Defaults to `{DEFAULT_STORE}`')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    plan_parser = subparsers.add_parser('plan', help='find the config entries to check')
+    plan_parser.add_argument('binary')
+    plan_parser.add_argument('config_file')
+    plan_parser.add_argument('--plan-dir', required=True)
+    plan_parser.add_argument('--checker-flags', default='',
+                             help='the checker flags bap runs with. Pass them as --checker-flags="..."')
+    plan_parser.add_argument('--checker-plugin', action='append', default=[],
+                             help='checker plugin file bap loads, can be repeated')
+    plan_parser.add_argument('--mitigation-flags',
+                             help='the mitigation cflags if the run double checks, without the alerts csv path. '
+                                  'Pass them as --mitigation-flags="..."')
+    plan_parser.add_argument('--mitigation-compiler', help='the compiler of the mitigation, with --mitigation-flags')
+
+    merge_parser = subparsers.add_parser('merge', help='store new alerts and write all of them')
+    merge_parser.add_argument('--plan-dir', required=True)
+    merge_parser.add_argument('--new-alerts', help=f'bap alerts csv of dirty.config. Defaults to '
+                                                   f'PLAN_DIR/{NEW_ALERTS_FILENAME}, or '
+                                                   f'PLAN_DIR/{NEW_VERIFICATION_ALERTS_FILENAME} with '
+                                                   f'--verification-binary')
+    merge_parser.add_argument('--verification-binary',
+                              help='merge the double check of this mitigated binary instead of the check')
+    merge_parser.add_argument('-o', '--output', required=True)
+
+    subparsers.add_parser('status', help='summarize the store')
+
+    args = parser.parse_args()
+    db = connect(args.store)
+
+    if args.command == 'plan':
+        mitigation = None
+        if args.mitigation_flags is not None:
+            if args.mitigation_compiler is None:
+                parser.error('--mitigation-flags needs --mitigation-compiler')
+            mitigation = mitigation_key(args.mitigation_flags.split(), args.mitigation_compiler)
+        plan(db, args.binary, args.config_file, args.plan_dir,
+             checker_key(args.checker_flags.split(), args.checker_plugin), mitigation)
+    elif args.command == 'merge':
+        try:
+            merge(db, args.plan_dir, args.output, args.new_alerts, args.verification_binary)
+        except ValueError as err:
+            print(f'error: {err}', file=sys.stderr)
+            sys.exit(1)
+    else:
+        for entry, num_fingerprints, num_alerts, last_checked in db.execute(
+                'SELECT e.entry, COUNT(DISTINCT e.fingerprint), COUNT(a.row), MAX(e.checked_at) '
+                'FROM entries e LEFT JOIN entry_alerts a ON a.fingerprint = e.fingerprint '
+                'GROUP BY e.entry ORDER BY e.entry'):
+            print(f'{entry}\t{num_fingerprints} versions\t{num_alerts} alerts\tlast checked {last_checked}')
+
+
+if __name__ == "__main__":
+    main()
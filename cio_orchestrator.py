@@ -0,0 +1,665 @@
+import argparse
+import csv
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+from collections import namedtuple
+
+import cio_incremental
+import cio_resource_monitor
+import cio_shard
+
+usage_msg = """
+run the cio pipeline as a DAG of cached stages:
+
+  configure -> compile -> check -> mitigate -> double_check
+                                            -> unit_tests (--is-libsodium)
+
+  python3 cio_orchestrator.py --crypto-dir ./libsodium --config-file ./libsodium.uarch_checker.config \\
+      [--is-libsodium] [--ss] [--cs] [-j 8] [-b BUILD_DIR] [-c CC] [...the rest of cio's options]
+  python3 cio_orchestrator.py --resume BUILD_DIR
+
+each stage is keyed by a hash of its inputs (the sources of the crypto dir,
+the compiler binary, its cflags, the checker plugin and config file) and of
+the outputs of the stages it depends on (e.g. the alerts csv for mitigate).
+the outputs of every finished stage are kept in a content addressed cache,
+./cio-cache by default, so a stage whose key was seen before is skipped and
+its outputs copied into the build dir instead: a run with only different
+mitigation flags starts at mitigate, and a failed run started again with
+--resume starts at the stage that failed. the build dir gets the same files
+cio writes, including cio-run-times.csv for ./get_bap_numbers.sh, where
+skipped stages take 0 seconds. the check's outputs include its taint
+caches (with --bap-shards, its shard plan and per shard caches too), so a
+double check after a cached check reads the same taint cache back; a
+cached check of another --bap-shards setting has to be run again with
+--rerun check. with --incremental the double check checks the check's
+dirty entries and merges like it, see ./cio_incremental.py. unit_tests runs `make check` in the crypto
+dir itself, so if mitigate came from the cache it builds the mitigated
+crypto dir again first.
+"""
+
+DEFAULT_CACHE_DIR = 'cio-cache'
+LATEST_BUILD_DIR = 'latest-cio-build'
+STATE_FILENAME = 'cio-orchestrator.json'
+
+DEFAULT_CC = os.path.expanduser('~/llvm-project/build/bin/clang')
+DEFAULT_CHECKER_PLUGIN_PATH = './checker/bap/interval/'
+CHECKER_PLUGIN_NAME = 'uarch_checker.plugin'
+DEFAULT_CFLAGS = ('-g -O2 -pthread -fvisibility=hidden -fPIC -fPIE -fno-strict-aliasing -fno-strict-overflow '
+                  '-fstack-protector -ftls-model=local-dynamic')
+SYSCLANG = '/usr/bin/clang'
+
+# the libsodium library files the Makefile copies out of the crypto dir after cio
+LIBSODIUM_ARTIFACTS = ['src/libsodium/.libs/libsodium.a']
+LIBSODIUM_LA = 'src/libsodium/libsodium.la'
+
+# what hashes the sources of the crypto dir, files generated by configure
+# (X with an X.in next to it) aside
+SOURCE_SUFFIXES = ('.c', '.h', '.s', '.S', '.inc', '.am', '.in', '.ac', '.m4', '.sh')
+SOURCE_NAMES = ('Makefile', 'configure')
+SKIPPED_DIRS = ('.git', '.libs', '.deps')
+
+# stands in for the build dir's alerts csv in the mitigation cflags, so the
+# key doesn't change with the build dir
+ALERTS_CSV_PLACEHOLDER = '@ALERTS_CSV@'
+
+# bap doesn't write it with --nosymex, so it's an output only when it's there
+SYMEX_PROFILING_CSV = 'symex-profiling-data.csv'
+# the check's taint caches, which the double check reads back. bap writes
+# the one in the build dir without --bap-shards and one per shard with it
+TAINT_CACHE = 'taintcache.bin'
+SHARD_DIR = 'bap-shards'
+SHARD_OUTPUT_PREFIX = 'shard_'
+OPTIONAL_OUTPUTS = ('symex_profiling', 'taint_cache')
+
+# cio-run-times.csv steps, in the order ./get_bap_numbers.sh reads them
+STEPS = ['COMPILATION', 'CHECKING', 'MITIGATION', 'DOUBLECHECKING']
+TOTAL_STEP = 'CIOTOTAL'
+
+Stage = namedtuple('Stage', ['name', 'step', 'deps', 'inputs', 'run', 'outputs'])
+Stage.__doc__ = '''
+a node of the pipeline. inputs(ctx) -> dict of what keys it besides its deps'
+outputs, run(ctx) does it, outputs(ctx) -> dict of output name -> path of the
+files it makes, which are cached and restored
+'''
+
+
+class StageError(Exception):
+    pass
+
+
+def sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def sha256_json(obj):
+    return hashlib.sha256(json.dumps(obj, sort_keys=True).encode()).hexdigest()
+
+
+def is_source(dirpath, filename, filenames):
+    if f'{filename}.in' in filenames:
+        return False
+    return filename in SOURCE_NAMES or filename.endswith(SOURCE_SUFFIXES)
+
+
+def sources_hash(target_dir):
+    ''' Hash of the relative paths and contents of the source files of the crypto dir. '''
+    digest = hashlib.sha256()
+    for dirpath, dirnames, filenames in os.walk(target_dir):
+        dirnames[:] = sorted(d for d in dirnames if d not in SKIPPED_DIRS)
+        names = set(filenames)
+        for filename in sorted(filenames):
+            path = os.path.join(dirpath, filename)
+            if not is_source(dirpath, filename, names) or not os.path.isfile(path):
+                continue
+            digest.update(os.path.relpath(path, target_dir).encode() + b'\0')
+            digest.update(sha256_file(path).encode())
+    return digest.hexdigest()
+
+
+def is_optional_output(name):
+    # --bap-shards N lists N shards' files, the plan may have made fewer
+    return name in OPTIONAL_OUTPUTS or name.startswith(SHARD_OUTPUT_PREFIX)
+
+
+class Cache:
+    ''' content addressed output files, and the outputs of each stage key '''
+
+    def __init__(self, cache_dir):
+        self.objects = os.path.join(cache_dir, 'objects')
+        self.stages = os.path.join(cache_dir, 'stages')
+        os.makedirs(self.objects, exist_ok=True)
+        os.makedirs(self.stages, exist_ok=True)
+
+    def object_path(self, sha):
+        return os.path.join(self.objects, sha[:2], sha)
+
+    def manifest_path(self, stage, key):
+        return os.path.join(self.stages, f'{stage}-{key}.json')
+
+    def lookup(self, stage, key):
+        ''' Get the output name -> sha of a stage key, if all its objects are still here. '''
+        path = self.manifest_path(stage, key)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            manifest = json.load(f)
+        if not all(os.path.exists(self.object_path(sha)) for sha in manifest.values()):
+            return None
+        return manifest
+
+    def store(self, stage, key, outputs):
+        manifest = dict()
+        for name, path in outputs.items():
+            if is_optional_output(name) and not os.path.exists(path):
+                continue
+            sha = sha256_file(path)
+            obj = self.object_path(sha)
+            if not os.path.exists(obj):
+                os.makedirs(os.path.dirname(obj), exist_ok=True)
+                shutil.copyfile(path, obj + '.tmp')
+                os.replace(obj + '.tmp', obj)
+            manifest[name] = sha
+        with open(self.manifest_path(stage, key) + '.tmp', 'w') as f:
+            json.dump(manifest, f)
+        os.replace(self.manifest_path(stage, key) + '.tmp', self.manifest_path(stage, key))
+        return manifest
+
+    def restore(self, manifest, outputs):
+        for name, path in outputs.items():
+            if name not in manifest:
+                # an optional output the stage didn't make
+                continue
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            shutil.copyfile(self.object_path(manifest[name]), path)
+
+
+def run_cmd(cmd, stage, log=None, **kwargs):
+    ''' Run a command of a stage, failing the stage if it fails. '''
+    print(f'[{stage}] {" ".join(cmd)}', flush=True)
+    if log is None:
+        result = subprocess.run(cmd, **kwargs)
+    else:
+        with open(log, 'w') as log_file:
+            result = subprocess.run(cmd, stdout=log_file, stderr=subprocess.STDOUT, **kwargs)
+    if result.returncode != 0:
+        raise StageError(f'`{" ".join(cmd)}` exited with {result.returncode}'
+                         + (f', see {log}' if log is not None else ''))
+
+
+def make(ctx, stage, *targets, cflags=None, jobs=True, log=None):
+    cmd = ['make', f'--directory={ctx.args.crypto_dir}']
+    if jobs:
+        cmd += ['-j', str(ctx.args.jobs)]
+    if log is not None:
+        cmd += ['--output-sync=target']
+    cmd += [f'CC={ctx.args.cc}'] if targets != ('clean',) else []
+    if cflags is not None:
+        cmd.append(f'CFLAGS={cflags}')
+    run_cmd(cmd + list(targets), stage, log=log)
+
+
+def jam(ctx, stage, output):
+    ''' Put the crypto dir's objects into one object file for the checker, like cio. '''
+    if ctx.args.is_libsodium:
+        dlname = None
+        with open(os.path.join(ctx.args.crypto_dir, LIBSODIUM_LA)) as f:
+            for line in f:
+                if line.startswith('dlname='):
+                    dlname = line.split('=', 1)[1].strip().strip("'")
+        found = [os.path.join(dirpath, dlname) for dirpath, _, filenames in os.walk(ctx.args.crypto_dir)
+                 if dlname in filenames]
+        if not found:
+            raise StageError(f"couldn't find libsodium's shared lib {dlname} in {ctx.args.crypto_dir}")
+        shutil.copyfile(found[0], output)
+        return
+
+    objects = [os.path.join(dirpath, filename)
+               for dirpath, _, filenames in os.walk(ctx.args.crypto_dir)
+               if '.libs' not in dirpath
+               for filename in filenames if filename.endswith('.o')]
+    run_cmd(['ld', '-O0', '-o', output] + sorted(objects) + ['-lc'], stage)
+
+
+def checker_flags(ctx):
+    flags = []
+    if ctx.args.cs:
+        flags.append('--uarch-checker-cs')
+    if ctx.args.ss:
+        flags.append('--uarch-checker-ss')
+    if ctx.args.nosymex:
+        flags.append('--uarch-checker-no-symex')
+    return flags + ctx.args.checker_flags.split()
+
+
+def run_bap(ctx, stage, alerts_csv, config_file, binary, log, symex_profiling_csv, extra_flags=()):
+    ''' cio's run_bap '''
+    bap_cmd = ['bap', f'--plugin-path={ctx.args.checker_plugin_path}', '--pass=uarch-checker', *extra_flags,
+               '--uarch-checker-log-level=info', '--no-cache', '--no-optimization', '--bil-optimization=0',
+               *checker_flags(ctx)]
+    if ctx.args.bap_shards > 1:
+        print(f'[{stage}] bap in {ctx.args.bap_shards} shards, see ./cio_shard.py', flush=True)
+        failed = cio_shard.run(cio_shard.connect(ctx.args.shard_timings_store), bap_cmd, binary, config_file,
+                               ctx.path(SHARD_DIR), ctx.args.bap_shards, alerts_csv, log,
+                               symex_profiling_csv, cores=ctx.args.bap_core)
+        if failed:
+            raise StageError(f'bap failed on shards {" ".join(map(str, failed))}, see {log}')
+        return
+    cmd = bap_cmd + [f'--uarch-checker-taint-cache={ctx.path(TAINT_CACHE)}',
+                     f'--uarch-checker-output-csv-file={alerts_csv}',
+                     f'--uarch-checker-symex-profiling-output-file={symex_profiling_csv}',
+                     f'--uarch-checker-config-file={config_file}', binary]
+    if ctx.args.bap_core is not None:
+        cmd = ['taskset', '-c', str(ctx.args.bap_core)] + cmd
+    run_cmd(cmd, stage, log=log)
+
+
+def check_alerts_csv(alerts_csv, log):
+    with open(alerts_csv) as f:
+        num_lines = sum(1 for _ in f)
+    if num_lines <= 1:
+        # if it is empty or only has the header row, bap probably didn't run properly
+        raise StageError(f'{alerts_csv} has no alerts, bap probably did not run properly, see {log}')
+
+
+def compilation_cflags(ctx):
+    return f'-mllvm --x86-gen-idx {ctx.args.cflags} {ctx.args.extra_cflags}'
+
+
+def mitigation_cflags(ctx, alerts_csv):
+    ''' the cflags of cio's mitigation pass '''
+    flags = '-mllvm --x86-gen-idx'
+    if ctx.args.ss:
+        flags += f' -mllvm --x86-ss -mllvm --x86-ss-csv-path={alerts_csv}'
+    if ctx.args.cs:
+        flags += f' -mllvm --x86-cs -mllvm --x86-cs-csv-path={alerts_csv}'
+    flags += ' -mllvm --x86-gen-deidx'
+    if ctx.args.cs:
+        flags += ' -mllvm -global-scratch -mllvm -gs-size=8'
+    if ctx.args.dynamic_hit_counts:
+        flags = f'-mllvm --x86-cs-dyn-stat -mllvm --x86-dyn-stat-decl {flags}'
+    return f'{flags} {ctx.args.cflags} {ctx.args.extra_cflags}'
+
+
+def configure_inputs(ctx):
+    return {'sources': ctx.sources, 'sysclang': SYSCLANG}
+
+
+def run_configure(ctx):
+    make(ctx, 'configure', 'clean', jobs=False)
+    if os.path.exists(os.path.join(ctx.args.crypto_dir, 'configure')):
+        run_cmd(['./configure', f'CC={SYSCLANG}', '--disable-asm'], 'configure', cwd=ctx.args.crypto_dir)
+    # the configured tree is the output, this stamp says which key it's for
+    with open(configure_stamp(ctx), 'w') as f:
+        f.write(ctx.keys['configure'])
+
+
+def configure_stamp(ctx):
+    return os.path.join(ctx.args.crypto_dir, '.cio-configure-key')
+
+
+def compile_inputs(ctx):
+    return {'sources': ctx.sources, 'cc': ctx.cc_hash, 'cflags': compilation_cflags(ctx),
+            'is_libsodium': ctx.args.is_libsodium}
+
+
+def run_compile(ctx):
+    make(ctx, 'compile', 'clean', jobs=False)
+    make(ctx, 'compile', cflags=compilation_cflags(ctx), log=ctx.path('normal.make.log'))
+    jam(ctx, 'compile', ctx.path('jammed.together.o'))
+
+
+def incremental_mitigation_key(ctx):
+    ''' the mitigation_key an incremental check is planned with, None if the run doesn't double check '''
+    if ctx.args.skip_double_check:
+        return None
+    return cio_incremental.mitigation_key(mitigation_cflags(ctx, ALERTS_CSV_PLACEHOLDER).split(), ctx.args.cc)
+
+
+def check_inputs(ctx):
+    inputs = {'config': sha256_file(ctx.args.config_file), 'plugin': ctx.plugin_hash,
+              'flags': checker_flags(ctx), 'incremental': ctx.args.incremental}
+    if ctx.args.incremental:
+        # which entries the incremental check checks depends on whether they were double checked
+        inputs['mitigation'] = incremental_mitigation_key(ctx)
+    return inputs
+
+
+def run_check(ctx):
+    alerts_csv = ctx.path('checker.alerts.csv')
+    if not ctx.args.incremental:
+        run_bap(ctx, 'check', alerts_csv, ctx.args.config_file, ctx.path('jammed.together.o'), ctx.path('bap.log'),
+                ctx.path(SYMEX_PROFILING_CSV))
+    else:
+        plan_dir = ctx.path('incremental')
+        db = cio_incremental.connect(ctx.args.incremental_store)
+        plugin = os.path.join(ctx.args.checker_plugin_path, CHECKER_PLUGIN_NAME)
+        dirty = cio_incremental.plan(db, ctx.path('jammed.together.o'), ctx.args.config_file, plan_dir,
+                                     cio_incremental.checker_key(checker_flags(ctx), [plugin]),
+                                     incremental_mitigation_key(ctx))
+        if dirty:
+            run_bap(ctx, 'check', os.path.join(plan_dir, cio_incremental.NEW_ALERTS_FILENAME),
+                    os.path.join(plan_dir, cio_incremental.DIRTY_CONFIG_FILENAME),
+                    ctx.path('jammed.together.o'), ctx.path('bap.log'), ctx.path(SYMEX_PROFILING_CSV))
+        else:
+            with open(ctx.path('bap.log'), 'w') as f:
+                f.write('No config entries changed since the last incremental run, not running bap\n')
+        cio_incremental.merge(db, plan_dir, alerts_csv)
+    check_alerts_csv(alerts_csv, ctx.path('bap.log'))
+
+
+def check_outputs(ctx):
+    outputs = {'alerts': ctx.path('checker.alerts.csv'), 'log': ctx.path('bap.log'),
+               'symex_profiling': ctx.path(SYMEX_PROFILING_CSV), 'taint_cache': ctx.path(TAINT_CACHE)}
+    if ctx.args.bap_shards > 1:
+        # the double check reuses the check's plan to get each shard's taint cache back
+        shard_dir = ctx.path(SHARD_DIR)
+        outputs[f'{SHARD_OUTPUT_PREFIX}plan'] = os.path.join(shard_dir, cio_shard.PLAN_FILENAME)
+        for shard in range(ctx.args.bap_shards):
+            for name, filename in (('config', cio_shard.SHARD_CONFIG_FILENAME),
+                                   ('taint_cache', cio_shard.TAINT_CACHE_FILENAME)):
+                outputs[f'{SHARD_OUTPUT_PREFIX}{shard}_{name}'] = cio_shard.shard_path(shard_dir, shard, filename)
+    if ctx.args.incremental:
+        # the double check checks the same dirty entries
+        plan_dir = ctx.path('incremental')
+        outputs['incremental_plan'] = os.path.join(plan_dir, cio_incremental.PLAN_FILENAME)
+        outputs['incremental_dirty_config'] = os.path.join(plan_dir, cio_incremental.DIRTY_CONFIG_FILENAME)
+    return outputs
+
+
+def missing_taint_caches(ctx, config_file):
+    ''' Get the taint caches of the check of config_file that aren't in the build dir. '''
+    if ctx.args.bap_shards <= 1:
+        return [] if os.path.exists(ctx.path(TAINT_CACHE)) else [ctx.path(TAINT_CACHE)]
+    shard_plan = cio_shard.read_plan(ctx.path(SHARD_DIR), config_file, ctx.args.bap_shards)
+    if shard_plan is None:
+        return [os.path.join(ctx.path(SHARD_DIR), cio_shard.PLAN_FILENAME)]
+    caches = [cio_shard.shard_path(ctx.path(SHARD_DIR), shard, cio_shard.TAINT_CACHE_FILENAME)
+              for shard in range(len(shard_plan['shards']))]
+    return [cache for cache in caches if not os.path.exists(cache)]
+
+
+def mitigate_inputs(ctx):
+    return {'sources': ctx.sources, 'cc': ctx.cc_hash,
+            'cflags': mitigation_cflags(ctx, ALERTS_CSV_PLACEHOLDER), 'artifacts': ctx.artifacts}
+
+
+def build_mitigated(ctx, stage, log):
+    ''' Build the crypto dir with the mitigations of the alerts csv. '''
+    make(ctx, stage, 'clean', jobs=False)
+    make(ctx, stage, cflags=mitigation_cflags(ctx, ctx.path('checker.alerts.csv')), log=log)
+    ctx.tree_mitigated = True
+
+
+def run_mitigate(ctx):
+    build_mitigated(ctx, 'mitigate', ctx.path('mitigation.make.log'))
+    jam(ctx, 'mitigate', ctx.path('jammed.together.o.verification.o'))
+
+
+def run_double_check(ctx):
+    alerts_csv = ctx.path('checker.alerts.csv.verification.csv')
+    binary = ctx.path('jammed.together.o.verification.o')
+    log = ctx.path('bap.log.verification.log')
+    symex_profiling_csv = ctx.path(f'{SYMEX_PROFILING_CSV}.verification.csv')
+    if not ctx.args.incremental:
+        double_check(ctx, alerts_csv, ctx.args.config_file, binary, log, symex_profiling_csv)
+        return
+    # the check's taint cache only covers its dirty entries, so double check
+    # those and merge the stored double check alerts of the rest
+    plan_dir = ctx.path('incremental')
+    with open(os.path.join(plan_dir, cio_incremental.PLAN_FILENAME)) as f:
+        dirty = json.load(f)['dirty']
+    if dirty:
+        double_check(ctx, os.path.join(plan_dir, cio_incremental.NEW_VERIFICATION_ALERTS_FILENAME),
+                     os.path.join(plan_dir, cio_incremental.DIRTY_CONFIG_FILENAME), binary, log, symex_profiling_csv)
+    else:
+        with open(log, 'w') as f:
+            f.write('No config entries changed since the last incremental run, not running bap\n')
+    try:
+        cio_incremental.merge(cio_incremental.connect(ctx.args.incremental_store), plan_dir, alerts_csv,
+                              verification_binary=binary)
+    except ValueError as err:
+        raise StageError(str(err))
+
+
+def double_check(ctx, alerts_csv, config_file, binary, log, symex_profiling_csv):
+    missing = missing_taint_caches(ctx, config_file)
+    if missing:
+        raise StageError(f'the double check needs the taint caches of the check, missing {" ".join(missing)}. '
+                         f'run again with --rerun check')
+    run_bap(ctx, 'double_check', alerts_csv, config_file, binary, log, symex_profiling_csv,
+            extra_flags=['--uarch-checker-double-check'])
+
+
+def run_unit_tests(ctx):
+    if not ctx.tree_mitigated:
+        # mitigate came from the cache, which only has its outputs, the
+        # crypto dir still has whatever was built in it last
+        print('[unit_tests] the crypto dir isn\'t the mitigated build, building it again', flush=True)
+        build_mitigated(ctx, 'unit_tests', ctx.path('unit-tests.make.log'))
+    run_cmd(['make', f'--directory={ctx.args.crypto_dir}', 'check', f'CC={ctx.args.cc}'], 'unit_tests',
+            log=ctx.path('unit-tests.log'))
+
+
+def pipeline(args):
+    stages = [
+        Stage('configure', 'COMPILATION', [], configure_inputs, run_configure, lambda ctx: {}),
+        Stage('compile', 'COMPILATION', ['configure'], compile_inputs, run_compile,
+              lambda ctx: {'big_obj': ctx.path('jammed.together.o'),
+                           'make_log': ctx.path('normal.make.log')}),
+        Stage('check', 'CHECKING', ['compile'], check_inputs, run_check, check_outputs),
+        Stage('mitigate', 'MITIGATION', ['configure', 'check'], mitigate_inputs, run_mitigate,
+              lambda ctx: dict({'big_obj': ctx.path('jammed.together.o.verification.o'),
+                                'make_log': ctx.path('mitigation.make.log')},
+                               **{artifact: os.path.join(ctx.args.crypto_dir, artifact)
+                                  for artifact in ctx.artifacts})),
+    ]
+    if not args.skip_double_check:
+        stages.append(Stage('double_check', 'DOUBLECHECKING', ['mitigate'], check_inputs, run_double_check,
+                            lambda ctx: {'alerts': ctx.path('checker.alerts.csv.verification.csv'),
+                                         'log': ctx.path('bap.log.verification.log'),
+                                         'symex_profiling': ctx.path(f'{SYMEX_PROFILING_CSV}.verification.csv')}))
+    if args.is_libsodium:
+        stages.append(Stage('unit_tests', None, ['mitigate'], lambda ctx: {}, run_unit_tests,
+                            lambda ctx: {'log': ctx.path('unit-tests.log')}))
+    return stages
+
+
+class Context:
+    ''' what the stages of one run share '''
+
+    def __init__(self, args, build_dir):
+        self.args = args
+        self.build_dir = build_dir
+        self.artifacts = LIBSODIUM_ARTIFACTS if args.is_libsodium else []
+        print('Hashing the sources, compiler and checker plugin...', flush=True)
+        self.sources = sources_hash(args.crypto_dir)
+        self.cc_hash = sha256_file(args.cc)
+        plugin = os.path.join(args.checker_plugin_path, CHECKER_PLUGIN_NAME)
+        self.plugin_hash = sha256_file(plugin) if os.path.exists(plugin) else None
+        # whether this run built the crypto dir with the mitigations
+        self.tree_mitigated = False
+        # stage -> key, and stage -> output name -> sha
+        self.keys = dict()
+        self.manifests = dict()
+
+    def path(self, filename):
+        return os.path.join(self.build_dir, filename)
+
+    def stage_key(self, stage):
+        return sha256_json({'stage': stage.name, 'inputs': stage.inputs(self),
+                            'deps': {dep: [self.keys[dep], self.manifests.get(dep)] for dep in stage.deps}})
+
+
+def is_cached(ctx, cache, stage, key, rerun):
+    if stage.name in rerun:
+        return None
+    if stage.name == 'configure':
+        # the configured tree itself can't be restored, only checked
+        if not os.path.exists(configure_stamp(ctx)):
+            return None
+        with open(configure_stamp(ctx)) as f:
+            return {} if f.read().strip() == key else None
+    return cache.lookup(stage.name, key)
+
+
+def save_state(build_dir, args, statuses):
+    with open(os.path.join(build_dir, STATE_FILENAME), 'w') as f:
+        json.dump({'args': vars(args), 'stages': statuses}, f, indent=2)
+
+
+def read_run_times(path):
+    ''' Get step -> (start_sec, stop_sec) of a cio-run-times.csv, if there is one. '''
+    if not os.path.exists(path):
+        return dict()
+    with open(path, newline='') as f:
+        return {row['step']: (int(row['start_sec']), int(row['stop_sec'])) for row in csv.DictReader(f)}
+
+
+def write_run_times(path, step_times, total):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f, lineterminator='\n')
+        writer.writerow(['step', 'start_sec', 'stop_sec'])
+        for step in STEPS:
+            if step in step_times:
+                writer.writerow([step, *step_times[step]])
+        if total is not None:
+            writer.writerow([TOTAL_STEP, *total])
+
+
+def run(args, build_dir):
+    start_sec = int(time.time())
+    cache = Cache(args.cache_dir)
+    ctx = Context(args, build_dir)
+    stages = pipeline(args)
+    statuses = {stage.name: 'pending' for stage in stages}
+    step_times = dict()
+    run_times_csv = ctx.path('cio-run-times.csv')
+    # a resumed run keeps the times of the steps it finished before
+    earlier_times = read_run_times(run_times_csv)
+
+    try:
+        for stage in stages:
+            stage_start = int(time.time())
+            key = ctx.stage_key(stage)
+            ctx.keys[stage.name] = key
+            manifest = is_cached(ctx, cache, stage, key, args.rerun)
+            if manifest is not None:
+                cache.restore(manifest, stage.outputs(ctx))
+                statuses[stage.name] = 'cached'
+                print(f'[{stage.name}] inputs unchanged, using the outputs of an earlier run', flush=True)
+            else:
+                statuses[stage.name] = 'running'
+                save_state(build_dir, args, statuses)
+                print(f'[{stage.name}] running', flush=True)
+                monitor = None
+                if args.monitor_resources and stage.step is not None:
+                    monitor = cio_resource_monitor.start(build_dir, stage.step)
+                try:
+                    stage.run(ctx)
+                finally:
+                    if monitor is not None:
+                        cio_resource_monitor.stop(monitor)
+                manifest = cache.store(stage.name, key, stage.outputs(ctx))
+                statuses[stage.name] = 'done'
+            ctx.manifests[stage.name] = manifest
+            save_state(build_dir, args, statuses)
+
+            if stage.step is not None and statuses[stage.name] == 'cached' and stage.step in earlier_times:
+                step_times[stage.step] = earlier_times[stage.step]
+            elif stage.step is not None:
+                first_start = step_times.get(stage.step, (stage_start, None))[0]
+                step_times[stage.step] = (first_start, int(time.time()))
+                write_run_times(run_times_csv, step_times, None)
+    except StageError as err:
+        statuses[stage.name] = 'failed'
+        save_state(build_dir, args, statuses)
+        print(f'[{stage.name}] failed: {err}\n'
+              f'fix it and run `python3 cio_orchestrator.py --resume {build_dir}` to continue from {stage.name}')
+        return 1
+
+    now = int(time.time())
+    # cio writes a DOUBLECHECKING row even when it skips the double check
+    for step in STEPS:
+        step_times.setdefault(step, (now, now))
+    write_run_times(run_times_csv, step_times, (start_sec, now))
+    print(f'Done, {sum(status == "cached" for status in statuses.values())} of {len(stages)} stages '
+          f'were unchanged. build dir: {build_dir}')
+    return 0
+
+
+def argparser():
+    parser = argparse.ArgumentParser(usage=usage_msg)
+    parser.add_argument('--resume', metavar='BUILD_DIR',
+                        help='run again with the options of an earlier run in its build dir')
+    parser.add_argument('-c', '--cc', default=DEFAULT_CC)
+    parser.add_argument('-p', '--checker-plugin-path', default=DEFAULT_CHECKER_PLUGIN_PATH)
+    parser.add_argument('-b', '--build-dir')
+    parser.add_argument('-a', '--cflags', default=DEFAULT_CFLAGS)
+    parser.add_argument('--extra-cflags', default='')
+    parser.add_argument('-e', '--checker-flags', default='')
+    parser.add_argument('-r', '--bap-core', type=str,
+                        help='core to pin bap to, with --bap-shards a taskset list to pin one shard per core')
+    parser.add_argument('-s', '--bap-shards', type=int, default=1, help='see ./cio_shard.py')
+    parser.add_argument('--shard-timings-store', default=cio_shard.DEFAULT_STORE)
+    parser.add_argument('--monitor-resources', action='store_true', help='see ./cio_resource_monitor.py')
+    parser.add_argument('-j', '--jobs', type=int, default=8, help='make job slots')
+    parser.add_argument('--is-libsodium', action='store_true')
+    parser.add_argument('--ss', action='store_true')
+    parser.add_argument('--cs', action='store_true')
+    parser.add_argument('--nosymex', action='store_true')
+    parser.add_argument('--skip-double-check', action='store_true')
+    parser.add_argument('-d', '--dynamic-hit-counts', action='store_true')
+    parser.add_argument('--incremental', action='store_true', help='see ./cio_incremental.py')
+    parser.add_argument('--incremental-store', default=cio_incremental.DEFAULT_STORE)
+    parser.add_argument('-f', '--config-file')
+    parser.add_argument('-t', '--crypto-dir')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR)
+    parser.add_argument('--rerun', nargs='+', default=[], metavar='STAGE',
+                        help='run these stages even if their inputs are unchanged')
+    return parser
+
+
+def main():
+    parser = argparser()
+    args = parser.parse_args()
+
+    if args.resume is not None:
+        build_dir = os.path.realpath(args.resume)
+        with open(os.path.join(build_dir, STATE_FILENAME)) as f:
+            saved_args = json.load(f)['args']
+        rerun = args.rerun
+        # options added since the run started get their defaults
+        args = argparse.Namespace(**dict(vars(parser.parse_args([])), **saved_args))
+        args.rerun = rerun
+    else:
+        if args.config_file is None or args.crypto_dir is None:
+            parser.error('--config-file and --crypto-dir are required')
+        for name in ('cc', 'checker_plugin_path', 'config_file', 'crypto_dir', 'cache_dir', 'incremental_store',
+                     'shard_timings_store'):
+            setattr(args, name, os.path.realpath(getattr(args, name)))
+        timestamp = time.strftime('%Y-%m-%d-%H:%M:%S-%Z')
+        build_dir = os.path.realpath(args.build_dir or f'./{timestamp}-cio-build')
+        os.makedirs(build_dir)
+
+    if os.path.islink(LATEST_BUILD_DIR):
+        os.remove(LATEST_BUILD_DIR)
+    if not os.path.exists(LATEST_BUILD_DIR):
+        os.symlink(build_dir, LATEST_BUILD_DIR)
+
+    if shutil.which('bap') is None:
+        print('Looks like bap is not installed or available on your path, see ./cio for how to install it')
+        sys.exit(3)
+    sys.exit(run(args, build_dir))
+
+
+if __name__ == "__main__":
+    main()
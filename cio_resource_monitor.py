@@ -0,0 +1,380 @@
+import argparse
+import csv
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+usage_msg = """
+sample the resources of cio's stages and compare them across build dirs.
+with --monitor-resources, cio samples each stage like this:
+
+  python3 cio_resource_monitor.py sample --pid CIO_PID --stage CHECKING --build-dir BUILD_DIR [--interval 0.25] &
+  (the stage)
+  kill -TERM $!; wait $!
+
+  python3 cio_resource_monitor.py report BUILD_DIR [BUILD_DIR ...] [--stage CHECKING]
+
+`sample` follows the process tree under --pid through /proc until it's
+killed or --pid exits, and appends a row per sample to
+BUILD_DIR/cio-resources.csv: running processes, cpu time, rss of the
+tree and of its largest process, major page faults, i/o bytes and context
+switches, counted from the start of the stage. at the end it adds the
+stage's totals and peaks to BUILD_DIR/cio-resources.json, with the cpus
+and memory of the host.
+
+cpu time, page faults and i/o bytes are exact: a process's /proc counts
+include those of the children it reaped, so short lived compiler
+processes between samples aren't lost. context switches aren't kept for
+reaped children, those are the last seen counts of every process and
+miss processes that lived less than an interval. rss is as sampled.
+
+`report` puts the stages of the build dirs side by side, and guesses from
+the counts whether each stage was waiting, cpu-bound, short of cpus,
+memory-bound or thrashing.
+"""
+
+CSV_FILENAME = 'cio-resources.csv'
+SUMMARY_FILENAME = 'cio-resources.json'
+DEFAULT_INTERVAL = 0.25
+
+CSV_COLUMNS = ['stage', 'time', 'elapsed_sec', 'num_procs', 'num_running', 'cpu_user_sec', 'cpu_sys_sec',
+               'rss_kb', 'max_proc_rss_kb', 'max_proc_rss_comm', 'majflt', 'read_bytes', 'write_bytes',
+               'rchar', 'wchar', 'voluntary_ctxt_switches', 'nonvoluntary_ctxt_switches']
+
+# the order cio runs them in, see cio-run-times.csv
+STAGE_ORDER = ['COMPILATION', 'CHECKING', 'MITIGATION', 'DOUBLECHECKING']
+
+CLK_TCK = os.sysconf('SC_CLK_TCK')
+PAGE_KB = os.sysconf('SC_PAGE_SIZE') // 1024
+
+# counts that include those of reaped children, and the ones that don't
+TREE_COUNTERS = ('utime', 'stime', 'majflt', 'read_bytes', 'write_bytes', 'rchar', 'wchar')
+PROC_COUNTERS = ('voluntary_ctxt_switches', 'nonvoluntary_ctxt_switches')
+
+# what report calls thrashing, and memory-bound as a share of the host's memory
+THRASHING_MAJFLT_PER_SEC = 50
+MEMORY_BOUND_SHARE = 0.9
+
+
+def read_stat(pid):
+    '''
+    Get the counts in /proc/<pid>/stat of one process, with those of the
+    children it reaped. None if it's gone.
+    '''
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            stat = f.read()
+        # the comm can have spaces and parens in it
+        comm = stat[stat.index('(') + 1:stat.rindex(')')]
+        fields = stat[stat.rindex(')') + 2:].split()
+        return {'comm': comm, 'state': fields[0], 'ppid': int(fields[1]),
+                'starttime': int(fields[19]),
+                'majflt': int(fields[9]) + int(fields[10]),
+                'utime': (int(fields[11]) + int(fields[13])) / CLK_TCK,
+                'stime': (int(fields[12]) + int(fields[14])) / CLK_TCK,
+                'rss_kb': int(fields[21]) * PAGE_KB}
+    except (FileNotFoundError, ProcessLookupError, IndexError, ValueError):
+        return None
+
+
+def read_proc(pid, proc):
+    '''
+    Add the counts of /proc/<pid>/status and /proc/<pid>/io to the
+    read_stat() of one process. False if it's gone.
+    '''
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                if key in PROC_COUNTERS:
+                    proc[key] = int(value)
+    except (FileNotFoundError, ProcessLookupError, ValueError):
+        return False
+    try:
+        with open(f'/proc/{pid}/io') as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                if key in TREE_COUNTERS:
+                    proc[key] = int(value)
+    except (FileNotFoundError, ProcessLookupError, PermissionError):
+        pass
+    for key in ('read_bytes', 'write_bytes', 'rchar', 'wchar') + PROC_COUNTERS:
+        proc.setdefault(key, 0)
+    return True
+
+
+def process_tree(root, exclude):
+    '''
+    Get pid -> counts of root and every process under it, but exclude. Only
+    the stat of every process is read to find the tree, the rest of the
+    counts only of the processes in it.
+    '''
+    stats = dict()
+    children = dict()
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit() or int(entry) == exclude:
+            continue
+        stat = read_stat(int(entry))
+        if stat is not None:
+            stats[int(entry)] = stat
+            children.setdefault(stat['ppid'], []).append(int(entry))
+
+    tree = dict()
+    todo = [root] if root in stats else []
+    while todo:
+        pid = todo.pop()
+        if read_proc(pid, stats[pid]):
+            tree[pid] = stats[pid]
+        todo.extend(children.get(pid, []))
+    return tree
+
+
+def host_info():
+    mem_kb = None
+    with open('/proc/meminfo') as f:
+        for line in f:
+            if line.startswith('MemTotal:'):
+                mem_kb = int(line.split()[1])
+    return {'hostname': socket.gethostname(), 'cpus': os.cpu_count(),
+            'usable_cpus': len(os.sched_getaffinity(0)), 'mem_kb': mem_kb}
+
+
+class Sampler:
+    ''' the counts of a process tree since the first sample '''
+
+    def __init__(self, root):
+        self.root = root
+        self.baseline = None
+        # (pid, starttime) -> last seen context switches, of every process
+        # seen, and of the ones already there at the first sample
+        self.ctxt_switches = dict()
+        self.ctxt_baseline = None
+        self.peaks = {'num_procs': 0, 'rss_kb': 0, 'max_proc_rss_kb': 0, 'max_proc_rss_comm': ''}
+        self.running_sum = 0
+        self.num_samples = 0
+
+    def sample(self):
+        ''' Get the counts now, or None if the root is gone. '''
+        tree = process_tree(self.root, os.getpid())
+        if self.root not in tree:
+            return None
+        totals = {key: sum(proc[key] for proc in tree.values()) for key in TREE_COUNTERS}
+        if self.baseline is None:
+            self.baseline = totals
+        for proc_pid, proc in tree.items():
+            self.ctxt_switches[(proc_pid, proc['starttime'])] = [proc[key] for key in PROC_COUNTERS]
+        if self.ctxt_baseline is None:
+            self.ctxt_baseline = dict(self.ctxt_switches)
+
+        largest = max(tree.values(), key=lambda proc: proc['rss_kb'])
+        row = {'num_procs': len(tree),
+               'num_running': sum(proc['state'] == 'R' for proc in tree.values()),
+               'cpu_user_sec': round(totals['utime'] - self.baseline['utime'], 2),
+               'cpu_sys_sec': round(totals['stime'] - self.baseline['stime'], 2),
+               'rss_kb': sum(proc['rss_kb'] for proc in tree.values()),
+               'max_proc_rss_kb': largest['rss_kb'],
+               'max_proc_rss_comm': largest['comm']}
+        for key in ('majflt', 'read_bytes', 'write_bytes', 'rchar', 'wchar'):
+            row[key] = totals[key] - self.baseline[key]
+        for idx, key in enumerate(PROC_COUNTERS):
+            row[key] = sum(counts[idx] - self.ctxt_baseline.get(proc_key, [0, 0])[idx]
+                           for proc_key, counts in self.ctxt_switches.items())
+
+        for key in ('num_procs', 'rss_kb'):
+            self.peaks[key] = max(self.peaks[key], row[key])
+        if row['max_proc_rss_kb'] > self.peaks['max_proc_rss_kb']:
+            self.peaks['max_proc_rss_kb'] = row['max_proc_rss_kb']
+            self.peaks['max_proc_rss_comm'] = row['max_proc_rss_comm']
+        self.running_sum += row['num_running']
+        self.num_samples += 1
+        return row
+
+
+def append_summary(build_dir, summary):
+    path = os.path.join(build_dir, SUMMARY_FILENAME)
+    if os.path.exists(path):
+        with open(path) as f:
+            summaries = json.load(f)
+    else:
+        summaries = {'host': host_info(), 'stages': []}
+    summaries['stages'].append(summary)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(summaries, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+def sample(root, stage, build_dir, interval=DEFAULT_INTERVAL):
+    ''' Sample the tree under root until SIGTERM or root exits, see usage_msg. '''
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+
+    sampler = Sampler(root)
+    csv_path = os.path.join(build_dir, CSV_FILENAME)
+    new_file = not os.path.exists(csv_path)
+    start = time.time()
+    last = None
+    with open(csv_path, 'a', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=CSV_COLUMNS, lineterminator='\n')
+        if new_file:
+            writer.writeheader()
+        while True:
+            row = sampler.sample()
+            if row is None:
+                break
+            now = time.time()
+            row.update({'stage': stage, 'time': round(now, 2), 'elapsed_sec': round(now - start, 2)})
+            writer.writerow(row)
+            f.flush()
+            last = row
+            if stopping:
+                break
+            time.sleep(interval)
+
+    summary = {'stage': stage, 'start': round(start, 2), 'wall_sec': round(time.time() - start, 2),
+               'num_samples': sampler.num_samples,
+               'mean_running': round(sampler.running_sum / sampler.num_samples, 2) if sampler.num_samples else 0}
+    if last is not None:
+        for key in ('cpu_user_sec', 'cpu_sys_sec', 'majflt', 'read_bytes', 'write_bytes', 'rchar', 'wchar',
+                    'voluntary_ctxt_switches', 'nonvoluntary_ctxt_switches'):
+            summary[key] = last[key]
+    summary.update({f'peak_{key}' if key in ('num_procs', 'rss_kb') else key: value
+                    for key, value in sampler.peaks.items()})
+    append_summary(build_dir, summary)
+
+
+def start(build_dir, stage, pid=None, interval=DEFAULT_INTERVAL):
+    ''' Start sampling a stage in the background, for python callers of cio's steps. '''
+    return subprocess.Popen([sys.executable, os.path.abspath(__file__), 'sample', '--pid', str(pid or os.getpid()),
+                             '--stage', stage, '--build-dir', build_dir, '--interval', str(interval)])
+
+
+def stop(monitor):
+    monitor.send_signal(signal.SIGTERM)
+    monitor.wait()
+
+
+def read_summary(build_dir):
+    ''' Get the host of a build dir and stage -> its summaries' totals and peaks. '''
+    with open(os.path.join(build_dir, SUMMARY_FILENAME)) as f:
+        summaries = json.load(f)
+    stages = dict()
+    for summary in summaries['stages']:
+        if summary.get('num_samples', 0) == 0:
+            continue
+        if summary['stage'] not in stages:
+            stages[summary['stage']] = dict(summary)
+            continue
+        # a stage sampled in parts, e.g. resumed, adds up
+        merged = stages[summary['stage']]
+        running_secs = merged['mean_running'] * merged['wall_sec'] + summary['mean_running'] * summary['wall_sec']
+        for key, value in summary.items():
+            if key.startswith('peak_') or key == 'max_proc_rss_kb':
+                if value > merged[key]:
+                    merged[key] = value
+                    if key == 'max_proc_rss_kb':
+                        merged['max_proc_rss_comm'] = summary['max_proc_rss_comm']
+            elif isinstance(value, (int, float)) and key not in ('start', 'mean_running'):
+                merged[key] += value
+        merged['mean_running'] = round(running_secs / merged['wall_sec'], 2) if merged['wall_sec'] else 0
+    return summaries['host'], stages
+
+
+def verdict(summary, host):
+    ''' A guess at what a stage was short of. '''
+    wall = max(summary['wall_sec'], 1e-9)
+    busy = (summary['cpu_user_sec'] + summary['cpu_sys_sec']) / wall
+    cpus = host['usable_cpus']
+    if summary['majflt'] / wall >= THRASHING_MAJFLT_PER_SEC:
+        return 'thrashing'
+    if host['mem_kb'] and summary['peak_rss_kb'] >= MEMORY_BOUND_SHARE * host['mem_kb']:
+        return 'memory-bound'
+    if summary['mean_running'] > cpus and busy >= 0.75 * cpus:
+        return 'short of cpus'
+    if busy >= 0.75 * max(1, min(summary['mean_running'], cpus)):
+        return 'cpu-bound'
+    return 'waiting (i/o, sleeps)'
+
+
+def mb(num_bytes):
+    return f'{num_bytes / (1 << 20):.1f}'
+
+
+def report_rows(summary, host):
+    wall = max(summary['wall_sec'], 1e-9)
+    cpu = summary['cpu_user_sec'] + summary['cpu_sys_sec']
+    switches = summary['voluntary_ctxt_switches'] + summary['nonvoluntary_ctxt_switches']
+    return [('wall s', f"{summary['wall_sec']:.1f}"),
+            ('cpu s (user+sys)', f"{cpu:.1f} ({summary['cpu_user_sec']:.1f}+{summary['cpu_sys_sec']:.1f})"),
+            ('avg cores busy', f"{cpu / wall:.2f} of {host['usable_cpus']}"),
+            ('mean running procs', f"{summary['mean_running']:.2f}"),
+            ('peak procs', str(summary['peak_num_procs'])),
+            ('peak tree rss MB', mb(summary['peak_rss_kb'] * 1024)),
+            ('peak proc rss MB', f"{mb(summary['max_proc_rss_kb'] * 1024)} {summary['max_proc_rss_comm']}"),
+            ('host mem MB', mb(host['mem_kb'] * 1024) if host['mem_kb'] else '?'),
+            ('major faults/s', f"{summary['majflt'] / wall:.1f}"),
+            ('disk read/write MB', f"{mb(summary['read_bytes'])}/{mb(summary['write_bytes'])}"),
+            ('ctx switches/s', f"{switches / wall:.0f}"),
+            ('involuntary share', f"{summary['nonvoluntary_ctxt_switches'] / switches:.0%}" if switches else '-'),
+            ('looks', verdict(summary, host))]
+
+
+def report(build_dirs, stages=None):
+    dirs = []
+    for build_dir in build_dirs:
+        host, summaries = read_summary(build_dir)
+        dirs.append((build_dir.rstrip('/'), host, summaries))
+
+    names = [stage for stage in STAGE_ORDER if any(stage in summaries for _, _, summaries in dirs)]
+    names += sorted(set(stage for _, _, summaries in dirs for stage in summaries) - set(names))
+    if stages:
+        names = [stage for stage in names if stage in stages]
+
+    width = max(24, *(len(os.path.basename(build_dir)) + 2 for build_dir, _, _ in dirs))
+    header = f"{'':<22}" + ''.join(f'{os.path.basename(build_dir):>{width}}' for build_dir, _, _ in dirs)
+    hosts = f"{'host':<22}" + ''.join(f"{host['hostname'] + ' ' + str(host['usable_cpus']) + ' cpus':>{width}}"
+                                      for _, host, _ in dirs)
+    print(header)
+    print(hosts)
+    for stage in names:
+        print(f'== {stage}')
+        columns = []
+        for _, host, summaries in dirs:
+            columns.append(report_rows(summaries[stage], host) if stage in summaries else None)
+        labels = next(column for column in columns if column is not None)
+        for idx, (label, _) in enumerate(labels):
+            cells = [column[idx][1] if column is not None else '-' for column in columns]
+            print(f'{label:<22}' + ''.join(f'{cell:>{width}}' for cell in cells))
+
+
+def main():
+    parser = argparse.ArgumentParser(usage=usage_msg)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    sample_parser = subparsers.add_parser('sample', help='sample one stage of a cio run')
+    sample_parser.add_argument('--pid', type=int, required=True, help='root of the process tree, cio itself')
+    sample_parser.add_argument('--stage', required=True)
+    sample_parser.add_argument('--build-dir', required=True)
+    sample_parser.add_argument('--interval', type=float, default=DEFAULT_INTERVAL, help='seconds between samples')
+
+    report_parser = subparsers.add_parser('report', help='compare the stages of build dirs')
+    report_parser.add_argument('build_dirs', nargs='+')
+    report_parser.add_argument('--stage', nargs='+', help='only these stages')
+
+    args = parser.parse_args()
+    if args.command == 'sample':
+        sample(args.pid, args.stage, args.build_dir, args.interval)
+        return
+
+    for build_dir in args.build_dirs:
+        if not os.path.exists(os.path.join(build_dir, SUMMARY_FILENAME)):
+            print(f"error: no {SUMMARY_FILENAME} in {build_dir}, was cio run with --monitor-resources?")
+            sys.exit(1)
+    report(args.build_dirs, args.stage)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,434 @@
+import argparse
+import csv
+import hashlib
+import heapq
+import json
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import time
+
+import cio_incremental
+
+usage_msg = """
+split the checker config into balanced shards and check them with several
+bap processes at once. with --shards N, cio runs bap through this:
+
+  python3 cio_shard.py run BIG_OBJ CONFIG_FILE --shards N --shard-dir BUILD_DIR/bap-shards \\
+      --alerts-csv BUILD_DIR/checker.alerts.csv --log BUILD_DIR/bap.log [--cores 0-31] -- bap [flags...]
+
+  python3 cio_shard.py plan BIG_OBJ CONFIG_FILE --shards N --shard-dir DIR
+  python3 cio_shard.py timings [--store cio-shard-timings.sqlite3]
+
+`plan` estimates the cost of every config entry (function,secret arg
+index) as the number of instructions of the functions it reaches in
+BIG_OBJ. entries checked in an earlier run use their measured seconds
+instead, scaled by how much the code they reach grew or shrank, and the
+others are converted to seconds at the rate of the measured ones. the
+entries go to the least loaded shard, most costly first, and each shard
+gets a config file of its entries.
+
+`run` plans, unless DIR already has a plan of the same config and number
+of shards, and runs `bap [flags...]` once per shard, each with its own
+config, taint cache, alerts csv, log and symex profiling csv in
+DIR/shard-K, pinned to one of --cores if given. the shards' alerts csvs,
+symex profiling csvs and logs are then merged into the usual files. an
+alert (addr, subroutine, opcode and reason) more than one shard found, in
+functions several entries reach, keeps only the rows of the first shard
+that found it. a double check (--uarch-checker-double-check) reuses the
+plan of the checking run, so each shard gets its taint cache slice back,
+and isn't timed.
+
+every bap process lifts the whole binary, so each shard pays that fixed
+cost on top of its entries: more shards than cores, or than the memory
+fits bap processes, won't go faster. a checking run stores the time of
+each shard with the instructions of the binary and of its entries, and
+the fixed cost is fitted over the stored shards as seconds per
+instruction of the binary. each shard's time less that fixed cost is
+divided among its entries by their estimated cost and stored for the next
+plan. until the stored shards tell the two apart, the fixed cost is
+taken as 0.
+"""
+
+DEFAULT_STORE = 'cio-shard-timings.sqlite3'
+
+PLAN_FILENAME = 'shards.json'
+SHARD_CONFIG_FILENAME = 'config'
+TAINT_CACHE_FILENAME = 'taintcache.bin'
+DEFAULT_SYMEX_PROFILING_CSV = './symex-profiling-data.csv'
+
+DOUBLE_CHECK_FLAG = '--uarch-checker-double-check'
+
+# what makes two alerts csv rows of different shards the same alert, their
+# tids can differ between bap processes
+ALERT_KEY_COLUMNS = ('addr', 'subroutine_name', 'mir_opcode', 'alert_reason')
+
+# how often run looks for finished bap processes
+POLL_SECS = 0.5
+
+SCHEMA = """
+-- size is the number of instructions the entry reached when it was timed
+CREATE TABLE IF NOT EXISTS entry_timings (
+    entry TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    seconds REAL NOT NULL,
+    measured_at TEXT NOT NULL
+);
+
+-- the instructions of the binary and of a shard's entries, and its seconds
+CREATE TABLE IF NOT EXISTS shard_timings (
+    binary_size INTEGER NOT NULL,
+    shard_size INTEGER NOT NULL,
+    seconds REAL NOT NULL,
+    measured_at TEXT NOT NULL
+);
+"""
+
+
+def connect(store_path=DEFAULT_STORE):
+    db = sqlite3.connect(store_path)
+    db.executescript(SCHEMA)
+    return db
+
+
+def config_hash(config_file):
+    with open(config_file, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def shard_path(shard_dir, shard, filename=''):
+    return os.path.join(shard_dir, f'shard-{shard}', filename)
+
+
+def entry_sizes(binary, entries):
+    '''
+    Get entry -> number of instructions of the functions it reaches in
+    binary, and the number of instructions of binary.
+    '''
+    analysis = cio_incremental.analyze(binary)
+    sizes = dict()
+    for entry in entries:
+        if entry not in analysis:
+            sizes[entry] = 0
+            continue
+        sizes[entry] = sum(analysis[name]['size'] for name in cio_incremental.reachable(analysis, entry))
+    return sizes, sum(info['size'] for info in analysis.values())
+
+
+def fixed_cost_rate(db):
+    '''
+    Get the seconds per instruction of the binary every shard pays before
+    checking its entries, fitting seconds = rate * binary_size + shard_rate *
+    shard_size over the stored shards. 0 if they can't tell the two apart.
+    '''
+    s11 = s12 = s22 = t1 = t2 = 0.0
+    for binary_size, shard_size, seconds in db.execute(
+            'SELECT binary_size, shard_size, seconds FROM shard_timings'):
+        s11 += binary_size * binary_size
+        s12 += binary_size * shard_size
+        s22 += shard_size * shard_size
+        t1 += binary_size * seconds
+        t2 += shard_size * seconds
+    det = s11 * s22 - s12 * s12
+    # nearly collinear, e.g. only shards of the same size of one binary
+    if det <= 1e-6 * s11 * s22:
+        return 0.0
+    rate = (t1 * s22 - t2 * s12) / det
+    shard_rate = (t2 * s11 - t1 * s12) / det
+    if rate <= 0 or shard_rate <= 0:
+        return 0.0
+    return rate
+
+
+def estimate_costs(db, sizes):
+    '''
+    Get entry -> estimated seconds, and how many entries had a timing.
+    without any timings the costs are in instructions, which balances the
+    same.
+    '''
+    timings = {entry: (size, seconds) for entry, size, seconds in
+               db.execute('SELECT entry, size, seconds FROM entry_timings')}
+    timed = {entry: timings[entry] for entry in sizes if entry in timings and timings[entry][0] > 0}
+    timed_size = sum(size for size, _ in timed.values())
+    rate = sum(seconds for _, seconds in timed.values()) / timed_size if timed_size else 1.0
+
+    costs = dict()
+    for entry, size in sizes.items():
+        if entry in timed:
+            timed_at_size, seconds = timed[entry]
+            costs[entry] = seconds * size / timed_at_size
+        else:
+            costs[entry] = size * rate
+    return costs, len(timed)
+
+
+def balance(costs, num_shards):
+    ''' Get lists of entries, greedily most costly first onto the least loaded shard. '''
+    num_shards = max(1, min(num_shards, len(costs)))
+    heap = [(0.0, shard) for shard in range(num_shards)]
+    shards = [[] for _ in range(num_shards)]
+    for entry in sorted(costs, key=lambda entry: (-costs[entry], entry)):
+        load, shard = heapq.heappop(heap)
+        shards[shard].append(entry)
+        heapq.heappush(heap, (load + costs[entry], shard))
+    return [sorted(entries) for entries in shards if entries]
+
+
+def plan(db, binary, config_file, shard_dir, num_shards):
+    ''' Write a config per shard and the plan into shard_dir. Returns the plan. '''
+    _, config_lines = cio_incremental.read_config(config_file)
+    sizes, binary_size = entry_sizes(binary, config_lines)
+    costs, num_timed = estimate_costs(db, sizes)
+    shards = balance(costs, num_shards)
+
+    if os.path.exists(shard_dir):
+        # stale taint caches and alerts of another config
+        shutil.rmtree(shard_dir)
+    for shard, entries in enumerate(shards):
+        os.makedirs(shard_path(shard_dir, shard))
+        with open(shard_path(shard_dir, shard, SHARD_CONFIG_FILENAME), 'w') as f:
+            for entry in entries:
+                f.writelines(line + '\n' for line in config_lines[entry])
+
+    shard_plan = {'binary': os.path.realpath(binary),
+                  'config': config_hash(config_file),
+                  'num_shards': num_shards,
+                  'binary_size': binary_size,
+                  'sizes': sizes,
+                  'costs': costs,
+                  'shards': shards}
+    with open(os.path.join(shard_dir, PLAN_FILENAME), 'w') as f:
+        json.dump(shard_plan, f, indent=2)
+
+    loads = [sum(costs[entry] for entry in entries) for entries in shards]
+    unit = 'estimated secs' if num_timed else 'reached insns'
+    print(f"{len(costs)} config entries in {len(shards)} shards, {num_timed} of them timed before", file=sys.stderr)
+    fixed_cost = fixed_cost_rate(db) * binary_size
+    if fixed_cost:
+        print(f"  each shard also pays about {fixed_cost:.1f} secs lifting {binary} first", file=sys.stderr)
+    for shard, (entries, load) in enumerate(zip(shards, loads)):
+        print(f"  shard-{shard}: {len(entries)} entries, {load:.1f} {unit}", file=sys.stderr)
+    if loads and sum(loads):
+        print(f"  largest shard is {max(loads) / (sum(loads) / len(loads)):.2f}x the mean", file=sys.stderr)
+    return shard_plan
+
+
+def read_plan(shard_dir, config_file, num_shards):
+    ''' Get the plan in shard_dir if it's of config_file and num_shards, else None. '''
+    path = os.path.join(shard_dir, PLAN_FILENAME)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        shard_plan = json.load(f)
+    if shard_plan['config'] != config_hash(config_file) or shard_plan.get('num_shards') != num_shards:
+        return None
+    return shard_plan
+
+
+def parse_cores(cores):
+    ''' Get the cores of a taskset list like 0-3,8. '''
+    parsed = []
+    for part in cores.split(','):
+        first, _, last = part.partition('-')
+        parsed.extend(range(int(first), int(last or first) + 1))
+    return parsed
+
+
+def merge_csvs(paths, output, key_columns=None):
+    '''
+    Write the csvs at paths one after another into output, with the header
+    line of the first once. With key_columns, the rows of a key an earlier
+    csv had are left out. Returns the number of rows written.
+    '''
+    header = None
+    key_idxs = None
+    # key -> the csv that had it first
+    seen = dict()
+    num_rows = 0
+    with open(output, 'w') as out:
+        for path_idx, path in enumerate(paths):
+            if not os.path.exists(path):
+                continue
+            with open(path) as f:
+                for idx, line in enumerate(f):
+                    if not line.endswith('\n'):
+                        line += '\n'
+                    if idx == 0:
+                        if header is None:
+                            header = line
+                            out.write(line)
+                            if key_columns is not None:
+                                columns = next(csv.reader([line]))
+                                key_idxs = [columns.index(column) for column in key_columns]
+                        if line == header:
+                            continue
+                    if key_idxs is not None:
+                        fields = next(csv.reader([line]))
+                        key = tuple(fields[idx] if idx < len(fields) else '' for idx in key_idxs)
+                        if seen.setdefault(key, path_idx) != path_idx:
+                            continue
+                    out.write(line)
+                    num_rows += 1
+    return num_rows
+
+
+def merge_logs(shard_plan, shard_dir, log_name, output):
+    with open(output, 'w') as out:
+        for shard, entries in enumerate(shard_plan['shards']):
+            out.write(f'==> shard-{shard}: {" ".join(entries)} <==\n')
+            path = shard_path(shard_dir, shard, log_name)
+            if os.path.exists(path):
+                with open(path) as f:
+                    shutil.copyfileobj(f, out)
+
+
+def record_timings(db, shard_plan, seconds):
+    '''
+    Store each timed shard's seconds, and them less the fixed cost of a
+    shard divided among its entries by their estimated cost.
+    '''
+    measured_at = time.strftime('%Y-%m-%d %H:%M:%S')
+    binary_size = shard_plan.get('binary_size')
+    if binary_size is not None:
+        db.executemany('INSERT INTO shard_timings VALUES (?, ?, ?, ?)',
+                       [(binary_size, sum(shard_plan['sizes'][entry] for entry in shard_plan['shards'][shard]),
+                         shard_seconds, measured_at)
+                        for shard, shard_seconds in seconds.items()])
+    fixed_cost = fixed_cost_rate(db) * (binary_size or 0)
+    if seconds:
+        # no shard took less than the fixed cost
+        fixed_cost = min(fixed_cost, min(seconds.values()))
+    for shard, shard_seconds in seconds.items():
+        entries = shard_plan['shards'][shard]
+        total_cost = sum(shard_plan['costs'][entry] for entry in entries)
+        for entry in entries:
+            if total_cost:
+                share = shard_plan['costs'][entry] / total_cost
+            else:
+                share = 1 / len(entries)
+            db.execute('INSERT OR REPLACE INTO entry_timings VALUES (?, ?, ?, ?)',
+                       (entry, shard_plan['sizes'][entry], (shard_seconds - fixed_cost) * share, measured_at))
+    db.commit()
+
+
+def run(db, bap_cmd, binary, config_file, shard_dir, num_shards, alerts_csv, log,
+        symex_profiling_csv=DEFAULT_SYMEX_PROFILING_CSV, cores=None):
+    '''
+    Run bap_cmd (bap and its flags, but not the per run ones) on every shard
+    of config_file, and merge what they write. Returns the shards that failed.
+    '''
+    shard_plan = read_plan(shard_dir, config_file, num_shards)
+    if shard_plan is None:
+        shard_plan = plan(db, binary, config_file, shard_dir, num_shards)
+    else:
+        print(f"Reusing the plan of {len(shard_plan['shards'])} shards in {shard_dir}", file=sys.stderr)
+    is_double_check = DOUBLE_CHECK_FLAG in bap_cmd
+    alerts_name = os.path.basename(alerts_csv)
+    log_name = os.path.basename(log)
+    symex_name = os.path.basename(symex_profiling_csv)
+    cores = parse_cores(cores) if cores is not None else None
+
+    procs = dict()
+    started = dict()
+    try:
+        for shard in range(len(shard_plan['shards'])):
+            cmd = bap_cmd + [f'--uarch-checker-taint-cache={shard_path(shard_dir, shard, TAINT_CACHE_FILENAME)}',
+                             f'--uarch-checker-output-csv-file={shard_path(shard_dir, shard, alerts_name)}',
+                             f'--uarch-checker-symex-profiling-output-file={shard_path(shard_dir, shard, symex_name)}',
+                             f'--uarch-checker-config-file={shard_path(shard_dir, shard, SHARD_CONFIG_FILENAME)}',
+                             binary]
+            if cores:
+                cmd = ['taskset', '-c', str(cores[shard % len(cores)])] + cmd
+            env = dict(os.environ)
+            if 'MEMTRACE' in env:
+                root, ext = os.path.splitext(env['MEMTRACE'])
+                env['MEMTRACE'] = f'{root}.shard-{shard}{ext}'
+            with open(shard_path(shard_dir, shard, log_name), 'w') as log_file:
+                procs[shard] = subprocess.Popen(cmd, stdout=log_file, stderr=subprocess.STDOUT, env=env)
+            started[shard] = time.monotonic()
+        print(f"Started {len(procs)} bap processes, logging to {shard_dir}/shard-*/{log_name}", file=sys.stderr)
+
+        seconds = dict()
+        failed = []
+        while len(seconds) + len(failed) < len(procs):
+            time.sleep(POLL_SECS)
+            for shard, proc in procs.items():
+                if shard in seconds or shard in failed or proc.poll() is None:
+                    continue
+                if proc.returncode != 0:
+                    failed.append(shard)
+                    print(f"shard-{shard} failed with {proc.returncode}, see "
+                          f"{shard_path(shard_dir, shard, log_name)}", file=sys.stderr)
+                else:
+                    seconds[shard] = time.monotonic() - started[shard]
+                    print(f"shard-{shard} done in {seconds[shard]:.0f}s", file=sys.stderr)
+    finally:
+        for proc in procs.values():
+            if proc.poll() is None:
+                proc.terminate()
+
+    merge_logs(shard_plan, shard_dir, log_name, log)
+    if failed:
+        # a partial alerts csv would look like a successful check
+        if os.path.exists(alerts_csv):
+            os.remove(alerts_csv)
+        return sorted(failed)
+
+    num_shards = len(shard_plan['shards'])
+    num_alerts = merge_csvs([shard_path(shard_dir, shard, alerts_name) for shard in range(num_shards)],
+                            alerts_csv, key_columns=ALERT_KEY_COLUMNS)
+    merge_csvs([shard_path(shard_dir, shard, symex_name) for shard in range(num_shards)],
+               symex_profiling_csv)
+    if not is_double_check:
+        record_timings(db, shard_plan, seconds)
+    print(f"Merged {num_alerts} alerts of {num_shards} shards into {alerts_csv}", file=sys.stderr)
+    return []
+
+
+def main():
+    parser = argparse.ArgumentParser(usage=usage_msg)
+    parser.add_argument('--store', default=DEFAULT_STORE, help=f'timings store. Defaults to `{DEFAULT_STORE}`')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    for command, help_msg in (('plan', 'split the config into shards'),
+                              ('run', 'check the shards in parallel and merge their outputs')):
+        sub = subparsers.add_parser(command, help=help_msg)
+        sub.add_argument('binary')
+        sub.add_argument('config_file')
+        sub.add_argument('-n', '--shards', type=int, required=True)
+        sub.add_argument('--shard-dir', required=True)
+        if command == 'run':
+            sub.add_argument('--alerts-csv', required=True)
+            sub.add_argument('--log', required=True)
+            sub.add_argument('--symex-profiling-csv', default=DEFAULT_SYMEX_PROFILING_CSV)
+            sub.add_argument('--cores', help='taskset list of cores to pin the shards to, one core each')
+
+    subparsers.add_parser('timings', help='print the stored timings')
+
+    # after --, bap and the flags every shard gets
+    argv = sys.argv[1:]
+    bap_cmd = argv[argv.index('--') + 1:] if '--' in argv else []
+    args = parser.parse_args(argv[:argv.index('--')] if '--' in argv else argv)
+    db = connect(args.store)
+
+    if args.command == 'plan':
+        plan(db, args.binary, args.config_file, args.shard_dir, args.shards)
+    elif args.command == 'run':
+        if not bap_cmd:
+            parser.error('run needs the bap command after --')
+        if run(db, bap_cmd, args.binary, args.config_file, args.shard_dir, args.shards, args.alerts_csv,
+               args.log, args.symex_profiling_csv, args.cores):
+            sys.exit(1)
+    else:
+        rate = fixed_cost_rate(db)
+        print(f'fixed cost of a shard: {rate * 1e6:.1f}s per million insns of the binary' if rate else
+              'fixed cost of a shard: not known yet')
+        for entry, size, seconds, measured_at in db.execute(
+                'SELECT entry, size, seconds, measured_at FROM entry_timings ORDER BY seconds DESC'):
+            print(f'{entry}\t{seconds:.1f}s\t{size} insns reached\tmeasured {measured_at}')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+import argparse
+import csv
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import elf_reader
+
+usage_msg = """
+report the per-object and per-function code (executable section) growth of
+each ablation's libsodium.a, and of the eval binaries if they were kept,
+vs the baseline build of the same eval run.
+
+  python3 code_size_report.py EVAL_DIR [--ablations rr ss cs ss+cs] [--top 20]
+"""
+
+DEFAULT_ABLATIONS = ['rr', 'ss', 'cs', 'ss+cs']
+
+# copied into each ablation dir by `make run_eval`
+ARCHIVE_FILENAME = 'libsodium.a'
+EVAL_BINARY_PREFIX = 'eval_'
+
+
+def find_binaries(abl_dir):
+    ''' Get the files of an ablation dir to measure: its libsodium.a and any eval binaries. '''
+    binaries = []
+    if os.path.exists(os.path.join(abl_dir, ARCHIVE_FILENAME)):
+        binaries.append(ARCHIVE_FILENAME)
+    for entry in sorted(os.listdir(abl_dir)):
+        if entry.startswith(EVAL_BINARY_PREFIX) and '.' not in entry:
+            binaries.append(entry)
+    return binaries
+
+
+def load_code_sizes(abl_dir):
+    '''
+    Get dict of binary -> object -> (text size, dict of function -> size) for
+    one ablation dir.
+    '''
+    sizes = dict()
+    for binary in find_binaries(abl_dir):
+        try:
+            sizes[binary] = elf_reader.read_code_sizes(os.path.join(abl_dir, binary))
+        except (elf_reader.ElfError, OSError) as err:
+            print(f"Couldn't read code sizes of {os.path.join(abl_dir, binary)}: {err}. Skipping")
+    return sizes
+
+
+def growth_rows(baseline_sizes, abl_sizes):
+    '''
+    Get the code growth of one ablation vs baseline as two lists of dicts, one
+    row per (binary, object) and one per (binary, object, function).
+    Objects or functions only in one build count as 0 bytes in the other.
+    '''
+    object_rows = []
+    function_rows = []
+    for binary in abl_sizes:
+        if binary not in baseline_sizes:
+            continue
+        base_objects = baseline_sizes[binary]
+        abl_objects = abl_sizes[binary]
+        for obj in list(base_objects) + [obj for obj in abl_objects if obj not in base_objects]:
+            base_text, base_fns = base_objects.get(obj, (0, dict()))
+            abl_text, abl_fns = abl_objects.get(obj, (0, dict()))
+            object_rows.append(dict({
+                'binary': binary, 'object': obj,
+                'baseline': base_text, 'size': abl_text, 'growth': abl_text - base_text,
+            }))
+            for fn in list(base_fns) + [fn for fn in abl_fns if fn not in base_fns]:
+                base_size = base_fns.get(fn, 0)
+                abl_size = abl_fns.get(fn, 0)
+                function_rows.append(dict({
+                    'binary': binary, 'object': obj, 'function': fn,
+                    'baseline': base_size, 'size': abl_size, 'growth': abl_size - base_size,
+                }))
+    return object_rows, function_rows
+
+
+def ratio_str(size, baseline):
+    return f'{size / baseline:.2f}x' if baseline else 'new'
+
+
+def gen_report_string(abl, object_rows, function_rows, top):
+    lines = [f'{abl}:']
+    for binary in sorted(set(row['binary'] for row in object_rows)):
+        rows = [row for row in object_rows if row['binary'] == binary]
+        baseline = sum(row['baseline'] for row in rows)
+        size = sum(row['size'] for row in rows)
+        lines.append(f'\t{binary}: text {baseline} -> {size} bytes '
+                     f'({size - baseline:+d}, {ratio_str(size, baseline)})')
+
+    lines.append('\ttop objects by text growth:')
+    for row in sorted(object_rows, key=lambda row: -row['growth'])[:top]:
+        lines.append(f"\t\t{row['growth']:>+9d} {ratio_str(row['size'], row['baseline']):>6}  "
+                     f"{row['binary']}:{row['object']}")
+
+    lines.append('\ttop functions by text growth:')
+    for row in sorted(function_rows, key=lambda row: -row['growth'])[:top]:
+        lines.append(f"\t\t{row['growth']:>+9d} {ratio_str(row['size'], row['baseline']):>6}  "
+                     f"{row['function']} ({row['binary']}:{row['object']})")
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(usage=usage_msg)
+    parser.add_argument('eval_dir', help='directory containing the raw eval data')
+    parser.add_argument('--baseline-dir', default='baseline',
+        help='subdirectory of eval_dir containing the baseline build. Defaults to `baseline`')
+    parser.add_argument('--ablations', nargs='+', default=DEFAULT_ABLATIONS,
+        help=f"ablations to compare. Defaults to `{' '.join(DEFAULT_ABLATIONS)}`")
+    parser.add_argument('--top', type=int, default=20,
+        help='number of top offenders to list per ablation. Defaults to 20')
+    parser.add_argument('-o', '--out', help='also write every function row to this csv')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+        help='number of worker processes for reading binaries. Defaults to the number of cores')
+
+    args = parser.parse_args()
+
+    abl_dirs = [os.path.join(args.eval_dir, abl) for abl in [args.baseline_dir] + args.ablations]
+    for abl_dir in abl_dirs:
+        if not os.path.isdir(abl_dir):
+            print(f"Couldn't find ablation dir {abl_dir}")
+            sys.exit(1)
+
+    if args.jobs == 1:
+        all_sizes = list(map(load_code_sizes, abl_dirs))
+    else:
+        with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+            all_sizes = list(pool.map(load_code_sizes, abl_dirs))
+    baseline_sizes = all_sizes[0]
+    if not baseline_sizes:
+        print(f"Couldn't find {ARCHIVE_FILENAME} or eval binaries in {abl_dirs[0]}")
+        sys.exit(1)
+
+    csv_rows = []
+    for abl, abl_sizes in zip(args.ablations, all_sizes[1:]):
+        object_rows, function_rows = growth_rows(baseline_sizes, abl_sizes)
+        print(gen_report_string(abl, object_rows, function_rows, args.top))
+        csv_rows += [dict(row, ablation=abl) for row in function_rows]
+
+    if args.out:
+        with open(args.out, 'w') as file:
+            writer = csv.DictWriter(file, fieldnames=['ablation', 'binary', 'object', 'function',
+                                                      'baseline', 'size', 'growth'])
+            writer.writeheader()
+            writer.writerows(csv_rows)
+        print(f'Saved per-function code sizes to {args.out}')
+
+
+if __name__ == "__main__":
+    main()
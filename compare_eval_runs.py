@@ -0,0 +1,236 @@
+import argparse
+import csv
+import math
+import os
+import sys
+
+import numpy as np
+
+import cycle_stats
+import process_eval_data as ped
+from eval_history import find_ablations
+
+usage_msg = """
+compare the overheads of an eval run against a reference eval run and fail if
+any mitigation got slower than its budget allows.
+
+  python3 compare_eval_runs.py NEW_EVAL_DIR REF_EVAL_DIR [--budget budget.csv]
+
+for each (ablation, fn), the overhead vs baseline is computed in both runs and
+the regression is new_overhead / ref_overhead - 1. a block bootstrap confidence
+interval is computed for the regression, and a one-sided Mann-Whitney U test
+checks whether the new run's baseline-normalized cycle counts are larger than
+the reference run's. a pair regresses when the lower bound of its confidence
+interval is above its budget.
+
+the budget file is a csv with the header `fn,ablation,max_regression`, e.g.
+
+  fn,ablation,max_regression
+  argon2id,ss+cs,0.05
+  *,cs,0.10
+
+`*` matches any fn or ablation, and the first matching row wins. pairs without
+a matching row use --default-budget.
+"""
+
+BUDGET_WILDCARD = '*'
+
+OK = 'ok'
+REGRESSED = 'REGRESSED'
+IMPROVED = 'improved'
+
+
+def load_budgets(filepath):
+    ''' Get the (fn, ablation, max_regression) rows of a budget csv in file order. '''
+    budgets = []
+    with open(filepath) as file:
+        for row in csv.DictReader(file):
+            budgets.append((row['fn'].strip(), row['ablation'].strip(), float(row['max_regression'])))
+    return budgets
+
+
+def find_budget(budgets, fn, abl, default):
+    for budget_fn, budget_abl, max_regression in budgets:
+        if budget_fn in (fn, BUDGET_WILDCARD) and budget_abl in (abl, BUDGET_WILDCARD):
+            return max_regression
+    return default
+
+
+def bootstrap_regression_ci(new_abl, new_base, ref_abl, ref_base, num_resamples, num_blocks,
+                            confidence, rng):
+    '''
+    Get a percentile bootstrap confidence interval for
+    (mean(new_abl) / mean(new_base)) / (mean(ref_abl) / mean(ref_base)) - 1.
+    Each of the four cycle count arrays is resampled independently, by blocks of
+    consecutive iterations rather than single iterations since consecutive
+    measurements are correlated (and so resampling stays cheap for long runs).
+    '''
+    def resampled_means(cycles_data):
+        return cycle_stats.bootstrap_means(cycles_data, num_resamples, num_blocks, rng)
+
+    ratios = (resampled_means(new_abl) / resampled_means(new_base)) / \
+             (resampled_means(ref_abl) / resampled_means(ref_base)) - 1
+    return cycle_stats.percentile_ci(ratios, confidence)
+
+
+def mann_whitney_greater(x, y):
+    '''
+    One-sided Mann-Whitney U test that `x` is stochastically greater than `y`.
+    Uses the normal approximation with tie and continuity corrections, which is
+    accurate for the hundreds to thousands of samples each eval run collects.
+    Returns (U, p-value).
+    '''
+    n_x, n_y = len(x), len(y)
+    values, inverse, counts = np.unique(np.concatenate([x, y]), return_inverse=True, return_counts=True)
+    # tied values share the average of the ranks they span
+    avg_ranks = np.cumsum(counts) - (counts - 1) / 2
+    u = avg_ranks[inverse[:n_x]].sum() - n_x * (n_x + 1) / 2
+
+    n = n_x + n_y
+    tie_term = np.sum(counts.astype(np.float64)**3 - counts) / (n * (n - 1))
+    sigma = math.sqrt(n_x * n_y / 12 * ((n + 1) - tie_term))
+    if sigma == 0:
+        return u, 1.0
+    z = (u - n_x * n_y / 2 - 0.5) / sigma
+    return u, 0.5 * math.erfc(z / math.sqrt(2))
+
+
+def compare(new_data, ref_data, baseline_dir, ablations, budgets, default_budget,
+            num_resamples, num_blocks, confidence, alpha, rng):
+    ''' Compare every (lib, ablation, fn) present in both runs. Returns a list of result dicts. '''
+    results = []
+    for lib in ped.CRYPTO_FNS:
+        for abl in [baseline_dir] + ablations:
+            for fn in ped.CRYPTO_FNS[lib]:
+                try:
+                    new_abl = new_data[lib][abl][fn][ped.RAW_CYCLES]
+                    ref_abl = ref_data[lib][abl][fn][ped.RAW_CYCLES]
+                    new_base = new_data[lib][baseline_dir][fn][ped.RAW_CYCLES]
+                    ref_base = ref_data[lib][baseline_dir][fn][ped.RAW_CYCLES]
+                except KeyError:
+                    print(f"Missing {lib} {abl} {fn} data in one of the runs. Skipping")
+                    continue
+
+                if abl == baseline_dir:
+                    # no overhead for the baseline itself, compare raw cycles
+                    # to catch machine or harness drift between the runs
+                    new_base = np.ones(1)
+                    ref_base = np.ones(1)
+                    budget = None
+                else:
+                    budget = find_budget(budgets, fn, abl, default_budget)
+
+                new_overhead = new_abl.mean() / new_base.mean()
+                ref_overhead = ref_abl.mean() / ref_base.mean()
+                regression = new_overhead / ref_overhead - 1
+                ci_low, ci_high = bootstrap_regression_ci(
+                    new_abl.astype(np.float64), new_base.astype(np.float64),
+                    ref_abl.astype(np.float64), ref_base.astype(np.float64),
+                    num_resamples, num_blocks, confidence, rng)
+                _, p_value = mann_whitney_greater(new_abl / np.median(new_base),
+                                                  ref_abl / np.median(ref_base))
+
+                if budget is not None and ci_low > budget:
+                    status = REGRESSED
+                elif ci_high < 0 and p_value > 1 - alpha:
+                    status = IMPROVED
+                else:
+                    status = OK
+
+                results.append(dict({
+                    'lib': lib,
+                    'ablation': abl,
+                    'fn': fn,
+                    'new_overhead': new_overhead,
+                    'ref_overhead': ref_overhead,
+                    'regression': regression,
+                    'ci_low': ci_low,
+                    'ci_high': ci_high,
+                    'p_value': p_value,
+                    'significant': p_value < alpha,
+                    'budget': budget,
+                    'status': status,
+                }))
+    return results
+
+
+def gen_report_string(results, baseline_dir, confidence):
+    ci_header = f'{round(confidence * 100)}% CI'
+    lines = [f"{'ablation':<12} {'fn':<26} {'ref':>8} {'new':>8} {'regr':>8} "
+             f"{ci_header:<18} {'p(new>ref)':>10} {'budget':>7}  status"]
+    for result in results:
+        budget = '-' if result['budget'] is None else f"{result['budget']:+.1%}"
+        if result['ablation'] == baseline_dir:
+            overheads = f"{'(cycles)':>8} {'':>8}"
+        else:
+            overheads = f"{result['ref_overhead']:>8.3f} {result['new_overhead']:>8.3f}"
+        ci = f"[{result['ci_low']:+.1%}, {result['ci_high']:+.1%}]"
+        lines.append(f"{result['ablation']:<12} {result['fn']:<26} {overheads} "
+                     f"{result['regression']:>+8.1%} {ci:<18} {result['p_value']:>10.3g} "
+                     f"{budget:>7}  {result['status']}")
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(usage=usage_msg)
+    parser.add_argument('eval_dir', help='directory containing the new raw eval data')
+    parser.add_argument('ref_eval_dir', help='directory containing the reference raw eval data')
+    parser.add_argument('--baseline-dir', default='baseline',
+        help='subdirectory of both eval dirs containing baseline data. Defaults to `baseline`')
+    parser.add_argument('--ablations', nargs='+', default=None,
+        help='ablations to compare. Defaults to every ablation present in both eval dirs')
+    parser.add_argument('--budget', help='csv of allowed regressions per (fn, ablation)')
+    parser.add_argument('--default-budget', type=float, default=0.05,
+        help='allowed regression for pairs not in the budget file, as a fraction. Defaults to 0.05')
+    parser.add_argument('--confidence', type=float, default=cycle_stats.BOOTSTRAP_CONFIDENCE,
+        help='confidence level of the bootstrap intervals. Defaults to 0.95')
+    parser.add_argument('--alpha', type=float, default=0.05,
+        help='significance level of the Mann-Whitney U test. Defaults to 0.05')
+    parser.add_argument('--resamples', type=int, default=cycle_stats.BOOTSTRAP_RESAMPLES,
+        help='number of bootstrap resamples. Defaults to 2000')
+    parser.add_argument('--blocks', type=int, default=cycle_stats.BOOTSTRAP_BLOCKS,
+        help='number of blocks of consecutive iterations each run is resampled by. Defaults to 200')
+    parser.add_argument('--seed', type=int, default=cycle_stats.BOOTSTRAP_SEED, help='bootstrap rng seed. Defaults to 0')
+    parser.add_argument('-o', '--out', help='also write the report to this file')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+        help='number of worker processes for loading data. Defaults to the number of cores')
+
+    args = parser.parse_args()
+
+    for eval_dir in (args.eval_dir, args.ref_eval_dir):
+        if not os.path.exists(os.path.join(eval_dir, args.baseline_dir)):
+            print(f"Couldn't find baseline dir {args.baseline_dir} in {eval_dir}")
+            sys.exit(2)
+
+    if args.ablations is None:
+        ref_ablations = set(find_ablations(args.ref_eval_dir, args.baseline_dir))
+        args.ablations = [abl for abl in find_ablations(args.eval_dir, args.baseline_dir)
+                          if abl in ref_ablations]
+
+    budgets = load_budgets(args.budget) if args.budget else []
+
+    new_data = ped.get_data(args.eval_dir, args.baseline_dir, args.ablations, jobs=args.jobs)
+    ref_data = ped.get_data(args.ref_eval_dir, args.baseline_dir, args.ablations, jobs=args.jobs)
+
+    results = compare(new_data, ref_data, args.baseline_dir, args.ablations, budgets,
+                      args.default_budget, args.resamples, args.blocks, args.confidence, args.alpha,
+                      np.random.default_rng(args.seed))
+
+    report = gen_report_string(results, args.baseline_dir, args.confidence)
+    regressed = [result for result in results if result['status'] == REGRESSED]
+    summary = f'{len(regressed)} of {len(results)} (ablation, fn) pairs regressed beyond budget'
+    print(report)
+    print(summary)
+
+    if args.out:
+        with open(args.out, 'w') as file:
+            print(f'new: {args.eval_dir}\nreference: {args.ref_eval_dir}\n', file=file)
+            print(report, file=file)
+            print(summary, file=file)
+        print(f'Saved comparison to {args.out}')
+
+    sys.exit(1 if regressed else 0)
+
+
+if __name__ == "__main__":
+    main()
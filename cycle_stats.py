@@ -0,0 +1,217 @@
+'''
+Statistics on cycle count series shared by process_eval_data.py,
+compare_eval_runs.py and implementation-testing/get_cycle_count_data.py.
+Everything works on whole numpy arrays, so the scripts report comparable
+means, medians and error bars.
+'''
+import numpy as np
+
+# MSER-5: batches of 5 consecutive samples
+STEADY_STATE_BATCH_SIZE = 5
+# a best truncation point in the last half of the batches means the series never settled
+STEADY_STATE_MAX_TRUNCATION = 0.5
+# too few batches to tell where the warmup ends, keep everything
+STEADY_STATE_MIN_BATCHES = 10
+
+# samples above the third quartile + IQR_FENCE * the interquartile range are outliers
+IQR_FENCE = 1.5
+# fraction cut from each end for trimmed means
+TRIM_PROPORTION = 0.1
+
+BOOTSTRAP_RESAMPLES = 2000
+# consecutive cycle counts are correlated, so bootstraps resample blocks of them
+BOOTSTRAP_BLOCKS = 200
+BOOTSTRAP_CONFIDENCE = 0.95
+BOOTSTRAP_SEED = 0
+
+
+def steady_state_start(cycles_data, batch_size=STEADY_STATE_BATCH_SIZE):
+    '''
+    Find where a cycle count series reaches steady state with MSER-5 (the
+    marginal standard error rule): the series is split into batches of
+    `batch_size` consecutive samples, and the start is the number of leading
+    batches whose removal minimizes the standard error of the mean of the rest.
+    Batch medians are used instead of batch means so single interrupts or cache
+    misses don't pull the truncation point.
+
+    Returns (start index, settled). `settled` is False when the best truncation
+    point is in the last half of the series, i.e. the series is still drifting
+    and no prefix of it is warmup.
+    '''
+    return steady_state_start_of_batches(batch_medians(cycles_data, batch_size), batch_size)
+
+
+def batch_medians(cycles_data, batch_size=STEADY_STATE_BATCH_SIZE):
+    '''
+    Get the medians of the consecutive batches of `batch_size` samples of a
+    series, without a partial last batch. The batch medians of consecutive
+    pieces of a series, each a multiple of `batch_size` long, are the batch
+    medians of the whole series.
+    '''
+    num_batches = len(cycles_data) // batch_size
+    return np.median(
+        np.asarray(cycles_data[:num_batches * batch_size], dtype=np.float64)
+          .reshape(num_batches, batch_size),
+        axis=1)
+
+
+def steady_state_start_of_batches(batches, batch_size=STEADY_STATE_BATCH_SIZE):
+    ''' steady_state_start of a series given its batch_medians. '''
+    num_batches = len(batches)
+    if num_batches < STEADY_STATE_MIN_BATCHES:
+        return 0, True
+
+    # sums of the batches from each truncation point d to the end
+    suffix_sum = np.cumsum(batches[::-1])[::-1]
+    suffix_sq_sum = np.cumsum(batches[::-1]**2)[::-1]
+    remaining = np.arange(num_batches, 0, -1, dtype=np.float64)
+    sse = np.maximum(suffix_sq_sum - suffix_sum**2 / remaining, 0)
+    mser = sse / remaining**2
+
+    # the last few batches trivially have ~0 error, never truncate to them
+    truncation = int(np.argmin(mser[:num_batches - STEADY_STATE_MIN_BATCHES + 1]))
+    settled = truncation <= num_batches * STEADY_STATE_MAX_TRUNCATION
+    return truncation * batch_size, bool(settled)
+
+
+def steady_state(cycles_data, batch_size=STEADY_STATE_BATCH_SIZE):
+    '''
+    Get the steady state samples of a cycle count series, along with where they
+    start and whether the series settled (see steady_state_start).
+    Unsettled series are returned whole.
+    '''
+    start, settled = steady_state_start(cycles_data, batch_size)
+    if not settled:
+        return cycles_data, 0, False
+    return cycles_data[start:], start, True
+
+
+def drop_outliers(cycles_data, fence=IQR_FENCE):
+    ''' Get the samples of `cycles_data` below the upper Tukey fence (Q3 + `fence` * IQR). '''
+    q1, q3 = np.quantile(cycles_data, [0.25, 0.75])
+    return cycles_data[cycles_data < q3 + (q3 - q1) * fence]
+
+
+def trimmed_mean(values, proportion=TRIM_PROPORTION):
+    ''' Get the mean of `values` without the lowest and highest `proportion` of them. '''
+    values = np.sort(np.asarray(values, dtype=np.float64))
+    cut = int(len(values) * proportion)
+    return float(np.mean(values[cut:len(values) - cut]))
+
+
+def median(values):
+    return float(np.median(values))
+
+
+def paired_ratios(numerators, denominators):
+    '''
+    Get numerators[i] / denominators[i] for paired measurements. Pairs with a
+    zero denominator or a non-positive ratio count as 1 (no change), so the
+    ratios always have a geometric mean.
+    '''
+    ratios = np.ones(len(numerators))
+    np.divide(numerators, denominators, out=ratios, where=denominators != 0)
+    ratios[ratios <= 0.0] = 1
+    return ratios
+
+
+def geomean(values):
+    ''' Geometric mean of positive values. '''
+    return float(np.exp(np.mean(np.log(values))))
+
+
+def block_means(values, num_blocks=BOOTSTRAP_BLOCKS):
+    '''
+    Split `values` into `num_blocks` contiguous blocks (dropping the remainder
+    at the end) and get the mean of each.
+    '''
+    values = np.asarray(values, dtype=np.float64)
+    num_blocks = min(num_blocks, len(values))
+    block_len = len(values) // num_blocks
+    return values[:num_blocks * block_len].reshape(num_blocks, block_len).mean(axis=1)
+
+
+def bootstrap_means(values, num_resamples=BOOTSTRAP_RESAMPLES, num_blocks=BOOTSTRAP_BLOCKS, rng=None):
+    '''
+    Get `num_resamples` block bootstrap replicates of the mean of `values`, all
+    drawn in one array operation.
+    '''
+    if rng is None:
+        rng = np.random.default_rng(BOOTSTRAP_SEED)
+    means = block_means(values, num_blocks)
+    idx = rng.integers(0, len(means), size=(num_resamples, len(means)))
+    return means[idx].mean(axis=1)
+
+
+def percentile_ci(replicates, confidence=BOOTSTRAP_CONFIDENCE):
+    ''' Get the (low, high) percentile interval of bootstrap replicates. '''
+    tail = (1 - confidence) / 2 * 100
+    low, high = np.percentile(replicates, [tail, 100 - tail])
+    return float(low), float(high)
+
+
+def bootstrap_mean_ci(values, confidence=BOOTSTRAP_CONFIDENCE, rng=None, **kwargs):
+    ''' Get a block bootstrap confidence interval (low, high) for the mean of `values`. '''
+    return percentile_ci(bootstrap_means(values, rng=rng, **kwargs), confidence)
+
+
+def bootstrap_geomean_ci(ratios, confidence=BOOTSTRAP_CONFIDENCE, rng=None, **kwargs):
+    ''' Get a block bootstrap confidence interval (low, high) for the geometric mean of positive `ratios`. '''
+    low, high = bootstrap_mean_ci(np.log(ratios), confidence, rng, **kwargs)
+    return float(np.exp(low)), float(np.exp(high))
+
+
+class LogHistogram:
+    '''
+    Fixed-size histogram with logarithmically spaced buckets (like an HDR
+    histogram) for streaming quantiles of positive values. Each bucket spans a
+    factor of (1 + 2 * `relative_error`), so quantiles are within
+    `relative_error` of an actual value, memory doesn't grow with the number of
+    values, and histograms of the same shape merge by adding their counts.
+    Values below `min_value` count as 0, values above `max_value` as `max_value`.
+    '''
+
+    def __init__(self, min_value=1e-3, max_value=1e12, relative_error=0.005):
+        self.min_value = min_value
+        self.max_value = max_value
+        self.relative_error = relative_error
+        self.log_growth = np.log1p(2 * relative_error)
+        # bucket 0 holds everything below min_value
+        self.num_buckets = int(np.ceil(np.log(max_value / min_value) / self.log_growth)) + 2
+        self.counts = np.zeros(self.num_buckets, dtype=np.int64)
+
+    @property
+    def count(self):
+        return int(self.counts.sum())
+
+    def add(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        idx = np.zeros(len(values), dtype=np.int64)
+        in_range = values >= self.min_value
+        idx[in_range] = 1 + np.floor(
+            np.log(np.minimum(values[in_range], self.max_value) / self.min_value) / self.log_growth
+        ).astype(np.int64)
+        self.counts += np.bincount(np.minimum(idx, self.num_buckets - 1), minlength=self.num_buckets)
+
+    def merge(self, other):
+        if (other.min_value, other.max_value, other.relative_error) != \
+           (self.min_value, self.max_value, self.relative_error):
+            raise ValueError('can only merge histograms with the same buckets')
+        self.counts += other.counts
+        return self
+
+    def quantiles(self, qs):
+        ''' Get the values at quantiles `qs` (each in [0, 1]), nan if the histogram is empty. '''
+        total = self.count
+        if total == 0:
+            return [float('nan')] * len(qs)
+        cumulative = np.cumsum(self.counts)
+        result = []
+        for q in qs:
+            bucket = int(np.searchsorted(cumulative, max(1, np.ceil(q * total))))
+            if bucket == 0:
+                result.append(0.0)
+            else:
+                # geometric middle of the bucket
+                result.append(float(self.min_value * np.exp((bucket - 0.5) * self.log_growth)))
+        return result
@@ -0,0 +1,243 @@
+'''
+Minimal reader for the section headers and symbol tables of x86-64 ELF files
+and of the members of `ar` archives, so code size can be measured without
+shelling out to nm/objdump/size per file.
+'''
+import struct
+
+AR_MAGIC = b'!<arch>\n'
+AR_HEADER_LEN = 60
+# ar members with these names hold the symbol index and the GNU long name table
+AR_SYMBOL_INDEXES = [b'/', b'/SYM64/', b'__.SYMDEF', b'__.SYMDEF SORTED']
+AR_LONG_NAMES = b'//'
+
+ELF_MAGIC = b'\x7fELF'
+ELFCLASS64 = 2
+ELFDATA2LSB = 1
+
+# Elf64_Ehdr fields after e_ident
+ELF64_EHDR = struct.Struct('<HHIQQQIHHHHHH')
+ELF64_SHDR = struct.Struct('<IIQQQQIIQQ')
+ELF64_SYM = struct.Struct('<IBBHQQ')
+ELF64_RELA = struct.Struct('<QQq')
+
+SHT_SYMTAB = 2
+SHT_RELA = 4
+SHT_NOBITS = 8
+SHT_DYNSYM = 11
+SHF_EXECINSTR = 0x4
+
+STT_FUNC = 2
+STT_SECTION = 3
+SHN_UNDEF = 0
+SHN_LORESERVE = 0xff00
+
+
+class ElfError(Exception):
+    pass
+
+
+def read_cstring(table, offset):
+    end = table.find(b'\0', offset)
+    return table[offset:end if end != -1 else len(table)].decode(errors='replace')
+
+
+def read_sections(elf):
+    '''
+    Get the sections of an ELF64 little endian file as a list of dicts with
+    name, type, flags, size, offset, link, info and entsize.
+    '''
+    if elf[:4] != ELF_MAGIC:
+        raise ElfError('not an ELF file')
+    if elf[4] != ELFCLASS64 or elf[5] != ELFDATA2LSB:
+        raise ElfError('only 64-bit little endian ELF files are supported')
+
+    (_, _, _, _, _, shoff, _, _, _, _, shentsize, shnum, shstrndx) = ELF64_EHDR.unpack_from(elf, 16)
+    if shoff == 0:
+        return []
+    if shnum == 0:
+        # more than SHN_LORESERVE sections, the real count is in section 0
+        shnum = ELF64_SHDR.unpack_from(elf, shoff)[5]
+
+    sections = []
+    for idx in range(shnum):
+        (name, sh_type, flags, _, offset, size, link, info, _, entsize) = \
+            ELF64_SHDR.unpack_from(elf, shoff + idx * shentsize)
+        sections.append(dict({
+            'name_offset': name,
+            'type': sh_type,
+            'flags': flags,
+            'offset': offset,
+            'size': size,
+            'link': link,
+            'info': info,
+            'entsize': entsize,
+        }))
+
+    if shstrndx < len(sections):
+        names = sections[shstrndx]
+        shstrtab = elf[names['offset']:names['offset'] + names['size']]
+        for section in sections:
+            section['name'] = read_cstring(shstrtab, section['name_offset'])
+    else:
+        for section in sections:
+            section['name'] = ''
+    return sections
+
+
+def read_function_symbols(elf, sections):
+    '''
+    Get (name, size, section index, value) of every defined function symbol in
+    the static symbol table (or the dynamic one for stripped shared objects).
+    The value is the offset in its section for object files.
+    '''
+    symtabs = [section for section in sections if section['type'] == SHT_SYMTAB] or \
+              [section for section in sections if section['type'] == SHT_DYNSYM]
+    functions = []
+    for symtab in symtabs:
+        strtab = sections[symtab['link']]
+        strings = elf[strtab['offset']:strtab['offset'] + strtab['size']]
+        entsize = symtab['entsize'] or ELF64_SYM.size
+        for offset in range(symtab['offset'], symtab['offset'] + symtab['size'], entsize):
+            name, info, _, shndx, value, size = ELF64_SYM.unpack_from(elf, offset)
+            if info & 0xf != STT_FUNC or shndx == SHN_UNDEF or shndx >= SHN_LORESERVE:
+                continue
+            functions.append((read_cstring(strings, name), size, shndx, value))
+    return functions
+
+
+def text_sizes(elf):
+    '''
+    Get the code size of one ELF file: (total size of its executable sections,
+    dict of function name -> size). Functions are keyed by name alone; a
+    duplicate name (e.g. two static fns) keeps the larger size.
+    '''
+    sections = read_sections(elf)
+    text_size = sum(section['size'] for section in sections
+                    if section['flags'] & SHF_EXECINSTR and section['type'] != SHT_NOBITS)
+
+    functions = dict()
+    for name, size, shndx, _ in read_function_symbols(elf, sections):
+        if shndx < len(sections) and sections[shndx]['flags'] & SHF_EXECINSTR:
+            functions[name] = max(functions.get(name, 0), size)
+    return text_size, functions
+
+
+def read_symbol_names(elf, symtab, sections):
+    '''
+    Get the names of every entry of a symbol table section, by index. Section
+    symbols are named after their section.
+    '''
+    strtab = sections[symtab['link']]
+    strings = elf[strtab['offset']:strtab['offset'] + strtab['size']]
+    entsize = symtab['entsize'] or ELF64_SYM.size
+    names = []
+    for offset in range(symtab['offset'], symtab['offset'] + symtab['size'], entsize):
+        name, info, _, shndx, _, _ = ELF64_SYM.unpack_from(elf, offset)
+        if info & 0xf == STT_SECTION and shndx < len(sections):
+            names.append(sections[shndx]['name'])
+        else:
+            names.append(read_cstring(strings, name))
+    return names
+
+
+def function_contents(elf):
+    '''
+    Get dict of function name -> the bytes of the function in an object file
+    followed by its relocations (offset in the function, type, symbol name and
+    addend), so two functions compare equal when they'd link to the same code
+    regardless of where they are in their sections.
+    '''
+    sections = read_sections(elf)
+    relocations = dict()
+    for section in sections:
+        if section['type'] != SHT_RELA or section['link'] >= len(sections):
+            continue
+        names = read_symbol_names(elf, sections[section['link']], sections)
+        entsize = section['entsize'] or ELF64_RELA.size
+        for offset in range(section['offset'], section['offset'] + section['size'], entsize):
+            r_offset, r_info, r_addend = ELF64_RELA.unpack_from(elf, offset)
+            sym = r_info >> 32
+            # sh_info of a relocation section is the section it applies to
+            relocations.setdefault(section['info'], []).append(
+                (r_offset, r_info & 0xffffffff, names[sym] if sym < len(names) else '', r_addend))
+
+    contents = dict()
+    for name, size, shndx, value in read_function_symbols(elf, sections):
+        if shndx >= len(sections) or sections[shndx]['type'] == SHT_NOBITS:
+            continue
+        start = sections[shndx]['offset'] + value
+        relocs = [f'{r_offset - value} {r_type} {r_sym} {r_addend}'
+                  for r_offset, r_type, r_sym, r_addend in sorted(relocations.get(shndx, []))
+                  if value <= r_offset < value + size]
+        contents[name] = bytes(elf[start:start + size]) + '\n'.join(relocs).encode()
+    return contents
+
+
+def read_ar_members(archive):
+    '''
+    Yield (member name, member bytes) of each object in an `ar` archive,
+    skipping the symbol index and resolving GNU/BSD long names.
+    '''
+    if archive[:len(AR_MAGIC)] != AR_MAGIC:
+        raise ElfError('not an ar archive')
+
+    long_names = b''
+    offset = len(AR_MAGIC)
+    while offset + AR_HEADER_LEN <= len(archive):
+        header = archive[offset:offset + AR_HEADER_LEN]
+        raw_name = header[:16].rstrip(b' ')
+        size = int(header[48:58].strip() or 0)
+        offset += AR_HEADER_LEN
+        data = archive[offset:offset + size]
+        # members are 2-byte aligned
+        offset += size + (size & 1)
+
+        if raw_name in AR_SYMBOL_INDEXES:
+            continue
+        if raw_name == AR_LONG_NAMES:
+            long_names = data
+            continue
+
+        if raw_name.startswith(b'#1/'):
+            # BSD: the name is at the start of the member data
+            name_len = int(raw_name[3:])
+            name = data[:name_len].rstrip(b'\0').decode(errors='replace')
+            data = data[name_len:]
+        elif raw_name.startswith(b'/') and raw_name[1:].isdigit():
+            # GNU: offset into the long name table, terminated by "/\n"
+            start = int(raw_name[1:])
+            end = long_names.find(b'/\n', start)
+            name = long_names[start:end if end != -1 else len(long_names)].decode(errors='replace')
+        else:
+            name = raw_name.rstrip(b'/').decode(errors='replace')
+        yield name, data
+
+
+def read_code_sizes(filepath):
+    '''
+    Get the code sizes of an ELF file or of every ELF member of an archive,
+    as dict of object name -> (text size, dict of function name -> size).
+    Archive members that aren't 64-bit ELF objects are skipped.
+    '''
+    with open(filepath, 'rb') as file:
+        contents = file.read()
+
+    if contents[:len(AR_MAGIC)] == AR_MAGIC:
+        objects = dict()
+        for name, data in read_ar_members(contents):
+            try:
+                text_size, functions = text_sizes(data)
+            except (ElfError, struct.error):
+                continue
+            # archives can hold several members with the same name
+            key = name
+            suffix = 1
+            while key in objects:
+                suffix += 1
+                key = f'{name}#{suffix}'
+            objects[key] = (text_size, functions)
+        return objects
+
+    name = filepath.rsplit('/', 1)[-1]
+    return dict({name: text_sizes(contents)})
@@ -32,6 +32,7 @@ CS_ABLATIONS_REFERENCE=("cs_mul64" "cs_lea" "cs_vector" "cs_other_64" "cs_other"
 
 VALIDATE=0
 VALIDATION_DIR=""
+REGRESSION_BUDGET=""
 
 EVAL_MSG_LEN=100
 EVAL_MSG=$(timeout 0.01s cat /dev/urandom | tr -dc '[:alnum:]' | fold -w $EVAL_MSG_LEN | head -n 1)
@@ -46,13 +47,14 @@ function usage
 			   [ -p | --checker-dir <path to root checker dir> ]
 			   [ -t | --crypto-dir <path to the crypto lib project that has the root makefile> ]
 			   [ -v | --validate <path to a prior eval directory against which to validate results> ]
+			   [ -r | --regression-budget <csv of allowed overhead regressions vs the --validate dir, see compare_eval_runs.py> ]
 			   [ -m | --makefile-flags \"<~double quoted string~ of extra flags for the Makefile>\" ]
 			   [ -d | --dynamic-hit-counts (record dynamic hit counts) ]
 			   [ -j <num make job slots> ]"
     exit 2
 }
 
-PARSED_ARGS=$(getopt -o "dhb:c:p:t:v:m:j:" -l "help,baseline-cc:,cc:,checker-dir:,dynamic-hit-counts,crypto-dir:,validate:,makefile-flags:" -n eval.sh -- "$@")
+PARSED_ARGS=$(getopt -o "dhb:c:p:t:v:r:m:j:" -l "help,baseline-cc:,cc:,checker-dir:,dynamic-hit-counts,crypto-dir:,validate:,regression-budget:,makefile-flags:" -n eval.sh -- "$@")
 
 if [[ $? -ne 0 ]]; then
        echo "Error parsing args"
@@ -105,6 +107,11 @@ while true; do
 	    shift 2
 	    continue
 	    ;;
+	'-r' | '--regression-budget')
+	    REGRESSION_BUDGET=`realpath $2`
+	    shift 2
+	    continue
+	    ;;
 	'-d' | '--dynamic-hit-counts')
 	    DYNAMIC_HIT_COUNTS=1
 	    shift
@@ -280,31 +287,18 @@ if [[ $? -ne 0 ]]; then
 fi
 
 # generate plots
+VALIDATION_STATUS=0
 if [[ "$VALIDATE" -eq 1 ]]; then
 	echo ""
-	echo "Validating baseline..."
-	python3 process_eval_data.py $TOP_EVAL_DIR $BASELINE_DIR "../$VALIDATION_DIR/$BASELINE_DIR"
-	mv $TOP_EVAL_DIR/calculated_data.txt $TOP_EVAL_DIR/baseline_validation_data.txt
-
-	echo ""
-	echo "Validating register reservation only..."
-	python3 process_eval_data.py $TOP_EVAL_DIR $REG_RES_DIR "../$VALIDATION_DIR/$REG_RES_DIR"
-	mv $TOP_EVAL_DIR/calculated_data.txt $TOP_EVAL_DIR/rr_validation_data.txt
-
-	echo ""
-	echo "Validating SS..."
-	python3 process_eval_data.py $TOP_EVAL_DIR $SS_DIR "../$VALIDATION_DIR/ss"
-	mv $TOP_EVAL_DIR/calculated_data.txt $TOP_EVAL_DIR/ss_validation_data.txt
-
-	echo ""
-	echo "Validating CS..."
-	python3 process_eval_data.py $TOP_EVAL_DIR $CS_DIR "../$VALIDATION_DIR/cs"
-	mv $TOP_EVAL_DIR/calculated_data.txt $TOP_EVAL_DIR/cs_validation_data.txt
-
-	echo ""
-	echo "Validating SS+CS..."
-	python3 process_eval_data.py $TOP_EVAL_DIR $SS_CS_DIR "../$VALIDATION_DIR/ss+cs"
-	mv $TOP_EVAL_DIR/calculated_data.txt $TOP_EVAL_DIR/ss+cs_validation_data.txt
+	echo "Validating against $VALIDATION_DIR..."
+	if [[ -n "$REGRESSION_BUDGET" ]]; then
+		VALIDATION_BUDGET_FLAGS="--budget $REGRESSION_BUDGET"
+	else
+		VALIDATION_BUDGET_FLAGS=""
+	fi
+	python3 compare_eval_runs.py $TOP_EVAL_DIR $VALIDATION_DIR --baseline-dir $BASELINE_DIR \
+		$VALIDATION_BUDGET_FLAGS -o $TOP_EVAL_DIR/validation_report.txt
+	VALIDATION_STATUS=$?
 fi
 
 echo ""
@@ -312,4 +306,19 @@ echo "Overheads vs baseline:"
 python3 process_eval_data.py $TOP_EVAL_DIR $BASELINE_DIR \
 	$SS_CS_DIR $CS_DIR $SS_DIR ${CS_ABLATIONS_REFERENCE[@]} $REG_RES_DIR
 
+echo ""
+echo "Recording results in eval history..."
+python3 eval_history.py ingest $TOP_EVAL_DIR --baseline-dir $BASELINE_DIR
+
+echo ""
+echo "Code size growth vs baseline..."
+python3 code_size_report.py $TOP_EVAL_DIR --baseline-dir $BASELINE_DIR \
+	--ablations $REG_RES_DIR $SS_DIR $CS_DIR $SS_CS_DIR -o $TOP_EVAL_DIR/code-size.csv \
+	| tee $TOP_EVAL_DIR/code-size.txt
+
 bash get_bap_numbers.sh "$SS_CS_DIR"
+
+if [[ "$VALIDATION_STATUS" -ne 0 ]]; then
+	echo "Overheads regressed vs $VALIDATION_DIR beyond budget, see $TOP_EVAL_DIR/validation_report.txt"
+	exit 1
+fi
@@ -25,10 +25,11 @@ cd "$IMPL_TESTING_DIR"
 MEASURE_CYCLE_ARG=1 NUM_FUZZ_RUNS=500000 NUM_FUZZ_JOBS=1 LLVM_HOME=$LLVM_HOME CC=$CLANG ./build_and_run_tests.sh --record-cycle-counts
 
 # amortization-count set in setupTest function in CS,SS transform files in LLVM
-python3 get_cycle_count_data.py --overhead-out-csv-file=transform-cycle-counts-overhead.csv --use-n-measurements=100000 --amortization-count=2000 fuzz_harnesses > cycle_counts.txt 
+python3 get_cycle_count_data.py --overhead-out-csv-file=transform-cycle-counts-overhead.csv --avg-cycles-csv-file=transform-cycle-counts-avg.csv --use-n-measurements=100000 --amortization-count=2000 fuzz_harnesses > cycle_counts.txt 
 
 cp ./cycle_counts.txt ../
 cp transform-cycle-counts-overhead.csv ../
+cp transform-cycle-counts-avg.csv ../
 cd ../
 
 echo "Cycle count results are in: cycle_counts.txt"
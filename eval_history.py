@@ -0,0 +1,256 @@
+import argparse
+import csv
+import os
+import re
+import sqlite3
+import sys
+import time
+
+usage_msg = """
+keep the per-(ablation, fn) results of every ./eval.sh run in one local sqlite
+database so results can be compared across runs without re-parsing raw csvs.
+
+  python3 eval_history.py ingest 2023-04-19-07:27:12-PDT-eval [more eval dirs...]
+  python3 eval_history.py trend --fn argon2id --ablation ss+cs --last 30
+  python3 eval_history.py runs
+"""
+
+DEFAULT_DB = 'eval-history.sqlite3'
+
+# eval dirs are named $(EVAL_START_TIME)-eval, see eval.sh
+EVAL_DIR_NAME_RE = re.compile(r"^(?P<date>\d{4}-\d{2}-\d{2})-(?P<time>\d{2}:\d{2}:\d{2})-(?P<tz>[A-Za-z]+)-eval$")
+
+# same order eval.sh passes ablations to process_eval_data.py
+ABLATION_ORDER = ['ss+cs', 'cs', 'ss', 'cs_mul64', 'cs_lea', 'cs_vector', 'cs_other_64', 'cs_other', 'rr', 'asm']
+
+TREND_STATS = ['overhead', 'overhead_std', 'mean_cycles', 'std', 'num_samples', 'binary_size']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY,
+    eval_dir TEXT NOT NULL UNIQUE,
+    eval_time TEXT NOT NULL,
+    eval_tz TEXT,
+    eval_msg TEXT,
+    ingested_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_by_time ON runs (eval_time);
+
+CREATE TABLE IF NOT EXISTS benchmarks (
+    run_id INTEGER NOT NULL REFERENCES runs (run_id) ON DELETE CASCADE,
+    lib TEXT NOT NULL,
+    ablation TEXT NOT NULL,
+    fn TEXT NOT NULL,
+    compiler TEXT,
+    mean_cycles REAL,
+    std REAL,
+    overhead REAL,
+    overhead_std REAL,
+    num_samples INTEGER,
+    binary_size INTEGER,
+    PRIMARY KEY (run_id, lib, ablation, fn)
+);
+CREATE INDEX IF NOT EXISTS benchmarks_by_fn ON benchmarks (fn, ablation, run_id);
+
+CREATE TABLE IF NOT EXISTS dyn_hits (
+    run_id INTEGER NOT NULL REFERENCES runs (run_id) ON DELETE CASCADE,
+    lib TEXT NOT NULL,
+    ablation TEXT NOT NULL,
+    fn TEXT NOT NULL,
+    opcode TEXT NOT NULL,
+    hits INTEGER NOT NULL,
+    PRIMARY KEY (run_id, lib, ablation, fn, opcode)
+);
+CREATE INDEX IF NOT EXISTS dyn_hits_by_opcode ON dyn_hits (opcode, fn, ablation);
+
+CREATE TABLE IF NOT EXISTS run_times (
+    run_id INTEGER NOT NULL REFERENCES runs (run_id) ON DELETE CASCADE,
+    ablation TEXT NOT NULL,
+    step TEXT NOT NULL,
+    start_sec INTEGER NOT NULL,
+    stop_sec INTEGER NOT NULL,
+    PRIMARY KEY (run_id, ablation, step)
+);
+"""
+
+
+def connect(db_path):
+    db = sqlite3.connect(db_path)
+    db.execute('PRAGMA foreign_keys = ON')
+    db.executescript(SCHEMA)
+    return db
+
+
+def read_first_line(filepath):
+    if not os.path.exists(filepath):
+        return None
+    with open(filepath) as file:
+        return file.readline().strip()
+
+
+def parse_eval_time(eval_dir):
+    '''
+    Get the (time, tz) an eval run started from its directory name, falling
+    back to the mtime of its msg.txt (or the dir) for renamed dirs.
+    time is formatted `YYYY-MM-DD HH:MM:SS` so it sorts chronologically.
+    '''
+    match = EVAL_DIR_NAME_RE.match(os.path.basename(os.path.normpath(eval_dir)))
+    if match:
+        return f"{match.group('date')} {match.group('time')}", match.group('tz')
+
+    msg_filepath = os.path.join(eval_dir, 'msg.txt')
+    mtime = os.path.getmtime(msg_filepath if os.path.exists(msg_filepath) else eval_dir)
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(mtime)), time.strftime('%Z')
+
+
+def find_ablations(eval_dir, baseline_dir):
+    ''' Get every ablation subdirectory of `eval_dir` that has cycle count data. '''
+    found = []
+    for entry in os.listdir(eval_dir):
+        abl_dir = os.path.join(eval_dir, entry)
+        if entry == baseline_dir or not os.path.isdir(abl_dir) or os.path.islink(abl_dir):
+            continue
+        if any(name.endswith('-cyclecounts.csv') for name in os.listdir(abl_dir)):
+            found.append(entry)
+
+    ordered = [abl for abl in ABLATION_ORDER if abl in found]
+    return ordered + sorted(set(found) - set(ordered))
+
+
+def read_run_times(filepath):
+    ''' Get the (step, start_sec, stop_sec) rows of a cio-run-times.csv. '''
+    if not os.path.exists(filepath):
+        return []
+    with open(filepath) as file:
+        return [(row['step'], int(row['start_sec']), int(row['stop_sec']))
+                for row in csv.DictReader(file)]
+
+
+def as_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def ingest(db, eval_dir, baseline_dir, jobs=None):
+    '''
+    Load the results of one eval run into the database, replacing any earlier
+    ingestion of the same eval dir.
+    '''
+    # only ingesting needs numpy and the report code, keep queries fast to start
+    import process_eval_data as ped
+
+    if not os.path.exists(os.path.join(eval_dir, baseline_dir)):
+        print(f"Couldn't find baseline dir {baseline_dir} in {eval_dir}. Skipping")
+        return False
+
+    ablations = find_ablations(eval_dir, baseline_dir)
+    data = ped.get_data(eval_dir, baseline_dir, ablations, jobs=jobs)
+    ped.calculate_overheads(data, baseline_dir)
+
+    eval_name = os.path.basename(os.path.normpath(eval_dir))
+    eval_time, eval_tz = parse_eval_time(eval_dir)
+    eval_msg = read_first_line(os.path.join(eval_dir, 'msg.txt'))
+
+    with db:
+        db.execute('DELETE FROM runs WHERE eval_dir = ?', (eval_name,))
+        run_id = db.execute(
+            'INSERT INTO runs (eval_dir, eval_time, eval_tz, eval_msg, ingested_at) VALUES (?, ?, ?, ?, ?)',
+            (eval_name, eval_time, eval_tz, eval_msg, time.strftime('%Y-%m-%d %H:%M:%S'))
+        ).lastrowid
+
+        for lib in data.keys():
+            for abl in data[lib].keys():
+                compiler = read_first_line(os.path.join(eval_dir, abl, 'eval-cc.txt'))
+                for fn, fn_data in data[lib][abl].items():
+                    db.execute(
+                        'INSERT INTO benchmarks VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                        (run_id, lib, abl, fn, compiler,
+                         float(fn_data[ped.MEAN]), float(fn_data[ped.STD]),
+                         float(fn_data[ped.OVERHEAD]), float(fn_data[ped.OVERHEAD_STD]),
+                         len(fn_data[ped.RAW_CYCLES]), as_int(fn_data[ped.BINARY_SIZE])))
+
+                    if fn_data[ped.DYN_HITS] is not None:
+                        db.executemany(
+                            'INSERT OR REPLACE INTO dyn_hits VALUES (?, ?, ?, ?, ?, ?)',
+                            [(run_id, lib, abl, fn, opcode, int(hits))
+                             for opcode, hits in fn_data[ped.DYN_HITS].items()])
+
+        for abl in [baseline_dir] + ablations:
+            db.executemany(
+                'INSERT OR REPLACE INTO run_times VALUES (?, ?, ?, ?, ?)',
+                [(run_id, abl, step, start, stop)
+                 for step, start, stop in read_run_times(os.path.join(eval_dir, abl, 'cio-run-times.csv'))])
+
+    num_benchmarks = sum(len(data[lib][abl]) for lib in data for abl in data[lib])
+    print(f"Ingested {num_benchmarks} benchmarks of {eval_name} ({eval_time} {eval_tz})")
+    return True
+
+
+def trend(db, fn, ablation, stat, last, lib='libsodium'):
+    ''' Get the last `last` runs' values of `stat` for one (ablation, fn), oldest first. '''
+    rows = db.execute(
+        f'SELECT r.eval_time, r.eval_dir, r.eval_msg, b.compiler, b.{stat} '
+        'FROM benchmarks b JOIN runs r ON r.run_id = b.run_id '
+        'WHERE b.fn = ? AND b.ablation = ? AND b.lib = ? '
+        'ORDER BY r.eval_time DESC LIMIT ?',
+        (fn, ablation, lib, last)).fetchall()
+    return rows[::-1]
+
+
+def main():
+    parser = argparse.ArgumentParser(usage=usage_msg)
+    parser.add_argument('--db', default=DEFAULT_DB, help=f'results database. Defaults to `{DEFAULT_DB}`')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    ingest_parser = subparsers.add_parser('ingest', help='load eval dirs into the database')
+    ingest_parser.add_argument('eval_dirs', nargs='+')
+    ingest_parser.add_argument('--baseline-dir', default='baseline',
+        help='subdirectory of each eval dir containing baseline data. Defaults to `baseline`')
+    ingest_parser.add_argument('-j', '--jobs', type=int, default=None,
+        help='number of worker processes for loading data. Defaults to the number of cores')
+
+    trend_parser = subparsers.add_parser('trend', help='show one statistic across runs')
+    trend_parser.add_argument('--fn', required=True, help='crypto fn, e.g. argon2id')
+    trend_parser.add_argument('--ablation', required=True, help='ablation, e.g. ss+cs')
+    trend_parser.add_argument('--lib', default='libsodium')
+    trend_parser.add_argument('--stat', choices=TREND_STATS, default='overhead')
+    trend_parser.add_argument('--last', type=int, default=30, help='number of most recent runs')
+
+    subparsers.add_parser('runs', help='list ingested runs')
+
+    args = parser.parse_args()
+    db = connect(args.db)
+
+    if args.command == 'ingest':
+        ok = True
+        for eval_dir in args.eval_dirs:
+            ok = ingest(db, eval_dir, args.baseline_dir, args.jobs) and ok
+        sys.exit(0 if ok else 1)
+
+    if args.command == 'runs':
+        for eval_time, eval_tz, eval_dir, eval_msg, num_benchmarks in db.execute(
+                'SELECT r.eval_time, r.eval_tz, r.eval_dir, r.eval_msg, COUNT(b.fn) '
+                'FROM runs r LEFT JOIN benchmarks b ON b.run_id = r.run_id '
+                'GROUP BY r.run_id ORDER BY r.eval_time'):
+            print(f'{eval_time} {eval_tz}\t{eval_dir}\t{num_benchmarks} benchmarks\tmsg: {eval_msg}')
+        return
+
+    rows = trend(db, args.fn, args.ablation, args.stat, args.last, args.lib)
+    if not rows:
+        print(f'No results for {args.lib} {args.ablation} {args.fn}')
+        sys.exit(1)
+
+    print(f'{args.stat} of {args.lib} {args.ablation} {args.fn} over the last {len(rows)} runs:')
+    for eval_time, eval_dir, eval_msg, compiler, value in rows:
+        print(f'\t{eval_time}\t{value}\t{eval_dir}\tcc: {compiler}\tmsg: {(eval_msg or "")[:16]}')
+
+    values = [value for *_, value in rows if value is not None]
+    if len(values) > 1:
+        print(f'min: {min(values)}, max: {max(values)}, mean: {sum(values) / len(values)}, '
+              f'last vs first: {values[-1] / values[0] if values[0] else float("nan")}')
+
+
+if __name__ == "__main__":
+    main()
@@ -54,9 +54,9 @@ echo -e "\tChecking: $CHECKING_TIME"
 echo -e "\tMitigation: $MITIGATION_TIME"
 echo -e "\tDouble checking: $DOUBLECHECKING_TIME"
 echo "------------------------------------------"
-grep -A 9 -E 'cs stats:' latest-cio-build/bap.log
+grep -A 9 -E 'cs stats:' "$CHECKING_LOG"
 echo "------------------------------------------"
-grep -A 9 -E 'ss stats:' latest-cio-build/bap.log
+grep -A 9 -E 'ss stats:' "$CHECKING_LOG"
 echo "------------------------------------------"
 
 
@@ -1,106 +1,300 @@
-import sys
-from pathlib import Path
 import argparse
+import bz2
+import gzip
+import lzma
 import re
+import sys
+from collections import Counter, defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
 
 usage_msg = """
-after running cio or an inner cio run of ./eval.sh with one job slot (-j 1),
-parse the compiler output to get the counts of num opcodes transformed out of those
-considered and
-num of insns transformed out of those considered
+parse the compiler output of the mitigation pass to get the counts of num
+opcodes transformed out of those considered and num of insns transformed out
+of those considered, in total, per function and per build, and how often
+each opcode was unsupported.
+
+  python3 get_transform_counts.py LOG_OR_BUILD_DIR [LOG_OR_BUILD_DIR ...] [--records] [--top 20] [-j JOBS]
+
+logs can be plain or compressed (.gz, .bz2, .xz) and are read streaming. for a
+build dir, the files in it matching --log-glob are read, by default the
+mitigation.make.log cio writes. the logs don't need a serial (-j 1) build:
+make -j N interleaves the output of compiler invocations, so records are
+found anywhere in a line, and records torn across lines are put back
+together where possible. the number that couldn't be is reported.
+
+records are counted per (CS/SS, object file, function), the object file
+being the -o (else the source file) of the last compile command before
+them in the log, or of automake's `CC foo.lo` line. a static function can
+have the same name in many files, and libtool compiles each file twice,
+into foo.o and .libs/foo.o. that needs make's output grouped by target,
+as cio's --output-sync=target does; without it interleaved records can
+be put down to another object of the same batch of jobs.
 """
 
-argparser = argparse.ArgumentParser(usage_msg)
-argparser.add_argument('log_file_to_parse')
+DEFAULT_LOG_GLOB = 'mitigation.make.log*'
 
-args = argparser.parse_args()
-log_file = Path(args.log_file_to_parse)
+CS = 'CS'
+SS = 'SS'
+OPCODES = 'opcodes'
+INSNS = 'insns'
 
-if not log_file.exists():
-    print(f"error: log file {log_file} doesn't exist")
-    sys.exit(1)
+# no anchors, make -j can put other invocations' output before and after a
+# record on the same line. function names can't contain '['
+RECORD_START_RE = re.compile(r'\[(?P<ss_or_cs>CS|SS)\] for function ')
+RECORD_PREFIXES = ('[CS] for function ', '[SS] for function ')
+# a line ending in this much of a record prefix may be torn inside it
+MIN_PARTIAL_PREFIX = 2
+OPCODES_RE = re.compile(r'\[(?P<ss_or_cs>CS|SS)\] for function (?P<subname>[^\s\[]+) transformed (?P<transformed>\d+) out of (?P<total>\d+) mir opcodes\.')
+INSNS_RE = re.compile(r'\[(?P<ss_or_cs>CS|SS)\] for function (?P<subname>[^\s\[]+) transforming (?P<transformed>\d+) out of (?P<total>\d+) insns\.')
+# the compiler invocations and automake's silent rule lines the records follow
+COMPILE_OUTPUT_RE = re.compile(r'(?:^|\s)-o\s*(?P<file>[^\s\'"`]+\.l?o)(?=[\s\'"`]|$)')
+COMPILE_SOURCE_RE = re.compile(r'(?:^|[\s\'"`])(?P<file>[^\s\'"`]+\.(?:c|cc|cpp|cxx|s|S))(?=[\s\'"`]|$)')
+SILENT_COMPILE_RE = re.compile(r'^\s*CC\s+(?P<file>\S+\.l?o)\s*$')
+UNKNOWN_SOURCE = '?'
+UNSUPPORTED_RE = re.compile(r'Unsupported opcode: (?P<opcode>\w+?)(?=Unsupported|\[|\s|$)')
 
-OPCODES_RE = re.compile("^\[(?P<ss_or_cs>CS|SS)\] for function (?P<subname>\S+) transforming (?P<transformed>\d+) out of (?P<total>\d+) insns.$")
-INSNS_RE = re.compile("^\[(?P<ss_or_cs>CS|SS)\] for function (?P<subname>\S+) transformed (?P<transformed>\d+) out of (?P<total>\d+) mir opcodes.$")
+# how many torn record starts to hold on to, waiting for their rest
+MAX_PENDING_FRAGMENTS = 64
 
-# opcodes a list of 4-tuples: {SS, CS} * subname_str * transformed_int * total_int
-opcodes = []
 
-# insns a list of 4-tuples: {SS, CS} * subname_str * transformed_int * total_int
-insns = []
+def open_log(path):
+    ''' Open a possibly compressed log for streaming, as text. '''
+    openers = {'.gz': gzip.open, '.bz2': bz2.open, '.xz': lzma.open}
+    opener = openers.get(Path(path).suffix, open)
+    return opener(path, mode='rt', errors='replace')
 
-with log_file.open(mode='r') as lf:
-    for line in lf:
-        opcode_match = OPCODES_RE.match(line)
-        if opcode_match:
-            opcodes.append((opcode_match.group('ss_or_cs'),
-                            opcode_match.group('subname'),
-                            int(opcode_match.group('transformed')),
-                            int(opcode_match.group('total'))))
-            continue
-        
-        insn_match = INSNS_RE.match(line)
-        if insn_match:
-            insns.append((insn_match.group('ss_or_cs'),
-                          insn_match.group('subname'),
-                          int(insn_match.group('transformed')),
-                          int(insn_match.group('total'))))
+
+def find_logs(path, log_glob):
+    ''' A log file as is, or the files in a build dir matching log_glob. '''
+    path = Path(path)
+    if path.is_dir():
+        return sorted(log for log in path.rglob(log_glob) if log.is_file())
+    return [path]
+
+
+def compiled_file(line):
+    ''' Get the object (else source) file a compile command line compiles, or None. '''
+    silent = SILENT_COMPILE_RE.match(line)
+    if silent is not None:
+        return silent.group('file')
+    if ' -c' not in line or 'for function' in line:
+        return None
+    match = COMPILE_OUTPUT_RE.search(line) or COMPILE_SOURCE_RE.search(line)
+    return match.group('file') if match is not None else None
+
+
+def partial_record_start(text):
+    ''' Get where text ends in a record prefix cut short, like `[CS] for func`, or None. '''
+    for length in range(len(RECORD_PREFIXES[0]) - 1, MIN_PARTIAL_PREFIX - 1, -1):
+        if any(text.endswith(prefix[:length]) for prefix in RECORD_PREFIXES):
+            return len(text) - length
+    return None
+
+
+def match_records(text):
+    '''
+    Get the records in text as (kind, match) in order, and the text left
+    over once they're cut out.
+    '''
+    matches = [(OPCODES, m) for m in OPCODES_RE.finditer(text)] + \
+              [(INSNS, m) for m in INSNS_RE.finditer(text)]
+    matches.sort(key=lambda kind_match: kind_match[1].start())
+
+    rest = []
+    last_end = 0
+    for _, match in matches:
+        rest.append(text[last_end:match.start()])
+        last_end = match.end()
+    rest.append(text[last_end:])
+    return matches, ''.join(rest)
+
+
+def new_counts():
+    '''
+    Counts of one log: (kind, ss_or_cs, source, subname) -> [transformed, total],
+    unsupported opcode -> count, and the number of records and torn
+    record fragments that couldn't be put back together.
+    '''
+    return {'records': defaultdict(lambda: [0, 0]), 'unsupported': Counter(),
+            'num_records': 0, 'torn': 0}
+
+
+def add_record(counts, kind, match, source):
+    record = counts['records'][(kind, match.group('ss_or_cs'), source, match.group('subname'))]
+    record[0] += int(match.group('transformed'))
+    record[1] += int(match.group('total'))
+    counts['num_records'] += 1
+
+
+def parse_log(log):
+    ''' Get the new_counts() of one log file. '''
+    counts = new_counts()
+    # (start, source) of records whose rest was written after some other output
+    pending = deque(maxlen=MAX_PENDING_FRAGMENTS)
+    source = UNKNOWN_SOURCE
+    with open_log(log) as lf:
+        for line in lf:
+            line = line.rstrip('\n')
+            for match in UNSUPPORTED_RE.finditer(line):
+                counts['unsupported'][match.group('opcode')] += 1
+            if 'for function' not in line and not pending and partial_record_start(line) is None:
+                source = compiled_file(line) or source
+                continue
+
+            matches, rest = match_records(line)
+            for kind, match in matches:
+                add_record(counts, kind, match, source)
+
+            # try to finish a torn record with what's left of this line
+            rest = UNSUPPORTED_RE.sub('', rest)
+            start = RECORD_START_RE.search(rest)
+            torn_at = start.start() if start is not None else partial_record_start(rest)
+            head = rest if torn_at is None else rest[:torn_at]
+            finished = False
+            if head.strip() and pending:
+                for idx in reversed(range(len(pending))):
+                    fragment, fragment_source = pending[idx]
+                    joined, _ = match_records(fragment + head)
+                    if joined:
+                        for kind, match in joined:
+                            add_record(counts, kind, match, fragment_source)
+                        del pending[idx]
+                        finished = True
+                        break
+
+            # and hold on to a record start this line didn't finish, even
+            # one torn inside its `[CS] for function ` prefix
+            if torn_at is not None:
+                if len(pending) == pending.maxlen:
+                    counts['torn'] += 1
+                pending.append((rest[torn_at:], source))
+            elif not matches and not finished:
+                source = compiled_file(line) or source
+    counts['torn'] += len(pending)
+    counts['records'] = dict(counts['records'])
+    return counts
+
+
+def merge_counts(into, counts):
+    for key, (transformed, total) in counts['records'].items():
+        into['records'][key][0] += transformed
+        into['records'][key][1] += total
+    into['unsupported'].update(counts['unsupported'])
+    into['num_records'] += counts['num_records']
+    into['torn'] += counts['torn']
+
+
+def totals(counts, kind):
+    ''' Get ss_or_cs -> (transformed, total) of one kind, and 'Total'. '''
+    sums = {'Total': [0, 0], CS: [0, 0], SS: [0, 0]}
+    for (record_kind, ss_or_cs, _, _), (transformed, total) in counts['records'].items():
+        if record_kind != kind:
             continue
+        for key in ('Total', ss_or_cs):
+            sums[key][0] += transformed
+            sums[key][1] += total
+    return sums
+
+
+def gen_totals_string(counts):
+    lines = []
+    for kind in (OPCODES, INSNS):
+        sums = totals(counts, kind)
+        for key in ('Total', CS, SS):
+            lines.append(f"{key}: transformed {sums[key][0]} out of {sums[key][1]} {kind}")
+    return '\n'.join(lines)
+
+
+def gen_function_string(counts, top):
+    ''' Per (function, object file) table, most insns transformed first. '''
+    functions = defaultdict(dict)
+    for (kind, ss_or_cs, source, subname), record in counts['records'].items():
+        functions[(subname, source)][(kind, ss_or_cs)] = record
+
+    def cell(fn_counts, kind, ss_or_cs):
+        transformed, total = fn_counts.get((kind, ss_or_cs), (0, 0))
+        return f"{transformed}/{total}"
+
+    ranked = sorted(functions.items(),
+                    key=lambda item: (-sum(item[1].get((INSNS, key), (0, 0))[0] for key in (CS, SS)), item[0]))
+    if top is not None:
+        ranked = ranked[:top]
+
+    lines = [f"{'function':<48} {'CS opcodes':>12} {'CS insns':>12} {'SS opcodes':>12} {'SS insns':>12}  object"]
+    for (subname, source), fn_counts in ranked:
+        lines.append(f"{subname:<48} {cell(fn_counts, OPCODES, CS):>12} {cell(fn_counts, INSNS, CS):>12} "
+                     f"{cell(fn_counts, OPCODES, SS):>12} {cell(fn_counts, INSNS, SS):>12}  {source}")
+    return '\n'.join(lines)
+
+
+def gen_unsupported_string(counts, top):
+    lines = [f"{'unsupported opcode':<24} {'count':>8}"]
+    for opcode, count in counts['unsupported'].most_common(top):
+        lines.append(f"{opcode:<24} {count:>8}")
+    return '\n'.join(lines)
+
+
+def main():
+    argparser = argparse.ArgumentParser(usage=usage_msg)
+    argparser.add_argument('logs_or_build_dirs', nargs='+')
+    argparser.add_argument('--log-glob', default=DEFAULT_LOG_GLOB,
+                           help='logs to read in a build dir')
+    argparser.add_argument('--records', action='store_true',
+                           help='also print every (CS/SS, object, function, transformed, total) record')
+    argparser.add_argument('--top', type=int, default=None,
+                           help='only print the top N functions and unsupported opcodes')
+    argparser.add_argument('-j', '--jobs', type=int, default=1,
+                           help='parse this many logs at once')
+    args = argparser.parse_args()
+
+    sources = []
+    for path in args.logs_or_build_dirs:
+        if not Path(path).exists():
+            print(f"error: log file or build dir {path} doesn't exist")
+            sys.exit(1)
+        logs = find_logs(path, args.log_glob)
+        if not logs:
+            print(f"error: no logs matching {args.log_glob} in {path}")
+            sys.exit(1)
+        sources.append((path, logs))
+
+    all_logs = [log for _, logs in sources for log in logs]
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        log_counts = dict(zip(all_logs, pool.map(parse_log, all_logs)))
+
+    overall = new_counts()
+    source_counts = []
+    for path, logs in sources:
+        counts = new_counts()
+        for log in logs:
+            merge_counts(counts, log_counts[log])
+        merge_counts(overall, counts)
+        source_counts.append((path, counts))
+
+    if args.records:
+        for (kind, ss_or_cs, source, subname), (transformed, total) in sorted(overall['records'].items()):
+            label = 'Opcode' if kind == OPCODES else 'Insn'
+            print(f"{label}: {(ss_or_cs, source, subname, transformed, total)}")
+        print()
+
+    print(gen_function_string(overall, args.top))
+    print()
+    print(gen_unsupported_string(overall, args.top))
+    print()
+
+    if len(source_counts) > 1:
+        for path, counts in source_counts:
+            print(f"== {path}")
+            print(gen_totals_string(counts))
+        print("== all")
+    print(gen_totals_string(overall))
+
+    print(f"{overall['num_records']} records from {len(all_logs)} logs")
+    if overall['torn']:
+        print(f"warning: {overall['torn']} records torn by interleaved output couldn't be put back "
+              "together, the counts are missing them")
+
 
-# print all records:
-
-for opc in sorted(opcodes):
-    print(f"Opcode: {opc}")
-
-for insn in sorted(insns):
-    print(f"Insn: {insn}")
-
-# now compute aggregate stats over the data
-
-total_opcodes_transformed = 0
-total_opcodes_considered = 0
-cs_opcodes_transformed = 0
-cs_opcodes_considered = 0
-ss_opcodes_transformed = 0
-ss_opcodes_considered = 0
-
-total_insns_transformed = 0
-total_insns_considered = 0
-cs_insns_transformed = 0
-cs_insns_considered = 0
-ss_insns_transformed = 0
-ss_insns_considered = 0
-
-for ss_or_cs, subname, transformed, total in opcodes:
-    if 'SS' == ss_or_cs:
-        ss_opcodes_considered += total
-        ss_opcodes_transformed += transformed
-    elif 'CS' == ss_or_cs:
-        cs_opcodes_considered += total
-        cs_opcodes_transformed += transformed
-    total_opcodes_considered += total
-    total_opcodes_transformed += transformed
-
-for ss_or_cs, subname, transformed, total in insns:
-    if 'SS' == ss_or_cs:
-        ss_insns_considered += total
-        ss_insns_transformed += transformed
-    elif 'CS' == ss_or_cs:
-        cs_insns_considered += total
-        cs_insns_transformed += transformed
-    total_insns_considered += total
-    total_insns_transformed += transformed
-
-print("Total: transformed {} out of {} opcodes".format(total_opcodes_transformed,
-                                                       total_opcodes_considered))
-print("CS: transformed {} out of {} opcodes".format(cs_opcodes_transformed,
-                                                    cs_opcodes_considered))
-print("SS: transformed {} out of {} opcodes".format(ss_opcodes_transformed,
-                                                    ss_opcodes_considered))
-
-print("Total: transformed {} out of {} insns".format(total_insns_transformed,
-                                                     total_insns_considered))
-print("CS: transformed {} out of {} insns".format(cs_insns_transformed,
-                                                  cs_insns_considered))
-print("SS: transformed {} out of {} insns".format(ss_insns_transformed,
-                                                  ss_insns_considered))
+if __name__ == "__main__":
+    main()
@@ -13,60 +13,29 @@ if [[ ! -e "$CC" ]]; then
 fi
 
 # Generate the obj file containing all implementations (orig insns + transforms)
-# and each fuzzer file
+# and each fuzzer file, then build the fuzzers on all cores. fuzzers whose
+# inputs didn't change since the last build are reused from ./.harness_cache
 
 FUZZ_HARNESSES_DIR=./fuzz_harnesses
-TEST_O=./test.o
 
-test "-d $FUZZ_HARNESSES_DIR" && rm -r "$FUZZ_HARNESSES_DIR"
-mkdir "$FUZZ_HARNESSES_DIR"
-
-python3 llvm-test-compsimp-transforms.py "$FUZZ_HARNESSES_DIR" $1 $2 $3 $4
-
-GENERATION_RET_STATUS=$?
-
-if [[ ! -e "$TEST_O" || "$GENERATION_RET_STATUS" -ne 0 ]]; then
-    echo "error running llvm-test-compsimp-transforms.py exiting."
-    exit 2
+if [[ -n $MEASURE_CYCLE_ARG ]]; then
+    OUR_MAIN_ARG="--our-main"
+else
+    OUR_MAIN_ARG=""
 fi
 
-HARNESS_C_FILES=$(ls $FUZZ_HARNESSES_DIR/*.c)
-declare -a FUZZERS
-
-for harness_file in $HARNESS_C_FILES; do
-    obj_file=${harness_file/%.c/.o}
-    final_file=${harness_file/%.c/}
-    echo "Building $final_file..."
-
-    if [[ -n $MEASURE_CYCLE_ARG ]]; then
-	clang -v -DOUR_MAIN -g -O0 -Wall -c $harness_file -o $obj_file
-    else
-	clang -v -g -O0 -Wall -fsanitize=fuzzer-no-link -c $harness_file -o $obj_file
-    fi
-    
+python3 build_harnesses.py "$FUZZ_HARNESSES_DIR" $OUR_MAIN_ARG $1 $2 $3 $4
 
-    COMPILE_STATUS=$?
+BUILD_RET_STATUS=$?
 
-    if [[ "$COMPILE_STATUS" -ne 0 ]]; then
-	echo "error compiling harness file $harness_file with exit status: $COMPILE_STATUS"
-	exit "$COMPILE_STATUS"
-    fi
-
-    if [[ -n $MEASURE_CYCLE_ARG ]]; then
-	clang -v -g -O0 -Wall $TEST_O $obj_file -o $final_file
-    else
-	clang -v -g -O0 -Wall -fsanitize=fuzzer $TEST_O $obj_file -o $final_file
-    fi
-
-    LINK_STATUS=$?
-
-    if [[ "$LINK_STATUS" -ne 0 ]]; then
-	echo "error linking harness file $obj_file with exit status: $LINK_STATUS"
-	exit "$LINK_STATUS"
-    fi
+if [[ "$BUILD_RET_STATUS" -ne 0 ]]; then
+    echo "error generating or building fuzz harnesses, exiting."
+    exit "$BUILD_RET_STATUS"
+fi
 
-    FUZZERS=("${FUZZERS[@]}" "$final_file")
-done
+# with --single-harness, these are symlinks named like the per opcode
+# harnesses to the one harness that tests every opcode
+mapfile -t FUZZERS < "$FUZZ_HARNESSES_DIR/harnesses.txt"
 
 echo "fuzzers are: ${FUZZERS[@]}"
 
@@ -96,20 +65,54 @@ else
     MEASURE_CYCLE_ARG=""
 fi
 
-if [[ $NUM_FUZZ_JOBS -eq 1 ]]; then
+# with CYCLE_COUNTS_BINARY set, each harness writes its cycle counts to
+# <harness>.cycles.bin as raw uint64 pairs instead of csv rows in its log
+if [[ -v CYCLE_COUNTS_BINARY ]]; then
+    CYCLE_COUNTS_FILE_ARG="-cycle_counts_file="
+else
+    CYCLE_COUNTS_FILE_ARG=""
+fi
+
+# libFuzzer harnesses seed from, and keep their crashing inputs in, a
+# corpus store that survives rebuilds of $FUZZ_HARNESSES_DIR
+if [[ ! -v CORPUS_STORE_DIR ]]; then
+    CORPUS_STORE_DIR=./fuzz_corpus
+fi
+
+if [[ -z $OUR_MAIN_ARG ]]; then
+    python3 corpus_store.py prepare "$FUZZ_HARNESSES_DIR/harnesses.txt" --store="$CORPUS_STORE_DIR" --work-dir="$FUZZ_HARNESSES_DIR/corpora"
+    CORPUS_ARGS_CMD="python3 corpus_store.py args --store=$CORPUS_STORE_DIR --work-dir=$FUZZ_HARNESSES_DIR/corpora"
+    CORPUS_STORE_ARG="--corpus-store=$CORPUS_STORE_DIR"
+else
+    # prints nothing
+    CORPUS_ARGS_CMD="true"
+    CORPUS_STORE_ARG=""
+fi
+
+if [[ -v FUZZ_BUDGET_RUNS || -v FUZZ_BUDGET_SECONDS ]]; then
+    # split one budget over all fuzzers by how often their opcodes are seen
+    # and alerted on, and stop fuzzing those whose coverage stops growing
+    if [[ -v FUZZ_BUDGET_RUNS ]]; then
+	BUDGET_ARG="--runs=$FUZZ_BUDGET_RUNS"
+    else
+	BUDGET_ARG="--seconds=$FUZZ_BUDGET_SECONDS"
+    fi
+
+    python3 schedule_fuzzing.py "$FUZZ_HARNESSES_DIR/harnesses.txt" $BUDGET_ARG --jobs=$NUM_FUZZ_JOBS --max-len=$MAX_SEED_LEN ${MEASURE_CYCLE_ARG:+--measure-cycles} ${CYCLE_COUNTS_FILE_ARG:+--cycle-counts-binary} --report-csv="$FUZZ_HARNESSES_DIR/fuzz-schedule.csv" $CORPUS_STORE_ARG
+elif [[ $NUM_FUZZ_JOBS -eq 1 ]]; then
     # do in serial
     for fuzzer in "${FUZZERS[@]}"; do
 	echo "running fuzzer $fuzzer"
 
-	$fuzzer -close_fd_mask=0 $MEASURE_CYCLE_ARG -runs=$NUM_FUZZ_RUNS -max_len=$MAX_SEED_LEN -len_control=0 -timeout=10 &> $fuzzer.log
+	$fuzzer -close_fd_mask=0 $MEASURE_CYCLE_ARG ${CYCLE_COUNTS_FILE_ARG:+$CYCLE_COUNTS_FILE_ARG$fuzzer.cycles.bin} -runs=$NUM_FUZZ_RUNS -max_len=$MAX_SEED_LEN -len_control=0 -timeout=10 $($CORPUS_ARGS_CMD $fuzzer) &> $fuzzer.log
 
 	if [[ $? -ne 0 ]]; then
 	    echo "fuzzer $fuzzer returned non-zero exit status, see $fuzzer.log"
 	fi
     done
 else
-    # do in parallel
-    echo "${FUZZERS[@]}" | xargs -I {} --max-procs=$NUM_FUZZ_JOBS bash -c "echo running fuzzer {} && ({} -close_fd_mask=0 -runs=$NUM_FUZZ_RUNS -max_len=$MAX_SEED_LEN -len_control=0 -timeout=10 &> {}.log || echo fuzzer {} returned non-zero exit status, see {}.log)"
+    # do in parallel, one fuzzer per line for xargs -I
+    printf '%s\n' "${FUZZERS[@]}" | xargs -I {} --max-procs=$NUM_FUZZ_JOBS bash -c "echo running fuzzer {} && ({} -close_fd_mask=0 $MEASURE_CYCLE_ARG ${CYCLE_COUNTS_FILE_ARG:+$CYCLE_COUNTS_FILE_ARG{}.cycles.bin} -runs=$NUM_FUZZ_RUNS -max_len=$MAX_SEED_LEN -len_control=0 -timeout=10 \$($CORPUS_ARGS_CMD {}) &> {}.log || echo fuzzer {} returned non-zero exit status, see {}.log)"
 fi
 
 echo "Done running fuzzers"
@@ -122,5 +125,11 @@ for logfile in $MISMATCHES; do
     echo "Mismatch in original,transformed output states in logfile: $logfile"
 done
 
-echo "cleaning up ./crash-* files. check $FUZZ_HARNESSES_DIR/*.log files for more detailed info"
-rm crash-*
+if [[ -z $OUR_MAIN_ARG ]]; then
+    # minimize each store corpus together with the inputs this run found
+    python3 corpus_store.py merge "$FUZZ_HARNESSES_DIR/harnesses.txt" --store="$CORPUS_STORE_DIR" --work-dir="$FUZZ_HARNESSES_DIR/corpora" --jobs=$NUM_FUZZ_JOBS --max-len=$MAX_SEED_LEN
+    echo "crashing and mismatching inputs are kept in $CORPUS_STORE_DIR/*/regressions. check $FUZZ_HARNESSES_DIR/*.log files for more detailed info"
+else
+    echo "cleaning up ./crash-* files. check $FUZZ_HARNESSES_DIR/*.log files for more detailed info"
+    rm crash-*
+fi
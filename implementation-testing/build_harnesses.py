@@ -0,0 +1,194 @@
+import argparse
+import hashlib
+import logging
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import elf_reader
+
+logging.basicConfig(level=logging.INFO)
+
+usage_msg = """
+generate the fuzz harnesses with ./llvm-test-compsimp-transforms.py and build
+them on all cores, reusing harnesses whose inputs are unchanged from a cache.
+
+  python3 build_harnesses.py FUZZ_HARNESSES_DIR [--our-main] [-j JOBS] [generator args, e.g. --single-harness]
+
+a harness object is cached by the hash of its generated source,
+./opcode_trampoline.h, the compiler and the compile flags. a harness binary
+is cached by the hash of its object, the linker flags, and the bytes and
+relocations of the original and transformed functions it calls in test.o,
+so changing one transform only relinks the harnesses testing it. delete the
+cache dir to force a full rebuild.
+"""
+
+GENERATOR = "llvm-test-compsimp-transforms.py"
+TEST_O = "test.o"
+HEADERS = ["opcode_trampoline.h", "outstate.h"]
+
+# the names of the harnesses to run, one per line, for ./build_and_run_tests.sh
+HARNESS_LIST_FILENAME = "harnesses.txt"
+
+# test functions a harness calls, see test_fn_prototype in ./llvm-test-compsimp-transforms.py
+TEST_FN_PROTOTYPE_RE = re.compile(r"^void (x86\w+)\(struct OutState\* outstate,", re.MULTILINE)
+
+COMPILE_FLAGS = ["-g", "-O0", "-Wall", "-I."]
+FUZZER_COMPILE_FLAGS = ["-fsanitize=fuzzer-no-link"]
+FUZZER_LINK_FLAGS = ["-fsanitize=fuzzer"]
+OUR_MAIN_COMPILE_FLAGS = ["-DOUR_MAIN"]
+
+# other args are passed on to the generator
+argparser = argparse.ArgumentParser(usage=usage_msg, allow_abbrev=False)
+argparser.add_argument('test_dir')
+argparser.add_argument('--our-main',
+                       action='store_true',
+                       help="build with the harness's own main instead of linking libFuzzer")
+argparser.add_argument('--cc',
+                       action='store',
+                       default='clang',
+                       type=str)
+argparser.add_argument('--cache-dir',
+                       action='store',
+                       default='.harness_cache',
+                       type=str)
+argparser.add_argument('-j', '--jobs',
+                       action='store',
+                       default=os.cpu_count(),
+                       type=int)
+
+def hash_parts(*parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else str(part).encode())
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+def compiler_identity(cc):
+    """
+    the resolved path and version of the compiler, so a rebuilt or switched
+    compiler doesn't reuse cached harnesses
+    """
+    cc_path = shutil.which(cc)
+    if cc_path is None:
+        logging.critical(f"couldn't find compiler {cc}")
+        sys.exit(1)
+    version = subprocess.run([cc_path, "--version"], check=True, text=True,
+                             stdout=subprocess.PIPE).stdout
+    return os.path.realpath(cc_path), version
+
+def run_generator(generator_args):
+    """
+    run the generator into a fresh dir, returns the dir. it also (re)writes
+    ./test.o
+    """
+    generated_dir = Path(tempfile.mkdtemp(prefix="generated-harnesses-", dir="."))
+    gen_process = subprocess.run([sys.executable, GENERATOR, str(generated_dir)] + generator_args)
+    if gen_process.returncode != 0 or not Path(TEST_O).exists():
+        shutil.rmtree(generated_dir)
+        logging.critical(f"error running {GENERATOR}, exiting.")
+        sys.exit(2)
+    return generated_dir
+
+def build_harness(source, test_fn_contents, compile_cmd, link_cmd, compiler, cache_dir):
+    """
+    get the binary for one generated harness source from the cache, or
+    compile and/or link it into the cache. returns (cached binary path, what
+    was done: 'cached', 'linked' or 'built')
+    """
+    source_contents = source.read_bytes()
+    header_contents = [Path(header).read_bytes() for header in HEADERS if Path(header).exists()]
+    obj_key = hash_parts(source_contents, *header_contents, *compiler, *compile_cmd)
+
+    test_fns = TEST_FN_PROTOTYPE_RE.findall(source_contents.decode())
+    missing = [test_fn for test_fn in test_fns if test_fn not in test_fn_contents]
+    if missing:
+        raise RuntimeError(f"{source.name} calls functions missing from {TEST_O}: {', '.join(missing)}")
+    bin_key = hash_parts(obj_key, *link_cmd, *[test_fn_contents[test_fn] for test_fn in sorted(test_fns)])
+
+    cached_obj = cache_dir / f"{obj_key}.o"
+    cached_bin = cache_dir / f"{bin_key}.bin"
+    if cached_bin.exists():
+        return cached_bin, 'cached'
+
+    action = 'linked'
+    if not cached_obj.exists():
+        action = 'built'
+        # write to a temporary name first so an interrupted build never leaves
+        # a truncated artifact under a valid key
+        tmp_obj = cached_obj.with_suffix(f".{os.getpid()}-{threading.get_ident()}.tmp.o")
+        subprocess.run(compile_cmd + ["-c", str(source), "-o", str(tmp_obj)],
+                       check=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        tmp_obj.replace(cached_obj)
+
+    tmp_bin = cached_bin.with_suffix(f".{os.getpid()}-{threading.get_ident()}.tmp")
+    subprocess.run(link_cmd + [TEST_O, str(cached_obj), "-o", str(tmp_bin)],
+                   check=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    tmp_bin.replace(cached_bin)
+    return cached_bin, action
+
+if __name__ == '__main__':
+    args, generator_args = argparser.parse_known_args()
+
+    test_dir = Path(args.test_dir)
+    cache_dir = Path(args.cache_dir)
+    cache_dir.mkdir(exist_ok=True)
+
+    compiler = compiler_identity(args.cc)
+    compile_cmd = [args.cc] + COMPILE_FLAGS + (OUR_MAIN_COMPILE_FLAGS if args.our_main else FUZZER_COMPILE_FLAGS)
+    link_cmd = [args.cc] + COMPILE_FLAGS + ([] if args.our_main else FUZZER_LINK_FLAGS)
+
+    generated_dir = run_generator(generator_args)
+    try:
+        test_fn_contents = elf_reader.function_contents(Path(TEST_O).read_bytes())
+        sources = sorted(generated_dir.glob("*.c"))
+
+        results = dict()
+        with ThreadPoolExecutor(max_workers=args.jobs) as pool:
+            futures = dict({
+                source: pool.submit(build_harness, source, test_fn_contents,
+                                    compile_cmd, link_cmd, compiler, cache_dir)
+                for source in sources
+            })
+            for source, future in futures.items():
+                try:
+                    results[source] = future.result()
+                except subprocess.CalledProcessError as err:
+                    logging.critical(f"error building harness file {source.name} with exit status "
+                                     f"{err.returncode}:\n{err.stdout.decode(errors='replace')}")
+                    sys.exit(err.returncode)
+                except RuntimeError as err:
+                    logging.critical(str(err))
+                    sys.exit(1)
+
+        # replace the harness dir with this generation's sources and binaries,
+        # like a from scratch build would
+        if test_dir.exists():
+            shutil.rmtree(test_dir)
+        test_dir.mkdir()
+        for source, (cached_bin, _) in results.items():
+            shutil.copy2(source, test_dir / source.name)
+            shutil.copy2(cached_bin, test_dir / source.stem)
+
+        # --single-harness symlinks each per opcode harness name to the one binary
+        links = sorted(path for path in generated_dir.iterdir() if path.is_symlink())
+        for link in links:
+            (test_dir / link.name).symlink_to(os.readlink(link))
+    finally:
+        shutil.rmtree(generated_dir)
+
+    harnesses = [test_dir / link.name for link in links] if links else \
+        [test_dir / source.stem for source in results]
+    with open(test_dir / HARNESS_LIST_FILENAME, 'w') as harness_list:
+        harness_list.writelines(f"{harness}\n" for harness in harnesses)
+
+    actions = [action for _, action in results.values()]
+    logging.info(f"{len(results)} harnesses: {actions.count('built')} built, "
+                 f"{actions.count('linked')} relinked, {actions.count('cached')} from cache")
@@ -1,126 +1,197 @@
 import os
 import argparse
+import difflib
+import json
 import re
+import subprocess
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import disasm_index
+import fuzz_targets
+import opcode_db
 
 BIN_DIR='fuzz_harnesses'
-DUMP_FILE='temp_dump'
-BIN_TRANS_FILE='temp_binary_transform'
-VER_TRANS_FILE='temp_verified_transform'
 VERIFICATION_DIR='../checker/synth'
+VERIFICATION_FILES = [ 'arith-transforms.rkt'
+                     , 'shift-transforms.rkt'
+                     , 'bitwise-transforms.rkt'
+                     , 'mul-transforms.rkt'
+                     ]
 
-def get_binary_dump(args):
-    # if binary dir is empty, try to build and run tests
-    if len(os.listdir(BIN_DIR)) == 0:
-        print(f'\nBinary directory {BIN_DIR} is empty. Attempting to build and run tests...')
-        os.system('./build_and_run_tests.sh')
-        print('\nTests finished successfully. Proceeding\n')
-    
-    # all binaries contain all insn funcs, so we only need to objdump once
-    filepath = os.path.join(BIN_DIR, f'cs-{args.insns[0]}-implementation-tester')
-    if not os.path.exists(filepath):
-        print(f'Could not find binary file {filepath}.\n'
-               'Did you enter the instruction name correctly?\n')
-        exit(-1)
+# the test functions wrap the transform in setup and output state saving code
+PREFIX_LINES = 7
+SUFFIX_LINES = 30
+PADDING_NOP = 'cs nopw 0x0(%rax,%rax,1)'
 
-    # extract dump
-    os.system(f'objdump {filepath} -d --no-addresses --no-show-raw-insn -M suffix > {DUMP_FILE}')
-    dump_file = open(DUMP_FILE)
-    dump = list(map(lambda s: s.strip(), dump_file.readlines()))
-    dump_file.close()
-    os.system(f'rm -f {DUMP_FILE}')
+SIDE_BY_SIDE_WIDTH = 60
 
-    return dump
 
+def get_binary(args):
+    # if binary dir is empty, try to build and run tests
+    if not os.path.isdir(BIN_DIR) or len(os.listdir(BIN_DIR)) == 0:
+        print(f'\nBinary directory {BIN_DIR} is empty. Attempting to build and run tests...')
+        subprocess.run(['./build_and_run_tests.sh'], check=True)
+        print('\nTests finished successfully. Proceeding\n')
 
-def get_verified_transforms():
-    verification_files = [ 'arith-transforms.rkt'
-                         , 'shift-transforms.rkt'
-                         , 'bitwise-transforms.rkt'
-                         , 'mul-transforms.rkt'
-                         ]
-    verification_lines = []
-
-    for filename in verification_files:
-        path = os.path.join(VERIFICATION_DIR, filename)
-        file = open(path)
-        verification_lines.extend(file.readlines())
-        file.close()
-
-    return verification_lines
+    if args.binary is not None:
+        return args.binary
+
+    # all binaries contain all insn funcs, so we only need to disassemble one
+    harness_list = os.path.join(BIN_DIR, 'harnesses.txt')
+    if os.path.exists(harness_list):
+        harnesses = fuzz_targets.read_harness_list(harness_list)
+        if harnesses:
+            return str(harnesses[0])
+    return os.path.join(BIN_DIR, f'cs-{args.insns[0]}-implementation-tester')
+
+
+def transformed_symbol(db, insn):
+    symbols = opcode_db.test_function_symbols(db, insn, opcode_db.CS)
+    if symbols is None:
+        # not indexed yet, this is what the test inserter names it
+        return f'x86compsimptest_{insn}_transformed'
+    return symbols[1]
+
+
+def reference_insn_name(db, insn):
+    # e.g. ADD64rr -> add64, the name of its verified transforms
+    opcode = opcode_db.load_opcode(db, insn)
+    if opcode is None:
+        return re.match('[A-Z]+[0-9]*', insn).group(0).lower()
+    return f'{opcode.opcode}{opcode.bitwidth or ""}'.lower()
+
+
+def binary_transform(function_insns):
+    # drop the test function's own prefix and suffix lines
+    suffix_lines = SUFFIX_LINES + (1 if PADDING_NOP in function_insns else 0)
+    return function_insns[PREFIX_LINES:len(function_insns) - suffix_lines]
+
+
+def side_by_side(left, right):
+    """ like diff -y """
+    lines = []
+    matcher = difflib.SequenceMatcher(a=left, b=right, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        for ii in range(max(i2 - i1, j2 - j1)):
+            a = left[i1 + ii] if i1 + ii < i2 else ''
+            b = right[j1 + ii] if j1 + ii < j2 else ''
+            marker = ' ' if tag == 'equal' else '|' if a and b else '<' if a else '>'
+            lines.append(f'{a:<{SIDE_BY_SIDE_WIDTH}} {marker} {b}')
+    return lines
+
+
+def compare_insn(insn, symbol, ref_insn, function_insns, candidates):
+    """
+    compare one opcode's transform in the binary with each of its verified
+    transforms. runs in a worker process, returns a json-able result
+    """
+    result = {'opcode': insn, 'symbol': symbol, 'reference': ref_insn,
+              'binary': None, 'candidates': [], 'status': None}
+    if function_insns is None:
+        result['status'] = 'no-transform'
+        return result
+
+    binary = binary_transform(function_insns)
+    result['binary'] = binary
+    binary_tokens = [disasm_index.insn_tokens(line) for line in binary]
+    binary_tokens = [tokens for tokens in binary_tokens if tokens]
+
+    for name, title, body in candidates:
+        verified_tokens = [tokens for tokens in map(disasm_index.insn_tokens, body) if tokens]
+        result['candidates'].append({
+            'name': name,
+            'title': title,
+            'verified': body,
+            'matches': verified_tokens == binary_tokens,
+            'diff': side_by_side(binary, body),
+        })
+
+    if not candidates:
+        result['status'] = 'no-verified'
+    elif any(candidate['matches'] for candidate in result['candidates']):
+        result['status'] = 'match'
+    else:
+        result['status'] = 'mismatch'
+    return result
+
+
+def print_result(result):
+    print(f"Checking {result['opcode']}...")
+    if result['status'] == 'no-transform':
+        print(f"Could not find transform for {result['opcode']}. Skipping\n")
+        return
+    if result['status'] == 'no-verified':
+        print(f"Could not find matching verified transform for {result['reference']}. Skipping\n")
+        return
+
+    print(f"Found {len(result['candidates'])} possible verified transforms. Emitting diffs...\n")
+    for candidate in result['candidates']:
+        print(f"Diff for verified transform: {candidate['title']}"
+              f"{' (matches)' if candidate['matches'] else ''}")
+        print('\n'.join(candidate['diff']))
+        print('')
 
 
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument('insns', nargs='+',
+    parser.add_argument('insns', nargs='*',
                         help='name(s) of the opcode(s) to test. Must exactly '
                              'match the names used in LLVM.')
+    parser.add_argument('--all', action='store_true',
+                        help='check every comp simp tested opcode in the opcode db')
+    parser.add_argument('--db', default=opcode_db.DEFAULT_DB,
+                        help='opcode index to look up test function symbols '
+                             'and mnemonics in, see ./opcode_db.py')
+    parser.add_argument('--binary',
+                        help='harness binary to disassemble, default: the first built one')
+    parser.add_argument('--verification-dir', default=VERIFICATION_DIR)
+    parser.add_argument('--cache-dir', default=disasm_index.DEFAULT_CACHE_DIR)
+    parser.add_argument('--json',
+                        help='also write the results to this json file')
+    parser.add_argument('-q', '--quiet', action='store_true',
+                        help='only print a summary line per opcode')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count())
     args = parser.parse_args()
 
-    dump = get_binary_dump(args)
-    verified = ''.join(get_verified_transforms())
-
-    for insn in args.insns:
-        os.system(f'echo "Checking {insn}..."')
-
-        # extract transformed function from binary dump
-        trans = f'<x86compsimptest_{insn}_transformed>:'
-        if trans not in dump:
-            print(f'Could not find transform for {insn}. Skipping\n')
-            continue
-
-        bin_start = dump.index(trans) + 7 # add prefix lines
-        bin_end = dump.index('', bin_start)
-        if 'cs nopw 0x0(%rax,%rax,1)' in dump[bin_start:bin_end]:
-            bin_end -= 31 # subtract suffix lines
+    db = opcode_db.connect(args.db)
+    insns = list(args.insns)
+    if args.all:
+        insns += sorted(opcode_db.tested_opcodes(db, opcode_db.CS) - set(insns))
+    if not insns:
+        parser.error('give opcodes to check, or --all')
+    args.insns = insns
+
+    binary = get_binary(args)
+    if not os.path.exists(binary):
+        print(f'Could not find binary file {binary}.\n'
+              'Did you enter the instruction name correctly?\n')
+        sys.exit(-1)
+
+    functions = disasm_index.disassembly_index(binary, args.cache_dir)
+    verified = disasm_index.verified_transforms_index(
+        os.path.join(args.verification_dir, filename) for filename in VERIFICATION_FILES)
+
+    work = []
+    for insn in insns:
+        symbol = transformed_symbol(db, insn)
+        ref_insn = reference_insn_name(db, insn)
+        candidates = [transform for transform in verified if transform[0].startswith(f'attempt-{ref_insn}')]
+        work.append((insn, symbol, ref_insn, functions.get(symbol), candidates))
+
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        results = list(pool.map(compare_insn, *zip(*work), chunksize=max(1, len(work) // (4 * args.jobs))))
+
+    for result in results:
+        if args.quiet:
+            print(f"{result['opcode']}: {result['status']}")
         else:
-            bin_end -= 30 # subtract suffix lines
-
-        # dump binary transform
-        bin_trans = '\n'.join(dump[bin_start:bin_end])
-        os.system(f'echo "{bin_trans}" > {BIN_TRANS_FILE}')
+            print_result(result)
 
-        # extract all possible verified transforms
-        ref_insn = re.match('[A-Z]+[0-9]*', insn).group(0).lower()
-        ref = f'(define attempt-{ref_insn}'
-        num_ref_transforms = verified.count(ref)
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
 
-        if num_ref_transforms == 0:
-            print(f'Could not find matching verified transform for {ref_insn}. Skipping\n')
-            continue
-        else:
-            os.system(f'echo "Found {num_ref_transforms} possible verified transforms. Emitting diffs...\n"')
-
-        # check each verified transform option
-        ver_start = 0
-        count = 0
-        while ref in verified[ver_start:]:
-            ver_start = verified.index(ref, ver_start)
-            ver_title = verified[verified.index('attempt', ver_start):verified.index('\n', ver_start)]
-
-            ver_start = verified.index('(list', ver_start) + len('(list\n')
-            ver_end = len(verified)
-            if '(define' in verified[ver_start + 1:]:
-                ver_end = verified.index('(define', ver_start + 1)
-            
-            # dump verified transform
-            ver_trans = verified[ver_start:ver_end]
-            os.system(f'echo "{ver_trans}" > {VER_TRANS_FILE}')
-
-            # emit diff
-            os.system(f'echo "Diff for verified transform: {ver_title}"')
-            os.system(f'diff -y {BIN_TRANS_FILE} {VER_TRANS_FILE}')
-            os.system('echo ""')
-
-            count += 1
-            if count >= num_ref_transforms:
-                break
-        # end while
-    # end for
-
-    # clean up
-    os.system(f'rm -f {BIN_TRANS_FILE}')
-    os.system(f'rm -f {VER_TRANS_FILE}')
-    
 
 if __name__ == "__main__":
     main()
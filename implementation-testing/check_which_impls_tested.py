@@ -1,71 +1,60 @@
-import csv
-import sys
+import argparse
 import logging
+import sys
 from pathlib import Path
 
+import opcode_db
+
 logging.basicConfig(level=logging.INFO)
 
-if __name__ == '__main__':
+usage_msg = """
+list the opcodes the checker alerts on that have no test functions in test.o
+(as generated by ./llvm-test-compsimp-transforms.py), and the comp simp
+opcodes that are tested but never alerted on.
 
-    # typically ./libna.ref.alerts.csv
-    alerts_csv = Path(sys.argv[1])
+  python3 check_which_impls_tested.py [./libna.ref.alerts.csv ...] [--test-obj ./test.o] [--db opcodes.sqlite3]
 
-    # typically ~/llvm-project/llvm/lib/Transforms/Scalar/InsertCompSimpTestFunctions.cpp 
-    llvm_test_inserter_file = Path(sys.argv[2])
+the alerts csvs and test.o are indexed into the opcode db first, see
+./opcode_db.py
+"""
 
-    ### Determine which flagged insns are not, at least, having a function generated in
-    ### ./test.o generated by llvm-test-compsimp-transforms.py
-    ss_mir_opcodes = set()
-    cs_mir_opcodes = set()
+argparser = argparse.ArgumentParser(usage=usage_msg)
+argparser.add_argument('alerts_csvs', nargs='*', default=[opcode_db.DEFAULT_ALERTS])
+argparser.add_argument('--test-obj', default='test.o')
+argparser.add_argument('--db', default=opcode_db.DEFAULT_DB)
 
-    with alerts_csv.open(mode="r") as csv_file:
-        csv_reader = csv.DictReader(csv_file)
+if __name__ == '__main__':
+    args = argparser.parse_args()
 
-        for row in csv_reader:
-            mir_opc = row['mir_opcode']
-            optimization = row['alert_reason']
-            
-            logging.debug(f"[{optimization}] mir_opcode is: {mir_opc}")
+    if not Path(args.test_obj).exists():
+        logging.critical(f"{args.test_obj} doesn't exist, run ./llvm-test-compsimp-transforms.py first")
+        sys.exit(1)
 
-            which_opcode_set = ss_mir_opcodes if optimization == "silent-stores" else cs_mir_opcodes
-            which_opcode_set.add(mir_opc)
+    db = opcode_db.connect(args.db)
+    with db:
+        for alerts_csv in args.alerts_csvs:
+            opcode_db.ingest_alerts(db, alerts_csv)
+        opcode_db.ingest_test_obj(db, args.test_obj)
 
+    ### Determine which flagged insns are not, at least, having a function generated in
+    ### ./test.o generated by llvm-test-compsimp-transforms.py
+    ss_mir_opcodes = opcode_db.alerted_opcodes(db, opcode_db.SILENT_STORES_ALERT)
+    cs_mir_opcodes = opcode_db.alerted_opcodes(db, opcode_db.COMP_SIMP_ALERT)
+
+    ss_tested = opcode_db.tested_opcodes(db, opcode_db.SS)
+    cs_tested = opcode_db.tested_opcodes(db, opcode_db.CS)
 
-    cs_untested = set()
-    with llvm_test_inserter_file.open(mode="r") as test_impl_file:
-        test_impl_code = test_impl_file.read()
+    for mir_opc in sorted(ss_mir_opcodes - ss_tested):
+        logging.critical(f"[SilentStores] MIR opcode {mir_opc} not currently tested")
 
-        # silent stores. no test infra yet
-        for mir_opc in ss_mir_opcodes:
-            if mir_opc not in test_impl_code:
-                logging.critical(f"[SilentStores] MIR opcode {mir_opc} not currently tested")
-        # comp simp
-        for mir_opc in cs_mir_opcodes:
-            if mir_opc not in test_impl_code:
-                cs_untested.add(mir_opc)
-                logging.critical(f"[CompSimp] MIR opcode {mir_opc} not currently tested")
+    cs_untested = cs_mir_opcodes - cs_tested
+    for mir_opc in sorted(cs_untested):
+        logging.critical(f"[CompSimp] MIR opcode {mir_opc} not currently tested")
 
     logging.critical(f"[CompSimp] {len(cs_untested)} untested MIR opcodes")
 
     ### Determine which instructions are being tested that are not flagged
-    ### (in the libNa reference impl build alerts csv file)
-    fuzz_harnesses_dir = Path(sys.argv[2])
-
-    fuzz_harness_c_files = fuzz_harnesses_dir.glob('*.c')
-
-    # these c file names look like this:
-    # ADC32mi8-implementation-tester.c
-    # we want this ADC32mi8 part
-    def c_file_to_mir_opc(c_file_name):
-        mir_opc, _, _ = str(c_file_name).split('-')
-        return mir_opc
-    
-    tested_mir_opcs = set(map(c_file_to_mir_opc, fuzz_harness_c_files))
-
-    # what has a test but is not flagged on (because switch from vector
-    # impls to ref impls)
-    unnecessarily_tested = tested_mir_opcs - cs_mir_opcodes
-    for mir_opc in unnecessarily_tested:
-        
-        # no testing infra for SS yet
+    ### (in the libNa reference impl build alerts csv file). what has a test
+    ### but is not flagged on (because switch from vector impls to ref impls)
+    for mir_opc in sorted(cs_tested - cs_mir_opcodes):
         logging.critical(f"[CompSimp] MIR opcode {mir_opc} unnecessarily tested")
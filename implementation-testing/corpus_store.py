@@ -0,0 +1,167 @@
+import argparse
+import logging
+import shutil
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import fuzz_targets
+
+logging.basicConfig(level=logging.INFO)
+
+usage_msg = """
+keep each harness's libFuzzer corpus across rebuilds of ./fuzz_harnesses,
+and the inputs that crashed or mismatched it as regression seeds.
+
+  python3 corpus_store.py prepare ./fuzz_harnesses/harnesses.txt [--store ./fuzz_corpus] [--work-dir ./fuzz_harnesses/corpora]
+  python3 corpus_store.py args HARNESS [--store ./fuzz_corpus] [--work-dir ./fuzz_harnesses/corpora]
+  python3 corpus_store.py merge ./fuzz_harnesses/harnesses.txt [-j JOBS] [--max-len MAX_SEED_LEN] [...]
+  python3 corpus_store.py status [--store ./fuzz_corpus]
+
+the store has a dir per harness, e.g. ./fuzz_corpus/cs-ADD64rr/, with:
+  corpus/       the minimized corpus, seeds every run
+  regressions/  libFuzzer's crash-*, timeout-* and oom-* artifacts, also
+                seeds every run, and never minimized away
+
+`args` prints the fuzzer args that use them: the harness's fresh work dir
+first (where libFuzzer writes the inputs it finds), then the store's
+corpus and regressions, and -artifact_prefix= pointing at regressions.
+./build_and_run_tests.sh runs `prepare` and `args` when fuzzing with
+libFuzzer, and `merge` after, which minimizes the old corpus together
+with the work dir into a new corpus with libFuzzer's -merge=1, one
+harness per job. harnesses built with their own main (--our-main) can't
+use the store.
+"""
+
+DEFAULT_STORE = "fuzz_corpus"
+DEFAULT_WORK_DIR = "fuzz_harnesses/corpora"
+
+CORPUS = "corpus"
+REGRESSIONS = "regressions"
+
+def harness_store(store, harness):
+    return Path(store) / fuzz_targets.harness_name(harness)
+
+def corpus_dir(store, harness):
+    return harness_store(store, harness) / CORPUS
+
+def regressions_dir(store, harness):
+    return harness_store(store, harness) / REGRESSIONS
+
+def work_dir(work_root, harness):
+    return Path(work_root) / fuzz_targets.harness_name(harness)
+
+def prepare(store, work_root, harnesses):
+    """ create the store dirs of each harness and an empty work dir """
+    for harness in harnesses:
+        corpus_dir(store, harness).mkdir(parents=True, exist_ok=True)
+        regressions_dir(store, harness).mkdir(parents=True, exist_ok=True)
+        if work_dir(work_root, harness).exists():
+            shutil.rmtree(work_dir(work_root, harness))
+        work_dir(work_root, harness).mkdir(parents=True)
+
+def fuzzer_store_args(store, work_root, harness):
+    """ (corpus dirs, artifact prefix) to run a harness with """
+    corpus_dirs = [work_dir(work_root, harness), corpus_dir(store, harness), regressions_dir(store, harness)]
+    return corpus_dirs, f"{regressions_dir(store, harness)}/"
+
+def num_inputs(directory):
+    return sum(1 for path in Path(directory).iterdir() if path.is_file()) if Path(directory).exists() else 0
+
+def minimize(store, work_root, harness, max_len):
+    """
+    merge the harness's corpus and work dir into a new minimal corpus, and
+    replace its corpus with it. returns (inputs before, inputs after), or
+    None if the merge failed, leaving the corpus as it was
+    """
+    old_corpus = corpus_dir(store, harness)
+    new_corpus = old_corpus.with_name(f"{CORPUS}.new")
+    if new_corpus.exists():
+        shutil.rmtree(new_corpus)
+    new_corpus.mkdir()
+
+    inputs_before = num_inputs(old_corpus) + num_inputs(work_dir(work_root, harness))
+    merge_cmd = [str(harness), "-merge=1", f"-max_len={max_len}", "-len_control=0",
+                 f"-timeout={fuzz_targets.FUZZ_TIMEOUT_SECONDS}",
+                 f"-artifact_prefix={regressions_dir(store, harness)}/",
+                 str(new_corpus), str(old_corpus), str(work_dir(work_root, harness))]
+    merge_process = subprocess.run(merge_cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, errors='replace')
+    if merge_process.returncode != 0:
+        logging.warning(f"merging the corpus of {harness} failed, keeping it as is:\n"
+                        + "\n".join(merge_process.stdout.splitlines()[-10:]))
+        shutil.rmtree(new_corpus)
+        return None
+
+    # swap in the new corpus, the old one is only deleted once it is replaced
+    old_backup = old_corpus.with_name(f"{CORPUS}.old")
+    if old_backup.exists():
+        shutil.rmtree(old_backup)
+    old_corpus.rename(old_backup)
+    new_corpus.rename(old_corpus)
+    shutil.rmtree(old_backup)
+    return inputs_before, num_inputs(old_corpus)
+
+def prepare_cmd(args):
+    harnesses = fuzz_targets.read_harness_list(args.harness_list)
+    prepare(args.store, args.work_dir, harnesses)
+    logging.info(f"corpus store {args.store} ready for {len(harnesses)} harnesses")
+
+def args_cmd(args):
+    corpus_dirs, artifact_prefix = fuzzer_store_args(args.store, args.work_dir, args.harness)
+    print(" ".join([f"-artifact_prefix={artifact_prefix}"] + [str(corpus) for corpus in corpus_dirs]))
+
+def merge_cmd(args):
+    harnesses = fuzz_targets.read_harness_list(args.harness_list)
+    with ThreadPoolExecutor(max_workers=args.jobs) as pool:
+        results = list(pool.map(lambda harness: minimize(args.store, args.work_dir, harness, args.max_len),
+                                harnesses))
+
+    failed = 0
+    for harness, result in zip(harnesses, results):
+        if result is None:
+            failed += 1
+            continue
+        before, after = result
+        print(f"{fuzz_targets.harness_name(harness)}: {before} inputs minimized to {after}")
+    if failed:
+        logging.critical(f"{failed} of {len(harnesses)} corpora couldn't be merged")
+        sys.exit(1)
+
+def status_cmd(args):
+    store = Path(args.store)
+    harness_stores = sorted(path for path in store.iterdir() if path.is_dir()) if store.exists() else []
+    print(f"{'harness':<24} {'corpus':>7} {'bytes':>9} {'regressions':>11}")
+    for harness_dir in harness_stores:
+        corpus = harness_dir / CORPUS
+        corpus_bytes = sum(path.stat().st_size for path in corpus.iterdir()) if corpus.exists() else 0
+        print(f"{harness_dir.name:<24} {num_inputs(corpus):>7} {corpus_bytes:>9} "
+              f"{num_inputs(harness_dir / REGRESSIONS):>11}")
+
+if __name__ == '__main__':
+    store_args = argparse.ArgumentParser(add_help=False)
+    store_args.add_argument('--store', default=DEFAULT_STORE)
+    store_args.add_argument('--work-dir', default=DEFAULT_WORK_DIR)
+
+    argparser = argparse.ArgumentParser(usage=usage_msg)
+    subparsers = argparser.add_subparsers(dest='command', required=True)
+
+    prepare_parser = subparsers.add_parser('prepare', parents=[store_args])
+    prepare_parser.add_argument('harness_list')
+    prepare_parser.set_defaults(func=prepare_cmd)
+
+    args_parser = subparsers.add_parser('args', parents=[store_args])
+    args_parser.add_argument('harness')
+    args_parser.set_defaults(func=args_cmd)
+
+    merge_parser = subparsers.add_parser('merge', parents=[store_args])
+    merge_parser.add_argument('harness_list')
+    merge_parser.add_argument('-j', '--jobs', type=int, default=1)
+    merge_parser.add_argument('--max-len', type=int, default=fuzz_targets.DEFAULT_MAX_LEN)
+    merge_parser.set_defaults(func=merge_cmd)
+
+    status_parser = subparsers.add_parser('status', parents=[store_args])
+    status_parser.set_defaults(func=status_cmd)
+
+    args = argparser.parse_args()
+    args.func(args)
@@ -0,0 +1,94 @@
+/* Batched differential execution of original/transformed test function
+   pairs for ./differential_engine.py, which links this with a position
+   independent test.o (./llvm-test-compsimp-transforms.py --pic) into a
+   shared library and calls run_differential_batch through ctypes.
+
+   each input is set up the way ./implementation-tester.c sets up a fuzz
+   input: memory operands point to per input copies of their 128 bit
+   values, ymm0-7 hold broadcasts of the vector inputs, the flags are
+   sahf'd from the lahf input, and rax holds the last arg for opcodes with
+   an implicit first arg. the output states are copied out for the driver
+   to compare in bulk */
+#include <assert.h>
+#include <stdint.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+
+#include "outstate.h"
+#include "opcode_trampoline.h"
+
+#define NUM_TEST_ARGS 5
+#define NUM_VECTOR_INPUTS 8
+#define MEMORY_OPERAND_WORDS 2
+
+static inline void
+load_vector_inputs(const uint64_t* vector_inputs)
+{
+	__asm__ __volatile__(
+		"vpbroadcastq (%0), %%ymm0\n"
+		"vpbroadcastq 0x8(%0), %%ymm1\n"
+		"vpbroadcastq 0x10(%0), %%ymm2\n"
+		"vpbroadcastq 0x18(%0), %%ymm3\n"
+		"vpbroadcastq 0x20(%0), %%ymm4\n"
+		"vpbroadcastq 0x28(%0), %%ymm5\n"
+		"vpbroadcastq 0x30(%0), %%ymm6\n"
+		"vpbroadcastq 0x38(%0), %%ymm7\n"
+		:
+		: "r" (vector_inputs)
+		: "ymm0", "ymm1", "ymm2", "ymm3",
+		  "ymm4", "ymm5", "ymm6", "ymm7", "memory"
+		);
+}
+
+/* Run one test function on one input, writing its output state and its
+   memory operands afterwards */
+static void
+run_one(test_fn_t fn, const uint8_t* is_mem_operand, int is_implicit_first_arg,
+	const uint64_t* args, uint64_t lahf, const uint64_t* vector_inputs,
+	const uint64_t* memory_inputs, struct OutState* out, uint64_t* memory_out)
+{
+	static _Alignas(16) struct OutState state;
+	static _Alignas(16) uint64_t memory[NUM_TEST_ARGS * MEMORY_OPERAND_WORDS];
+	uint64_t call_args[NUM_TEST_ARGS];
+
+	memcpy(memory, memory_inputs, sizeof(memory));
+	for (int ii = 0; ii < NUM_TEST_ARGS; ++ii) {
+		call_args[ii] = is_mem_operand[ii] ?
+			(uint64_t) &memory[ii * MEMORY_OPERAND_WORDS] : args[ii];
+	}
+	memset(&state, 0, sizeof(state));
+
+	load_vector_inputs(vector_inputs);
+	opcode_trampoline(fn, &state,
+			  call_args[0], call_args[1], call_args[2], call_args[3], call_args[4],
+			  is_implicit_first_arg ? call_args[4] : 0, lahf);
+
+	memcpy(out, &state, sizeof(state));
+	memcpy(memory_out, memory, sizeof(memory));
+}
+
+/* Run `original` and `transformed` on `num_inputs` inputs:
+   args[n][5], lahf[n], vector_inputs[n][8] and memory_inputs[n][5][2].
+   writes original_out[n], transformed_out[n], and the memory operands after
+   each call to original_memory_out[n][5][2] and transformed_memory_out[n][5][2] */
+void
+run_differential_batch(test_fn_t original, test_fn_t transformed,
+		       const uint8_t* is_mem_operand, int is_implicit_first_arg,
+		       size_t num_inputs, const uint64_t* args, const uint64_t* lahf,
+		       const uint64_t* vector_inputs, const uint64_t* memory_inputs,
+		       struct OutState* original_out, struct OutState* transformed_out,
+		       uint64_t* original_memory_out, uint64_t* transformed_memory_out)
+{
+	const size_t memory_words = NUM_TEST_ARGS * MEMORY_OPERAND_WORDS;
+	for (size_t ii = 0; ii < num_inputs; ++ii) {
+		run_one(original, is_mem_operand, is_implicit_first_arg,
+			&args[ii * NUM_TEST_ARGS], lahf[ii],
+			&vector_inputs[ii * NUM_VECTOR_INPUTS], &memory_inputs[ii * memory_words],
+			&original_out[ii], &original_memory_out[ii * memory_words]);
+		run_one(transformed, is_mem_operand, is_implicit_first_arg,
+			&args[ii * NUM_TEST_ARGS], lahf[ii],
+			&vector_inputs[ii * NUM_VECTOR_INPUTS], &memory_inputs[ii * memory_words],
+			&transformed_out[ii], &transformed_memory_out[ii * memory_words]);
+	}
+}
@@ -0,0 +1,333 @@
+import argparse
+import ctypes
+import itertools
+import logging
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+import numpy as np
+
+import opcode_db
+from build_harnesses import compiler_identity, hash_parts
+from mir_opcode import OperandType, flag
+
+logging.basicConfig(level=logging.INFO)
+
+usage_msg = """
+check original/transformed test function pairs in bulk in one process,
+instead of one libFuzzer process per pair: test.o is linked with
+./differential_engine.c into a shared library, batches of inputs are
+generated with numpy following each opcode's operand types, both functions
+are run on every input natively, and their output states are compared with
+the same rules as check_outstates_equivalent in ./implementation-tester.c.
+
+  python3 llvm-test-compsimp-transforms.py --pic fuzz_harnesses  # test.o has to be position independent
+  python3 differential_engine.py [OPCODE ...] [--batches 16] [--batch-size 65536] [--sweep] [-j JOBS]
+
+with no OPCODEs, every tested opcode in the opcode db (see ./opcode_db.py)
+is checked. --sweep also runs every combination of the boundary values of
+the opcode's bitwidth over its register and memory operands, with all flags
+clear and all set. exits with 1 if any pair mismatched.
+
+a transform that crashes takes the engine down with it, run its fuzz
+harness to find the input.
+"""
+
+ENGINE_SOURCE = "differential_engine.c"
+ENGINE_HEADERS = ["outstate.h", "opcode_trampoline.h"]
+ENGINE_FLAGS = ["-O2", "-mavx2", "-fPIC", "-shared", "-Wall", "-Wno-unused-function", "-I."]
+
+# struct OutState in ./outstate.h, as uint64 words
+OUTSTATE_FIELDS = ['rax', 'rbx', 'rcx', 'rdx', 'rsp', 'rbp', 'rsi', 'rdi',
+                   'r8', 'r9', 'r10', 'r11', 'r12', 'r13', 'r14', 'r15',
+                   'lahf_rax_res', 'padding'] + \
+                  [f"xmm{ii}{half}" for ii in range(8) for half in ('lo', 'hi')] + \
+                  ['cyclecount']
+OUTSTATE_WORDS = len(OUTSTATE_FIELDS)
+FIELD_IDX = dict({name: idx for idx, name in enumerate(OUTSTATE_FIELDS)})
+
+# rdi holds the pointer to the output state
+CHECKED_GPRS = [reg for reg in OUTSTATE_FIELDS[:16] if reg != 'rdi']
+# the registers of the test args, in order. see POINTS_TO_MEM in ./implementation-tester.c
+ARG_REGISTERS = ['rsi', 'rdx', 'rcx', 'r8', 'r9']
+NUM_VECTOR_INPUTS = 8
+MEMORY_OPERAND_WORDS = 2
+
+LAHF_MASK_OF_FLAG = dict({
+    flag('SF'): 0x80,
+    flag('ZF'): 0x40,
+    flag('AF'): 0x10,
+    flag('PF'): 0x4,
+    flag('CF'): 0x1,
+})
+# sahf loads the flags from ah
+ALL_FLAGS_SET_LAHF = 0xd5 << 8
+
+DEFAULT_BATCH_SIZE = 1 << 16
+DEFAULT_BATCHES = 16
+MAX_SWEEP_INPUTS = 1 << 22
+# mismatching inputs printed per opcode
+MAX_REPORTED_MISMATCHES = 5
+
+MASK64 = (1 << 64) - 1
+
+argparser = argparse.ArgumentParser(usage=usage_msg)
+argparser.add_argument('opcodes', nargs='*')
+argparser.add_argument('--test-obj', default='test.o')
+argparser.add_argument('--cc', default='clang')
+argparser.add_argument('--cache-dir', default='.harness_cache')
+argparser.add_argument('--db', default=opcode_db.DEFAULT_DB)
+argparser.add_argument('--test-type', default=opcode_db.CS, choices=[opcode_db.CS, opcode_db.SS])
+argparser.add_argument('--batches', type=int, default=DEFAULT_BATCHES)
+argparser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+argparser.add_argument('--sweep', action='store_true')
+argparser.add_argument('--seed', type=int, default=0)
+argparser.add_argument('-j', '--jobs', type=int, default=1)
+
+def build_engine(cc, test_obj, cache_dir):
+    """
+    link ./differential_engine.c with test.o into a shared library in the
+    harness cache, keyed like ./build_harnesses.py keys harnesses. returns
+    its path
+    """
+    compile_cmd = [cc] + ENGINE_FLAGS
+    key = hash_parts(Path(ENGINE_SOURCE).read_bytes(),
+                     *[Path(header).read_bytes() for header in ENGINE_HEADERS],
+                     Path(test_obj).read_bytes(), *compiler_identity(cc), *compile_cmd)
+    lib_path = Path(cache_dir) / f"{key}.so"
+    if lib_path.exists():
+        return lib_path
+
+    Path(cache_dir).mkdir(exist_ok=True)
+    tmp_lib = lib_path.with_suffix(".tmp.so")
+    link_process = subprocess.run(compile_cmd + [ENGINE_SOURCE, str(test_obj), "-o", str(tmp_lib)],
+                                  text=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    if link_process.returncode != 0:
+        logging.critical(f"error building the engine library, was {test_obj} generated with "
+                         f"./llvm-test-compsimp-transforms.py --pic?\n{link_process.stdout}")
+        sys.exit(2)
+    tmp_lib.replace(lib_path)
+    return lib_path
+
+class DifferentialEngine:
+    def __init__(self, lib_path):
+        self.lib = ctypes.CDLL(str(lib_path))
+        self.run_batch = self.lib.run_differential_batch
+        self.run_batch.restype = None
+        self.run_batch.argtypes = [ctypes.c_void_p, ctypes.c_void_p,
+                                   ctypes.c_void_p, ctypes.c_int,
+                                   ctypes.c_size_t, ctypes.c_void_p, ctypes.c_void_p,
+                                   ctypes.c_void_p, ctypes.c_void_p,
+                                   ctypes.c_void_p, ctypes.c_void_p,
+                                   ctypes.c_void_p, ctypes.c_void_p]
+
+    def symbol_address(self, symbol):
+        return ctypes.cast(getattr(self.lib, symbol), ctypes.c_void_p).value
+
+    def run(self, opcode, original_symbol, transformed_symbol, inputs):
+        """
+        run both functions on every input. returns the output states as
+        uint64 arrays [n, OUTSTATE_WORDS] and the memory operands after each
+        call [n, 5, 2], original's then transformed's
+        """
+        num_inputs = len(inputs['lahf'])
+        is_mem_operand = np.array([optype == OperandType.MEM for optype in opcode.operand_types],
+                                  dtype=np.uint8)
+        outputs = [np.zeros((num_inputs, OUTSTATE_WORDS), dtype=np.uint64) for _ in range(2)]
+        memory_outputs = [np.zeros((num_inputs, 5, MEMORY_OPERAND_WORDS), dtype=np.uint64) for _ in range(2)]
+        self.run_batch(self.symbol_address(original_symbol), self.symbol_address(transformed_symbol),
+                       is_mem_operand.ctypes.data, int(opcode.is_implicit_first_arg),
+                       num_inputs, inputs['args'].ctypes.data, inputs['lahf'].ctypes.data,
+                       inputs['vectors'].ctypes.data, inputs['memory'].ctypes.data,
+                       outputs[0].ctypes.data, outputs[1].ctypes.data,
+                       memory_outputs[0].ctypes.data, memory_outputs[1].ctypes.data)
+        return outputs[0], outputs[1], memory_outputs[0], memory_outputs[1]
+
+def boundary_values(bitwidth):
+    """
+    0, 1, 2, and the values around the signed and unsigned limits of every
+    width up to bitwidth (64 if it has none)
+    """
+    bits = int(bitwidth) if bitwidth else 64
+    values = set([0, 1, 2])
+    for width in (8, 16, 32, 64):
+        if width > bits:
+            break
+        top = 1 << width
+        values.update([top - 1, top - 2, top >> 1, (top >> 1) - 1, (top >> 1) + 1])
+    return np.array(sorted(value & MASK64 for value in values), dtype=np.uint64)
+
+def operand_values(rng, num_inputs, boundaries, bitwidth):
+    """
+    half uniformly random values, a quarter boundary values, a quarter
+    boundary values with random bits above bitwidth
+    """
+    values = rng.integers(0, MASK64, size=num_inputs, dtype=np.uint64, endpoint=True)
+    choice = rng.random(num_inputs)
+    from_boundaries = boundaries[rng.integers(0, len(boundaries), size=num_inputs)]
+    bits = int(bitwidth) if bitwidth else 64
+    low_mask = np.uint64(MASK64 if bits >= 64 else (1 << bits) - 1)
+    values = np.where(choice < 0.25, from_boundaries, values)
+    return np.where((choice >= 0.25) & (choice < 0.5), from_boundaries | (values & ~low_mask), values)
+
+def random_inputs(opcode, rng, num_inputs):
+    boundaries = boundary_values(opcode.bitwidth)
+    args = np.empty((num_inputs, 5), dtype=np.uint64)
+    memory = rng.integers(0, MASK64, size=(num_inputs, 5, MEMORY_OPERAND_WORDS), dtype=np.uint64, endpoint=True)
+    for ii, optype in enumerate(opcode.operand_types):
+        args[:, ii] = operand_values(rng, num_inputs, boundaries, opcode.bitwidth)
+        if optype == OperandType.MEM:
+            memory[:, ii, 0] = args[:, ii]
+    vectors = np.stack([operand_values(rng, num_inputs, boundary_values(None), None)
+                        for _ in range(NUM_VECTOR_INPUTS)], axis=1)
+    lahf = rng.integers(0, MASK64, size=num_inputs, dtype=np.uint64, endpoint=True)
+    return dict({'args': args, 'lahf': lahf, 'vectors': np.ascontiguousarray(vectors), 'memory': memory})
+
+def sweep_inputs(opcode, rng):
+    """
+    every combination of boundary values over the register and memory
+    operands, with all flags clear and all set. None if there are more than
+    MAX_SWEEP_INPUTS
+    """
+    boundaries = boundary_values(opcode.bitwidth)
+    swept = [ii for ii, optype in enumerate(opcode.operand_types)
+             if optype in (OperandType.REG, OperandType.MEM)]
+    lahfs = [0, ALL_FLAGS_SET_LAHF]
+    num_inputs = len(boundaries) ** len(swept) * len(lahfs)
+    if num_inputs > MAX_SWEEP_INPUTS:
+        return None
+
+    inputs = random_inputs(opcode, rng, num_inputs)
+    combos = np.array(list(itertools.product(range(len(boundaries)), repeat=len(swept))), dtype=np.int64)
+    combos = np.repeat(combos.reshape(-1, len(swept)), len(lahfs), axis=0)
+    for col, ii in enumerate(swept):
+        inputs['args'][:, ii] = boundaries[combos[:, col]]
+        inputs['memory'][:, ii, 0] = inputs['args'][:, ii]
+    inputs['lahf'] = np.tile(np.array(lahfs, dtype=np.uint64), num_inputs // len(lahfs))
+    return inputs
+
+def compare_outstates(opcode, original, transformed, original_memory, transformed_memory):
+    """
+    get (a mask of the inputs whose output states aren't equivalent, the
+    number of mismatches of each checked field)
+    """
+    differs = dict()
+    for reg in CHECKED_GPRS:
+        arg_idx = ARG_REGISTERS.index(reg) if reg in ARG_REGISTERS else None
+        if arg_idx is not None and opcode.operand_types[arg_idx] == OperandType.MEM:
+            # compare the 64 bits pointed to, not the pointers
+            differs[f"*{reg}"] = original_memory[:, arg_idx, 0] != transformed_memory[:, arg_idx, 0]
+        else:
+            differs[reg] = original[:, FIELD_IDX[reg]] != transformed[:, FIELD_IDX[reg]]
+
+    for ii in range(8):
+        lo, hi = FIELD_IDX[f"xmm{ii}lo"], FIELD_IDX[f"xmm{ii}hi"]
+        differs[f"xmm{ii}"] = (original[:, lo] != transformed[:, lo]) | (original[:, hi] != transformed[:, hi])
+
+    checked_flags = (opcode.preserve_flags if opcode.must_preserve_flags() else []) + \
+        (opcode.set_flags if opcode.must_set_flags() else [])
+    for checked_flag in sorted(set(checked_flags)):
+        mask = np.uint64(LAHF_MASK_OF_FLAG[checked_flag])
+        lahf_idx = FIELD_IDX['lahf_rax_res']
+        differs[f"flag {checked_flag}"] = ((original[:, lahf_idx] ^ transformed[:, lahf_idx]) & mask) != 0
+
+    mismatched = np.zeros(len(original), dtype=bool)
+    for field_differs in differs.values():
+        mismatched |= field_differs
+    return mismatched, dict({field: int(np.count_nonzero(field_differs))
+                             for field, field_differs in differs.items() if field_differs.any()})
+
+engine = None
+
+def init_worker(lib_path):
+    global engine
+    engine = DifferentialEngine(lib_path)
+
+def check_opcode(opcode, test_type, original_symbol, transformed_symbol, num_batches, batch_size, sweep, seed):
+    """ run in a worker process, see init_worker. returns a result dict """
+    rng = np.random.default_rng([seed, sum(map(ord, original_symbol))])
+    batches = [random_inputs(opcode, rng, batch_size) for _ in range(num_batches)]
+    if sweep:
+        sweep_batch = sweep_inputs(opcode, rng)
+        if sweep_batch is None:
+            logging.warning(f"{opcode.string}: boundary sweep is over {MAX_SWEEP_INPUTS} inputs, skipping it")
+        else:
+            batches.insert(0, sweep_batch)
+
+    result = dict({'name': f"{test_type}-{opcode.string}", 'inputs': 0, 'mismatches': 0,
+                   'fields': dict(), 'examples': [], 'seconds': 0.0})
+    for inputs in batches:
+        start = time.perf_counter()
+        outputs = engine.run(opcode, original_symbol, transformed_symbol, inputs)
+        result['seconds'] += time.perf_counter() - start
+
+        mismatched, fields = compare_outstates(opcode, *outputs)
+        result['inputs'] += len(mismatched)
+        result['mismatches'] += int(np.count_nonzero(mismatched))
+        for field, count in fields.items():
+            result['fields'][field] = result['fields'].get(field, 0) + count
+        for idx in np.flatnonzero(mismatched)[:MAX_REPORTED_MISMATCHES - len(result['examples'])]:
+            result['examples'].append(dict({
+                'args': [int(arg) for arg in inputs['args'][idx]],
+                'lahf': int(inputs['lahf'][idx]),
+                'memory': [int(word) for word in inputs['memory'][idx, :, 0]],
+            }))
+    return result
+
+def print_result(result):
+    rate = result['inputs'] / result['seconds'] if result['seconds'] else float('inf')
+    print(f"{result['name']}: {result['inputs']} inputs, {result['mismatches']} mismatches "
+          f"({rate / 1e6:.2f}M inputs/s)")
+    if result['mismatches']:
+        fields = ', '.join(f"{field} ({count})" for field, count in sorted(result['fields'].items()))
+        print(f"\tmismatched on: {fields}")
+        for example in result['examples']:
+            args = ', '.join(f"{reg}: {arg:#x}" for reg, arg in zip(ARG_REGISTERS, example['args']))
+            print(f"\tIn state causing mismatch: {args}, lahf: {example['lahf']:#x}")
+
+if __name__ == '__main__':
+    args = argparser.parse_args()
+
+    if not Path(args.test_obj).exists():
+        logging.critical(f"{args.test_obj} doesn't exist, run ./llvm-test-compsimp-transforms.py --pic first")
+        sys.exit(1)
+
+    db = opcode_db.connect(args.db)
+    with db:
+        opcode_db.ingest_test_obj(db, args.test_obj)
+
+    pairs = []
+    for mir_opcode, test_type, original_symbol, transformed_symbol in opcode_db.test_functions(db, args.test_type):
+        if args.opcodes and mir_opcode not in args.opcodes:
+            continue
+        opcode = opcode_db.load_opcode(db, mir_opcode)
+        if opcode is None:
+            logging.critical(f"couldn't parse MIR opcode {mir_opcode}, skipping it")
+            continue
+        pairs.append((opcode, test_type, original_symbol, transformed_symbol))
+
+    missing = set(args.opcodes) - set(opcode.string for opcode, _, _, _ in pairs)
+    for mir_opcode in sorted(missing):
+        logging.critical(f"MIR opcode {mir_opcode} has no {args.test_type} test functions in {args.test_obj}")
+
+    lib_path = build_engine(args.cc, args.test_obj, args.cache_dir)
+
+    num_mismatched = 0
+    try:
+        with ProcessPoolExecutor(max_workers=args.jobs, initializer=init_worker, initargs=(lib_path,)) as pool:
+            futures = [pool.submit(check_opcode, *pair, args.batches, args.batch_size, args.sweep, args.seed)
+                       for pair in pairs]
+            for future in futures:
+                result = future.result()
+                print_result(result)
+                num_mismatched += 1 if result['mismatches'] else 0
+    except BrokenProcessPool:
+        logging.critical("a test function crashed the engine, run the fuzz harnesses to find which")
+        sys.exit(2)
+
+    print(f"{num_mismatched} of {len(pairs)} opcodes mismatched")
+    sys.exit(1 if num_mismatched or missing else 0)
@@ -0,0 +1,112 @@
+"""
+symbol -> instruction list indexes of binaries (from one objdump run per
+binary, cached by the binary's hash) and of the verified transforms in the
+checker's synth/*.rkt files, for ./check_bin_transforms.py
+"""
+import hashlib
+import json
+import re
+import subprocess
+from pathlib import Path
+
+DEFAULT_CACHE_DIR = '.disasm_cache'
+OBJDUMP_FLAGS = ['-d', '--no-addresses', '--no-show-raw-insn', '-M', 'suffix']
+
+# <x86compsimptest_ADD64rr_transformed>:
+SYMBOL_HEADER_RE = re.compile(r'^<(?P<symbol>[^>]+)>:$')
+
+# (define attempt-add64-1 ...)
+RKT_DEFINE_RE = re.compile(r'\(define\s+(?P<name>attempt-[^\s()]+)')
+RKT_COMMENT_RE = re.compile(r';.*$')
+# mnemonics, registers, numbers. drops AT&T's % and $ sigils and punctuation
+INSN_TOKEN_RE = re.compile(r'[a-z0-9_.\-]+')
+
+
+def normalize_insn(line):
+    """ objdump pads mnemonics with runs of spaces and tabs """
+    return ' '.join(line.split())
+
+
+def insn_tokens(line):
+    """
+    the tokens of an instruction with syntax dropped, so an objdump line and
+    an s-expression of the same instruction compare equal
+    """
+    return INSN_TOKEN_RE.findall(RKT_COMMENT_RE.sub('', line).lower())
+
+
+def parse_objdump(dump):
+    """ map each symbol in objdump -d output to its normalized instructions """
+    functions = dict()
+    insns = None
+    for line in dump.splitlines():
+        line = line.strip()
+        match = SYMBOL_HEADER_RE.match(line)
+        if match is not None:
+            insns = functions.setdefault(match.group('symbol'), [])
+        elif not line:
+            insns = None
+        elif insns is not None:
+            insns.append(normalize_insn(line))
+    return functions
+
+
+def objdump_identity(objdump):
+    version = subprocess.run([objdump, '--version'], check=True, text=True,
+                             stdout=subprocess.PIPE).stdout
+    return version.splitlines()[0] if version else objdump
+
+
+def disassembly_index(binary, cache_dir=DEFAULT_CACHE_DIR, objdump='objdump'):
+    """
+    get the symbol -> instructions index of a binary, disassembling it only
+    if no index of a binary with the same contents (and objdump) is cached
+    """
+    digest = hashlib.sha256(Path(binary).read_bytes())
+    digest.update('\0'.join([objdump_identity(objdump)] + OBJDUMP_FLAGS).encode())
+    cached = Path(cache_dir) / f'{digest.hexdigest()}.json'
+    if cached.exists():
+        return json.loads(cached.read_text())
+
+    dump = subprocess.run([objdump, str(binary)] + OBJDUMP_FLAGS, check=True, text=True,
+                          stdout=subprocess.PIPE).stdout
+    index = parse_objdump(dump)
+
+    Path(cache_dir).mkdir(exist_ok=True)
+    tmp = cached.with_suffix('.tmp')
+    tmp.write_text(json.dumps(index))
+    tmp.replace(cached)
+    return index
+
+
+def parse_verified_transforms(rkt_text):
+    """
+    get (name, title line, body lines) of each attempt-* definition. the
+    body is everything after its `(list` up to the next definition, as
+    check_bin_transforms.py always diffed it
+    """
+    transforms = []
+    defines = list(re.finditer(r'\(define', rkt_text))
+    for idx, define in enumerate(defines):
+        match = RKT_DEFINE_RE.match(rkt_text, define.start())
+        if match is None:
+            continue
+        end = defines[idx + 1].start() if idx + 1 < len(defines) else len(rkt_text)
+        title_end = rkt_text.find('\n', match.start('name'))
+        title = rkt_text[match.start('name'):title_end if title_end != -1 else end]
+
+        list_start = rkt_text.find('(list', match.end(), end)
+        if list_start == -1:
+            continue
+        body_start = rkt_text.find('\n', list_start, end)
+        body = rkt_text[body_start + 1:end] if body_start != -1 else ''
+        transforms.append((match.group('name'), title, [line.strip() for line in body.splitlines() if line.strip()]))
+    return transforms
+
+
+def verified_transforms_index(rkt_files):
+    """ every attempt-* definition of the given files, in order """
+    transforms = []
+    for rkt_file in rkt_files:
+        transforms.extend(parse_verified_transforms(Path(rkt_file).read_text()))
+    return transforms
@@ -0,0 +1,80 @@
+"""
+what the scripts that run the fuzz harnesses built by ./build_harnesses.py
+share: harness names, the fuzzer command line ./build_and_run_tests.sh uses,
+and reading libFuzzer's output
+"""
+import re
+from pathlib import Path
+
+# harnesses are named <test type>-<MIR opcode><this>, e.g. cs-ADD64rr-implementation-tester
+HARNESS_SUFFIX = "-implementation-tester"
+
+# 6 input GPRs each of size 8 bytes
+# 8 input vector regs each of size 32 bytes (ymms 256 bit)
+# quadruple the actual size so it doesn't try a bunch of small sizes
+# that the fuzzers reject
+DEFAULT_MAX_LEN = 4 * (8 * 6 + 32 * 8)
+FUZZ_TIMEOUT_SECONDS = 10
+
+# libFuzzer status lines look like
+# #4096	pulse  cov: 52 ft: 61 corp: 9/312b lim: 4 exec/s: 2048 rss: 29Mb
+LIBFUZZER_COVERAGE_RE = re.compile(r"\bcov: (?P<cov>\d+) ft: (?P<ft>\d+)")
+
+# what ./build_and_run_tests.sh greps the logs for
+MISMATCH_RE = re.compile(r"mismatch|differ", re.IGNORECASE)
+
+def read_harness_list(harness_list_file):
+    """ the harnesses in a harnesses.txt written by ./build_harnesses.py """
+    with open(harness_list_file) as f:
+        return [Path(line.strip()) for line in f if line.strip()]
+
+def harness_name(harness):
+    """ e.g. ./fuzz_harnesses/cs-ADD64rr-implementation-tester -> cs-ADD64rr """
+    name = Path(harness).name
+    if name.endswith(HARNESS_SUFFIX):
+        name = name[:-len(HARNESS_SUFFIX)]
+    return name
+
+def harness_opcode(harness):
+    """ e.g. ./fuzz_harnesses/cs-ADD64rr-implementation-tester -> ('cs', 'ADD64rr') """
+    test_type, _, mir_opcode = harness_name(harness).partition('-')
+    return test_type, mir_opcode
+
+def fuzzer_cmd(harness, runs=None, seconds=None, max_len=DEFAULT_MAX_LEN, seed=None,
+               measure_cycles=False, cycle_counts_file=None, corpus_dirs=(), artifact_prefix=None):
+    """
+    the command line ./build_and_run_tests.sh runs a harness with. runs or
+    seconds limit the run, the harnesses' own main (--our-main) only
+    supports runs
+    """
+    cmd = [str(harness), "-close_fd_mask=0"]
+    if measure_cycles:
+        cmd.append("-measure_cycles")
+    if cycle_counts_file is not None:
+        cmd.append(f"-cycle_counts_file={cycle_counts_file}")
+    if runs is not None:
+        cmd.append(f"-runs={runs}")
+    if seconds is not None:
+        cmd.append(f"-max_total_time={seconds}")
+    if seed is not None:
+        cmd.append(f"-seed={seed}")
+    if artifact_prefix is not None:
+        cmd.append(f"-artifact_prefix={artifact_prefix}")
+    cmd += [f"-max_len={max_len}", "-len_control=0", f"-timeout={FUZZ_TIMEOUT_SECONDS}"]
+    return cmd + [str(corpus_dir) for corpus_dir in corpus_dirs]
+
+def scan_fuzzer_output(lines):
+    """
+    get (the (cov, ft) of the last libFuzzer status line, or None if there
+    are none, e.g. for harnesses built with their own main; whether any line
+    reports a mismatch)
+    """
+    coverage = None
+    mismatch = False
+    for line in lines:
+        match = LIBFUZZER_COVERAGE_RE.search(line)
+        if match is not None:
+            coverage = (int(match.group('cov')), int(match.group('ft')))
+        if MISMATCH_RE.search(line):
+            mismatch = True
+    return coverage, mismatch
@@ -2,7 +2,12 @@ import argparse
 import sys
 from pathlib import Path
 import re
-import statistics
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import cycle_stats
 
 LOG_FILE_EXTENSION = "*.log"
 
@@ -12,6 +17,14 @@ static void print_cycle_counts()
 """
 CSV_HEADER = "orig,transformed"
 
+"""
+harnesses run with -cycle_counts_file=<harness>.cycles.bin write their cycle
+counts there as little endian uint64 (orig, transformed) pairs instead of as
+csv rows in the log. see print_cycle_counts() in ./implementation-tester.c
+"""
+CYCLE_COUNTS_BINARY_EXTENSION = ".cycles.bin"
+CYCLE_COUNTS_BINARY_DTYPE = np.dtype([('original', '<u8'), ('transformed', '<u8')])
+
 # following regexes used to validate preconditions about
 # syntax of the eval data so processing goes smoothly
 CSV_ROW_RE = re.compile(r"^\d+,\d+$") # per line
@@ -41,6 +54,23 @@ argparser.add_argument('--avg-cycles-csv-file',
                        action='store',
                        default=None,
                        type=str)
+argparser.add_argument('--streaming',
+                       action='store_true',
+                       help='process logs in chunks with bounded memory, also reporting percentiles')
+argparser.add_argument('--percentiles-csv-file',
+                       action='store',
+                       default=None,
+                       type=str)
+argparser.add_argument('-j', '--jobs',
+                       action='store',
+                       default=None,
+                       type=int,
+                       help='worker processes for --streaming. defaults to the number of cores')
+
+# --streaming reads this many measurements at a time, a whole number of the
+# batches steady state detection takes the medians of
+STREAM_CHUNK_LEN = cycle_stats.STEADY_STATE_BATCH_SIZE << 13
+PERCENTILES = [50, 90, 99, 99.9]
 
 def get_opcode_name(logfilename):
     if re.fullmatch(FILE_NAME_RE, logfilename) is None:
@@ -52,26 +82,254 @@ def get_opcode_name(logfilename):
 
 def get_measurement_overhead(cycle_counts):
     origvtran = cycle_counts[EMPTY_TEST_OPCODE_NAME]
-    all_counts = origvtran['original'] + origvtran['transformed']
-    avg = statistics.fmean(all_counts)
-    pstdev = statistics.pstdev(all_counts)
+    all_counts = np.concatenate((origvtran['original'], origvtran['transformed']))
+    avg = np.mean(all_counts)
+    pstdev = np.std(all_counts)
     print(f"measurement overhead is: {avg} ± {pstdev}")
     del cycle_counts[EMPTY_TEST_OPCODE_NAME] # so it's not used later
     return avg
 
 def remove_measurement_overhead(nums, overhead, amortization_count):
-    for num in nums:
-        yield (num / amortization_count)
-    # for num in nums:
-    #     removed = num - overhead
-    #     if removed < 0.0:
-    #         yield 0.0
-    #     else:
-    #         yield removed / amortization_count
-
-def ratio(numerators, denomenators):
-    for n, d in zip(numerators, denomenators):
-        yield (n / d if d != 0 else 1)
+    return nums / amortization_count
+    # removed = nums - overhead
+    # return np.maximum(removed, 0.0) / amortization_count
+
+
+def read_text_cycle_counts(log):
+    """
+    get the (original, transformed) cycle count arrays from the csv rows
+    at the end of a harness log
+    """
+    txt = log.read_text()
+    lines = txt.splitlines()
+
+    try:
+        header_line_idx = lines.index(CSV_HEADER)
+    except ValueError: # if CSV_HEADER not found
+        print(f"File {log} does not have cycle count data (no csv header line found). "
+              "Fuzzer num_runs parameter probably too low to hit counts")
+        sys.exit(1)
+
+    line_num = header_line_idx + 1
+    cycle_count_lines = lines[line_num:]
+
+    for line in cycle_count_lines:
+        if re.fullmatch(CSV_ROW_RE, line) is None:
+            print(f"line num {line_num} in file {log} is badly formed.")
+            print(f"the line is: {line}")
+            sys.exit(1)
+        line_num += 1
+
+    counts = np.array([line.split(",") for line in cycle_count_lines], dtype=np.uint64).reshape(-1, 2)
+    return counts[:, 0], counts[:, 1]
+
+def read_binary_cycle_counts(binary_file):
+    """
+    memory map the (original, transformed) cycle count arrays a harness
+    wrote to its -cycle_counts_file
+    """
+    num_pairs = binary_file.stat().st_size // CYCLE_COUNTS_BINARY_DTYPE.itemsize
+    if num_pairs * CYCLE_COUNTS_BINARY_DTYPE.itemsize != binary_file.stat().st_size:
+        print(f"{binary_file} has a partial record at the end (harness killed?), ignoring it")
+    if num_pairs == 0:
+        print(f"File {binary_file} does not have cycle count data. "
+              "Fuzzer num_runs parameter probably too low to hit counts")
+        sys.exit(1)
+
+    counts = np.memmap(binary_file, dtype=CYCLE_COUNTS_BINARY_DTYPE, mode='r', shape=(num_pairs,))
+    return counts['original'], counts['transformed']
+
+def iter_cycle_count_chunks(log, chunk_len):
+    """
+    yield (original, transformed) arrays of at most chunk_len cycle counts
+    of one harness at a time, from its binary sidecar file or log
+    """
+    binary_file = log.with_suffix(CYCLE_COUNTS_BINARY_EXTENSION)
+    if binary_file.exists():
+        orig_counts, transformed_counts = read_binary_cycle_counts(binary_file)
+        for start in range(0, len(orig_counts), chunk_len):
+            yield (np.asarray(orig_counts[start:start + chunk_len]),
+                   np.asarray(transformed_counts[start:start + chunk_len]))
+        return
+
+    with log.open() as log_file:
+        for line_num, line in enumerate(log_file, start=1):
+            if line.rstrip('\n') == CSV_HEADER:
+                break
+        else:
+            print(f"File {log} does not have cycle count data (no csv header line found). "
+                  "Fuzzer num_runs parameter probably too low to hit counts")
+            sys.exit(1)
+
+        chunk = []
+        for line_num, line in enumerate(log_file, start=line_num + 1):
+            line = line.rstrip('\n')
+            if re.fullmatch(CSV_ROW_RE, line) is None:
+                print(f"line num {line_num} in file {log} is badly formed.")
+                print(f"the line is: {line}")
+                sys.exit(1)
+            chunk.append(line.split(","))
+            if len(chunk) == chunk_len:
+                counts = np.array(chunk, dtype=np.uint64)
+                yield counts[:, 0], counts[:, 1]
+                chunk = []
+        if chunk:
+            counts = np.array(chunk, dtype=np.uint64)
+            yield counts[:, 0], counts[:, 1]
+
+def scan_log(log, use_n_measurements):
+    """
+    first pass over one harness's cycle counts: get (number of measurements,
+    index of the first one to use, whether they settled). like the
+    non-streaming path, the warmup is found on all of them, or all but the
+    last use_n_measurements are skipped
+    """
+    num_measurements = 0
+    orig_batches = []
+    tran_batches = []
+    for orig, tran in iter_cycle_count_chunks(log, STREAM_CHUNK_LEN):
+        num_measurements += len(orig)
+        if use_n_measurements == -1:
+            orig_batches.append(cycle_stats.batch_medians(orig))
+            tran_batches.append(cycle_stats.batch_medians(tran))
+
+    if use_n_measurements != -1:
+        if use_n_measurements >= num_measurements:
+            print(f"{log.name} only has {num_measurements} measurements, so cannot use --use-n-measurements={use_n_measurements}")
+            sys.exit(2)
+        return num_measurements, num_measurements - use_n_measurements, True
+
+    orig_start, orig_settled = cycle_stats.steady_state_start_of_batches(np.concatenate(orig_batches))
+    tran_start, tran_settled = cycle_stats.steady_state_start_of_batches(np.concatenate(tran_batches))
+    start = max(orig_start if orig_settled else 0, tran_start if tran_settled else 0)
+    return num_measurements, start, orig_settled and tran_settled
+
+def summarize_log(log, start, num_used, amortization_count):
+    """
+    stream num_used of one harness's cycle counts from start on into running
+    sums and quantile sketches of the original, transformed and
+    transformed/original cycles
+    """
+    summary = dict()
+    for series in ['original', 'transformed', 'ratio']:
+        summary[series] = dict({'n': 0, 'sum': 0.0, 'sum_sq': 0.0, 'sum_log': 0.0,
+                                'sketch': cycle_stats.LogHistogram()})
+
+    seen = 0
+    stop = start + num_used
+    for orig, tran in iter_cycle_count_chunks(log, STREAM_CHUNK_LEN):
+        chunk_start = min(max(start - seen, 0), len(orig))
+        chunk_stop = min(max(stop - seen, 0), len(orig))
+        seen += len(orig)
+        if chunk_start == chunk_stop:
+            if seen >= stop:
+                break
+            continue
+        orig = remove_measurement_overhead(orig[chunk_start:chunk_stop].astype(np.float64), 0, amortization_count)
+        tran = remove_measurement_overhead(tran[chunk_start:chunk_stop].astype(np.float64), 0, amortization_count)
+        overhead_ratios = cycle_stats.paired_ratios(tran, orig)
+
+        for series, values in [('original', orig), ('transformed', tran), ('ratio', overhead_ratios)]:
+            stats = summary[series]
+            stats['n'] += len(values)
+            stats['sum'] += values.sum()
+            stats['sum_sq'] += np.square(values).sum()
+            stats['sum_log'] += np.log(values[values > 0]).sum()
+            stats['sketch'].add(values)
+
+    return summary
+
+def report_steady_states(steady_states):
+    """
+    warn about the harnesses that never settle and print how many warmup
+    runs the fuzz harnesses need, given opcode -> (steady state start, settled)
+    """
+    if not steady_states:
+        return
+    unsettled = sorted(opcode for opcode, (_, settled) in steady_states.items() if not settled)
+    for opcode in unsettled:
+        print(f"warning: {opcode} cycle counts never reach steady state, using all of them")
+    # the empty test only measures the measurement overhead, like in get_measurement_overhead
+    harness_starts = [start for opcode, (start, _) in steady_states.items() if opcode != EMPTY_TEST_OPCODE_NAME]
+    if harness_starts:
+        print(f"steady state starts after at most {max(harness_starts)} "
+              f"measurements, so the fuzz harnesses need that many warmup runs")
+
+def summary_mean_pstdev(stats):
+    mean = stats['sum'] / stats['n']
+    return mean, np.sqrt(max(stats['sum_sq'] / stats['n'] - mean**2, 0.0))
+
+def run_streaming(args, test_dir):
+    logs = sorted(test_dir.glob(LOG_FILE_EXTENSION))
+    opcodes = [get_opcode_name(log.name) for log in logs]
+    n = len(logs)
+    pool = ProcessPoolExecutor(max_workers=args.jobs) if args.jobs != 1 else None
+    pool_map = pool.map if pool is not None else map
+    try:
+        # two passes, so every harness is cut to the fewest steady state
+        # measurements of any of them, like the non-streaming path does
+        scans = dict(zip(opcodes, pool_map(scan_log, logs, [args.use_n_measurements] * n)))
+        steady_states = dict()
+        if args.use_n_measurements == -1:
+            steady_states = dict({opcode: (start, settled) for opcode, (_, start, settled) in scans.items()})
+        least_csv_lines, who_has_least = min((num_measurements - start, log.name) for log, (num_measurements, start, _)
+                                             in zip(logs, scans.values()))
+        print(f"Least number of opcodes ({least_csv_lines}) in {who_has_least}")
+        report_steady_states(steady_states)
+
+        starts = [start for _, start, _ in scans.values()]
+        summaries = dict(zip(opcodes, pool_map(summarize_log, logs, starts, [least_csv_lines] * n,
+                                               [args.amortization_count] * n)))
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    if EMPTY_TEST_OPCODE_NAME in summaries:
+        empty = summaries.pop(EMPTY_TEST_OPCODE_NAME)
+        overhead_stats = dict({key: empty['original'][key] + empty['transformed'][key]
+                               for key in ['n', 'sum', 'sum_sq']})
+        overhead_sketch = cycle_stats.LogHistogram().merge(empty['original']['sketch']).merge(
+            empty['transformed']['sketch'])
+        avg, pstdev = summary_mean_pstdev(overhead_stats)
+        median, = overhead_sketch.quantiles([0.5])
+        print(f"measurement overhead is: {avg} ± {pstdev}, median {median:.4g}")
+
+    overheads = []
+    avg_cycles = []
+    percentile_rows = []
+    for opcode, summary in summaries.items():
+        orig_avg, orig_pstd = summary_mean_pstdev(summary['original'])
+        transformed_avg, transformed_pstd = summary_mean_pstdev(summary['transformed'])
+        geomean_overhead = np.exp(summary['ratio']['sum_log'] / summary['ratio']['n'])
+        overheads.append((opcode, geomean_overhead))
+        avg_cycles.append((opcode, orig_avg, orig_pstd, transformed_avg, transformed_pstd))
+
+        print(f"{opcode}:")
+        print(f"\tN = {summary['original']['n']}")
+        if opcode in steady_states:
+            start, settled = steady_states[opcode]
+            print(f"\tsteady state start: {start}{'' if settled else ' (never settled)'}")
+        print(f"\toriginal: {orig_avg} ± {orig_pstd}")
+        print(f"\ttransformed: {transformed_avg} ± {transformed_pstd}")
+        print(f"\tgeomean_overhead: {geomean_overhead}")
+        for series in ['original', 'transformed', 'ratio']:
+            values = summary[series]['sketch'].quantiles([p / 100 for p in PERCENTILES])
+            percentile_rows.append([opcode, series] + values)
+            print(f"\t{series} " + ", ".join(f"p{p}: {value:.4g}" for p, value in zip(PERCENTILES, values)))
+
+    if args.overhead_out_csv_file is not None:
+        with open(args.overhead_out_csv_file, 'w') as fl:
+            for ohd in overheads:
+                fl.write(f"{ohd[0]},{ohd[1]}\n")
+    if args.avg_cycles_csv_file is not None:
+        with open(args.avg_cycles_csv_file, 'w') as fl:
+            for row in avg_cycles:
+                fl.write(",".join(map(str, row)) + "\n")
+    if args.percentiles_csv_file is not None:
+        with open(args.percentiles_csv_file, 'w') as fl:
+            fl.write("opcode,series," + ",".join(f"p{p}" for p in PERCENTILES) + "\n")
+            for row in percentile_rows:
+                fl.write(",".join(map(str, row)) + "\n")
 
 if __name__ == '__main__':
     args = argparser.parse_args()
@@ -84,10 +342,17 @@ if __name__ == '__main__':
         print(f"error: test dir {test_dir} doesn't exist or isn't dir")
         sys.exit(1)
 
+    if args.streaming:
+        run_streaming(args, test_dir)
+        sys.exit(0)
+
     # cycle counts
-    # this is a dict from: miropcode -> {"original", "transformed"} -> list of cycle counts
+    # this is a dict from: miropcode -> {"original", "transformed"} -> array of cycle counts
     cycle_counts = dict()
 
+    # miropcode -> (index of first steady state measurement, whether the measurements settled)
+    steady_states = dict()
+
     # since libfuzzer randomly generates input data,
     # there is no guarantee the num of csv lines in each log
     # file is the same. to avoid wrongly varying variation
@@ -100,59 +365,41 @@ if __name__ == '__main__':
     who_has_least = None
 
     for log in test_dir.glob(LOG_FILE_EXTENSION):
-        txt = log.read_text()
-        lines = txt.splitlines()
-        
-        origvtrans_store = dict()
-
-        try:
-            header_line_idx = lines.index(CSV_HEADER)
-        except ValueError: # if CSV_HEADER not found
-            print(f"File {log} does not have cycle count data (no csv header line found). "
-                  "Fuzzer num_runs parameter probably too low to hit counts")
-            sys.exit(1)
+        binary_file = log.with_suffix(CYCLE_COUNTS_BINARY_EXTENSION)
+        if binary_file.exists():
+            orig_counts, transformed_counts = read_binary_cycle_counts(binary_file)
+        else:
+            orig_counts, transformed_counts = read_text_cycle_counts(log)
 
-        line_num = header_line_idx + 1
-        cycle_count_lines = lines[line_num:]
+        origvtrans_store = dict()
+        origvtrans_store['original'] = orig_counts
+        origvtrans_store['transformed'] = transformed_counts
 
-        # discard the first 100 since the first 3 or so can have
-        # ramp up times (50,000 cycles which is unrealistic)
-        default_discard_amount = 100 # from the start
+        num_measurements = len(orig_counts)
         if use_n_measurements == -1:
-            cycle_count_lines = cycle_count_lines[default_discard_amount:]
+            # drop the warmup, the first few measurements can have ramp up
+            # times (50,000 cycles which is unrealistic). both series of a
+            # harness start at the later of their two steady state starts
+            orig_start, orig_settled = cycle_stats.steady_state_start(orig_counts)
+            tran_start, tran_settled = cycle_stats.steady_state_start(transformed_counts)
+            start = max(orig_start if orig_settled else 0, tran_start if tran_settled else 0)
+            steady_states[get_opcode_name(log.name)] = (start, orig_settled and tran_settled)
         else:
-            if use_n_measurements < len(cycle_count_lines):
+            if use_n_measurements < num_measurements:
                 # otherwise, take the last `use_n_measurements` measurements
-                cycle_count_lines = cycle_count_lines[-use_n_measurements:]
+                start = num_measurements - use_n_measurements
             else:
-                print(f"{log.name} only has {len(cycle_count_lines)} measurements, so cannot use --use-n-measurements={use_n_measurements}")
+                print(f"{log.name} only has {num_measurements} measurements, so cannot use --use-n-measurements={use_n_measurements}")
                 sys.exit(2)
 
+        for series in origvtrans_store:
+            origvtrans_store[series] = origvtrans_store[series][start:]
+
         # compute least_csv_lines
-        cur_num_csv_lines = len(cycle_count_lines)
+        cur_num_csv_lines = num_measurements - start
         if cur_num_csv_lines < least_csv_lines:
             least_csv_lines = cur_num_csv_lines
             who_has_least = log.name
-        
-        for line in cycle_count_lines:
-            if re.fullmatch(CSV_ROW_RE, line) is None:
-                print(f"line num {line_num} in file {log} is badly formed.")
-                print(f"the line is: {line}")
-                sys.exit(1)
-                    
-            orig_cycles, _, transformed_cycles = line.partition(",")
-            orig_cycles = int(orig_cycles)
-            transformed_cycles = int(transformed_cycles)
-
-            if 'original' not in origvtrans_store:
-                origvtrans_store['original'] = []
-            if 'transformed' not in origvtrans_store:
-                origvtrans_store['transformed'] = []
-                
-            origvtrans_store['original'].append(orig_cycles)
-            origvtrans_store['transformed'].append(transformed_cycles)
-
-            line_num += 1
 
         opcode_name = get_opcode_name(log.name)
         cycle_counts[opcode_name] = origvtrans_store
@@ -161,6 +408,8 @@ if __name__ == '__main__':
 
     print(f"Least number of opcodes ({least_csv_lines}) in {who_has_least}")
 
+    report_steady_states(steady_states)
+
     # truncate the number of counts on all measurements to
     # least_csv_lines
     for opcode in cycle_counts:
@@ -178,33 +427,40 @@ if __name__ == '__main__':
     for opcode in cycle_counts:
         origvtransformed = cycle_counts[opcode]
         
-        orig = list(remove_measurement_overhead(origvtransformed['original'],
-                                                measurement_overhead,
-                                                amortization_count))
-        tran = list(remove_measurement_overhead(origvtransformed['transformed'],
-                                                measurement_overhead,
-                                                amortization_count))
-
-        overhead_ratios = list(map(lambda x : 1 if x <= 0.0 else x,
-                                   ratio(tran, orig)))
-        
-        orig_avg, orig_pstd = statistics.fmean(orig), statistics.pstdev(orig)
-        transformed_avg, transformed_pstd = statistics.fmean(tran), statistics.pstdev(tran)
-        geomean_overhead = statistics.geometric_mean(overhead_ratios)
-
-        #         argparser.add_argument('--overhead-out-csv-file',
-        #                        action='store',
-        #                        default=None,
-        #                        type=str)
-        # argparser.add_argument('--avg-cycles-csv-file',
+        orig = remove_measurement_overhead(origvtransformed['original'].astype(np.float64),
+                                           measurement_overhead,
+                                           amortization_count)
+        tran = remove_measurement_overhead(origvtransformed['transformed'].astype(np.float64),
+                                           measurement_overhead,
+                                           amortization_count)
+
+        overhead_ratios = cycle_stats.paired_ratios(tran, orig)
+
+        orig_avg, orig_pstd = np.mean(orig), np.std(orig)
+        transformed_avg, transformed_pstd = np.mean(tran), np.std(tran)
+        orig_ci = cycle_stats.bootstrap_mean_ci(orig)
+        transformed_ci = cycle_stats.bootstrap_mean_ci(tran)
+        geomean_overhead = cycle_stats.geomean(overhead_ratios)
+        geomean_ci = cycle_stats.bootstrap_geomean_ci(overhead_ratios)
+
         overheads.append((opcode, geomean_overhead))
         orig_avg_cycles.append((opcode, orig_avg, orig_pstd))
         trans_avg_cycles.append((opcode, transformed_avg, transformed_pstd))
         print(f"{opcode}:")
-        print(f"\toriginal: {orig_avg} ± {orig_pstd}")
-        print(f"\ttransformed: {transformed_avg} ± {transformed_pstd}")
-        print(f"\tgeomean_overhead: {geomean_overhead}")
+        if opcode in steady_states:
+            start, settled = steady_states[opcode]
+            print(f"\tsteady state start: {start}{'' if settled else ' (never settled)'}")
+        print(f"\toriginal: {orig_avg} ± {orig_pstd} (95% CI [{orig_ci[0]:.6g}, {orig_ci[1]:.6g}], "
+              f"median {cycle_stats.median(orig)}, trimmed mean {cycle_stats.trimmed_mean(orig):.6g})")
+        print(f"\ttransformed: {transformed_avg} ± {transformed_pstd} (95% CI [{transformed_ci[0]:.6g}, {transformed_ci[1]:.6g}], "
+              f"median {cycle_stats.median(tran)}, trimmed mean {cycle_stats.trimmed_mean(tran):.6g})")
+        print(f"\tgeomean_overhead: {geomean_overhead} (95% CI [{geomean_ci[0]:.6g}, {geomean_ci[1]:.6g}])")
     if args.overhead_out_csv_file is not None:
         with open(args.overhead_out_csv_file, 'w') as fl:
             for ohd in overheads:
                 fl.write(f"{ohd[0]},{ohd[1]}\n")
+    if args.avg_cycles_csv_file is not None:
+        # opcode,orig_avg,orig_pstd,transformed_avg,transformed_pstd
+        with open(args.avg_cycles_csv_file, 'w') as fl:
+            for orig_avg, trans_avg in zip(orig_avg_cycles, trans_avg_cycles):
+                fl.write(f"{orig_avg[0]},{orig_avg[1]},{orig_avg[2]},{trans_avg[1]},{trans_avg[2]}\n")
@@ -120,61 +120,7 @@
 		       LAHF_SF(rax), LAHF_ZF(rax), LAHF_AF(rax), LAHF_PF(rax), LAHF_CF(rax)); \
 	}
 
-enum EFLAGS {
-	SF = 1,
-	ZF = 2,
-	AF = 3,
-	PF = 4,
-	CF = 5,
-};
-
-struct __attribute__((__packed__)) OutState {
-	uint64_t rax; // 0
-	uint64_t rbx; // 8
-	uint64_t rcx; // 10
-	uint64_t rdx; // 18
-	uint64_t rsp; // 20
-	uint64_t rbp; // 28
-	uint64_t rsi; // 30
-	uint64_t rdi; // 38
-	uint64_t r8; // 40
-	uint64_t r9; // 48
-	uint64_t r10; // 50
-	uint64_t r11; // 58
-	uint64_t r12; // 60
-	uint64_t r13; // 68
-	uint64_t r14; // 70
-	uint64_t r15; // 78
-
-	uint64_t lahf_rax_res; // idx 16 at 8 scale (80)
-	uint64_t padding;
-
-	uint64_t xmm0lo; // idx 17 at 8 scale (90
-	uint64_t xmm0hi; //
-
-	uint64_t xmm1lo; // A0
-	uint64_t xmm1hi; // 
-
-	uint64_t xmm2lo; // b0
-	uint64_t xmm2hi;
-
-	uint64_t xmm3lo; // c0
-	uint64_t xmm3hi;
-
-	uint64_t xmm4lo; // d0
-	uint64_t xmm4hi;
-
-	uint64_t xmm5lo; // e0
-	uint64_t xmm5hi;
-
-	uint64_t xmm6lo; // f0
-	uint64_t xmm6hi;
-
-	uint64_t xmm7lo; // 100
-	uint64_t xmm7hi; // 
-
-	uint64_t cyclecount; // 110
-};
+#include "outstate.h"
 
 static _Alignas(16) struct OutState original_state = { 0 };
 static _Alignas(16) struct OutState transformed_state = { 0 };
@@ -191,6 +137,37 @@ static uint64_t num_transformed_cycles = 0;
 
 static int measure_cycle_run = 0;
 
+/* if set with -cycle_counts_file=<path>, cycle counts are written there as
+   raw (orig, transformed) pairs of little endian uint64s instead of as csv
+   rows on stdout. see get_cycle_count_data.py */
+static const char* cycle_counts_file = 0;
+
+#define CYCLE_COUNTS_WRITE_BATCH 4096
+
+static void
+write_cycle_counts_binary()
+{
+	FILE* ff = fopen(cycle_counts_file, "wb");
+	assert(ff != NULL && "Couldn't open cycle counts file for writing");
+
+	/* x86-64 is little endian, so the uint64s are written as is */
+	uint64_t batch[2 * CYCLE_COUNTS_WRITE_BATCH];
+	for (uint64_t ii = 0; ii < num_orig_cycles; ii += CYCLE_COUNTS_WRITE_BATCH) {
+		uint64_t batch_len = num_orig_cycles - ii < CYCLE_COUNTS_WRITE_BATCH ?
+			num_orig_cycles - ii : CYCLE_COUNTS_WRITE_BATCH;
+		for (uint64_t jj = 0; jj < batch_len; ++jj) {
+			batch[2 * jj] = orig_cycles[ii + jj];
+			batch[2 * jj + 1] = transformed_cycles[ii + jj];
+		}
+		size_t written = fwrite(batch, 2 * sizeof(uint64_t), batch_len, ff);
+		assert(written == batch_len && "Couldn't write cycle counts file");
+	}
+
+	fclose(ff);
+	printf("orig,transformed cycle counts (%" PRIu64 ") written to %s\n",
+	       num_orig_cycles, cycle_counts_file);
+}
+
 static void
 print_cycle_counts()
 {
@@ -199,6 +176,11 @@ print_cycle_counts()
 	}
 	
 	assert(num_transformed_cycles == num_orig_cycles);
+	if (cycle_counts_file) {
+		write_cycle_counts_binary();
+		return;
+	}
+
 	printf("orig,transformed\n");
 	for (uint64_t ii = 0; ii < num_orig_cycles; ++ii) {
 		printf("%" PRIu64 ",%" PRIu64 "\n",
@@ -391,15 +373,21 @@ int
 LLVMFuzzerInitialize(int *argc, char ***argv)
 {
 	const char* measure_cycle_run_arg = "-measure_cycles";
+	const char* cycle_counts_file_pre = "-cycle_counts_file=";
 	
 	for (int ii = 0; ii < *argc; ++ii) {
 		char* arg = (*argv)[ii];
 		if (0 == strcmp(arg, measure_cycle_run_arg)) {
 			measure_cycle_run = 1;
-			return 0;
+		}
+
+		if (0 == strncmp(arg, cycle_counts_file_pre, strlen(cycle_counts_file_pre))) {
+			cycle_counts_file = arg + strlen(cycle_counts_file_pre);
 		}
 	}
-	
+
+	AUTOMATICALLY_REPLACE_ME_INITIALIZE
+
 	return 0;
 }
 
@@ -602,8 +590,10 @@ LLVMFuzzerTestOneInput(const uint8_t *data, size_t size)
 #ifdef OUR_MAIN
 static int runs = 0;
 static int max_len = 0;
+static unsigned int seed = 0;
 static const char* runs_pre = "-runs=";
 static const char* max_len_pre = "-max_len=";
+static const char* seed_pre = "-seed=";
 
 static void
 fill_buf_rand(uint8_t* restrict bytes, int bytes_len)
@@ -631,6 +621,14 @@ parse_args(int argc, const char** restrict argv)
 			assert(max_len >= INPUT_STATE_SIZE &&
 			       "Max len of fuzz buffer is less than needed");
 		}
+
+		/* like libFuzzer's -seed=, so repeated runs (e.g. the slices
+		   schedule_fuzzing.py runs) don't all test the same inputs */
+		if (0 == strncmp(argv[ii], seed_pre, strlen(seed_pre))) {
+			const char* seed_s = argv[ii] + strlen(seed_pre);
+			seed = strtoul(seed_s, &strtol_errs, 10);
+			assert(*strtol_errs == '\0' && "-seed=... param is invalid int");
+		}
 	}
 
 	assert(max_len != 0 && "Need -max_len=... cl arg");
@@ -644,8 +642,8 @@ main(int argc, char** argv)
 {
 	uint8_t bytes[INPUT_STATE_SIZE] = {0};
 
-	srand(RAND_SEED);
 	parse_args(argc, argv);
+	srand(seed ? seed : RAND_SEED);
 	LLVMFuzzerInitialize(&argc, &argv);
 	
 	int fuzz_result = 0;
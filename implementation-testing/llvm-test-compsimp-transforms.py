@@ -3,10 +3,11 @@ import re
 import subprocess
 import argparse
 import sys 
-from enum import Enum
 from pathlib import Path
 import logging
 
+import opcode_db
+
 logging.basicConfig(level=logging.INFO)
 
 argparser = argparse.ArgumentParser('generate test harnesses')
@@ -14,354 +15,52 @@ argparser.add_argument('--verifiable-tests',
                        action=argparse.BooleanOptionalAction)
 argparser.add_argument('--record-cycle-counts',
                        action=argparse.BooleanOptionalAction)
+argparser.add_argument('--single-harness',
+                       action=argparse.BooleanOptionalAction,
+                       help='generate one harness with a table of every opcode instead of one harness per opcode')
+argparser.add_argument('--pic',
+                       action=argparse.BooleanOptionalAction,
+                       help='build test.o position independent, for linking into ./differential_engine.py')
+argparser.add_argument('--opcode-db',
+                       default=opcode_db.DEFAULT_DB,
+                       help='opcode index to record the test functions in, see ./opcode_db.py')
 argparser.add_argument('test_dir')
 
-# some commented out. always an overapprox
-# since the BAP IR contains no info
-# e.g., about LEA, so heuristics have to be
-# used, and it's not worth tuning to all
-# of these
-sets_flags = {
-    "CMP64rm": ['CF', 'ZF'],
-    "CMP32rm": ['CF'],
-    "ADD32mi8": ['ZF'],
-    "ADD32ri8": ['CF', 'ZF'],
-    "ADD64ri8": ['ZF'],
-    "CMP64rr": ['CF', 'ZF'],
-    "TEST8ri": ['ZF'],
-    "AND64ri8": ['ZF'],
-    "CMP64mr": ['CF', 'ZF'],
-    "TEST8mi": ['ZF'],
-    "TEST8i8": ['ZF'],
-    "ADD64mi32": ['CF'],
-    "ADD64mr": ['CF'],
-    "ADD64rr": ['CF'],
-    "OR64rr": ['ZF'],
-    "SUB64rr": ['CF', 'ZF'],
-    "ADD64rm": ['CF'],
-    "AND32ri8": ['ZF'],
-    "CMP32rr": ['CF'],
-    "AND32mr": ['ZF']
-}
-
-# this is really "flags live in", so some commented out
-# that don't need to preserve
-preserves_flags = {
-    "SHR64ri": ['ZF'],
-    "MOV32mi": ['ZF'],
-    "MOV64mr": ['CF', 'ZF'],
-    "MOV32mr": ['CF', 'ZF'],
-    "MOVDQAmr": ['ZF'],
-    "LEA64r": ['CF'],
-}
-
-def flag(name):
-    """
-    indices of the flag name str correspond to C enum values
-    of enum EFLAGS in ./implementation-tester.c
-    """
-    flags_at_indices_of_enum_val = [None, 'SF', 'ZF', 'AF', 'PF', 'CF']
-    return flags_at_indices_of_enum_val.index(name)
-
-def is_duplicate_fn_def(symname):
-    if "." in symname:
-        logging.critical(f"symbol name {symname} is duplicate, not generating tests for it")
-        return True
-    return False
-
-def is_test_fn_line(line):
-    return "x86compsimptest" in line or \
-        "x86silentstorestest" in line
-
-def parse_nm_stdout(line):
-    """
-    lines of nm's stdout look like this:
-    00000000004020e0 t x86compsimptest_XOR16rr_original
-    00000000004020f0 t x86compsimptest_XOR16rr_transformed
-    OR
-    0000000000005a50 T x86silentstorestest_ADD64mr_original
-    0000000000005a60 T x86silentstorestest_ADD64mr_transformed
-
-    precondition: is_test_fn_line(line) returns True for this argument line
-    returns a tuple of (function_name_str, mir_opcode_str, is_cs, is_ss, s_original_bool, is_transformed_bool)
-
-    some functions have names like 
-    x86silentstorestest_MOV8mr_NOREX_original
-    x86silentstorestest_LEA64_32r_original
-    but these are special cased
-    """
-     # split on all whitespace
-    v_addr, _, func_name = line.split()
-    
-    # version is one of ['original', 'transformed']
-    if "NOREX" in func_name:
-        testtype, mir_opcode, dontcare, version = func_name.split('_')
-        mir_opcode = mir_opcode + '_NOREX'
-    elif "HIGHBYTE" in func_name:
-        testtype, mir_opcode, dontcare, version = func_name.split('_')
-        mir_opcode = mir_opcode + '_HIGHBYTE'
-    elif "LEA64_32r" in func_name:
-        testtype, mir_opcode, dontcare, version = func_name.split('_')
-        mir_opcode = mir_opcode + '_32r'
-    else:
-        testtype, mir_opcode, version = func_name.split('_')
-
-    is_ss = "silentstorestest" in testtype
-    is_cs = "compsimptest" in testtype
-    
-    is_original = version == 'original'
-    is_transformed = version == 'transformed'
-    
-    return (func_name, mir_opcode, is_cs, is_ss, is_original, is_transformed)
-
-class OperandType(Enum):
-    UNDEF = 0
-    REG = 1
-    IMM = 2
-    MEM = 3
-    def __str__(self):
-        if self.name == "UNDEF":
-            return "0"
-        else:
-            return f"\"{self.name}\""
-
-class MirOpcode():
-    def __init__(self, opcode_string):
-        self.string = opcode_string
-
-        self.is_vector = False
-        self.is_push = False
-        self.is_implicit_first_arg = False # like MUL, IMUL, DIV, IDIV
-        self.is_test = False
-        self.is_cmp = False
-        self.depends_on_carry_flag = False
-        self.uses_memory = False
-        self.uses_imm = False
-
-        self.preserve_flags = None
-        self.set_flags = None
-        
-        self.bitwidth = None
-        self.opcode = None
-        self.operand_info_str = None
-        self.operand_types = []
-
-        self.__parse()
-        self.__set_sets_flags()
-        self.__set_preserves_flags()
-
-    def must_preserve_flags(self):
-        return self.preserve_flags is not None
-
-    def must_set_flags(self):
-        return self.set_flags is not None
-
-    def __set_sets_flags(self):
-        """
-        precondition: self.string already set
-        """
-        if self.string in sets_flags:
-            flags_need_to_be_set = sets_flags[self.string]
-            self.set_flags = list(map(flag, flags_need_to_be_set))
-
-    def __set_preserves_flags(self):
-        """
-        precondition: self.string already set
-        """
-        if self.string in preserves_flags:
-            flags_preserved = preserves_flags[self.string]
-            self.preserve_flags = list(map(flag, flags_preserved))
-
-    def __set_is_vector_op(self):
-        """
-        a vector instruction starts with V... or P... and has no bitwidth
-        (or is MOVDQA, MOVAPS, MOVDQU, MOVUPS) from our list of
-        transforms needed. these will be hardcoded below
-        """
-        starts_with_v = self.string[0] == 'V'
-        starts_with_p = self.string[0] == 'P'
-        is_our_vector_mov = "MOVDQA" in self.string or \
-            "MOVAPS" in self.string or \
-            "MOVDQU" in self.string or \
-            "MOVUPS" in self.string
-        
-        has_bitwidth = False
-        for letter in self.string:
-            if letter.isnumeric():
-                has_bitwidth = True
-                
-        self.is_vector = not has_bitwidth and (starts_with_p or starts_with_v or is_our_vector_mov)
-        return self.is_vector
-
-    def __set_is_push(self):
-        self.is_push = self.string.startswith('PUSH')
-        return self.is_push
-
-    def __set_is_test(self):
-        self.is_test = self.string.startswith('TEST')
-        return self.is_test
-
-    def __set_is_cmp(self):
-        self.is_cmp = self.string.startswith('CMP')
-        return self.is_cmp
-
-    def __handle_IMUL_special_case(self):
-        """
-        special casing for IMUL which can be implicit or explicit
-        depending on operand types
-
-        precondition: self.__set_is_implicit_first_arg() already ran
-        
-        to be called in self.__parse_operand_info_str()
-        """
-        if "IMUL" in self.string:
-            self.is_implicit_first_arg = 1 == len(self.operand_types)
-
-    def __set_is_implicit_first_arg(self):
-        self.is_implicit_first_arg = self.string.startswith('MUL') or \
-            self.string.startswith('IMUL') or \
-            self.string.startswith('DIV') or \
-            self.string.startswith('IDIV') or \
-            'HIGHBYTE' in self.string
-        return self.is_implicit_first_arg
-
-    def __find_index_of_insn_bitwidth(self):
-        """
-        precondition: not self.is_vector
-        """
-        for idx, letter in enumerate(self.string):
-            if letter.isnumeric():
-                return idx
-        raise Exception(f"couldn't find idx of first number for opcode string: {self.string}")
-
-    def __find_last_index_of_insn_bitwidth(self, start_idx):
-        """
-        precondition: not self.is_vector
-        precondition: start_idx = self.__find_index_of_insn_bitwidth()
-        """
-        for idx, letter in enumerate(self.string[start_idx:]):
-            if not letter.isnumeric():
-                return start_idx + idx
-        raise Exception(f"couldn't find end of insn bitwidth for opcode string: {self.string}")
-
-    def __split_opcode_str(self):
-        """
-        precondition: all the __set_is_* functions already ran
-        """
-        if not self.is_vector:
-            bitwidth_start_idx = self.__find_index_of_insn_bitwidth()
-            after_bitwidth_idx = self.__find_last_index_of_insn_bitwidth(bitwidth_start_idx)
-            logging.debug(f"start idx: {bitwidth_start_idx}; after_idx: {after_bitwidth_idx}")
-            
-            self.opcode = self.string[:bitwidth_start_idx]
-            self.bitwidth = self.string[bitwidth_start_idx:after_bitwidth_idx]
-            self.operand_info_str = self.string[after_bitwidth_idx:]
-            logging.debug(f"all: {self.string}; opcode: {self.opcode}; bitwidth: {self.bitwidth}; operand_info: {self.operand_info_str}")
-        else:
-            # this prints twice currently, but leaving it in just in case it isn't fixed in both places
-            # find first lower case letter
-            idx_start_operand_types = None
-            for idx, letter in enumerate(self.string):
-                if letter.islower():
-                    idx_start_operand_types = idx
-                    break
-                
-            if idx_start_operand_types is None:
-                logging.critical(f"couldnt parse vector MIR opcode string: {self.string}")
-                
-            self.opcode = self.string[:idx_start_operand_types]
-            self.operand_info_str = self.string[idx_start_operand_types:]
-            logging.debug(f"all: {self.string}; opcode: {self.opcode}; bitwidth: ?; operand_info: {self.operand_info_str}")
-                
-
-    def __set_depends_on_carry_flag(self):
-        """
-        precondition: self.__split_opcode_str() already ran
-        """
-        self.depends_on_carry_flag = self.opcode == "SBB" or \
-            self.opcode == "ADC"
-        return self.depends_on_carry_flag
-
-    def __parse_operand_info_str(self):
-        imm_width = []
-
-        last_operand_was_imm = False
-        for letter in self.operand_info_str:
-            if last_operand_was_imm and letter.isnumeric():
-                imm_width.append(letter)
-                continue
-                
-            if 'r' == letter:
-                last_operand_was_imm = False
-                self.operand_types.append(OperandType.REG)
-            if 'm' == letter:
-                last_operand_was_imm = False
-                self.operand_types.append(OperandType.MEM)
-            if 'i'  == letter:
-                last_operand_was_imm = True
-                self.operand_types.append(OperandType.IMM)
-
-        self.__handle_IMUL_special_case()
-
-        if self.is_implicit_first_arg and "HIGHBYTE" not in self.string:
-            # like MUL, IMUL (conditionally),
-            # DIV, IDIV: dst is REG, first src is REG
-            self.operand_types.insert(0, OperandType.REG)
-            self.operand_types.insert(0, OperandType.REG)
-
-        while len(self.operand_types) < 5:
-            self.operand_types.append(OperandType.UNDEF)
-        
-    def __parse(self):
-        """
-        opcode seems to be until the first number of the bitwidth for non-vector insns or
-           until the first lowercase letter for vector instructions (these vector insns
-           have an uppercase letter that indicates the size immediately after the opcode)
-        """
-        self.__set_is_vector_op()
-        self.__set_is_push()
-        self.__set_is_test()
-        self.__set_is_cmp()
-        self.__set_is_implicit_first_arg()
-
-        self.__split_opcode_str()
-
-        self.__set_depends_on_carry_flag()
-        
-        self.__parse_operand_info_str()
-        
-        logging.debug(f"operand types are: {self.operand_types}")
+# --single-harness writes <this>-implementation-tester.c
+SINGLE_HARNESS_NAME = "opcode-table"
 
 def read_test_harness_template(filename):
     with open(filename, "r") as f:
         return f.read()
 
-def generate_finalized_code_for_opcode(opcode_str, file_contents, orig_sym_name, trans_sym_name):
-    opcode = MirOpcode(opcode_str)
+def test_fn_prototype(sym_name):
+    return f"void {sym_name}(struct OutState* outstate, uint64_t i0, uint64_t i1, uint64_t i2, uint64_t i3, uint64_t i4);"
+
+def operand_types_initializer(opcode):
+    return "{ " + ", ".join(map(lambda optype: str(optype), opcode.operand_types)) + " }"
+
+def flags_initializer(flags):
+    """
+    flags is None or a list of enum EFLAGS values, see mir_opcode.flag()
+    """
+    if flags is None:
+        return "{0}"
+    return "{" + ", ".join(map(str, flags)) + ", 0, }"
 
+def generate_finalized_code_for_opcode(opcode, file_contents, orig_sym_name, trans_sym_name):
     prototypes = [
-        f"void {orig_sym_name}(struct OutState* outstate, uint64_t i0, uint64_t i1, uint64_t i2, uint64_t i3, uint64_t i4);",
-        f"void {trans_sym_name}(struct OutState* outstate, uint64_t i0, uint64_t i1, uint64_t i2, uint64_t i3, uint64_t i4);"
+        test_fn_prototype(orig_sym_name),
+        test_fn_prototype(trans_sym_name)
     ]
     prototypes_str = "\n".join(prototypes)
 
-    operand_types = list(map(lambda optype: str(optype), opcode.operand_types))
-    operand_types_str = ", ".join(operand_types)
-    operand_types_defines_str = "const char* operand_types[5] = { " + operand_types_str + " };"
+    operand_types_defines_str = "const char* operand_types[5] = " + operand_types_initializer(opcode) + ";"
 
-    preserve_flags_str = "int must_preserve_flags = 0;\n" + \
-        "enum EFLAGS preserves[5] = {0};\n"
-    if opcode.must_preserve_flags():
-        preserve_flags_str = "int must_preserve_flags = 1;\n"
-        flags_str = ", ".join(map(str, opcode.preserve_flags))
-        preserve_flags_str += "enum EFLAGS preserves[5] = {" + flags_str + ", 0, };\n"
+    preserve_flags_str = f"int must_preserve_flags = {1 if opcode.must_preserve_flags() else 0};\n" + \
+        "enum EFLAGS preserves[5] = " + flags_initializer(opcode.preserve_flags) + ";\n"
 
-    set_flags_str = "int must_set_flags = 0;\n" + \
-        "enum EFLAGS sets[5] = {0};\n"
-    if opcode.must_set_flags():
-        set_flags_str = "int must_set_flags = 1;\n"
-        flags_str = ", ".join(map(str, opcode.set_flags))
-        set_flags_str += "enum EFLAGS sets[5] = {" + flags_str + ", 0, };\n"
+    set_flags_str = f"int must_set_flags = {1 if opcode.must_set_flags() else 0};\n" + \
+        "enum EFLAGS sets[5] = " + flags_initializer(opcode.set_flags) + ";\n"
 
     is_vector_op_str = f"int is_vector = {1 if opcode.is_vector else 0};"
 
@@ -374,6 +73,8 @@ def generate_finalized_code_for_opcode(opcode_str, file_contents, orig_sym_name,
     file_contents = file_contents.replace("AUTOMATICALLY_REPLACE_ME_PROTOTYPES",
                                           all_filler_code)
 
+    file_contents = file_contents.replace("AUTOMATICALLY_REPLACE_ME_INITIALIZE", "")
+
     # use last arg (r9) as implicit arg value in rax
     orig_set_eax_for_implicit_calls = """\
                 __asm__ __inline__ __volatile__(
@@ -425,6 +126,93 @@ def generate_finalized_code_for_opcode(opcode_str, file_contents, orig_sym_name,
     
     return file_contents
 
+def generate_opcode_table_code(harnesses, file_contents):
+    """
+    fill the template with a table of every original/transformed pair instead
+    of a single pair. the harness picks its pair at runtime by name or index,
+    see ./opcode_trampoline.h
+
+    harnesses is a list of (harness name, e.g. cs-ADD64rr, MirOpcode,
+    original symbol name, transformed symbol name)
+    """
+    prototypes = []
+    entries = []
+    for harness_name, opcode, orig_sym_name, trans_sym_name in harnesses:
+        prototypes.append(test_fn_prototype(orig_sym_name))
+        prototypes.append(test_fn_prototype(trans_sym_name))
+        entries.append("\t{\n" +
+                       f"\t\t.name = \"{harness_name}\",\n" +
+                       f"\t\t.original = {orig_sym_name},\n" +
+                       f"\t\t.transformed = {trans_sym_name},\n" +
+                       f"\t\t.operand_types = {operand_types_initializer(opcode)},\n" +
+                       f"\t\t.must_preserve_flags = {1 if opcode.must_preserve_flags() else 0},\n" +
+                       f"\t\t.preserves = {flags_initializer(opcode.preserve_flags)},\n" +
+                       f"\t\t.must_set_flags = {1 if opcode.must_set_flags() else 0},\n" +
+                       f"\t\t.sets = {flags_initializer(opcode.set_flags)},\n" +
+                       f"\t\t.is_vector = {1 if opcode.is_vector else 0},\n" +
+                       f"\t\t.is_implicit_first_arg = {1 if opcode.is_implicit_first_arg else 0},\n" +
+                       "\t},")
+
+    # the rest of the template reads the settings of the selected opcode
+    # through the same names the per opcode harnesses define as globals
+    table_code = "\n".join([
+        "#include \"opcode_trampoline.h\"",
+        "",
+        "\n".join(prototypes),
+        "",
+        "static const struct OpcodeEntry opcode_table[] = {",
+        "\n".join(entries),
+        "};",
+        "#define NUM_OPCODES (sizeof(opcode_table) / sizeof(opcode_table[0]))",
+        "",
+        "static const struct OpcodeEntry* selected_opcode = 0;",
+        "#define operand_types (selected_opcode->operand_types)",
+        "#define must_preserve_flags (selected_opcode->must_preserve_flags)",
+        "#define preserves (selected_opcode->preserves)",
+        "#define must_set_flags (selected_opcode->must_set_flags)",
+        "#define sets (selected_opcode->sets)",
+        "#define is_vector (selected_opcode->is_vector)",
+        ""
+    ])
+
+    file_contents = file_contents.replace("AUTOMATICALLY_REPLACE_ME_PROTOTYPES", table_code)
+
+    file_contents = file_contents.replace("AUTOMATICALLY_REPLACE_ME_INITIALIZE",
+                                          "selected_opcode = select_opcode_entry(opcode_table, NUM_OPCODES, *argc, *argv);")
+
+    # use last arg (r9) as implicit arg value in rax, like the per opcode harnesses
+    orig_call = """\
+	(void) rax_save; /* the trampoline sets rax and the flags itself */
+	opcode_trampoline(selected_opcode->original, &original_state,
+			  orig_arg0, orig_arg1, orig_arg2, orig_arg3, orig_arg4,
+			  selected_opcode->is_implicit_first_arg ? orig_arg4 : 0, lahf_load);
+"""
+
+    trans_call = """\
+	opcode_trampoline(selected_opcode->transformed, &transformed_state,
+			  trans_arg0, trans_arg1, trans_arg2, trans_arg3, trans_arg4,
+			  selected_opcode->is_implicit_first_arg ? trans_arg4 : 0, lahf_load);
+"""
+
+    file_contents = file_contents.replace("AUTOMATICALLY_REPLACE_ME_ORIG_CALLS", orig_call)
+
+    file_contents = file_contents.replace("AUTOMATICALLY_REPLACE_ME_TRANS_CALLS", trans_call)
+
+    return file_contents
+
+def link_single_harness_names(test_dir, harness_names, single_harness_file_name, harness_file_name):
+    """
+    symlink each per opcode harness name to the single harness binary, which
+    picks its opcode from the name it is run as. so the build script runs, and
+    get_cycle_count_data.py reads the logs of, the same names in both modes
+    """
+    single_harness_binary = Path(single_harness_file_name).stem
+    for harness_name in harness_names:
+        link = test_dir / f"{harness_name}-{Path(harness_file_name).stem}"
+        if link.is_symlink() or link.exists():
+            link.unlink()
+        link.symlink_to(single_harness_binary)
+
 if __name__ == '__main__':
     args = argparser.parse_args()
 
@@ -444,30 +232,33 @@ if __name__ == '__main__':
     cc_optional_flags = "-mllvm -x86-cs-test-cycle-counts -mllvm -x86-ss-test-cycle-counts" if args.record_cycle_counts else ""
     verifiable_tests_flags = "-mllvm -x86-ss-verifiable-tests -mllvm -x86-cs-verifiable-tests" if args.verifiable_tests else ""
 
-    compile_cmd = f"{CC} -O0 {verifiable_tests_flags} -mllvm -x86-ss -mllvm -x86-cs -mllvm -x86-cs-test -mllvm -global-scratch -mllvm -gs-size=8 {cc_optional_flags} -c {tempFile} -o {tempObjFile}"
+    pic_flags = "-fPIC" if args.pic else ""
+
+    compile_cmd = f"{CC} -O0 {pic_flags} {verifiable_tests_flags} -mllvm -x86-ss -mllvm -x86-cs -mllvm -x86-cs-test -mllvm -global-scratch -mllvm -gs-size=8 {cc_optional_flags} -c {tempFile} -o {tempObjFile}"
     subprocess.run(compile_cmd, shell=True, check=True)
 
-    nm_process = subprocess.run(f"nm {tempObjFile}", check=True, shell=True, text=True, stdout=subprocess.PIPE)
+    db = opcode_db.connect(args.opcode_db)
+    with db:
+        opcode_db.ingest_test_obj(db, tempObjFile, force=True)
 
     test_harness_template_filename = "implementation-tester.c"
     test_harness_template_file_contents = read_test_harness_template(test_harness_template_filename)
     
-    for line in nm_process.stdout.split('\n'):
-        # this will see each *_original and *_transformed pair. just do this
-        # once for each pair by skipping processing the *_transformed string
-        if not is_test_fn_line(line) or "_transformed" in line:
+    harnesses = []
+    for mir_opcode, test_type, original_symbol_name, transformed_symbol_name in opcode_db.test_functions(db):
+        opcode = opcode_db.load_opcode(db, mir_opcode)
+        if opcode is None:
+            logging.critical(f"couldn't parse MIR opcode {mir_opcode}, skipping its test functions")
             continue
-        
-        func_name, mir_opcode, is_cs, is_ss, is_original, is_transformed = parse_nm_stdout(line)
 
-        if is_duplicate_fn_def(func_name):
-            continue
+        harness_name = f"{test_type}-{mir_opcode}"
 
-        original_symbol_name = func_name
-        transformed_symbol_name = original_symbol_name.replace("original", "transformed")
+        if args.single_harness:
+            harnesses.append((harness_name, opcode, original_symbol_name, transformed_symbol_name))
+            continue
 
         final_code = generate_finalized_code_for_opcode(
-            mir_opcode,
+            opcode,
             test_harness_template_file_contents,
             original_symbol_name,
             transformed_symbol_name
@@ -476,11 +267,21 @@ if __name__ == '__main__':
         if final_code is None:
             continue
 
-        test_type = "cs" if is_cs else "ss"
-        new_file_name = f"{str(test_dir)}/{test_type}-{mir_opcode}-{test_harness_template_filename}"
+        new_file_name = f"{str(test_dir)}/{harness_name}-{test_harness_template_filename}"
         
         if Path(new_file_name).exists():
             Path(new_file_name).unlink()
             
         with open(new_file_name, "w") as testfile:
             testfile.write(final_code)
+
+    if args.single_harness:
+        single_harness_file_name = f"{SINGLE_HARNESS_NAME}-{test_harness_template_filename}"
+        final_code = generate_opcode_table_code(harnesses, test_harness_template_file_contents)
+
+        with open(test_dir / single_harness_file_name, "w") as testfile:
+            testfile.write(final_code)
+
+        link_single_harness_names(test_dir, [harness[0] for harness in harnesses],
+                                  single_harness_file_name, test_harness_template_filename)
+        logging.info(f"generated single harness {test_dir / single_harness_file_name} for {len(harnesses)} opcodes")
@@ -0,0 +1,355 @@
+"""
+MIR opcode metadata parsed from opcode strings like ADD64rr or VPXORrr, and
+the names of the test functions ./llvm-test-compsimp-transforms.py generates
+harnesses for. ./opcode_db.py saves all of it so the implementation testing
+scripts don't parse opcodes again on every run.
+"""
+from enum import Enum
+import logging
+
+# some commented out. always an overapprox
+# since the BAP IR contains no info
+# e.g., about LEA, so heuristics have to be
+# used, and it's not worth tuning to all
+# of these
+sets_flags = {
+    "CMP64rm": ['CF', 'ZF'],
+    "CMP32rm": ['CF'],
+    "ADD32mi8": ['ZF'],
+    "ADD32ri8": ['CF', 'ZF'],
+    "ADD64ri8": ['ZF'],
+    "CMP64rr": ['CF', 'ZF'],
+    "TEST8ri": ['ZF'],
+    "AND64ri8": ['ZF'],
+    "CMP64mr": ['CF', 'ZF'],
+    "TEST8mi": ['ZF'],
+    "TEST8i8": ['ZF'],
+    "ADD64mi32": ['CF'],
+    "ADD64mr": ['CF'],
+    "ADD64rr": ['CF'],
+    "OR64rr": ['ZF'],
+    "SUB64rr": ['CF', 'ZF'],
+    "ADD64rm": ['CF'],
+    "AND32ri8": ['ZF'],
+    "CMP32rr": ['CF'],
+    "AND32mr": ['ZF']
+}
+
+# this is really "flags live in", so some commented out
+# that don't need to preserve
+preserves_flags = {
+    "SHR64ri": ['ZF'],
+    "MOV32mi": ['ZF'],
+    "MOV64mr": ['CF', 'ZF'],
+    "MOV32mr": ['CF', 'ZF'],
+    "MOVDQAmr": ['ZF'],
+    "LEA64r": ['CF'],
+}
+
+def flag(name):
+    """
+    indices of the flag name str correspond to C enum values
+    of enum EFLAGS in ./implementation-tester.c
+    """
+    flags_at_indices_of_enum_val = [None, 'SF', 'ZF', 'AF', 'PF', 'CF']
+    return flags_at_indices_of_enum_val.index(name)
+
+def is_duplicate_fn_def(symname):
+    if "." in symname:
+        logging.critical(f"symbol name {symname} is duplicate, not generating tests for it")
+        return True
+    return False
+
+def is_test_fn_line(line):
+    return "x86compsimptest" in line or \
+        "x86silentstorestest" in line
+
+def parse_nm_stdout(line):
+    """
+    lines of nm's stdout look like this:
+    00000000004020e0 t x86compsimptest_XOR16rr_original
+    00000000004020f0 t x86compsimptest_XOR16rr_transformed
+    OR
+    0000000000005a50 T x86silentstorestest_ADD64mr_original
+    0000000000005a60 T x86silentstorestest_ADD64mr_transformed
+
+    precondition: is_test_fn_line(line) returns True for this argument line
+    returns a tuple of (function_name_str, mir_opcode_str, is_cs, is_ss, s_original_bool, is_transformed_bool)
+    """
+     # split on all whitespace
+    v_addr, _, func_name = line.split()
+    return parse_test_fn_name(func_name)
+
+def parse_test_fn_name(func_name):
+    """
+    precondition: is_test_fn_line(func_name) returns True
+    returns the same tuple as parse_nm_stdout
+
+    some functions have names like 
+    x86silentstorestest_MOV8mr_NOREX_original
+    x86silentstorestest_LEA64_32r_original
+    but these are special cased
+    """
+    # version is one of ['original', 'transformed']
+    if "NOREX" in func_name:
+        testtype, mir_opcode, dontcare, version = func_name.split('_')
+        mir_opcode = mir_opcode + '_NOREX'
+    elif "HIGHBYTE" in func_name:
+        testtype, mir_opcode, dontcare, version = func_name.split('_')
+        mir_opcode = mir_opcode + '_HIGHBYTE'
+    elif "LEA64_32r" in func_name:
+        testtype, mir_opcode, dontcare, version = func_name.split('_')
+        mir_opcode = mir_opcode + '_32r'
+    else:
+        testtype, mir_opcode, version = func_name.split('_')
+
+    is_ss = "silentstorestest" in testtype
+    is_cs = "compsimptest" in testtype
+    
+    is_original = version == 'original'
+    is_transformed = version == 'transformed'
+    
+    return (func_name, mir_opcode, is_cs, is_ss, is_original, is_transformed)
+
+class OperandType(Enum):
+    UNDEF = 0
+    REG = 1
+    IMM = 2
+    MEM = 3
+    def __str__(self):
+        if self.name == "UNDEF":
+            return "0"
+        else:
+            return f"\"{self.name}\""
+
+class MirOpcode():
+    def __init__(self, opcode_string):
+        self.string = opcode_string
+
+        self.is_vector = False
+        self.is_push = False
+        self.is_implicit_first_arg = False # like MUL, IMUL, DIV, IDIV
+        self.is_test = False
+        self.is_cmp = False
+        self.depends_on_carry_flag = False
+        self.uses_memory = False
+        self.uses_imm = False
+
+        self.preserve_flags = None
+        self.set_flags = None
+        
+        self.bitwidth = None
+        self.opcode = None
+        self.operand_info_str = None
+        self.operand_types = []
+
+        self.__parse()
+        self.__set_sets_flags()
+        self.__set_preserves_flags()
+
+    @classmethod
+    def from_record(cls, record):
+        """
+        get a MirOpcode from the fields saved by ./opcode_db.py without parsing
+        the opcode string again
+        """
+        opcode = cls.__new__(cls)
+        opcode.__dict__.update(record)
+        return opcode
+
+    def category(self):
+        """
+        the cs ablation of ../eval.sh whose transforms cover this opcode, which
+        ../attribute_overhead.py breaks the predicted overhead down by
+        """
+        if self.string.startswith('MUL64') or self.string.startswith('IMUL64'):
+            return 'cs_mul64'
+        if self.string.startswith('LEA'):
+            return 'cs_lea'
+        if self.is_vector:
+            return 'cs_vector'
+        if self.bitwidth == '64':
+            return 'cs_other_64'
+        return 'cs_other'
+
+    def must_preserve_flags(self):
+        return self.preserve_flags is not None
+
+    def must_set_flags(self):
+        return self.set_flags is not None
+
+    def __set_sets_flags(self):
+        """
+        precondition: self.string already set
+        """
+        if self.string in sets_flags:
+            flags_need_to_be_set = sets_flags[self.string]
+            self.set_flags = list(map(flag, flags_need_to_be_set))
+
+    def __set_preserves_flags(self):
+        """
+        precondition: self.string already set
+        """
+        if self.string in preserves_flags:
+            flags_preserved = preserves_flags[self.string]
+            self.preserve_flags = list(map(flag, flags_preserved))
+
+    def __set_is_vector_op(self):
+        """
+        a vector instruction starts with V... or P... and has no bitwidth
+        (or is MOVDQA, MOVAPS, MOVDQU, MOVUPS) from our list of
+        transforms needed. these will be hardcoded below
+        """
+        starts_with_v = self.string[0] == 'V'
+        starts_with_p = self.string[0] == 'P'
+        is_our_vector_mov = "MOVDQA" in self.string or \
+            "MOVAPS" in self.string or \
+            "MOVDQU" in self.string or \
+            "MOVUPS" in self.string
+        
+        has_bitwidth = False
+        for letter in self.string:
+            if letter.isnumeric():
+                has_bitwidth = True
+                
+        self.is_vector = not has_bitwidth and (starts_with_p or starts_with_v or is_our_vector_mov)
+        return self.is_vector
+
+    def __set_is_push(self):
+        self.is_push = self.string.startswith('PUSH')
+        return self.is_push
+
+    def __set_is_test(self):
+        self.is_test = self.string.startswith('TEST')
+        return self.is_test
+
+    def __set_is_cmp(self):
+        self.is_cmp = self.string.startswith('CMP')
+        return self.is_cmp
+
+    def __handle_IMUL_special_case(self):
+        """
+        special casing for IMUL which can be implicit or explicit
+        depending on operand types
+
+        precondition: self.__set_is_implicit_first_arg() already ran
+        
+        to be called in self.__parse_operand_info_str()
+        """
+        if "IMUL" in self.string:
+            self.is_implicit_first_arg = 1 == len(self.operand_types)
+
+    def __set_is_implicit_first_arg(self):
+        self.is_implicit_first_arg = self.string.startswith('MUL') or \
+            self.string.startswith('IMUL') or \
+            self.string.startswith('DIV') or \
+            self.string.startswith('IDIV') or \
+            'HIGHBYTE' in self.string
+        return self.is_implicit_first_arg
+
+    def __find_index_of_insn_bitwidth(self):
+        """
+        precondition: not self.is_vector
+        """
+        for idx, letter in enumerate(self.string):
+            if letter.isnumeric():
+                return idx
+        raise Exception(f"couldn't find idx of first number for opcode string: {self.string}")
+
+    def __find_last_index_of_insn_bitwidth(self, start_idx):
+        """
+        precondition: not self.is_vector
+        precondition: start_idx = self.__find_index_of_insn_bitwidth()
+        """
+        for idx, letter in enumerate(self.string[start_idx:]):
+            if not letter.isnumeric():
+                return start_idx + idx
+        raise Exception(f"couldn't find end of insn bitwidth for opcode string: {self.string}")
+
+    def __split_opcode_str(self):
+        """
+        precondition: all the __set_is_* functions already ran
+        """
+        if not self.is_vector:
+            bitwidth_start_idx = self.__find_index_of_insn_bitwidth()
+            after_bitwidth_idx = self.__find_last_index_of_insn_bitwidth(bitwidth_start_idx)
+            logging.debug(f"start idx: {bitwidth_start_idx}; after_idx: {after_bitwidth_idx}")
+            
+            self.opcode = self.string[:bitwidth_start_idx]
+            self.bitwidth = self.string[bitwidth_start_idx:after_bitwidth_idx]
+            self.operand_info_str = self.string[after_bitwidth_idx:]
+            logging.debug(f"all: {self.string}; opcode: {self.opcode}; bitwidth: {self.bitwidth}; operand_info: {self.operand_info_str}")
+        else:
+            # this prints twice currently, but leaving it in just in case it isn't fixed in both places
+            # find first lower case letter
+            idx_start_operand_types = None
+            for idx, letter in enumerate(self.string):
+                if letter.islower():
+                    idx_start_operand_types = idx
+                    break
+                
+            if idx_start_operand_types is None:
+                logging.critical(f"couldnt parse vector MIR opcode string: {self.string}")
+                
+            self.opcode = self.string[:idx_start_operand_types]
+            self.operand_info_str = self.string[idx_start_operand_types:]
+            logging.debug(f"all: {self.string}; opcode: {self.opcode}; bitwidth: ?; operand_info: {self.operand_info_str}")
+                
+
+    def __set_depends_on_carry_flag(self):
+        """
+        precondition: self.__split_opcode_str() already ran
+        """
+        self.depends_on_carry_flag = self.opcode == "SBB" or \
+            self.opcode == "ADC"
+        return self.depends_on_carry_flag
+
+    def __parse_operand_info_str(self):
+        imm_width = []
+
+        last_operand_was_imm = False
+        for letter in self.operand_info_str:
+            if last_operand_was_imm and letter.isnumeric():
+                imm_width.append(letter)
+                continue
+                
+            if 'r' == letter:
+                last_operand_was_imm = False
+                self.operand_types.append(OperandType.REG)
+            if 'm' == letter:
+                last_operand_was_imm = False
+                self.operand_types.append(OperandType.MEM)
+            if 'i'  == letter:
+                last_operand_was_imm = True
+                self.operand_types.append(OperandType.IMM)
+
+        self.__handle_IMUL_special_case()
+
+        if self.is_implicit_first_arg and "HIGHBYTE" not in self.string:
+            # like MUL, IMUL (conditionally),
+            # DIV, IDIV: dst is REG, first src is REG
+            self.operand_types.insert(0, OperandType.REG)
+            self.operand_types.insert(0, OperandType.REG)
+
+        while len(self.operand_types) < 5:
+            self.operand_types.append(OperandType.UNDEF)
+        
+    def __parse(self):
+        """
+        opcode seems to be until the first number of the bitwidth for non-vector insns or
+           until the first lowercase letter for vector instructions (these vector insns
+           have an uppercase letter that indicates the size immediately after the opcode)
+        """
+        self.__set_is_vector_op()
+        self.__set_is_push()
+        self.__set_is_test()
+        self.__set_is_cmp()
+        self.__set_is_implicit_first_arg()
+
+        self.__split_opcode_str()
+
+        self.__set_depends_on_carry_flag()
+        
+        self.__parse_operand_info_str()
+        
+        logging.debug(f"operand types are: {self.operand_types}")
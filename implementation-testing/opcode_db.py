@@ -0,0 +1,367 @@
+import argparse
+import csv
+import hashlib
+import json
+import logging
+import re
+import sqlite3
+import subprocess
+from collections import Counter
+from pathlib import Path
+
+import mir_opcode
+from mir_opcode import MirOpcode, OperandType, is_duplicate_fn_def, is_test_fn_line, parse_nm_stdout
+
+logging.basicConfig(level=logging.INFO)
+
+usage_msg = """
+index the MIR opcodes the implementation testing scripts work with in one
+local sqlite database: what MirOpcode parses from each opcode string, which
+opcodes have test functions in test.o, how often each is alerted on, and how
+many instances of each need support.
+
+  python3 opcode_db.py build [--test-obj ./test.o] [--alerts ./libna.ref.alerts.csv]
+                             [--instance-counts ./instructions_to_support_and_instance_counts.txt]
+  python3 opcode_db.py query [--category cs_vector] [--bitwidth 64] [--tested cs] [--untested cs]
+                             [--alerted comp-simp] [OPCODE ...]
+
+sources are only re-read when their contents change since the last build.
+opcodes are parsed again when ./mir_opcode.py changes since they were saved.
+./llvm-test-compsimp-transforms.py updates the test functions itself every
+time it builds test.o.
+"""
+
+DEFAULT_DB = 'opcodes.sqlite3'
+DEFAULT_ALERTS = 'libna.ref.alerts.csv'
+DEFAULT_INSTANCE_COUNTS = 'instructions_to_support_and_instance_counts.txt'
+
+# test types, the prefixes of harness names
+CS = 'cs'
+SS = 'ss'
+
+# alert reasons of the checker's alerts csvs, see check_which_impls_tested.py
+SILENT_STORES_ALERT = 'silent-stores'
+COMP_SIMP_ALERT = 'comp-simp'
+
+# the alerts each test type checks the transforms of
+ALERT_REASON_OF_TEST_TYPE = dict({
+    CS: COMP_SIMP_ALERT,
+    SS: SILENT_STORES_ALERT,
+})
+
+# lines look like `LEA64r: 572`
+INSTANCE_COUNT_RE = re.compile(r"^(?P<opcode>\S+):\s*(?P<count>\d+)$")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS opcodes (
+    opcode TEXT PRIMARY KEY,
+    mnemonic TEXT,
+    bitwidth INTEGER,
+    category TEXT,
+    is_vector INTEGER,
+    is_implicit_first_arg INTEGER,
+    -- every MirOpcode attribute as json, for MirOpcode.from_record
+    record TEXT,
+    -- set instead of the above if MirOpcode couldn't parse the opcode
+    parse_error TEXT,
+    -- sha256 of the mir_opcode.py that parsed the opcode
+    parser TEXT
+);
+CREATE INDEX IF NOT EXISTS opcodes_by_category ON opcodes (category, bitwidth);
+
+CREATE TABLE IF NOT EXISTS test_functions (
+    opcode TEXT NOT NULL REFERENCES opcodes (opcode),
+    test_type TEXT NOT NULL,
+    original_symbol TEXT NOT NULL,
+    transformed_symbol TEXT NOT NULL,
+    PRIMARY KEY (opcode, test_type)
+);
+
+CREATE TABLE IF NOT EXISTS alerts (
+    opcode TEXT NOT NULL REFERENCES opcodes (opcode),
+    alert_reason TEXT NOT NULL,
+    source TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (opcode, alert_reason, source)
+);
+CREATE INDEX IF NOT EXISTS alerts_by_reason ON alerts (alert_reason, opcode);
+
+CREATE TABLE IF NOT EXISTS instance_counts (
+    opcode TEXT PRIMARY KEY REFERENCES opcodes (opcode),
+    count INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS sources (
+    kind TEXT NOT NULL,
+    path TEXT NOT NULL,
+    sha256 TEXT NOT NULL,
+    PRIMARY KEY (kind, path)
+);
+"""
+
+def connect(db_path=DEFAULT_DB):
+    db = sqlite3.connect(db_path)
+    db.row_factory = sqlite3.Row
+    db.executescript(SCHEMA)
+    # dbs built before the parser column was added
+    if 'parser' not in [row['name'] for row in db.execute('PRAGMA table_info(opcodes)')]:
+        db.execute('ALTER TABLE opcodes ADD COLUMN parser TEXT')
+    return db
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+_parser_sha256 = None
+
+def parser_sha256():
+    """ the sha256 of mir_opcode.py, saved with each parsed opcode """
+    global _parser_sha256
+    if _parser_sha256 is None:
+        _parser_sha256 = file_sha256(mir_opcode.__file__)
+    return _parser_sha256
+
+def is_current(db, kind, path, sha256):
+    row = db.execute('SELECT sha256 FROM sources WHERE kind = ? AND path = ?',
+                     (kind, str(path))).fetchone()
+    return row is not None and row['sha256'] == sha256
+
+def record_source(db, kind, path, sha256):
+    db.execute('INSERT OR REPLACE INTO sources (kind, path, sha256) VALUES (?, ?, ?)',
+               (kind, str(path), sha256))
+
+def opcode_record(opcode):
+    """
+    the attributes of a parsed MirOpcode as json. operand types are saved by
+    name
+    """
+    record = dict(vars(opcode))
+    record['operand_types'] = [optype.name for optype in opcode.operand_types]
+    return json.dumps(record)
+
+def add_opcode(db, opcode_str, force=False):
+    """
+    parse an opcode string with MirOpcode and save the result, unless it is
+    already saved by the same mir_opcode.py
+    """
+    parser = parser_sha256()
+    row = db.execute('SELECT parser FROM opcodes WHERE opcode = ?', (opcode_str,)).fetchone()
+    if not force and row is not None and row['parser'] == parser:
+        return
+    try:
+        opcode = MirOpcode(opcode_str)
+    except Exception as err:
+        db.execute('INSERT OR REPLACE INTO opcodes (opcode, parse_error, parser) VALUES (?, ?, ?)',
+                   (opcode_str, str(err), parser))
+        return
+    db.execute('INSERT OR REPLACE INTO opcodes (opcode, mnemonic, bitwidth, category, is_vector, '
+               'is_implicit_first_arg, record, parser) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+               (opcode_str, opcode.opcode, int(opcode.bitwidth) if opcode.bitwidth else None,
+                opcode.category(), int(opcode.is_vector), int(opcode.is_implicit_first_arg),
+                opcode_record(opcode), parser))
+
+def ingest_nm_symbols(db, nm_stdout, source):
+    """
+    replace the saved test functions with the *_original/*_transformed pairs
+    in nm's stdout for the test object file
+    """
+    db.execute('DELETE FROM test_functions')
+    for line in nm_stdout.split('\n'):
+        # each pair once, by its *_original symbol
+        if not is_test_fn_line(line) or "_transformed" in line:
+            continue
+
+        func_name, mir_opcode, is_cs, is_ss, is_original, is_transformed = parse_nm_stdout(line)
+        if is_duplicate_fn_def(func_name):
+            continue
+
+        add_opcode(db, mir_opcode)
+        db.execute('INSERT OR REPLACE INTO test_functions VALUES (?, ?, ?, ?)',
+                   (mir_opcode, CS if is_cs else SS, func_name,
+                    func_name.replace("original", "transformed")))
+    logging.info(f"indexed test functions of {source}")
+
+def ingest_test_obj(db, test_obj, force=False):
+    sha256 = file_sha256(test_obj)
+    if not force and is_current(db, 'test_obj', test_obj, sha256):
+        return
+    nm_process = subprocess.run(["nm", str(test_obj)], check=True, text=True, stdout=subprocess.PIPE)
+    ingest_nm_symbols(db, nm_process.stdout, test_obj)
+    record_source(db, 'test_obj', test_obj, sha256)
+
+def ingest_alerts(db, alerts_csv, force=False):
+    """ count the alerts of each (opcode, alert reason) in a checker alerts csv """
+    sha256 = file_sha256(alerts_csv)
+    if not force and is_current(db, 'alerts', alerts_csv, sha256):
+        return
+    counts = Counter()
+    with open(alerts_csv, newline='') as csv_file:
+        for row in csv.DictReader(csv_file):
+            counts[(row['mir_opcode'], row['alert_reason'])] += 1
+
+    db.execute('DELETE FROM alerts WHERE source = ?', (str(alerts_csv),))
+    for (mir_opcode, alert_reason), count in counts.items():
+        add_opcode(db, mir_opcode)
+        db.execute('INSERT INTO alerts VALUES (?, ?, ?, ?)',
+                   (mir_opcode, alert_reason, str(alerts_csv), count))
+    record_source(db, 'alerts', alerts_csv, sha256)
+    logging.info(f"indexed {sum(counts.values())} alerts of {alerts_csv}")
+
+def ingest_instance_counts(db, counts_file, force=False):
+    sha256 = file_sha256(counts_file)
+    if not force and is_current(db, 'instance_counts', counts_file, sha256):
+        return
+    db.execute('DELETE FROM instance_counts')
+    with open(counts_file) as f:
+        for line in f:
+            match = INSTANCE_COUNT_RE.match(line.strip())
+            if match is None:
+                continue
+            add_opcode(db, match.group('opcode'))
+            db.execute('INSERT OR REPLACE INTO instance_counts VALUES (?, ?)',
+                       (match.group('opcode'), int(match.group('count'))))
+    record_source(db, 'instance_counts', counts_file, sha256)
+    logging.info(f"indexed instance counts of {counts_file}")
+
+def load_opcode(db, opcode_str):
+    """
+    get the saved MirOpcode of an opcode string, parsing and saving it first
+    if needed. None if MirOpcode can't parse it
+    """
+    add_opcode(db, opcode_str)
+    row = db.execute('SELECT record FROM opcodes WHERE opcode = ?', (opcode_str,)).fetchone()
+    if row['record'] is None:
+        return None
+    record = json.loads(row['record'])
+    record['operand_types'] = [OperandType[name] for name in record['operand_types']]
+    return MirOpcode.from_record(record)
+
+def test_functions(db, test_type=None):
+    """
+    get (opcode, test type, original symbol, transformed symbol) of every
+    tested opcode, in nm's (symbol name) order
+    """
+    query = 'SELECT opcode, test_type, original_symbol, transformed_symbol FROM test_functions'
+    params = ()
+    if test_type is not None:
+        query += ' WHERE test_type = ?'
+        params = (test_type,)
+    return [tuple(row) for row in db.execute(query + ' ORDER BY original_symbol', params)]
+
+def test_function_symbols(db, opcode_str, test_type):
+    """ get (original symbol, transformed symbol) of a tested opcode, or None """
+    row = db.execute('SELECT original_symbol, transformed_symbol FROM test_functions '
+                     'WHERE opcode = ? AND test_type = ?', (opcode_str, test_type)).fetchone()
+    return None if row is None else tuple(row)
+
+def instance_count(db, opcode_str):
+    row = db.execute('SELECT count FROM instance_counts WHERE opcode = ?', (opcode_str,)).fetchone()
+    return 0 if row is None else row['count']
+
+def alert_count(db, opcode_str, alert_reason):
+    """ total alerts of an opcode for one alert reason, over every indexed alerts csv """
+    row = db.execute('SELECT sum(count) FROM alerts WHERE opcode = ? AND alert_reason = ?',
+                     (opcode_str, alert_reason)).fetchone()
+    return row[0] or 0
+
+def alerted_opcodes(db, alert_reason):
+    return set(row['opcode'] for row in
+               db.execute('SELECT DISTINCT opcode FROM alerts WHERE alert_reason = ?', (alert_reason,)))
+
+def tested_opcodes(db, test_type):
+    return set(opcode for opcode, _, _, _ in test_functions(db, test_type))
+
+def query_opcodes(db, opcodes=None, category=None, bitwidth=None, tested=None, untested=None, alerted=None):
+    """
+    get the rows of saved opcodes matching every given filter, with their test
+    types, instance counts and alert counts. `tested`/`untested` are a test
+    type, `alerted` an alert reason
+    """
+    conditions = []
+    params = []
+    if opcodes:
+        conditions.append(f"o.opcode IN ({', '.join('?' * len(opcodes))})")
+        params += opcodes
+    if category is not None:
+        conditions.append('o.category = ?')
+        params.append(category)
+    if bitwidth is not None:
+        conditions.append('o.bitwidth = ?')
+        params.append(bitwidth)
+    if tested is not None:
+        conditions.append('EXISTS (SELECT 1 FROM test_functions t WHERE t.opcode = o.opcode AND t.test_type = ?)')
+        params.append(tested)
+    if untested is not None:
+        conditions.append('NOT EXISTS (SELECT 1 FROM test_functions t WHERE t.opcode = o.opcode AND t.test_type = ?)')
+        params.append(untested)
+    if alerted is not None:
+        conditions.append('EXISTS (SELECT 1 FROM alerts a WHERE a.opcode = o.opcode AND a.alert_reason = ?)')
+        params.append(alerted)
+
+    query = """
+        SELECT o.opcode, o.category, o.bitwidth, o.is_vector, o.parse_error,
+               (SELECT group_concat(test_type, ',') FROM test_functions t WHERE t.opcode = o.opcode) AS tested,
+               COALESCE((SELECT count FROM instance_counts i WHERE i.opcode = o.opcode), 0) AS instances,
+               COALESCE((SELECT sum(count) FROM alerts a WHERE a.opcode = o.opcode), 0) AS alerts
+        FROM opcodes o
+    """
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    return db.execute(query + ' ORDER BY o.opcode', params).fetchall()
+
+def build(args):
+    db = connect(args.db)
+    with db:
+        if args.force:
+            for (opcode_str,) in db.execute('SELECT opcode FROM opcodes').fetchall():
+                add_opcode(db, opcode_str, force=True)
+        if args.test_obj is not None:
+            if Path(args.test_obj).exists():
+                ingest_test_obj(db, args.test_obj, args.force)
+            else:
+                logging.warning(f"{args.test_obj} doesn't exist, run ./llvm-test-compsimp-transforms.py first")
+        for alerts_csv in args.alerts:
+            ingest_alerts(db, alerts_csv, args.force)
+        if args.instance_counts is not None:
+            ingest_instance_counts(db, args.instance_counts, args.force)
+    num_opcodes = db.execute('SELECT count(*) FROM opcodes').fetchone()[0]
+    print(f"{num_opcodes} opcodes indexed in {args.db}")
+
+def query(args):
+    db = connect(args.db)
+    rows = query_opcodes(db, args.opcodes, args.category, args.bitwidth,
+                         args.tested, args.untested, args.alerted)
+    print(f"{'opcode':<20} {'category':<12} {'bits':>4} {'tested':<6} {'instances':>9} {'alerts':>7}")
+    for row in rows:
+        category = row['category'] or "(unparsed)"
+        print(f"{row['opcode']:<20} {category:<12} {row['bitwidth'] or '-':>4} {row['tested'] or '-':<6} "
+              f"{row['instances']:>9} {row['alerts']:>7}")
+    print(f"{len(rows)} opcodes")
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(usage=usage_msg)
+    argparser.add_argument('--db', default=DEFAULT_DB)
+    subparsers = argparser.add_subparsers(dest='command', required=True)
+
+    build_parser = subparsers.add_parser('build')
+    build_parser.add_argument('--test-obj', default='test.o')
+    build_parser.add_argument('--alerts', nargs='*', default=[DEFAULT_ALERTS])
+    build_parser.add_argument('--instance-counts', default=DEFAULT_INSTANCE_COUNTS)
+    build_parser.add_argument('-f', '--force', action='store_true',
+                              help='re-read every source and re-parse every opcode even if unchanged')
+    build_parser.set_defaults(func=build)
+
+    query_parser = subparsers.add_parser('query')
+    query_parser.add_argument('opcodes', nargs='*')
+    query_parser.add_argument('--category')
+    query_parser.add_argument('--bitwidth', type=int)
+    query_parser.add_argument('--tested', choices=[CS, SS])
+    query_parser.add_argument('--untested', choices=[CS, SS])
+    query_parser.add_argument('--alerted', help=f'alert reason, e.g. {COMP_SIMP_ALERT} or {SILENT_STORES_ALERT}')
+    query_parser.set_defaults(func=query)
+
+    args = argparser.parse_args()
+    args.func(args)
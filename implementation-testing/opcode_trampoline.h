@@ -0,0 +1,163 @@
+/* Opcode table support for the single harness build, where one binary tests
+   every original/transformed pair instead of one binary per pair. see
+   --single-harness in ./llvm-test-compsimp-transforms.py
+
+   this is included into ./implementation-tester.c after struct OutState and
+   enum EFLAGS are defined, and the generator fills in the table itself:
+   static const struct OpcodeEntry opcode_table[] = { ... };
+ */
+#ifndef OPCODE_TRAMPOLINE_H
+#define OPCODE_TRAMPOLINE_H
+
+#define HARNESS_NAME_SUFFIX "-implementation-tester"
+
+typedef void (*test_fn_t)(struct OutState* outstate,
+			  uint64_t i0, uint64_t i1, uint64_t i2, uint64_t i3, uint64_t i4);
+
+struct OpcodeEntry {
+	/* same as the per opcode harness name without the suffix, e.g. cs-ADD64rr */
+	const char* name;
+	test_fn_t original;
+	test_fn_t transformed;
+	const char* operand_types[5];
+	int must_preserve_flags;
+	enum EFLAGS preserves[5];
+	int must_set_flags;
+	enum EFLAGS sets[5];
+	int is_vector;
+	/* like MUL, IMUL, DIV, IDIV: the last arg is also passed in rax */
+	int is_implicit_first_arg;
+};
+
+/* Call a test function with the testing ABI (see the top of
+   ./implementation-tester.c) and with exact register and flag inputs.
+
+   the per opcode harnesses set rax and the flags with inline asm right before
+   a direct call. calling through a function pointer lets the compiler use rax
+   and the flags for the table lookup in between, so this does the whole
+   setup in asm instead: rdi = outstate, rsi..r9 = i0..i4, flags = sahf of
+   lahf_load, rax = `rax` and r10, r11, rbx, r12-r15 = 0, then calls `fn`.
+   the callee saved registers are zeroed too (and restored after) so their
+   values don't depend on the caller. the fn pointer is kept on the stack
+   since every GPR but rdi is compared between the original and the
+   transformed output states. */
+void opcode_trampoline(test_fn_t fn, struct OutState* outstate,
+		       uint64_t i0, uint64_t i1, uint64_t i2, uint64_t i3, uint64_t i4,
+		       uint64_t rax, uint64_t lahf_load);
+
+__asm__(
+	".text\n"
+	".globl opcode_trampoline\n"
+	".type opcode_trampoline, @function\n"
+	"opcode_trampoline:\n"
+	"	pushq %rbp\n"
+	"	movq %rsp, %rbp\n"
+	"	pushq %rbx\n"
+	"	pushq %r12\n"
+	"	pushq %r13\n"
+	"	pushq %r14\n"
+	"	pushq %r15\n"
+	/* keeps rsp 16 byte aligned at the call */
+	"	subq $24, %rsp\n"
+	"	movq %rdi, -48(%rbp)\n"
+	"	movq %rsi, %rdi\n"
+	"	movq %rdx, %rsi\n"
+	"	movq %rcx, %rdx\n"
+	"	movq %r8, %rcx\n"
+	"	movq %r9, %r8\n"
+	/* stack args: i4 at 16(%rbp), rax at 24(%rbp), lahf_load at 32(%rbp) */
+	"	movq 16(%rbp), %r9\n"
+	"	xorl %r10d, %r10d\n"
+	"	xorl %r11d, %r11d\n"
+	"	xorl %ebx, %ebx\n"
+	"	xorl %r12d, %r12d\n"
+	"	xorl %r13d, %r13d\n"
+	"	xorl %r14d, %r14d\n"
+	"	xorl %r15d, %r15d\n"
+	"	movq 32(%rbp), %rax\n"
+	"	sahf\n"
+	"	movq 24(%rbp), %rax\n"
+	"	callq *-48(%rbp)\n"
+	"	leaq -40(%rbp), %rsp\n"
+	"	popq %r15\n"
+	"	popq %r14\n"
+	"	popq %r13\n"
+	"	popq %r12\n"
+	"	popq %rbx\n"
+	"	popq %rbp\n"
+	"	retq\n"
+	".size opcode_trampoline, .-opcode_trampoline\n"
+	);
+
+static void
+print_opcode_table(const struct OpcodeEntry* table, size_t num_entries)
+{
+	for (size_t ii = 0; ii < num_entries; ++ii) {
+		printf("%zu %s\n", ii, table[ii].name);
+	}
+}
+
+/* Pick the opcode to test from the -opcode=<name> or -opcode_index=<n> args,
+   or else from the name the harness was run as, so symlinks named like the
+   per opcode harnesses (e.g. cs-ADD64rr-implementation-tester) work as
+   drop in replacements for them. -list_opcodes prints the table and exits. */
+static const struct OpcodeEntry*
+select_opcode_entry(const struct OpcodeEntry* table, size_t num_entries,
+		    int argc, char** argv)
+{
+	const char* list_opcodes_arg = "-list_opcodes";
+	const char* opcode_pre = "-opcode=";
+	const char* opcode_index_pre = "-opcode_index=";
+
+	const char* name = 0;
+	for (int ii = 0; ii < argc; ++ii) {
+		const char* arg = argv[ii];
+		if (0 == strcmp(arg, list_opcodes_arg)) {
+			print_opcode_table(table, num_entries);
+			exit(0);
+		}
+
+		if (0 == strncmp(arg, opcode_pre, strlen(opcode_pre))) {
+			name = arg + strlen(opcode_pre);
+		}
+
+		if (0 == strncmp(arg, opcode_index_pre, strlen(opcode_index_pre))) {
+			char* strtol_errs = 0;
+			long idx = strtol(arg + strlen(opcode_index_pre), &strtol_errs, 10);
+			assert(*strtol_errs == '\0' && "-opcode_index=... param is invalid int");
+			if (idx < 0 || (size_t) idx >= num_entries) {
+				printf("-opcode_index=%ld is out of range, there are %zu opcodes\n",
+				       idx, num_entries);
+				exit(1);
+			}
+			return &table[idx];
+		}
+	}
+
+	size_t name_len = 0;
+	if (name) {
+		name_len = strlen(name);
+	} else if (argc > 0) {
+		const char* slash = strrchr(argv[0], '/');
+		name = slash ? slash + 1 : argv[0];
+		name_len = strlen(name);
+		size_t suffix_len = strlen(HARNESS_NAME_SUFFIX);
+		if (name_len > suffix_len &&
+		    0 == strcmp(name + name_len - suffix_len, HARNESS_NAME_SUFFIX)) {
+			name_len -= suffix_len;
+		}
+	}
+
+	for (size_t ii = 0; name && ii < num_entries; ++ii) {
+		if (strlen(table[ii].name) == name_len &&
+		    0 == strncmp(table[ii].name, name, name_len)) {
+			return &table[ii];
+		}
+	}
+
+	printf("no opcode selected, pass -opcode=<name> or -opcode_index=<n>. opcodes are:\n");
+	print_opcode_table(table, num_entries);
+	exit(1);
+}
+
+#endif // OPCODE_TRAMPOLINE_H
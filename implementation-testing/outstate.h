@@ -0,0 +1,65 @@
+/* The output state the test functions write through RDI (see the testing
+   ABI at the top of ./implementation-tester.c), shared by the fuzz
+   harnesses and ./differential_engine.c */
+#ifndef OUTSTATE_H
+#define OUTSTATE_H
+
+#include <stdint.h>
+
+enum EFLAGS {
+	SF = 1,
+	ZF = 2,
+	AF = 3,
+	PF = 4,
+	CF = 5,
+};
+
+struct __attribute__((__packed__)) OutState {
+	uint64_t rax; // 0
+	uint64_t rbx; // 8
+	uint64_t rcx; // 10
+	uint64_t rdx; // 18
+	uint64_t rsp; // 20
+	uint64_t rbp; // 28
+	uint64_t rsi; // 30
+	uint64_t rdi; // 38
+	uint64_t r8; // 40
+	uint64_t r9; // 48
+	uint64_t r10; // 50
+	uint64_t r11; // 58
+	uint64_t r12; // 60
+	uint64_t r13; // 68
+	uint64_t r14; // 70
+	uint64_t r15; // 78
+
+	uint64_t lahf_rax_res; // idx 16 at 8 scale (80)
+	uint64_t padding;
+
+	uint64_t xmm0lo; // idx 17 at 8 scale (90
+	uint64_t xmm0hi; //
+
+	uint64_t xmm1lo; // A0
+	uint64_t xmm1hi; // 
+
+	uint64_t xmm2lo; // b0
+	uint64_t xmm2hi;
+
+	uint64_t xmm3lo; // c0
+	uint64_t xmm3hi;
+
+	uint64_t xmm4lo; // d0
+	uint64_t xmm4hi;
+
+	uint64_t xmm5lo; // e0
+	uint64_t xmm5hi;
+
+	uint64_t xmm6lo; // f0
+	uint64_t xmm6hi;
+
+	uint64_t xmm7lo; // 100
+	uint64_t xmm7hi; // 
+
+	uint64_t cyclecount; // 110
+};
+
+#endif // OUTSTATE_H
@@ -0,0 +1,298 @@
+import argparse
+import csv
+import logging
+import math
+import shutil
+import subprocess
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+
+import corpus_store
+import fuzz_targets
+import opcode_db
+
+logging.basicConfig(level=logging.INFO)
+
+usage_msg = """
+split one fuzzing budget across the harnesses built by ./build_harnesses.py,
+weighted by how much each opcode matters, on JOBS cores at once.
+
+  python3 schedule_fuzzing.py ./fuzz_harnesses/harnesses.txt (--runs TOTAL_RUNS | --seconds WALL_SECONDS)
+                              [-j JOBS] [--max-len MAX_SEED_LEN] [--measure-cycles] [--cycle-counts-binary]
+                              [--plateau-slices N] [--report-csv report.csv]
+
+each harness gets an even share of MIN_BUDGET_FRACTION of the budget, and
+the rest in proportion to its weight:
+1 + the opcode's instance count (./instructions_to_support_and_instance_counts.txt)
+  + its alerts of the harness's test type (./libna.ref.alerts.csv)
+looked up in the opcode db, see ./opcode_db.py.
+
+a harness's budget is run in slices that continue from its own corpus dir
+(seeded from the --corpus-store, if given),
+and a harness is retired once PLATEAU_SLICES slices in a row found no new
+libFuzzer features (ft:), or once a slice fails (e.g. a mismatch), and its
+unused budget goes to the harnesses still running. harnesses built with
+their own main (--our-main) report no coverage, so only their budgets are
+weighted, and they only support --runs.
+
+each slice's output is appended to <harness>.log, and with
+--cycle-counts-binary its cycle counts to <harness>.cycles.bin, so
+./get_cycle_count_data.py reads them like a single run's.
+"""
+
+# this fraction of the budget is split evenly, so rarely seen opcodes still get fuzzed
+MIN_BUDGET_FRACTION = 0.2
+# each harness's share is run in about this many slices, so plateaus can be seen
+SLICES_PER_HARNESS = 8
+MIN_SLICE_RUNS = 1000
+MIN_SLICE_SECONDS = 1
+PLATEAU_SLICES = 3
+
+ACTIVE = 'active'
+DONE = 'done'
+PLATEAUED = 'plateaued'
+FAILED = 'failed'
+
+REPORT_COLUMNS = ['harness', 'weight', 'allocated', 'used', 'slices', 'cov', 'ft', 'status']
+
+argparser = argparse.ArgumentParser(usage=usage_msg)
+argparser.add_argument('harness_list')
+budget_args = argparser.add_mutually_exclusive_group(required=True)
+budget_args.add_argument('--runs', type=int, help='total fuzzer runs over all harnesses')
+budget_args.add_argument('--seconds', type=int, help='wall clock seconds, on every job')
+argparser.add_argument('-j', '--jobs', type=int, default=1)
+argparser.add_argument('--max-len', type=int, default=fuzz_targets.DEFAULT_MAX_LEN)
+argparser.add_argument('--measure-cycles', action='store_true')
+argparser.add_argument('--cycle-counts-binary', action='store_true')
+argparser.add_argument('--plateau-slices', type=int, default=PLATEAU_SLICES)
+argparser.add_argument('--seed', type=int, default=1,
+                       help="a harness's n-th slice is run with -seed=SEED+n")
+argparser.add_argument('--corpus-dir',
+                       help='dir of the per harness corpus dirs, default: corpora next to the harnesses')
+argparser.add_argument('--corpus-store',
+                       help='seed from, and keep crashing inputs in, this corpus store, see ./corpus_store.py')
+argparser.add_argument('--db', default=opcode_db.DEFAULT_DB)
+argparser.add_argument('--alerts', nargs='*', default=[opcode_db.DEFAULT_ALERTS])
+argparser.add_argument('--instance-counts', default=opcode_db.DEFAULT_INSTANCE_COUNTS)
+argparser.add_argument('--report-csv')
+
+class FuzzTarget:
+    """
+    the budget and progress of one harness. budgets are in runs, or in
+    seconds for --seconds
+    """
+    def __init__(self, harness, weight, corpus_dirs, artifact_prefix=None):
+        self.harness = harness
+        self.name = fuzz_targets.harness_name(harness)
+        self.weight = weight
+        # libFuzzer adds the inputs it finds to the first
+        self.corpus_dirs = corpus_dirs
+        self.artifact_prefix = artifact_prefix
+        self.allocated = 0
+        self.remaining = 0
+        self.slice_size = 0
+        self.used = 0
+        self.slices = 0
+        self.coverage = None
+        self.stale_slices = 0
+        self.status = ACTIVE
+        self.running = False
+
+    @property
+    def log_file(self):
+        return Path(f"{self.harness}.log")
+
+    @property
+    def cycle_counts_file(self):
+        return Path(f"{self.harness}.cycles.bin")
+
+def harness_weight(db, harness):
+    test_type, mir_opcode = fuzz_targets.harness_opcode(harness)
+    alert_reason = opcode_db.ALERT_REASON_OF_TEST_TYPE.get(test_type)
+    alerts = 0 if alert_reason is None else opcode_db.alert_count(db, mir_opcode, alert_reason)
+    return 1 + opcode_db.instance_count(db, mir_opcode) + alerts
+
+def allocate(targets, budget, min_slice):
+    total_weight = sum(target.weight for target in targets)
+    even_share = budget * MIN_BUDGET_FRACTION / len(targets)
+    for target in targets:
+        target.allocated = target.remaining = \
+            even_share + budget * (1 - MIN_BUDGET_FRACTION) * target.weight / total_weight
+        target.slice_size = max(min_slice, target.allocated / SLICES_PER_HARNESS)
+
+def redistribute(targets, budget):
+    """ split a retired harness's unused budget over the active ones by weight """
+    active = [target for target in targets if target.status == ACTIVE]
+    total_weight = sum(target.weight for target in active)
+    for target in active:
+        target.remaining += budget * target.weight / total_weight
+
+def next_target(targets):
+    """ the idle active harness with the most budget left, or None """
+    idle = [target for target in targets if target.status == ACTIVE and not target.running]
+    return max(idle, key=lambda target: target.remaining, default=None)
+
+def run_slice(target, amount, seed, args):
+    """
+    run one slice of a harness, appending its output to the harness's log.
+    returns (exit status, whether it reported a mismatch, last libFuzzer
+    (cov, ft) or None, seconds taken)
+    """
+    slice_cycle_counts = target.cycle_counts_file.with_suffix('.slice.bin') if args.cycle_counts_binary else None
+    cmd = fuzz_targets.fuzzer_cmd(target.harness,
+                                  runs=amount if args.runs is not None else None,
+                                  seconds=amount if args.seconds is not None else None,
+                                  max_len=args.max_len,
+                                  seed=seed,
+                                  measure_cycles=args.measure_cycles,
+                                  cycle_counts_file=slice_cycle_counts,
+                                  corpus_dirs=target.corpus_dirs,
+                                  artifact_prefix=target.artifact_prefix)
+
+    log_offset = target.log_file.stat().st_size
+    start = time.monotonic()
+    with target.log_file.open('ab') as log:
+        fuzz_process = subprocess.run(cmd, stdout=log, stderr=subprocess.STDOUT)
+    elapsed = time.monotonic() - start
+
+    with target.log_file.open('rb') as log:
+        log.seek(log_offset)
+        coverage, mismatch = fuzz_targets.scan_fuzzer_output(line.decode(errors='replace') for line in log)
+
+    # the cycle counts files are raw (orig, transformed) pairs, so slices concatenate
+    if slice_cycle_counts is not None and slice_cycle_counts.exists():
+        with target.cycle_counts_file.open('ab') as all_cycle_counts, slice_cycle_counts.open('rb') as f:
+            shutil.copyfileobj(f, all_cycle_counts)
+        slice_cycle_counts.unlink()
+
+    return fuzz_process.returncode, mismatch, coverage, elapsed
+
+def finish_slice(targets, target, used, returncode, mismatch, coverage, plateau_slices):
+    target.running = False
+    target.used += used
+    target.remaining -= used
+
+    if returncode != 0:
+        print(f"fuzzer {target.harness} returned non-zero exit status, see {target.log_file}")
+        target.status = FAILED
+    elif mismatch:
+        # more runs won't make it pass
+        target.status = FAILED
+    elif coverage is not None:
+        if target.coverage is not None and coverage[1] <= target.coverage[1]:
+            target.stale_slices += 1
+        else:
+            target.stale_slices = 0
+            target.coverage = coverage
+        if target.stale_slices >= plateau_slices:
+            logging.info(f"{target.name} plateaued at cov: {target.coverage[0]} ft: {target.coverage[1]} "
+                         f"after {target.slices} slices")
+            target.status = PLATEAUED
+
+    if target.status != ACTIVE:
+        unused = max(target.remaining, 0)
+        target.remaining = 0
+        redistribute(targets, unused)
+    elif target.remaining < 1:
+        target.status = DONE
+
+def schedule(targets, args):
+    """ run slices on args.jobs cores until every harness is retired or out of budget """
+    deadline = None if args.seconds is None else time.monotonic() + args.seconds
+    min_slice = MIN_SLICE_RUNS if args.runs is not None else MIN_SLICE_SECONDS
+    unit = 'runs' if args.runs is not None else 'seconds'
+
+    in_flight = dict()
+    with ThreadPoolExecutor(max_workers=args.jobs) as pool:
+        while True:
+            while len(in_flight) < args.jobs and (deadline is None or time.monotonic() < deadline):
+                target = next_target(targets)
+                if target is None:
+                    break
+                amount = math.ceil(min(target.remaining, max(target.slice_size, min_slice)))
+                if deadline is not None:
+                    amount = max(1, min(amount, math.ceil(deadline - time.monotonic())))
+                seed = args.seed + target.slices
+                target.slices += 1
+                target.running = True
+                print(f"running fuzzer {target.harness} for {amount} {unit}")
+                in_flight[pool.submit(run_slice, target, amount, seed, args)] = (target, amount)
+
+            if not in_flight:
+                break
+
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                target, amount = in_flight.pop(future)
+                returncode, mismatch, coverage, elapsed = future.result()
+                used = amount if args.runs is not None else elapsed
+                finish_slice(targets, target, used, returncode, mismatch, coverage, args.plateau_slices)
+
+    # out of time
+    for target in targets:
+        if target.status == ACTIVE:
+            target.status = DONE
+
+def report(targets, report_csv=None):
+    rows = [dict({
+        'harness': target.name,
+        'weight': target.weight,
+        'allocated': round(target.allocated),
+        'used': round(target.used),
+        'slices': target.slices,
+        'cov': target.coverage[0] if target.coverage else '',
+        'ft': target.coverage[1] if target.coverage else '',
+        'status': target.status,
+    }) for target in sorted(targets, key=lambda target: -target.weight)]
+
+    print(f"{'harness':<24} {'weight':>7} {'allocated':>10} {'used':>10} {'slices':>6} {'cov':>6} {'ft':>6}  status")
+    for row in rows:
+        print(f"{row['harness']:<24} {row['weight']:>7} {row['allocated']:>10} {row['used']:>10} "
+              f"{row['slices']:>6} {row['cov']:>6} {row['ft']:>6}  {row['status']}")
+
+    if report_csv is not None:
+        with open(report_csv, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=REPORT_COLUMNS)
+            writer.writeheader()
+            writer.writerows(rows)
+
+if __name__ == '__main__':
+    args = argparser.parse_args()
+
+    harnesses = fuzz_targets.read_harness_list(args.harness_list)
+    if not harnesses:
+        logging.critical(f"no harnesses in {args.harness_list}")
+        sys.exit(1)
+
+    db = opcode_db.connect(args.db)
+    with db:
+        for alerts_csv in args.alerts:
+            if Path(alerts_csv).exists():
+                opcode_db.ingest_alerts(db, alerts_csv)
+        if Path(args.instance_counts).exists():
+            opcode_db.ingest_instance_counts(db, args.instance_counts)
+
+    corpus_root = Path(args.corpus_dir) if args.corpus_dir else Path(args.harness_list).parent / "corpora"
+    targets = []
+    for harness in harnesses:
+        if args.corpus_store is not None:
+            corpus_dirs, artifact_prefix = corpus_store.fuzzer_store_args(args.corpus_store, corpus_root, harness)
+        else:
+            corpus_dirs, artifact_prefix = [corpus_store.work_dir(corpus_root, harness)], None
+        target = FuzzTarget(harness, harness_weight(db, harness), corpus_dirs, artifact_prefix)
+        for corpus_dir in target.corpus_dirs:
+            corpus_dir.mkdir(parents=True, exist_ok=True)
+        # like a single run's `&> <harness>.log`
+        target.log_file.write_bytes(b'')
+        target.cycle_counts_file.unlink(missing_ok=True)
+        targets.append(target)
+
+    if args.runs is not None:
+        allocate(targets, args.runs, MIN_SLICE_RUNS)
+    else:
+        allocate(targets, args.seconds * args.jobs, MIN_SLICE_SECONDS)
+
+    schedule(targets, args)
+    report(targets, args.report_csv)
@@ -1,12 +1,14 @@
 import argparse
+import hashlib
+import json
 import os
-import matplotlib.pyplot as plt
-import matplotlib
-matplotlib.rcParams['pdf.fonttype'] = 42
-matplotlib.rcParams['ps.fonttype'] = 42
-import statistics as stat
+import re
+import warnings
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 
+import cycle_stats
+
 CRYPTO_FNS = dict({
     'libsodium':
     [   'argon2id'
@@ -32,9 +34,35 @@ RAW_CYCLES = 'raw_cycles'
 DYN_HITS = 'dynamic_hit_counts'
 MEAN = 'mean_cycles'
 STD = 'std'
+MEAN_CI = 'mean_ci'
+MEDIAN = 'median_cycles'
+TRIMMED_MEAN = 'trimmed_mean_cycles'
 OVERHEAD = 'overhead'
 OVERHEAD_STD = 'overhead_std'
+OVERHEAD_CI = 'overhead_ci'
 BINARY_SIZE = 'binary_size'
+STEADY_STATE_START = 'steady_state_start'
+SETTLED = 'settled'
+RECOMMENDED_WARMUP = 'recommended_warmup'
+
+# see the printf of the title in eval_*.c
+TITLE_RE = re.compile(r"\((?P<iterations>\d+) iterations, (?P<warmup>\d+) warmup\)")
+
+# sidecar cache next to each *-cyclecounts.csv, see load_cycle_counts
+CYCLES_CACHE_SUFFIX = '.npy'
+
+# cycle curves are decimated to about this many points per series, a couple
+# per pixel column of the default figure size
+CYCLE_CURVE_POINTS = 1280
+DECIMATIONS = ['none', 'minmax', 'lttb']
+
+# records input hashes and what was generated from them, see load_manifest
+MANIFEST_FILENAME = 'report-manifest.json'
+MANIFEST_INPUTS = 'inputs'
+MANIFEST_STATS = 'stats'
+MANIFEST_OUTPUTS = 'outputs'
+# bump when load_benchmark computes different statistics, so recorded ones are recomputed
+STATS_VERSION = 2
 
 LEGEND = dict({
     'ss+cs': 'SS and CS',
@@ -49,6 +77,19 @@ LEGEND = dict({
 })
 
 
+def import_pyplot():
+    '''
+    Import matplotlib on first use. Importing it takes seconds, so it is only
+    done when a plot actually has to be redrawn.
+    '''
+    import matplotlib
+    matplotlib.use('Agg')
+    matplotlib.rcParams['pdf.fonttype'] = 42
+    matplotlib.rcParams['ps.fonttype'] = 42
+    import matplotlib.pyplot as plt
+    return plt
+
+
 def parse_lines(filepath):
     '''
     Get the lines of a file as individual entries in a list, without newlines.
@@ -64,60 +105,279 @@ def parse_lines(filepath):
     return data
 
 
-def get_data(args):
-    data = dict()
+def load_cycle_counts(filepath, use_cache=True):
+    '''
+    Read a `*-cyclecounts.csv` file into its title line and an int64 array of
+    the cycle counts below it.
+
+    The array is also saved to a sidecar `<filepath>.npy` cache. The first two
+    entries of the cache are the size and mtime (ns) of the CSV it was built
+    from, so it is only reused while the CSV is unchanged.
+    '''
+    csv_stat = os.stat(filepath)
+    stamp = np.array([csv_stat.st_size, csv_stat.st_mtime_ns], dtype=np.int64)
+    cache_filepath = filepath + CYCLES_CACHE_SUFFIX
+
+    with open(filepath) as file:
+        title = file.readline().strip()
+
+        if use_cache and os.path.exists(cache_filepath):
+            try:
+                cached = np.load(cache_filepath, mmap_mode='r')
+                if len(cached) >= len(stamp) and np.array_equal(cached[:len(stamp)], stamp):
+                    return title, np.array(cached[len(stamp):])
+            except (OSError, ValueError):
+                # unreadable or truncated cache, rebuild it below
+                pass
+
+        with warnings.catch_warnings():
+            # loadtxt warns on a file that only has the title line
+            warnings.simplefilter('ignore', UserWarning)
+            cycles = np.loadtxt(file, dtype=np.int64, ndmin=1)
+
+    if use_cache:
+        tmp_filepath = f'{cache_filepath}.{os.getpid()}.tmp'
+        try:
+            with open(tmp_filepath, 'wb') as cache_file:
+                np.save(cache_file, np.concatenate((stamp, cycles)))
+            os.replace(tmp_filepath, cache_filepath)
+        except OSError:
+            print(f"Couldn't write cycle counts cache {cache_filepath}")
+
+    return title, cycles
+
+
+def parse_title_warmup(title):
+    ''' Get the number of warmup iterations from a cycle counts title, None if it has none. '''
+    match = TITLE_RE.search(title)
+    return int(match.group('warmup')) if match else None
+
+
+def load_benchmark(eval_dir, lib, abl, fn, use_cache=True, steady_state=True):
+    '''
+    Load the cycle counts, dynamic hit counts and binary size of one benchmark.
+    With `steady_state`, cycle counts before the series reaches steady state
+    are dropped.
+    Returns None if there is no cycle count data for it.
+    '''
+    # Read cycles data
+    cycles_filepath = os.path.join(eval_dir, abl, f'{lib}-{fn}-cyclecounts.csv')
+    if not os.path.exists(cycles_filepath):
+        print(f"Couldn't find cycle counts file {cycles_filepath}. Skipping")
+        return None
+
+    title, cycles_arr = load_cycle_counts(cycles_filepath, use_cache)
+    if len(cycles_arr) == 0:
+        # No data, skip
+        return None
+
+    # Drop the warmup the driver's own warmup iterations didn't cover
+    fn_data = dict()
+    fn_data[TITLE] = title
+    if steady_state:
+        cycles_arr, start, settled = cycle_stats.steady_state(cycles_arr)
+        driver_warmup = parse_title_warmup(title)
+        fn_data[STEADY_STATE_START] = start
+        fn_data[SETTLED] = settled
+        fn_data[RECOMMENDED_WARMUP] = driver_warmup + start \
+            if settled and driver_warmup is not None else None
+
+    # Filter outliers
+    cycles_arr = cycle_stats.drop_outliers(cycles_arr)
+
+    # cycles data
+    fn_data[RAW_CYCLES] = cycles_arr
+    fn_data[MEAN] = np.mean(cycles_arr)
+    fn_data[STD] = np.std(cycles_arr)
+    fn_data[MEAN_CI] = cycle_stats.bootstrap_mean_ci(cycles_arr)
+    fn_data[MEDIAN] = cycle_stats.median(cycles_arr)
+    fn_data[TRIMMED_MEAN] = cycle_stats.trimmed_mean(cycles_arr)
+
+    # dynamic hit counts data
+    dyn_hits_filepath = os.path.join(eval_dir, abl, f'{lib}-{fn}-dynhitcounts.csv')
+    if not os.path.exists(dyn_hits_filepath):
+        print(f"Couldn't find dynamic hit counts at {dyn_hits_filepath}")
+        fn_data[DYN_HITS] = None
+    else:
+        fn_data[DYN_HITS] = dict(map(
+            lambda s: s.split(','), parse_lines(dyn_hits_filepath)
+        ))
+
+    # binary size
+    sz_filepath = os.path.join(eval_dir, abl, f'{lib}-{fn}-bytesize.txt')
+    if not os.path.exists(sz_filepath):
+        print(f"Couldn't find binary size data at {sz_filepath}")
+        fn_data[BINARY_SIZE] = None
+    else:
+        fn_file_sz = open(sz_filepath)
+        fn_data[BINARY_SIZE] = fn_file_sz.readline().strip()
+        fn_file_sz.close()
+
+    return fn_data
+
+
+def get_benchmarks(baseline_dir, ablations):
+    ''' List every (lib, ablation, fn) benchmark in report order. '''
+    benchmarks = []
     for lib in CRYPTO_FNS:
-        data[lib] = dict()
-        for abl in [args.baseline_dir] + args.ablations:
-            data[lib][abl] = dict()
+        for abl in [baseline_dir] + ablations:
             for fn in CRYPTO_FNS[lib]:
-                # Read cycles data
-                cycles_filepath = os.path.join(args.eval_dir, abl, f'{lib}-{fn}-cyclecounts.csv')
-                if not os.path.exists(cycles_filepath):
-                    print(f"Couldn't find cycle counts file {cycles_filepath}. Skipping")
-                    continue
-                
-                cycles_data = parse_lines(cycles_filepath)
-                if len(cycles_data) <= 1:
-                    # No data, skip
-                    continue
+                benchmarks.append((lib, abl, fn))
+    return benchmarks
+
+
+def get_data(eval_dir, baseline_dir, ablations, jobs=None, use_cache=True, only=None,
+             steady_state=True):
+    '''
+    Load every (lib, ablation, fn) benchmark under `eval_dir`, fanning the
+    benchmarks out over `jobs` worker processes (all cores by default).
+    If `only` is given, just the benchmarks in it are loaded.
+    '''
+    data = dict()
+    benchmarks = []
+    for lib, abl, fn in get_benchmarks(baseline_dir, ablations):
+        data.setdefault(lib, dict()).setdefault(abl, dict())
+        if only is None or (lib, abl, fn) in only:
+            benchmarks.append((lib, abl, fn))
+
+    if not benchmarks:
+        return data
+
+    libs, abls, fns = zip(*benchmarks)
+    n = len(benchmarks)
+    load_args = ([eval_dir] * n, libs, abls, fns, [use_cache] * n, [steady_state] * n)
+    if jobs == 1:
+        results = list(map(load_benchmark, *load_args))
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            results = list(pool.map(load_benchmark, *load_args))
+
+    for (lib, abl, fn), fn_data in zip(benchmarks, results):
+        if fn_data is not None:
+            data[lib][abl][fn] = fn_data
 
-                # Filter outliers
-                quartiles = np.quantile(cycles_data[1:], [0.25, 0.75])
-                iqr = quartiles[1] - quartiles[0]
-                upper_bound = quartiles[1] + iqr * 1.5
-                cycles_arr = np.array(cycles_data[1:])
-
-                # cycles data
-                data[lib][abl][fn] = dict()
-                data[lib][abl][fn][TITLE] = cycles_data[0]
-                data[lib][abl][fn][RAW_CYCLES] = cycles_arr[cycles_arr < upper_bound]
-                data[lib][abl][fn][MEAN] = np.mean(data[lib][abl][fn][RAW_CYCLES])
-                data[lib][abl][fn][STD] = np.std(data[lib][abl][fn][RAW_CYCLES])
-
-                # dynamic hit counts data
-                dyn_hits_filepath = os.path.join(args.eval_dir, abl, f'{lib}-{fn}-dynhitcounts.csv')
-                if not os.path.exists(dyn_hits_filepath):
-                    print(f"Couldn't find dynamic hit counts at {dyn_hits_filepath}")
-                    data[lib][abl][fn][DYN_HITS] = None
-                else:
-                    data[lib][abl][fn][DYN_HITS] = dict(map(
-                        lambda s: s.split(','), parse_lines(dyn_hits_filepath)
-                    ))
-
-                # binary size
-                sz_filepath = os.path.join(args.eval_dir, abl, f'{lib}-{fn}-bytesize.txt')
-                if not os.path.exists(sz_filepath):
-                    print(f"Couldn't find binary size data at {sz_filepath}")
-                    data[lib][abl][fn][BINARY_SIZE] = None
-                else:
-                    fn_file_sz = open(sz_filepath)
-                    data[lib][abl][fn][BINARY_SIZE] = fn_file_sz.readline().strip()
-                    fn_file_sz.close()
-                
     return data
 
 
+def hash_file(filepath):
+    ''' Get the sha256 hex digest of a file's contents. '''
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_strings(*parts):
+    ''' Get a sha256 hex digest identifying a sequence of strings. '''
+    return hashlib.sha256('\0'.join(map(str, parts)).encode()).hexdigest()
+
+
+def load_manifest(eval_dir):
+    '''
+    Load the report manifest of `eval_dir`. It maps:
+      inputs:  input file (relative to eval_dir) -> its size, mtime and sha256
+      stats:   benchmark id -> key of its inputs and its calculated statistics
+      outputs: generated file (relative to eval_dir) -> key of its inputs
+    so that only outputs whose input keys changed have to be regenerated.
+    '''
+    manifest_filepath = os.path.join(eval_dir, MANIFEST_FILENAME)
+    manifest = dict()
+    if os.path.exists(manifest_filepath):
+        try:
+            with open(manifest_filepath) as file:
+                manifest = json.load(file)
+        except (OSError, ValueError):
+            print(f"Couldn't read report manifest {manifest_filepath}. Regenerating everything")
+            manifest = dict()
+
+    for section in [MANIFEST_INPUTS, MANIFEST_STATS, MANIFEST_OUTPUTS]:
+        manifest.setdefault(section, dict())
+    return manifest
+
+
+def save_manifest(eval_dir, manifest):
+    manifest_filepath = os.path.join(eval_dir, MANIFEST_FILENAME)
+    tmp_filepath = f'{manifest_filepath}.{os.getpid()}.tmp'
+    with open(tmp_filepath, 'w') as file:
+        json.dump(manifest, file, indent=1)
+    os.replace(tmp_filepath, manifest_filepath)
+
+
+def input_digest(eval_dir, manifest, filepath):
+    '''
+    Get the content hash of an input file, recording it in the manifest.
+    Files whose size and mtime match the manifest are not rehashed.
+    '''
+    if not os.path.exists(filepath):
+        return 'missing'
+
+    relpath = os.path.relpath(filepath, eval_dir)
+    file_stat = os.stat(filepath)
+    recorded = manifest[MANIFEST_INPUTS].get(relpath)
+    if recorded is not None and \
+       recorded['size'] == file_stat.st_size and \
+       recorded['mtime_ns'] == file_stat.st_mtime_ns:
+        return recorded['sha256']
+
+    digest = hash_file(filepath)
+    manifest[MANIFEST_INPUTS][relpath] = dict({
+        'size': file_stat.st_size,
+        'mtime_ns': file_stat.st_mtime_ns,
+        'sha256': digest,
+    })
+    return digest
+
+
+def benchmark_id(lib, abl, fn):
+    return f'{lib}:{abl}:{fn}'
+
+
+def benchmark_key(eval_dir, manifest, lib, abl, fn):
+    ''' Key identifying the contents of all input files of one benchmark. '''
+    abl_dir = os.path.join(eval_dir, abl)
+    return hash_strings(*[
+        input_digest(eval_dir, manifest, os.path.join(abl_dir, f'{lib}-{fn}-{suffix}'))
+        for suffix in ['cyclecounts.csv', 'dynhitcounts.csv', 'bytesize.txt']
+    ])
+
+
+def is_stale(eval_dir, manifest, filepath, key):
+    ''' Does the output at `filepath` need to be regenerated for inputs `key`? '''
+    relpath = os.path.relpath(filepath, eval_dir)
+    return not os.path.exists(filepath) or manifest[MANIFEST_OUTPUTS].get(relpath) != key
+
+
+def record_output(eval_dir, manifest, filepath, key):
+    manifest[MANIFEST_OUTPUTS][os.path.relpath(filepath, eval_dir)] = key
+
+
+def stats_to_json(fn_data):
+    ''' Get the statistics of one benchmark (no raw cycles) as plain json values. '''
+    if fn_data is None:
+        return None
+    return dict({
+        stat_name: value.item() if isinstance(value, np.generic) else value
+        for stat_name, value in fn_data.items() if stat_name != RAW_CYCLES
+    })
+
+
+def cycle_curve_filepath(eval_dir, lib, abl, fn):
+    return os.path.join(eval_dir, abl, f'{lib}-{fn}-cycles.png')
+
+
+def calculate_overheads(data: dict, baseline_dir):
+    ''' Add the overhead of every benchmark vs the same fn in `baseline_dir`. '''
+    for lib in data.keys():
+        for abl in data[lib].keys():
+            for fn in data[lib][abl].keys():
+                baseline = data[lib][baseline_dir][fn]
+                fn_data = data[lib][abl][fn]
+                fn_data[OVERHEAD] = fn_data[MEAN] / baseline[MEAN]
+                fn_data[OVERHEAD_STD] = fn_data[STD] / baseline[MEAN]
+                fn_data[OVERHEAD_CI] = tuple(float(bound / baseline[MEAN]) for bound in fn_data[MEAN_CI])
+
+
 def merge_decrypt_encrypt_data(data: dict):
     merged_data = dict()
     for lib in data.keys():
@@ -149,40 +409,182 @@ def gen_pretty_data_string(data: dict):
     return result
 
 
-def gen_cycle_curves(eval_dir, data):
+def warmup_make_var(fn):
+    ''' Get the Makefile variable setting the warmup iterations of a crypto fn's driver. '''
+    fn_name = re.sub(r'-(en|de)crypt$', '', fn)
+    return f"{fn_name.replace('-', '_').upper()}_WARMUP_ITER"
+
+
+def gen_warmup_report(data: dict):
+    '''
+    Summarize where each benchmark's cycle counts reached steady state: flag
+    the series that never settled and recommend, per driver, the most warmup
+    iterations any of its ablations needed.
+    '''
+    result = ''
+    recommended = dict()
+    for lib in data.keys():
+        for abl in data[lib].keys():
+            for fn, fn_data in data[lib][abl].items():
+                if STEADY_STATE_START not in fn_data:
+                    continue
+                if not fn_data[SETTLED]:
+                    result += f'warning: {lib} {abl} {fn} cycle counts never reach steady state\n'
+                elif fn_data[RECOMMENDED_WARMUP] is not None:
+                    make_var = warmup_make_var(fn)
+                    recommended[make_var] = max(recommended.get(make_var, 0), fn_data[RECOMMENDED_WARMUP])
+
+    for make_var, warmup in recommended.items():
+        result += f'{make_var}={warmup}\n'
+    return result
+
+
+def decimate_minmax(cycles_data, num_points):
+    '''
+    Downsample a series to about `num_points` points by keeping the min and
+    the max of each bucket, in the order they occur. Every spike that would
+    be visible at full resolution is kept.
+    Returns the (iterations, cycles) of the kept points.
+    '''
+    n = len(cycles_data)
+    if n <= num_points:
+        return np.arange(n), cycles_data
+
+    bucket_len = -(-n // (num_points // 2))
+    num_buckets = -(-n // bucket_len)
+    padded = np.full(num_buckets * bucket_len, np.nan)
+    padded[:n] = cycles_data
+    buckets = padded.reshape(num_buckets, bucket_len)
+
+    offsets = np.arange(num_buckets) * bucket_len
+    kept = np.concatenate((offsets + np.nanargmin(buckets, axis=1),
+                           offsets + np.nanargmax(buckets, axis=1)))
+    kept = np.unique(kept)
+    return kept, cycles_data[kept]
+
+
+def decimate_lttb(cycles_data, num_points):
+    '''
+    Downsample a series to `num_points` points with Largest-Triangle-Three-Buckets:
+    from each bucket keep the point forming the largest triangle with the last
+    kept point and the average of the next bucket.
+    Returns the (iterations, cycles) of the kept points.
+    '''
+    n = len(cycles_data)
+    if n <= num_points or num_points < 3:
+        return np.arange(n), cycles_data
+
+    cycles = cycles_data.astype(np.float64)
+    # the first and last points are always kept, the rest is split into
+    # num_points - 2 buckets
+    edges = np.linspace(1, n - 1, num_points - 1).astype(np.int64)
+    edges = np.append(edges, n)
+
+    kept = np.empty(num_points, dtype=np.int64)
+    kept[0] = 0
+    kept[-1] = n - 1
+    prev = 0
+    for ii in range(num_points - 2):
+        start, end = edges[ii], edges[ii + 1]
+        next_start, next_end = edges[ii + 1], edges[ii + 2]
+        next_x = (next_start + next_end - 1) / 2
+        next_y = cycles[next_start:next_end].mean()
+
+        xs = np.arange(start, end)
+        areas = np.abs((prev - next_x) * (cycles[start:end] - cycles[prev]) -
+                       (prev - xs) * (next_y - cycles[prev]))
+        prev = start + np.argmax(areas)
+        kept[ii + 1] = prev
+
+    return kept, cycles_data[kept]
+
+
+def rolling_median(cycles_data, window, num_points):
+    '''
+    Median of a sliding `window` of iterations, evaluated at about `num_points`
+    evenly spaced positions (enough to draw it) rather than at every iteration.
+    Returns the (iterations, medians) at the centers of the evaluated windows.
+    '''
+    n = len(cycles_data)
+    window = max(1, min(window, n))
+    starts = np.unique(np.linspace(0, n - window, min(num_points, n - window + 1)).astype(np.int64))
+    windows = np.lib.stride_tricks.sliding_window_view(cycles_data, window)[starts]
+    return starts + window // 2, np.median(windows, axis=1)
+
+
+def plot_cycle_curve(filepath, title, cycles_data, decimation='none', median_window=0):
+    ''' Draw and save one cycle line chart. Runs in the plotting worker processes. '''
+    plt = import_pyplot()
+
+    # Calculate reasonable bounds for y-axis
+    quartiles = np.quantile(cycles_data, [0.1, 0.9])
+    iqr = quartiles[1] - quartiles[0]
+    upper_bound = quartiles[1] + iqr * 8
+    lower_bound = quartiles[0] - iqr * 2
+
+    if decimation == 'minmax':
+        iterations, cycles = decimate_minmax(cycles_data, CYCLE_CURVE_POINTS)
+    elif decimation == 'lttb':
+        iterations, cycles = decimate_lttb(cycles_data, CYCLE_CURVE_POINTS)
+    else:
+        iterations, cycles = np.arange(len(cycles_data)), cycles_data
+
+    # Plot
+    fig, ax = plt.subplots()
+    ax.plot(iterations, cycles)
+    if median_window > 0:
+        median_iterations, medians = rolling_median(cycles_data, median_window, CYCLE_CURVE_POINTS)
+        ax.plot(median_iterations, medians, label=f'rolling median ({median_window} iterations)')
+        ax.legend(loc='upper right')
+    ax.set_ylim(bottom=lower_bound, top=upper_bound)
+    ax.set_title(title)
+    ax.set_ylabel('Cycles')
+    ax.set_xlabel('Iteration')
+    fig.savefig(filepath)
+    plt.close(fig)
+    return filepath
+
+
+def gen_cycle_curves(eval_dir, data, benchmarks=None, decimation='none', median_window=0, jobs=None):
     ''' 
     Generate cycle line charts for each crypto func test case in a subdirectory.
     Useful for gauging number of warmup iterations.
+    If `benchmarks` is given, only the (lib, abl, fn) charts in it are drawn.
+    Charts are drawn in `jobs` worker processes (all cores by default).
     '''
     print("Generating cycle graphs for each benchmark...")
+    plots = []
     for lib in data.keys():
         for abl in data[lib].keys():
             for fn in data[lib][abl].keys():
-                title = data[lib][abl][fn][TITLE]
-                cycles_data = data[lib][abl][fn][RAW_CYCLES]
-
-                # Calculate reasonable bounds for y-axis
-                quartiles = np.quantile(cycles_data, [0.1, 0.9])
-                iqr = quartiles[1] - quartiles[0]
-                upper_bound = quartiles[1] + iqr * 8
-                lower_bound = quartiles[0] - iqr * 2
-
-                # Plot
-                fig, ax = plt.subplots()
-                ax.plot(cycles_data)
-                ax.set_ylim(bottom=lower_bound, top=upper_bound)
-                ax.set_title(title)
-                ax.set_ylabel('Cycles')
-                ax.set_xlabel('Iteration')
-                fig.savefig(os.path.join(eval_dir, abl, f'{lib}-{fn}-cycles.png'))
-                print(f"Saved {abl} {fn} ({lib}) graph to "
-                      f"{os.path.join(eval_dir, abl, f'{lib}-{fn}-cycles.png')}")
-                plt.close()
+                if benchmarks is not None and (lib, abl, fn) not in benchmarks:
+                    continue
+
+                plots.append(((lib, abl, fn), (
+                    cycle_curve_filepath(eval_dir, lib, abl, fn),
+                    data[lib][abl][fn][TITLE],
+                    data[lib][abl][fn][RAW_CYCLES],
+                    decimation,
+                    median_window,
+                )))
+
+    if not plots:
+        return
+
+    if jobs == 1:
+        filepaths = [plot_cycle_curve(*plot_args) for _, plot_args in plots]
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            filepaths = list(pool.map(plot_cycle_curve, *zip(*[plot_args for _, plot_args in plots])))
+
+    for ((lib, abl, fn), _), filepath in zip(plots, filepaths):
+        print(f"Saved {abl} {fn} ({lib}) graph to {filepath}")
 
 
 def gen_overhead_plot(target_dir, baseline_dir, data):
     ''' Create plot of runtime overhead for each ablation vs baseline.'''
     print("Generating bar chart of normalized overheads...")
+    plt = import_pyplot()
     for lib in data.keys():
         abls = list(data[lib].keys())
         abls.remove(baseline_dir)
@@ -233,10 +635,14 @@ def gen_overhead_plot(target_dir, baseline_dir, data):
         plt.close()
 
 
-def gen_latex_table_inserts(target_dir, baseline_dir, data):
+def gen_latex_table_inserts(target_dir, baseline_dir, data, fns=None):
+    ''' Write the `<fn>.tex` table row of each fn (or just those in `fns`). '''
     lib = 'libsodium'
 
     for fn in CRYPTO_FNS[lib]:
+        if fns is not None and fn not in fns:
+            continue
+
         filepath = os.path.join(target_dir, f'{fn}.tex')
         output = ''
 
@@ -287,40 +693,140 @@ def main():
              'subdirectory with the same name in `eval_dir`.'
     )
     parser.add_argument('-o', '--out', help="output directory. Defaults to `eval_dir`")
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+        help='number of worker processes for loading data and drawing cycle curves. '
+             'Defaults to the number of cores')
+    parser.add_argument('--no-cache', action='store_true',
+        help='ignore and do not write the `.npy` cycle count caches next to each csv')
+    parser.add_argument('--curve-decimation', choices=DECIMATIONS, default='none',
+        help='downsample each cycle curve before drawing it: `minmax` keeps the min and max of '
+             'each pixel bucket, `lttb` uses largest-triangle-three-buckets. Defaults to `none`')
+    parser.add_argument('--rolling-median', type=int, default=0, metavar='WINDOW',
+        help='overlay a rolling median over WINDOW iterations on each cycle curve')
+    parser.add_argument('--no-steady-state', action='store_true',
+        help='analyze every cycle count instead of only those after the series reaches steady state')
+    parser.add_argument('-f', '--force', action='store_true',
+        help=f'regenerate every output even if `{MANIFEST_FILENAME}` says it is up to date')
 
     args = parser.parse_args()
-
-    # Retrieve cycles data
-    data = get_data(args)
+    benchmarks = get_benchmarks(args.baseline_dir, args.ablations)
+
+    # Hash the inputs of each benchmark and find what changed since the last run
+    manifest = load_manifest(args.eval_dir)
+    if args.force:
+        manifest[MANIFEST_STATS] = dict()
+        manifest[MANIFEST_OUTPUTS] = dict()
+
+    keys = dict()
+    curve_keys = dict()
+    to_load = set()
+    for lib, abl, fn in benchmarks:
+        key = hash_strings(benchmark_key(args.eval_dir, manifest, lib, abl, fn),
+                           f'steady_state={not args.no_steady_state}',
+                           f'stats_version={STATS_VERSION}')
+        keys[(lib, abl, fn)] = key
+        curve_keys[(lib, abl, fn)] = hash_strings(key, args.curve_decimation, args.rolling_median)
+        recorded = manifest[MANIFEST_STATS].get(benchmark_id(lib, abl, fn))
+        if recorded is None or recorded['key'] != key:
+            to_load.add((lib, abl, fn))
+        elif recorded['data'] is not None and \
+             is_stale(args.eval_dir, manifest, cycle_curve_filepath(args.eval_dir, lib, abl, fn),
+                      curve_keys[(lib, abl, fn)]):
+            # cycle curves need the raw cycles
+            to_load.add((lib, abl, fn))
+
+    # Retrieve cycles data for changed benchmarks, reuse statistics of the rest
+    loaded = get_data(args.eval_dir, args.baseline_dir, args.ablations,
+                      jobs=args.jobs, use_cache=not args.no_cache, only=to_load,
+                      steady_state=not args.no_steady_state)
+    print(f'Loaded {len(to_load)} of {len(benchmarks)} benchmarks, the rest are unchanged')
+    data = dict()
+    for lib, abl, fn in benchmarks:
+        bench_id = benchmark_id(lib, abl, fn)
+        if (lib, abl, fn) in to_load:
+            fn_data = loaded[lib][abl].get(fn)
+            manifest[MANIFEST_STATS][bench_id] = dict({
+                'key': keys[(lib, abl, fn)],
+                'data': stats_to_json(fn_data),
+            })
+        elif manifest[MANIFEST_STATS][bench_id]['data'] is not None:
+            fn_data = dict(manifest[MANIFEST_STATS][bench_id]['data'])
+        else:
+            fn_data = None
+
+        data.setdefault(lib, dict()).setdefault(abl, dict())
+        if fn_data is not None:
+            data[lib][abl][fn] = fn_data
     
     # Calculate cycle overheads vs baseline
-    for lib in data.keys():
-        for abl in data[lib].keys():
-            for fn in data[lib][abl].keys():
-                baseline = data[lib][args.baseline_dir][fn]
-                fn_data = data[lib][abl][fn]
-                fn_data[OVERHEAD] = fn_data[MEAN] / baseline[MEAN]
-                fn_data[OVERHEAD_STD] = fn_data[STD] / baseline[MEAN]
+    calculate_overheads(data, args.baseline_dir)
+
+    warmup_report = gen_warmup_report(data)
+    if warmup_report:
+        print('Steady state warmup iterations needed by each driver (see Makefile):')
+        print(warmup_report, end='')
+
+    # every report covering all benchmarks depends on all of their inputs
+    # and on the order of the ablations
+    all_key = hash_strings(args.baseline_dir, *[
+        f'{benchmark_id(*benchmark)}={keys[benchmark]}' for benchmark in benchmarks
+    ])
     
     # Save calculated data
-    data_str = gen_pretty_data_string(data)
     data_filepath = os.path.join(args.eval_dir, 'calculated_data.txt')
-    data_file = open(data_filepath, 'w')
-    print(data_str, file=data_file)
-    data_file.close()
-    print(f'Saved calculated results to {data_filepath}')
+    if is_stale(args.eval_dir, manifest, data_filepath, all_key):
+        data_str = gen_pretty_data_string(data)
+        data_file = open(data_filepath, 'w')
+        print(data_str, file=data_file)
+        data_file.close()
+        record_output(args.eval_dir, manifest, data_filepath, all_key)
+        print(f'Saved calculated results to {data_filepath}')
+    else:
+        print(f'Calculated results in {data_filepath} are up to date')
     
     # Plot cycles for each eval run (line charts)
-    gen_cycle_curves(args.eval_dir, data)
+    stale_curves = set()
+    for lib in data.keys():
+        for abl in data[lib].keys():
+            for fn in data[lib][abl].keys():
+                filepath = cycle_curve_filepath(args.eval_dir, lib, abl, fn)
+                if is_stale(args.eval_dir, manifest, filepath, curve_keys[(lib, abl, fn)]):
+                    stale_curves.add((lib, abl, fn))
+    if stale_curves:
+        gen_cycle_curves(args.eval_dir, data, stale_curves, decimation=args.curve_decimation,
+                         median_window=args.rolling_median, jobs=args.jobs)
+        for lib, abl, fn in stale_curves:
+            record_output(args.eval_dir, manifest,
+                          cycle_curve_filepath(args.eval_dir, lib, abl, fn), curve_keys[(lib, abl, fn)])
 
     # Generate data and charts for paper
     target_dir = os.path.join(args.eval_dir, 'benchmarks')
     if not os.path.exists(target_dir):
         os.makedirs(target_dir)
 
-    gen_latex_table_inserts(target_dir, args.baseline_dir, data)
-    data = merge_decrypt_encrypt_data(data)
-    gen_overhead_plot(target_dir, args.baseline_dir, data)
+    lib = 'libsodium'
+    tex_keys = dict()
+    for fn in CRYPTO_FNS[lib]:
+        tex_keys[fn] = hash_strings(*[
+            f'{abl}={keys[(lib, abl, fn)]}'
+            for abl in [args.baseline_dir, 'ss', 'cs', 'ss+cs'] if abl in data[lib].keys()
+        ])
+    stale_tex = [fn for fn in CRYPTO_FNS[lib]
+                 if is_stale(args.eval_dir, manifest, os.path.join(target_dir, f'{fn}.tex'), tex_keys[fn])]
+    if stale_tex:
+        gen_latex_table_inserts(target_dir, args.baseline_dir, data, stale_tex)
+        for fn in stale_tex:
+            record_output(args.eval_dir, manifest, os.path.join(target_dir, f'{fn}.tex'), tex_keys[fn])
+
+    plot_filepath = os.path.join(target_dir, 'microbench-overheads.pdf')
+    if is_stale(args.eval_dir, manifest, plot_filepath, all_key):
+        data = merge_decrypt_encrypt_data(data)
+        gen_overhead_plot(target_dir, args.baseline_dir, data)
+        record_output(args.eval_dir, manifest, plot_filepath, all_key)
+    else:
+        print(f'Bar chart {plot_filepath} is up to date')
+
+    save_manifest(args.eval_dir, manifest)
 
 
 if __name__ == "__main__":